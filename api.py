@@ -10,15 +10,42 @@ REST API для Vision-Language Models OCR и чата.
 
 from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Depends, Query, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Set
 from PIL import Image
-from collections import defaultdict
-import io
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
+import atexit
+import json
 import time
 import logging
 import os
+import threading
+from urllib.parse import parse_qs
+
+from utils.tiling import select_tiling_policy, process_tiled, get_pixel_budget, image_size
+from utils.ingest import (
+    sniff_image_header, decode_image_once, ImageHeader, IngestedImage, ImageTooLargeError
+)
+from utils.validators import ValidationError
+from utils.cascade import CascadeRouter, cascade_settings
+from utils.singleflight import SingleFlight, request_key
+from utils.prefilter import PageFilter, PrefilterSession, prefilter_settings
+from utils.metrics import (
+    MODEL_CACHE, OTHER_MODEL, STAGE_SECONDS, MetricsMiddleware, model_call, registry
+)
+from utils.tracing import TracingMiddleware, tracer
+from utils.scheduler import (
+    PRIORITY_CLASSES, ClientDisconnected, FairScheduler, RequestDropped, Ticket, scheduled, scheduler_settings
+)
+from utils.rate_limit import RateLimiter, rate_limit_settings
+from utils.inference_worker import InferenceClient
+from utils.perf_store import PerfRecorder, PerformanceStore
+from utils.gpu_telemetry import get_telemetry
+from utils.documents import (
+    DocumentPage, count_pages, is_pdf, iter_document_pages, iter_page_batches
+)
 # import magic  # python-magic для определения MIME-типа - временно отключено для Windows
 
 logging.basicConfig(level=logging.INFO)
@@ -56,6 +83,17 @@ class SecurityConfig:
     
     # Разрешённые расширения
     ALLOWED_EXTENSIONS: List[str] = [".jpg", ".jpeg", ".png", ".bmp", ".tiff", ".tif", ".webp"]
+    
+    # Разрешённые форматы PIL (проверяются по заголовку файла)
+    ALLOWED_FORMATS: tuple = ("JPEG", "PNG", "BMP", "TIFF", "WEBP", "MPO")
+    
+    # Максимальный размер изображения после декодирования (защита от decompression bomb)
+    MAX_MEGAPIXELS: float = float(os.getenv("MAX_MEGAPIXELS", "80"))
+    
+    # Многостраничные документы (PDF, TIFF)
+    MAX_DOCUMENT_SIZE: int = 100 * 1024 * 1024  # 100 MB
+    MAX_DOCUMENT_PAGES: int = int(os.getenv("MAX_DOCUMENT_PAGES", "500"))
+    DOCUMENT_EXTENSIONS: List[str] = [".pdf", ".tiff", ".tif"]
 
 
 security_config = SecurityConfig()
@@ -65,54 +103,47 @@ security_config = SecurityConfig()
 # Rate Limiting
 # =============================================================================
 
-class RateLimiter:
-    """Простой rate limiter на основе IP."""
-    
-    def __init__(self, requests_per_minute: int = 60):
-        self.requests_per_minute = requests_per_minute
-        self.requests: Dict[str, List[float]] = defaultdict(list)
-    
-    def is_allowed(self, client_ip: str) -> bool:
-        """Проверка, разрешён ли запрос."""
-        now = time.time()
-        minute_ago = now - 60
-        
-        # Очистка старых записей
-        self.requests[client_ip] = [
-            t for t in self.requests[client_ip] if t > minute_ago
-        ]
-        
-        # Проверка лимита
-        if len(self.requests[client_ip]) >= self.requests_per_minute:
-            return False
-        
-        # Запись нового запроса
-        self.requests[client_ip].append(now)
-        return True
-    
-    def get_remaining(self, client_ip: str) -> int:
-        """Получение оставшихся запросов."""
-        now = time.time()
-        minute_ago = now - 60
-        recent = [t for t in self.requests[client_ip] if t > minute_ago]
-        return max(0, self.requests_per_minute - len(recent))
+# Лимиты запросов и страниц в минуту на клиента (GCRA): API-ключи из секции
+# rate_limit конфигурации - по ключу, остальные клиенты - по IP. При запуске
+# с --workers N состояние общее через SQLite (RATE_LIMIT_STORE=sqlite)
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_guard = threading.Lock()
 
 
-rate_limiter = RateLimiter(security_config.RATE_LIMIT_PER_MINUTE)
+def get_rate_limiter() -> RateLimiter:
+    """Rate limiter из секции rate_limit конфигурации и переменных окружения."""
+    global _rate_limiter
+    with _rate_limiter_guard:
+        if _rate_limiter is None:
+            from models import ModelLoader
+            settings = rate_limit_settings(ModelLoader.load_config())
+            if "RATE_LIMIT" in os.environ:
+                settings['requests_per_minute'] = security_config.RATE_LIMIT_PER_MINUTE
+            settings['store'] = os.getenv("RATE_LIMIT_STORE", settings['store'])
+            settings['path'] = os.getenv("RATE_LIMIT_DB", settings['path'])
+            _rate_limiter = RateLimiter(settings)
+            atexit.register(_rate_limiter.close)
+        return _rate_limiter
 
 
 # =============================================================================
 # Валидация файлов
 # =============================================================================
 
-def validate_file(file: UploadFile, content: bytes) -> None:
+def validate_file(file: UploadFile, content: bytes) -> ImageHeader:
     """
     Валидация загруженного файла.
     
+    Пиксели не декодируются: формат и размеры читаются из заголовка,
+    изображения больше MAX_MEGAPIXELS отклоняются до декодирования.
+    
     Args:
         file: Объект загруженного файла
         content: Содержимое файла
         
+    Returns:
+        Заголовок изображения (формат, размеры)
+        
     Raises:
         HTTPException: При ошибке валидации
     """
@@ -146,28 +177,152 @@ def validate_file(file: UploadFile, content: bytes) -> None:
     #     # Fallback на проверку PIL
     #     pass
     
-    # Проверка, что файл является валидным изображением
+    # Проверка, что файл является валидным изображением (только заголовок)
     try:
-        image = Image.open(io.BytesIO(content))
-        image.verify()
-    except Exception as e:
+        return sniff_image_header(
+            content,
+            allowed_formats=security_config.ALLOWED_FORMATS,
+            max_megapixels=security_config.MAX_MEGAPIXELS
+        )
+    except ImageTooLargeError as e:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Изображение слишком большое: {str(e)}"
+        )
+    except ValidationError as e:
         raise HTTPException(
             status_code=400,
             detail=f"Файл не является валидным изображением: {str(e)}"
         )
 
 
-async def rate_limit_check(request: Request):
-    """Dependency для проверки rate limit."""
-    client_ip = request.client.host if request.client else "unknown"
+# Модели, принимающие RGB-массив напрямую (без конвертации в PIL)
+ARRAY_NATIVE_MODELS = ("qwen3_vl", "got_ocr_hf")
+
+
+def decode_upload(content: bytes, header: ImageHeader, model: str, tiling: bool = True) -> IngestedImage:
+    """
+    Однократное декодирование загруженного изображения.
+    
+    Если модель всё равно уменьшит изображение (и тайлы не нужны),
+    JPEG декодируется сразу в уменьшенном масштабе через Image.draft.
+    """
+    target_pixels = None
+    if not (tiling and select_tiling_policy(header.size, model)):
+        target_pixels = get_pixel_budget(model)
+    
+    try:
+        with STAGE_SECONDS.labels("image_decode", metric_model(model)).time(), tracer.span("image_decode", model=model):
+            return decode_image_once(content, header=header, target_pixels=target_pixels)
+    except Exception as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Не удалось декодировать изображение: {str(e)}"
+        )
+
+
+def as_model_input(image, model: str):
+    """RGB-массив для моделей, принимающих массивы, иначе PIL Image."""
+    if isinstance(image, Image.Image) or model.startswith(ARRAY_NATIVE_MODELS):
+        return image
+    return Image.fromarray(image)
+
+
+async def read_upload(file: UploadFile, model: str):
+    """Чтение и валидация загруженного изображения (с метриками этапов)."""
+    with STAGE_SECONDS.labels("upload_read", metric_model(model)).time(), tracer.span("upload_read", filename=file.filename):
+        content = await file.read()
+    with STAGE_SECONDS.labels("validation", metric_model(model)).time(), tracer.span("validation", bytes=len(content)):
+        header = validate_file(file, content)
+    return content, header
+
+
+def validate_document(file: UploadFile, content: bytes) -> int:
+    """
+    Валидация многостраничного документа (PDF, TIFF или одиночное изображение).
+    
+    Returns:
+        Количество страниц
+        
+    Raises:
+        HTTPException: При ошибке валидации
+    """
+    if len(content) > security_config.MAX_DOCUMENT_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Документ слишком большой. Максимум: {security_config.MAX_DOCUMENT_SIZE // 1024 // 1024} MB"
+        )
+    
+    if file.filename:
+        ext = os.path.splitext(file.filename.lower())[1]
+        allowed = set(security_config.ALLOWED_EXTENSIONS) | set(security_config.DOCUMENT_EXTENSIONS)
+        if ext not in allowed:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Недопустимое расширение файла. Разрешены: {', '.join(sorted(allowed))}"
+            )
+    
+    try:
+        if not is_pdf(content):
+            sniff_image_header(
+                content,
+                allowed_formats=security_config.ALLOWED_FORMATS,
+                max_megapixels=security_config.MAX_MEGAPIXELS
+            )
+        pages = count_pages(content)
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=f"Изображение слишком большое: {str(e)}")
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Недопустимый документ: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Не удалось прочитать документ: {str(e)}")
+    
+    if pages > security_config.MAX_DOCUMENT_PAGES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Слишком много страниц: {pages}. Максимум: {security_config.MAX_DOCUMENT_PAGES}"
+        )
+    
+    return pages
+
+
+def rate_limit_check(request: Request):
+    """
+    Dependency для проверки rate limit (стоимость запроса - 1).
     
-    if not rate_limiter.is_allowed(client_ip):
-        remaining = rate_limiter.get_remaining(client_ip)
+    Обычная функция: FastAPI выполняет ее в пуле потоков, транзакция
+    SQLite-хранилища (ожидание блокировки до 10 с) не блокирует цикл событий.
+    """
+    limiter = get_rate_limiter()
+    client = limiter.identify(
+        api_key=request.headers.get("X-API-Key"),
+        address=request.client.host if request.client else "unknown"
+    )
+    decision = limiter.hit(client, "requests")
+    if not decision.allowed:
         raise HTTPException(
             status_code=429,
-            detail=f"Превышен лимит запросов. Попробуйте через минуту.",
-            headers={"X-RateLimit-Remaining": str(remaining)}
+            detail=f"Превышен лимит запросов. Повторите через {decision.headers()['Retry-After']} с.",
+            headers=decision.headers()
         )
+    request.state.rate_client = client
+    request.state.rate_limit = decision
+
+
+async def charge_pages(request: Request, pages: int) -> None:
+    """Списание страниц (изображений, страниц документа) из лимита клиента (в рабочем потоке)."""
+    decision = await asyncio.to_thread(get_rate_limiter().hit, request.state.rate_client, "pages", pages)
+    if not decision.allowed:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Превышен лимит страниц. Повторите через {decision.headers()['Retry-After']} с.",
+            headers=decision.headers()
+        )
+
+
+def rate_limit_headers(request: Request) -> Dict[str, str]:
+    """Заголовки X-RateLimit-* ответа (результат проверки этого запроса)."""
+    return request.state.rate_limit.headers()
 
 
 # =============================================================================
@@ -192,18 +347,395 @@ app.add_middleware(
     expose_headers=["X-RateLimit-Remaining"]
 )
 
+# История производительности (PERF_STORE_PATH, PERF_STORE=off отключает):
+# задержки запросов к моделям пишутся в SQLite в фоновом потоке и
+# доступны PerformanceAnalyzer наравне с результатами бенчмарков
+PERF_ENDPOINTS = ("/ocr", "/chat", "/batch/ocr", "/document/ocr")
+_perf_recorder: Optional[PerfRecorder] = None
+_perf_recorder_guard = threading.Lock()
+
+
+def get_perf_recorder() -> Optional[PerfRecorder]:
+    """Запись истории производительности (None при PERF_STORE=off), создается при первой записи."""
+    global _perf_recorder
+    if os.getenv("PERF_STORE", "on") == "off":
+        return None
+    with _perf_recorder_guard:
+        if _perf_recorder is None:
+            _perf_recorder = PerfRecorder(PerformanceStore())
+            atexit.register(_perf_recorder.close)
+        return _perf_recorder
+
+
+def record_request(endpoint: str, model: str, status: int, seconds: float, scope: Dict[str, Any]) -> None:
+    """Запись задержки запроса к модели в историю производительности."""
+    # Ошибки клиента (валидация, лимит запросов) не характеризуют модель
+    if endpoint not in PERF_ENDPOINTS or 400 <= status < 500 or model == OTHER_MODEL:
+        return
+    perf_recorder = get_perf_recorder()
+    if perf_recorder is None:
+        return
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    perf_recorder.record(
+        model or "qwen3_vl_2b",  # Модель по умолчанию эндпоинтов
+        seconds,
+        success=status < 400,
+        document_type=query.get("document_type", [None])[0],
+        source="api",
+        endpoint=endpoint
+    )
+
+
+# Известные модели для меток /metrics (реестр загрузчика и "auto")
+_metric_models: Optional[frozenset] = None
+
+
+def metric_model(model: Optional[str]) -> str:
+    """
+    Метка модели для /metrics.
+    
+    Имя модели передает клиент: имена вне реестра моделей сводятся в
+    "other", иначе каждое выдуманное имя добавляет новые ряды метрик.
+    """
+    global _metric_models
+    if not model:
+        return ""
+    if _metric_models is None:
+        from models import ModelLoader
+        _metric_models = frozenset(ModelLoader.MODEL_REGISTRY) | {"auto"}
+    return model if model in _metric_models else OTHER_MODEL
+
+
+# Счетчики запросов по эндпоинтам, моделям и статусам для /metrics
+app.add_middleware(MetricsMiddleware, on_request=record_request, model_label=metric_model)
+
+# Трассировка запросов (TRACING=jsonl|otlp): корневой span на запрос,
+# входящий заголовок traceparent продолжает трассировку вызывающей стороны
+app.add_middleware(TracingMiddleware)
+
 
 # Кеш моделей
 model_cache = {}
 
+# Одинаковые одновременные запросы (изображение, модель, промпт, параметры)
+# присоединяются к уже выполняющемуся запросу и получают его результат
+single_flight = SingleFlight()
+
+# Модели выполняются в рабочих потоках; одна модель - один запрос за раз.
+# Очередь модели общая для классов приоритета (interactive, api, batch) и
+# клиентов: взвешенная справедливая очередь вместо FIFO, запросы с истекшим
+# сроком или отключившимся клиентом снимаются до выполнения на GPU
+_scheduler: Optional[FairScheduler] = None
+_scheduler_guard = threading.Lock()
+
+# Интервал проверки отключения клиента во время ожидания модели (с)
+DISCONNECT_POLL_INTERVAL = 0.5
+
+
+# Разделенный режим (uvicorn --workers N): модели загружены один раз в процессе
+# scripts/inference_server.py, рабочие процессы API передают ему
+# декодированные изображения через разделяемую память (INFERENCE_SERVER -
+# путь сокета или host:port, INFERENCE_AUTHKEY - общий секрет)
+INFERENCE_SERVER = os.getenv("INFERENCE_SERVER", "")
+INFERENCE_RING_MB = int(os.getenv("INFERENCE_RING_MB", "256"))
+_inference_client: Optional[InferenceClient] = None
+_inference_client_guard = threading.Lock()
+
+
+def get_inference_client() -> InferenceClient:
+    """Соединение с процессом инференса (переподключение после его перезапуска)."""
+    global _inference_client
+    with _inference_client_guard:
+        if _inference_client is None or _inference_client.closed:
+            authkey = os.getenv("INFERENCE_AUTHKEY")
+            _inference_client = InferenceClient(
+                INFERENCE_SERVER,
+                authkey=authkey.encode() if authkey else None,
+                ring_size=INFERENCE_RING_MB * 1024 * 1024
+            )
+            atexit.register(_inference_client.close)
+            logger.info(f"Подключено к процессу инференса {INFERENCE_SERVER} (pid {_inference_client.server_pid})")
+        return _inference_client
+
+
+def get_scheduler() -> FairScheduler:
+    """Планировщик из секции scheduler конфигурации."""
+    global _scheduler
+    with _scheduler_guard:
+        if _scheduler is None:
+            from models import ModelLoader
+            _scheduler = FairScheduler(scheduler_settings(ModelLoader.load_config()))
+        return _scheduler
+
+
+@contextmanager
+def model_slot(model_name: str, cost: float = 1.0):
+    """
+    Модель для выполнения запроса: ожидание очереди, загрузка и вызов.
+    
+    Модель удерживается до выхода из блока; порядок ожидания задает
+    билет текущего запроса (класс, клиент, срок). Ожидание, загрузка и
+    выполнение попадают в /metrics и в трассировку.
+    
+    Raises:
+        RequestDropped: Срок запроса истек или клиент отключился до выполнения
+    """
+    if INFERENCE_SERVER:
+        # Очередь общая для всех рабочих процессов - в процессе инференса
+        # (билет запроса передается вместе с вызовом)
+        model_instance = get_model(model_name)
+        with tracer.span("model_call", model=model_name), model_call(model_name):
+            yield model_instance
+        return
+    
+    scheduler = get_scheduler()
+    with tracer.span("queue_wait", model=model_name):
+        scheduler.acquire(model_name, cost=cost)
+    try:
+        model_instance = get_model(model_name)
+        with tracer.span("model_call", model=model_name), model_call(model_name):
+            yield model_instance
+    finally:
+        scheduler.release(model_name)
+
+
+def request_ticket(request: Request, default_priority: str = "api") -> Ticket:
+    """
+    Билет планировщика для запроса.
+    
+    Класс - из заголовка X-Priority (interactive, api, batch), клиент -
+    X-API-Key, X-Client-Id или IP-адрес, срок ожидания - X-Deadline-Ms
+    (по умолчанию срок класса).
+    """
+    priority = request.headers.get("X-Priority", default_priority).strip().lower()
+    if priority not in PRIORITY_CLASSES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Неизвестный приоритет: {priority}. Допустимые: {', '.join(PRIORITY_CLASSES)}"
+        )
+    
+    client = request.headers.get("X-API-Key") or request.headers.get("X-Client-Id")
+    if not client:
+        client = request.client.host if request.client else "unknown"
+    
+    timeout = None
+    deadline_ms = request.headers.get("X-Deadline-Ms")
+    if deadline_ms:
+        try:
+            timeout = max(0.0, float(deadline_ms) / 1000)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Некорректный X-Deadline-Ms: {deadline_ms}")
+    
+    return get_scheduler().ticket(priority, client, timeout)
+
+
+async def watch_disconnect(request: Request, ticket: Ticket) -> None:
+    """Отмена билета при отключении клиента (ожидающие вызовы снимаются с очереди)."""
+    while not ticket.cancelled:
+        if await request.is_disconnected():
+            logger.info(f"Клиент {ticket.client} отключился, запросы в очереди отменены")
+            ticket.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+@asynccontextmanager
+async def watched(request: Request, ticket: Ticket):
+    """Билет - текущий для блока, отключение клиента отслеживается в фоне."""
+    watcher = asyncio.ensure_future(watch_disconnect(request, ticket))
+    try:
+        with scheduled(ticket):
+            yield ticket
+    finally:
+        watcher.cancel()
+
+
+def dropped_error(error: RequestDropped) -> HTTPException:
+    """HTTP-ошибка для запроса, снятого с очереди планировщиком."""
+    if isinstance(error, ClientDisconnected):
+        # Ответ уже некому отправить; 499 - для логов и /metrics
+        return HTTPException(status_code=499, detail="Клиент отключился до выполнения запроса")
+    return HTTPException(
+        status_code=504,
+        detail=f"Истек срок ожидания модели (класс {error.priority})"
+    )
+
+# CPU-узлы без GPU: реплики модели в отдельных процессах с общей очередью
+# (CPU_REPLICAS=auto - по числу ядер, или число процессов; потоки на реплику
+# и реплики на сокет берутся из секции cpu конфигурации модели)
+CPU_REPLICAS = os.getenv("CPU_REPLICAS", "")
+CPU_REPLICA_MODELS = ("got_ocr_hf", "got_ocr_ucas")
+
+
+def use_cpu_replicas(model_name: str) -> bool:
+    """Обслуживать ли модель пулом CPU-реплик."""
+    if not CPU_REPLICAS or model_name not in CPU_REPLICA_MODELS:
+        return False
+    import torch
+    return not torch.cuda.is_available()
+
+
+def start_replica_pool(model_name: str):
+    """Запуск пула реплик: каждая реплика закреплена за своими ядрами."""
+    from models import ModelLoader
+    from utils.cpu_inference import ModelReplicaFactory, ReplicaPool, cpu_settings
+    
+    settings = cpu_settings(ModelLoader.load_config()["models"].get(model_name))
+    pool = ReplicaPool(
+        ModelReplicaFactory(model_name),
+        replicas=None if CPU_REPLICAS == "auto" else int(CPU_REPLICAS),
+        threads_per_replica=settings["threads_per_replica"],
+        inter_op_threads=settings["inter_op_threads"],
+        replicas_per_socket=settings["replicas_per_socket"]
+    )
+    return pool.start()
+
+
+# Предфильтр пакетов: пустые страницы пропускаются; с dedupe=batch/recent
+# повторы страницы (перцептивный хеш и совпадение маски текста) получают
+# результат уже обработанной страницы
+DEDUPE_PATTERN = "^(off|batch|recent)$"
+_page_filter: Optional[PageFilter] = None
+_page_filter_guard = threading.Lock()
+
+
+def get_page_filter() -> PageFilter:
+    """Предфильтр из секции prefilter конфигурации."""
+    global _page_filter
+    with _page_filter_guard:
+        if _page_filter is None:
+            from models import ModelLoader
+            _page_filter = PageFilter(prefilter_settings(ModelLoader.load_config()))
+        return _page_filter
+
+
+# Каскадная маршрутизация: model=auto - сначала самая дешевая модель,
+# эскалация на более крупные при низкой оценке результата
+AUTO_MODEL = "auto"
+_cascade_router: Optional[CascadeRouter] = None
+_cascade_router_guard = threading.Lock()
+
+
+def get_cascade_router() -> CascadeRouter:
+    """Роутер каскада из секции cascade конфигурации (только настроенные модели)."""
+    global _cascade_router
+    with _cascade_router_guard:
+        if _cascade_router is None:
+            from models import ModelLoader
+            config = ModelLoader.load_config()
+            settings = cascade_settings(config)
+            configured = config.get("models", {})
+            tiers = [tier for tier in settings["tiers"] if tier["model"] in configured]
+            skipped = [tier["model"] for tier in settings["tiers"] if tier["model"] not in configured]
+            if skipped:
+                logger.warning(f"Каскад: модели не настроены и пропущены: {skipped}")
+            _cascade_router = CascadeRouter({**settings, "tiers": tiers or settings["tiers"]})
+        return _cascade_router
+
+
+def run_cascade(image, language: Optional[str] = None, tiling: bool = True,
+                document_type: Optional[str] = None, fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    OCR через каскад моделей.
+    
+    Returns:
+        Словарь с ключами text, model, tiling, repetition_trimmed и cascade (оценки всех попыток)
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    
+    def run(model_name: str) -> str:
+        with model_slot(model_name) as model_instance:
+            results[model_name] = run_ocr(model_instance, model_name, image, language=language, tiling=tiling,
+                                          document_type=document_type)
+        return results[model_name]["text"]
+    
+    routed = get_cascade_router().route(run, document_type=document_type, fields=fields)
+    result = results.get(routed.model, {})
+    return {
+        "text": routed.text,
+        "model": routed.model,
+        "tiling": result.get("tiling"),
+        "repetition_trimmed": result.get("repetition_trimmed", False),
+        "cascade": routed.to_dict()
+    }
+
+
+def decode_model(model: str) -> str:
+    """Модель, по бюджету пикселей которой декодируется изображение."""
+    if model == AUTO_MODEL:
+        # Самая крупная модель каскада: изображение не уменьшается сильнее, чем ей нужно
+        return get_cascade_router().tiers[-1]["model"]
+    return model
+
+
+def execute_ocr(image_data: bytes, header: ImageHeader, model: str, language: Optional[str] = None,
+                tiling: bool = True, document_type: Optional[str] = None) -> Dict[str, Any]:
+    """Декодирование и OCR одного изображения (выполняется в рабочем потоке)."""
+    image = decode_upload(image_data, header, decode_model(model), tiling=tiling).array
+    if model == AUTO_MODEL:
+        return run_cascade(image, language=language, tiling=tiling, document_type=document_type)
+    with model_slot(model) as model_instance:
+        return run_ocr(model_instance, model, image, language=language, tiling=tiling, document_type=document_type)
+
+
+def execute_batch_item(image, model: str) -> Dict[str, Any]:
+    """OCR одного декодированного файла пакета (без тайлов)."""
+    if model == AUTO_MODEL:
+        return run_cascade(image, tiling=False)
+    
+    image = as_model_input(image, model)
+    with model_slot(model) as model_instance:
+        if "qwen3" in model:
+            text = model_instance.extract_text(image)
+        elif "qwen" in model:
+            text = model_instance.chat(image, "Extract all text.")
+        else:
+            text = model_instance.process_image(image)
+    return {"text": text, "model": model, "cascade": None}
+
+
+def execute_chat(image_data: bytes, header: ImageHeader, model: str, prompt: str,
+                 temperature: float, max_tokens: int) -> str:
+    """Чат с моделью об изображении (выполняется в рабочем потоке)."""
+    image = as_model_input(decode_upload(image_data, header, model, tiling=False).array, model)
+    with model_slot(model) as model_instance:
+        if "qwen" in model:
+            return model_instance.chat(
+                image=image,
+                prompt=prompt,
+                temperature=temperature,
+                max_new_tokens=max_tokens
+            )
+        elif model == "dots_ocr":
+            return str(model_instance.process_image(image, prompt=prompt))
+        else:  # GOT-OCR
+            return model_instance.process_image(image)
+
 
 def get_model(model_name: str):
     """Загрузка и кеширование модели."""
-    if model_name not in model_cache:
+    if INFERENCE_SERVER:
+        # Модель загружается процессом инференса при первом вызове
+        if model_name not in model_cache or model_cache[model_name].client.closed:
+            try:
+                model_cache[model_name] = get_inference_client().model(model_name)
+            except OSError as e:
+                logger.error(f"Процесс инференса {INFERENCE_SERVER} недоступен: {e}")
+                raise HTTPException(status_code=503, detail="Процесс инференса недоступен")
+        return model_cache[model_name]
+    
+    if model_name in model_cache:
+        MODEL_CACHE.labels("hit").inc()
+    else:
+        MODEL_CACHE.labels("miss").inc()
         try:
             from models import ModelLoader
             logger.info(f"Загрузка модели: {model_name}")
-            model_cache[model_name] = ModelLoader.load_model(model_name)
+            with STAGE_SECONDS.labels("model_load", metric_model(model_name)).time(), tracer.span("model_load", model=model_name):
+                if use_cpu_replicas(model_name):
+                    model_cache[model_name] = start_replica_pool(model_name)
+                else:
+                    model_cache[model_name] = ModelLoader.load_model(model_name)
             logger.info(f"Модель загружена успешно: {model_name}")
         except Exception as e:
             logger.error(f"Ошибка загрузки модели {model_name}: {e}")
@@ -211,6 +743,204 @@ def get_model(model_name: str):
     return model_cache[model_name]
 
 
+def repetition_trimmed(model_instance) -> Set[int]:
+    """Строки последнего вызова модели, вывод которых обрезан защитой от зацикливания."""
+    report = getattr(model_instance, "last_repetition_report", None)
+    return {stop["row"] for stop in (report or {}).get("stops", [])}
+
+
+def run_ocr_batch(model_instance, model: str, images: List[Image.Image], language: Optional[str] = None,
+                  document_type: Optional[str] = None, trimmed: Optional[Set[int]] = None) -> List[str]:
+    """
+    Извлечение текста из списка изображений выбранной моделью.
+    
+    Qwen3-VL обрабатывает список одним батчем, остальные модели - по одному.
+    Тип документа запроса передается в Qwen3-VL (метрики спекулятивного декодирования).
+    
+    Args:
+        trimmed: Если передано, сюда добавляются номера изображений, вывод которых
+            обрезан защитой от зацикливания
+    """
+    images = [as_model_input(image, model) for image in images]
+    trimmed = trimmed if trimmed is not None else set()
+    
+    if "qwen3" in model:
+        if len(images) == 1:
+            texts = [model_instance.extract_text(images[0], language=language, document_type=document_type)]
+        else:
+            texts = model_instance.extract_text_batch(images, language=language, document_type=document_type)
+        trimmed.update(repetition_trimmed(model_instance))
+        return texts
+    elif "qwen" in model:
+        return [model_instance.chat(image, "Extract all text from this document.") for image in images]
+    
+    # dots.ocr и GOT-OCR обрабатывают изображения по одному: отчет защиты - после каждого
+    texts = []
+    for index, image in enumerate(images):
+        if model == "dots_ocr":
+            result = model_instance.parse_document(image, return_json=False)
+            texts.append(result.get('raw_text', str(result)))
+        else:  # GOT-OCR
+            texts.extend(model_instance.process_batch([image]))
+        if repetition_trimmed(model_instance):
+            trimmed.add(index)
+    return texts
+
+
+def run_ocr(model_instance, model: str, image, language: Optional[str] = None,
+            tiling: bool = True, document_type: Optional[str] = None) -> Dict[str, Any]:
+    """
+    OCR одного изображения с автоматическим разбиением на тайлы.
+    
+    Тайлы используются, если уменьшение страницы до бюджета пикселей
+    модели сделало бы мелкий текст нечитаемым.
+    
+    Returns:
+        Словарь с ключами text, tiling (None, если тайлы не использовались)
+        и repetition_trimmed (вывод обрезан защитой от зацикливания)
+    """
+    policy = select_tiling_policy(image_size(image), model) if tiling else None
+    trimmed: Set[int] = set()
+    
+    if policy is None:
+        text = run_ocr_batch(model_instance, model, [image], language, document_type, trimmed)[0]
+        return {"text": text, "tiling": None, "repetition_trimmed": bool(trimmed)}
+    
+    logger.info(f"Тайловая обработка {image_size(image)} для {model}: "
+                f"{policy.tile_width}x{policy.tile_height}, перекрытие {policy.overlap}")
+    tiled = process_tiled(
+        image,
+        lambda tiles: run_ocr_batch(model_instance, model, tiles, language, document_type, trimmed),
+        policy,
+        # dots.ocr возвращает элементы разметки с bbox тайла
+        layout=(model == "dots_ocr")
+    )
+    text = tiled.pop("text")
+    return {"text": text, "tiling": tiled, "repetition_trimmed": bool(trimmed)}
+
+
+def ocr_pages(model_instance, model: str, pages: List[DocumentPage],
+              language: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    OCR пакета страниц документа.
+    
+    Страницы, не требующие тайлов, обрабатываются одним батчем;
+    крупные страницы - через тайловую обработку.
+    """
+    start_time = time.time()
+    texts: Dict[int, str] = {}
+    tiling_info: Dict[int, Any] = {}
+    trimmed_pages: Set[int] = set()
+    
+    plain = [page for page in pages if select_tiling_policy(page.size, model) is None]
+    if plain:
+        trimmed: Set[int] = set()
+        outputs = run_ocr_batch(model_instance, model, [page.array for page in plain], language, trimmed=trimmed)
+        texts.update({page.index: text for page, text in zip(plain, outputs)})
+        trimmed_pages.update(plain[row].index for row in trimmed)
+    
+    for page in pages:
+        if page.index not in texts:
+            result = run_ocr(model_instance, model, page.array, language=language)
+            texts[page.index] = result["text"]
+            tiling_info[page.index] = result["tiling"]
+            if result["repetition_trimmed"]:
+                trimmed_pages.add(page.index)
+    
+    per_page_time = (time.time() - start_time) / max(1, len(pages))
+    return [
+        {
+            "page": page.index + 1,
+            "status": "success",
+            "text": texts[page.index],
+            "image_size": list(page.size),
+            "dpi": page.dpi,
+            "tiling": tiling_info.get(page.index),
+            "repetition_trimmed": page.index in trimmed_pages,
+            "processing_time": round(per_page_time, 3)
+        }
+        for page in pages
+    ]
+
+
+def cascade_ocr_pages(pages: List[DocumentPage], language: Optional[str] = None) -> List[Dict[str, Any]]:
+    """OCR страниц документа через каскад (model=auto): каждая страница маршрутизируется отдельно."""
+    results = []
+    for page in pages:
+        start_time = time.time()
+        routed = run_cascade(page.array, language=language)
+        results.append({
+            "page": page.index + 1,
+            "status": "success",
+            "text": routed["text"],
+            "model": routed["model"],
+            "cascade": routed["cascade"],
+            "image_size": list(page.size),
+            "dpi": page.dpi,
+            "tiling": routed["tiling"],
+            "repetition_trimmed": routed["repetition_trimmed"],
+            "processing_time": round(time.time() - start_time, 3)
+        })
+    return results
+
+
+def locked_ocr_pages(model: str, pages: List[DocumentPage],
+                     language: Optional[str] = None) -> List[Dict[str, Any]]:
+    """ocr_pages в слоте модели (загрузка и запросы к модели выполняются по одному)."""
+    with model_slot(model, cost=len(pages)) as model_instance:
+        return ocr_pages(model_instance, model, pages, language)
+
+
+def prefiltered_ocr_pages(model: str, pages: List[DocumentPage], session: PrefilterSession,
+                          language: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    OCR пакета страниц документа с предфильтром.
+    
+    Пустые страницы пропускаются, повторы страниц получают текст
+    ранее обработанной страницы; модель обрабатывает только остальные.
+    При model=auto страницы проходят каскад.
+    """
+    decisions = {page.index: session.check(page.index, page.array) for page in pages}
+    unique = [page for page in pages if decisions[page.index].action == "process"]
+    
+    processed: Dict[int, Dict[str, Any]] = {}
+    if unique:
+        if model == AUTO_MODEL:
+            outputs = cascade_ocr_pages(unique, language)
+        else:
+            outputs = locked_ocr_pages(model, unique, language)
+        for page, result in zip(unique, outputs):
+            routed = {"text": result["text"], "model": result.get("model", model), "cascade": result.get("cascade")}
+            session.complete(page.index, decisions[page.index], routed, result["processing_time"])
+            processed[page.index] = result
+    
+    results = []
+    for page in pages:
+        if page.index in processed:
+            results.append(processed[page.index])
+            continue
+        
+        decision = decisions[page.index]
+        result = {
+            "page": page.index + 1,
+            "status": "skipped_blank",
+            "text": "",
+            "image_size": list(page.size),
+            "dpi": page.dpi,
+            "tiling": None,
+            "processing_time": 0.0,
+            "prefilter": decision.to_dict()
+        }
+        if decision.action == "duplicate":
+            original = session.resolve(decision)
+            result["status"] = "duplicate"
+            result["text"] = original["text"] if original else ""
+            if not decision.recent:
+                result["duplicate_of"] = decision.duplicate_of + 1
+        results.append(result)
+    return results
+
+
 # =============================================================================
 # Эндпоинты
 # =============================================================================
@@ -252,7 +982,9 @@ async def health_check():
         "vram_used_gb": vram_used,
         "models_loaded": len(model_cache),
         "loaded_models": list(model_cache.keys()),
-        "rate_limit_per_minute": security_config.RATE_LIMIT_PER_MINUTE
+        "rate_limit_per_minute": get_rate_limiter().settings['requests_per_minute'],
+        "inference_server": INFERENCE_SERVER or None,
+        "coalescing": single_flight.get_stats()
     }
 
 
@@ -271,7 +1003,8 @@ async def list_models():
             {"id": "phi3_vision", "name": "Phi-3.5 Vision", "params": "4.2B", "vram_fp16": "7.7GB"},
             {"id": "got_ocr_ucas", "name": "GOT-OCR 2.0 (UCAS)", "params": "580M", "vram_fp16": "2.7GB"},
             {"id": "got_ocr_hf", "name": "GOT-OCR 2.0 (HF)", "params": "580M", "vram_fp16": "1.1GB"},
-            {"id": "deepseek_ocr", "name": "DeepSeek OCR", "params": "~1B", "vram_fp16": "0.01GB"}
+            {"id": "deepseek_ocr", "name": "DeepSeek OCR", "params": "~1B", "vram_fp16": "0.01GB"},
+            {"id": AUTO_MODEL, "name": "Каскад: дешевая модель, эскалация при низкой оценке"}
         ],
         "loaded": list(model_cache.keys())
     }
@@ -282,61 +1015,62 @@ async def extract_text(
     request: Request,
     file: UploadFile = File(...),
     model: str = "qwen3_vl_2b",
-    language: Optional[str] = None
+    language: Optional[str] = None,
+    tiling: bool = True,
+    document_type: Optional[str] = None
 ):
     """
     Извлечение текста из изображения.
     
     Args:
         file: Файл изображения (JPG, PNG, BMP, TIFF)
-        model: Модель для использования (по умолчанию: qwen3_vl_2b)
+        model: Модель для использования (по умолчанию: qwen3_vl_2b;
+            auto - каскад от дешевой модели к крупным)
         language: Подсказка языка (опционально)
+        tiling: Разбивать крупные изображения на перекрывающиеся тайлы
+        document_type: Тип документа (passport, invoice, receipt) для оценки каскада
+            и метрик спекулятивного декодирования Qwen3-VL
     
     Returns:
         Извлечённый текст с метаданными
     """
     try:
-        # Чтение и валидация файла
-        image_data = await file.read()
-        validate_file(file, image_data)
+        await charge_pages(request, 1)
         
-        image = Image.open(io.BytesIO(image_data))
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+        # Чтение и валидация файла
+        image_data, header = await read_upload(file, model)
         
-        model_instance = get_model(model)
         start_time = time.time()
         
-        # Обработка в зависимости от типа модели
-        if "qwen3" in model:
-            text = model_instance.extract_text(image, language=language)
-        elif "qwen" in model:
-            text = model_instance.chat(image, "Extract all text from this document.")
-        elif model == "dots_ocr":
-            result = model_instance.parse_document(image, return_json=False)
-            text = result.get('raw_text', str(result))
-        else:  # GOT-OCR
-            text = model_instance.process_image(image)
+        # Одинаковые одновременные запросы выполняются один раз
+        key = request_key(image_data, model, language=language, tiling=tiling, document_type=document_type)
+        async with watched(request, request_ticket(request)):
+            ocr_result = await single_flight.do_async(
+                key,
+                lambda: execute_ocr(image_data, header, model, language, tiling, document_type)
+            )
+        text = ocr_result["text"]
         
         processing_time = time.time() - start_time
         
-        # Добавление заголовка с оставшимися запросами
-        client_ip = request.client.host if request.client else "unknown"
-        remaining = rate_limiter.get_remaining(client_ip)
-        
         return JSONResponse(
             content={
                 "text": text,
-                "model": model,
+                "model": ocr_result.get("model", model),
                 "processing_time": round(processing_time, 3),
-                "image_size": list(image.size),
-                "language": language
+                "image_size": list(header.size),
+                "language": language,
+                "tiling": ocr_result["tiling"],
+                "repetition_trimmed": ocr_result["repetition_trimmed"],
+                "cascade": ocr_result.get("cascade")
             },
-            headers={"X-RateLimit-Remaining": str(remaining)}
+            headers=rate_limit_headers(request)
         )
         
     except HTTPException:
         raise
+    except RequestDropped as e:
+        raise dropped_error(e)
     except Exception as e:
         logger.error(f"Ошибка OCR: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -365,37 +1099,30 @@ async def chat_with_image(
         Ответ модели
     """
     try:
-        # Чтение и валидация файла
-        image_data = await file.read()
-        validate_file(file, image_data)
+        # Модель передается формой, а не в query - метка для /metrics
+        request.state.model = model
+        if model == AUTO_MODEL:
+            # Каскад оценивает результат OCR; для свободного диалога оценки нет
+            raise HTTPException(status_code=400, detail="model=auto поддерживается только для OCR")
+        await charge_pages(request, 1)
         
-        image = Image.open(io.BytesIO(image_data))
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+        # Чтение и валидация файла
+        image_data, header = await read_upload(file, model)
         
         # Санитизация промпта
         prompt = prompt.strip()[:2000]  # Ограничение длины промпта
         
-        model_instance = get_model(model)
         start_time = time.time()
         
-        if "qwen" in model:
-            response = model_instance.chat(
-                image=image,
-                prompt=prompt,
-                temperature=temperature,
-                max_new_tokens=max_tokens
+        key = request_key(image_data, model, prompt, temperature=temperature, max_tokens=max_tokens)
+        async with watched(request, request_ticket(request)):
+            response = await single_flight.do_async(
+                key,
+                lambda: execute_chat(image_data, header, model, prompt, temperature, max_tokens)
             )
-        elif model == "dots_ocr":
-            response = str(model_instance.process_image(image, prompt=prompt))
-        else:  # GOT-OCR
-            response = model_instance.process_image(image)
         
         processing_time = time.time() - start_time
         
-        client_ip = request.client.host if request.client else "unknown"
-        remaining = rate_limiter.get_remaining(client_ip)
-        
         return JSONResponse(
             content={
                 "response": response,
@@ -403,11 +1130,13 @@ async def chat_with_image(
                 "processing_time": round(processing_time, 3),
                 "prompt": prompt
             },
-            headers={"X-RateLimit-Remaining": str(remaining)}
+            headers=rate_limit_headers(request)
         )
         
     except HTTPException:
         raise
+    except RequestDropped as e:
+        raise dropped_error(e)
     except Exception as e:
         logger.error(f"Ошибка чата: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -417,17 +1146,26 @@ async def chat_with_image(
 async def batch_ocr(
     request: Request,
     files: List[UploadFile] = File(...),
-    model: str = "qwen3_vl_2b"
+    model: str = "qwen3_vl_2b",
+    skip_blank: bool = True,
+    dedupe: str = Query(default="off", pattern=DEDUPE_PATTERN)
 ):
     """
     Пакетная обработка OCR.
     
+    Перед запуском модели страницы проходят предфильтр: пустые страницы
+    пропускаются (status "skipped_blank"); с dedupe=batch/recent повторы
+    страницы получают результат исходной страницы (status "duplicate").
+    
     Args:
         files: Список файлов изображений (максимум 10)
         model: Модель для использования
+        skip_blank: Пропускать пустые страницы
+        dedupe: Повторы страниц: off (по умолчанию), batch (в пределах пакета)
+            или recent (также недавние результаты этой модели для этого клиента)
     
     Returns:
-        Список результатов
+        Список результатов и отчет предфильтра (сэкономленные GPU-секунды)
     """
     # Проверка количества файлов
     if len(files) > security_config.MAX_BATCH_SIZE:
@@ -435,65 +1173,294 @@ async def batch_ocr(
             status_code=400,
             detail=f"Слишком много файлов. Максимум: {security_config.MAX_BATCH_SIZE}"
         )
+    await charge_pages(request, len(files))
     
-    results = []
+    # Пакеты по умолчанию в классе batch: интерактивные запросы не ждут за ними
+    ticket = request_ticket(request, default_priority="batch")
+    session = get_page_filter().session(model, skip_blank=skip_blank, dedupe=dedupe,
+                                        client=request.state.rate_client.id)
     
-    for file in files:
+    def batch_error(file: UploadFile, error: Exception) -> Dict[str, Any]:
+        if isinstance(error, HTTPException):
+            return {"filename": file.filename, "error": error.detail, "status": "error"}
+        if isinstance(error, RequestDropped):
+            return {"filename": file.filename, "error": dropped_error(error).detail, "status": "error"}
+        logger.error(f"Ошибка пакетной обработки для {file.filename}: {error}")
+        return {"filename": file.filename, "error": str(error), "status": "error"}
+    
+    async def prepare(file: UploadFile):
+        image_data, header = await read_upload(file, model)
+        ingested = await asyncio.to_thread(decode_upload, image_data, header, decode_model(model), False)
+        return image_data, ingested.array
+    
+    # Декодирование параллельно, предфильтр - по порядку файлов
+    prepared = await asyncio.gather(*(prepare(file) for file in files), return_exceptions=True)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(files)
+    decisions = {}
+    
+    for index, (file, item) in enumerate(zip(files, prepared)):
+        if isinstance(item, Exception):
+            results[index] = batch_error(file, item)
+            continue
+        decisions[index] = await asyncio.to_thread(session.check, index, item[1])
+    
+    async def process(index: int) -> None:
+        file = files[index]
+        image_data, image = prepared[index]
         try:
-            image_data = await file.read()
-            validate_file(file, image_data)
-            
-            image = Image.open(io.BytesIO(image_data))
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            model_instance = get_model(model)
             start_time = time.time()
             
-            if "qwen3" in model:
-                text = model_instance.extract_text(image)
-            elif "qwen" in model:
-                text = model_instance.chat(image, "Extract all text.")
-            else:
-                text = model_instance.process_image(image)
+            # Одинаковые файлы (в том числе из других запросов) выполняются один раз
+            key = request_key(image_data, model, endpoint="batch")
+            routed = await single_flight.do_async(key, lambda: execute_batch_item(image, model))
             
             processing_time = time.time() - start_time
+            session.complete(index, decisions[index], routed, processing_time)
             
-            results.append({
+            results[index] = {
                 "filename": file.filename,
-                "text": text,
+                "text": routed["text"],
+                "model": routed["model"],
+                "cascade": routed["cascade"],
                 "processing_time": round(processing_time, 3),
                 "status": "success"
-            })
-            
-        except HTTPException as e:
-            results.append({
-                "filename": file.filename,
-                "error": e.detail,
-                "status": "error"
-            })
+            }
         except Exception as e:
-            logger.error(f"Ошибка пакетной обработки для {file.filename}: {e}")
-            results.append({
-                "filename": file.filename,
-                "error": str(e),
-                "status": "error"
-            })
+            results[index] = batch_error(file, e)
     
-    successful = sum(1 for r in results if r["status"] == "success")
+    # Файлы обрабатываются параллельно; одна модель выполняет один запрос за раз
+    async with watched(request, ticket):
+        await asyncio.gather(*(
+            process(index) for index, decision in decisions.items() if decision.action == "process"
+        ))
     
-    client_ip = request.client.host if request.client else "unknown"
-    remaining = rate_limiter.get_remaining(client_ip)
+    for index, decision in decisions.items():
+        if decision.action == "process":
+            continue
+        
+        result = {
+            "filename": files[index].filename,
+            "text": "",
+            "model": None,
+            "cascade": None,
+            "processing_time": 0.0,
+            "status": "skipped_blank",
+            "prefilter": decision.to_dict()
+        }
+        if decision.action == "duplicate":
+            original = session.resolve(decision)
+            if original is None:
+                result.update(status="error", error="Исходная страница не обработана")
+            else:
+                result.update(status="duplicate", text=original["text"], model=original["model"],
+                              cascade=original["cascade"])
+            if not decision.recent:
+                result["duplicate_of"] = files[decision.duplicate_of].filename
+        results[index] = result
+    
+    successful = sum(1 for r in results if r["status"] != "error")
     
     return JSONResponse(
         content={
             "results": results,
             "total": len(files),
             "successful": successful,
-            "failed": len(files) - successful
+            "failed": len(files) - successful,
+            "prefilter": session.report()
         },
-        headers={"X-RateLimit-Remaining": str(remaining)}
+        headers=rate_limit_headers(request)
+    )
+
+
+@app.post("/document/ocr", dependencies=[Depends(rate_limit_check)])
+async def document_ocr(
+    request: Request,
+    file: UploadFile = File(...),
+    model: str = "qwen3_vl_2b",
+    language: Optional[str] = None,
+    batch_size: int = Query(default=4, ge=1, le=16),
+    skip_blank: bool = True,
+    dedupe: str = Query(default="off", pattern=DEDUPE_PATTERN)
+):
+    """
+    Постраничное OCR многостраничных PDF и TIFF документов.
+    
+    Страницы декодируются лениво (TIFF - по кадрам, PDF - растеризация
+    постранично с DPI под бюджет пикселей модели). Следующий пакет страниц
+    растеризуется, пока обрабатывается текущий; в памяти находится не более
+    двух пакетов. Результаты возвращаются потоком NDJSON по мере готовности.
+    
+    Args:
+        file: PDF, многостраничный TIFF или изображение
+        model: Модель для использования (auto - каскад для каждой страницы)
+        language: Подсказка языка (опционально)
+        batch_size: Количество страниц в одном пакете генерации
+        skip_blank: Пропускать пустые страницы
+        dedupe: Повторы страниц: off (по умолчанию), batch (в пределах документа)
+            или recent (также недавние результаты этой модели для этого клиента)
+    
+    Returns:
+        NDJSON: одна строка на страницу и итоговая строка summary
+    """
+    with STAGE_SECONDS.labels("upload_read", metric_model(model)).time(), tracer.span("upload_read", filename=file.filename):
+        content = await file.read()
+    with STAGE_SECONDS.labels("validation", metric_model(model)).time(), tracer.span("validation", bytes=len(content)):
+        total_pages = validate_document(file, content)
+    await charge_pages(request, total_pages)
+    ticket = request_ticket(request, default_priority="batch")
+    
+    pages = iter_document_pages(
+        content,
+        pixel_budget=get_pixel_budget(decode_model(model)),
+        max_megapixels=security_config.MAX_MEGAPIXELS
     )
+    batches = iter_page_batches(pages, batch_size)
+    session = get_page_filter().session(model, skip_blank=skip_blank, dedupe=dedupe,
+                                        client=request.state.rate_client.id)
+    
+    async def stream():
+        watcher = asyncio.ensure_future(watch_disconnect(request, ticket))
+        try:
+            async for line in stream_pages():
+                yield line
+        finally:
+            watcher.cancel()
+    
+    async def stream_pages():
+        start_time = time.time()
+        processed = 0
+        failed = 0
+        next_batch = asyncio.ensure_future(asyncio.to_thread(next, batches, None))
+        
+        while True:
+            try:
+                batch = await next_batch
+            except Exception as e:
+                logger.error(f"Ошибка декодирования документа {file.filename}: {e}")
+                yield json.dumps({"page": processed + 1, "status": "error", "error": str(e)},
+                                 ensure_ascii=False) + "\n"
+                failed += 1
+                break
+            
+            if batch is None:
+                break
+            
+            if await request.is_disconnected():
+                logger.info(f"Клиент отключился, обработка {file.filename} остановлена")
+                return
+            
+            # Растеризация следующего пакета параллельно с OCR текущего
+            next_batch = asyncio.ensure_future(asyncio.to_thread(next, batches, None))
+            
+            try:
+                # Модель загружается в слоте модели, в рабочем потоке
+                results = await asyncio.to_thread(
+                    ticket.run, prefiltered_ocr_pages, model, batch, session, language
+                )
+            except ClientDisconnected:
+                logger.info(f"Клиент отключился, обработка {file.filename} остановлена")
+                return
+            except RequestDropped as e:
+                # Срок истек: оставшиеся страницы тоже не дождутся модели
+                detail = dropped_error(e).detail
+                for page in batch:
+                    yield json.dumps({"page": page.index + 1, "status": "error", "error": detail},
+                                     ensure_ascii=False) + "\n"
+                failed += len(batch)
+                processed += len(batch)
+                break
+            except Exception as e:
+                logger.error(f"Ошибка OCR страниц документа {file.filename}: {e}")
+                error = e.detail if isinstance(e, HTTPException) else str(e)
+                results = [
+                    {"page": page.index + 1, "status": "error", "error": error}
+                    for page in batch
+                ]
+                failed += len(batch)
+            
+            for result in results:
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+            processed += len(batch)
+        
+        yield json.dumps({
+            "summary": True,
+            "filename": file.filename,
+            "model": model,
+            "total_pages": total_pages,
+            "processed": processed,
+            "failed": failed,
+            "processing_time": round(time.time() - start_time, 3),
+            "prefilter": session.report()
+        }, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+def cache_hit_ratios():
+    """Доли попаданий кешей для /metrics (вычисляются при сборе метрик)."""
+    coalescing = single_flight.get_stats()
+    yield ("coalescing",), coalescing["coalesced_rate"]
+    
+    model_hits = MODEL_CACHE.labels("hit").value
+    model_lookups = model_hits + MODEL_CACHE.labels("miss").value
+    yield ("model",), model_hits / model_lookups if model_lookups else 0.0
+    
+    if _page_filter is not None:
+        totals = _page_filter.get_stats()
+        skipped = totals["blank_skipped"] + totals["duplicates"]
+        yield ("prefilter",), skipped / totals["pages"] if totals["pages"] else 0.0
+    
+    for name, model_instance in list(model_cache.items()):
+        vision_cache = getattr(model_instance, "vision_cache", None)
+        if vision_cache is not None:
+            yield (f"vision:{name}",), vision_cache.stats()["hit_ratio"]
+
+
+registry.gauge("chatvlm_cache_hit_ratio", "Cache hit ratios", ("cache",)).set_function(cache_hit_ratios)
+registry.gauge("chatvlm_models_loaded", "Loaded models").set_function(lambda: [((), len(model_cache))])
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Метрики в формате Prometheus: латентность этапов, счетчики запросов и токенов, память GPU."""
+    return PlainTextResponse(registry.render(), media_type=registry.content_type)
+
+
+@app.get("/gpu/telemetry")
+async def gpu_telemetry(seconds: float = Query(default=60.0, gt=0, le=3600)):
+    """Последний замер GPU (память, утилизация, температура, процессы) и история для графиков."""
+    telemetry = get_telemetry()
+    return {
+        "latest": telemetry.latest().to_dict(),
+        "interval": telemetry.interval,
+        "history": [sample.to_dict() for sample in telemetry.history(seconds)]
+    }
+
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    """Очереди моделей по классам приоритета: ожидание, выполненные и снятые запросы."""
+    if INFERENCE_SERVER:
+        return await asyncio.to_thread(lambda: get_inference_client().stats()["scheduler"])
+    return get_scheduler().get_stats()
+
+
+@app.get("/coalescing/stats")
+async def coalescing_stats():
+    """Счетчики объединения одинаковых одновременных запросов."""
+    return single_flight.get_stats()
+
+
+@app.get("/prefilter/stats")
+async def prefilter_stats():
+    """Пропущенные пустые страницы, повторы и сэкономленные GPU-секунды."""
+    return get_page_filter().get_stats()
+
+
+@app.get("/cascade/stats")
+async def cascade_stats():
+    """Доля страниц по уровням каскада и смешанная стоимость страницы."""
+    return get_cascade_router().get_stats()
 
 
 @app.delete("/models/{model_name}")
@@ -531,7 +1498,8 @@ async def http_exception_handler(request: Request, exc: HTTPException):
     """Обработчик HTTP исключений."""
     return JSONResponse(
         status_code=exc.status_code,
-        content={"detail": exc.detail, "status_code": exc.status_code}
+        content={"detail": exc.detail, "status_code": exc.status_code},
+        headers=getattr(exc, "headers", None)
     )
 
 
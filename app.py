@@ -22,6 +22,8 @@ if 'utils.smart_content_renderer' in sys.modules:
 import json
 import re
 
+from utils.tracing import tracer
+
 def render_message_with_json_and_html_tables(content: str, role: str = "assistant"):
     """
     ОБРАБОТКА JSON И HTML ТАБЛИЦ - ТЕКСТОВАЯ ВЕРСИЯ
@@ -251,91 +253,7 @@ def convert_html_table_to_text(content: str) -> str:
 # All HTML rendering has been replaced with native Streamlit elements
 
 from ui.styles import get_custom_css
-
-
-def clean_ocr_result(text: str) -> str:
-    """Очистка результата OCR от лишних символов и повторений."""
-    if not text:
-        return text
-    
-    # Исправление кодировки и искаженных символов
-    # Замена латинских символов на кириллические
-    char_replacements = {
-        'B': 'В', 'O': 'О', 'P': 'Р', 'A': 'А', 'H': 'Н', 'K': 'К', 
-        'E': 'Е', 'T': 'Т', 'M': 'М', 'X': 'Х', 'C': 'С', 'Y': 'У'
-    }
-    
-    # Применяем замены только к буквам в словах (не к цифрам и датам)
-    for lat, cyr in char_replacements.items():
-        # Заменяем только если символ окружен буквами
-        text = re.sub(f'(?<=[А-ЯЁа-яё]){lat}(?=[А-ЯЁа-яё])', cyr, text)
-        text = re.sub(f'^{lat}(?=[А-ЯЁа-яё])', cyr, text)
-        text = re.sub(f'(?<=[А-ЯЁа-яё]){lat}$', cyr, text)
-    
-    # Исправление конкретных искажений
-    corrections = {
-        'BOJNTEJBCKOEVJOCTOBEPENNE': 'ВОДИТЕЛЬСКОЕ УДОСТОВЕРЕНИЕ',
-        'BAKAPNHLEB': 'ВАКАРИН ЛЕВ',
-        'AHAPENNABNOBNY': 'АНДРЕЙ ЛЬВОВИЧ',
-        'ANTANCKNIKPA': 'АЛТАЙСКИЙ КРАЙ',
-        'TN6A2747': 'ГИ БДД 2747'
-    }
-    
-    for wrong, correct in corrections.items():
-        text = text.replace(wrong, correct)
-    
-    # Добавление пробелов между полями
-    text = re.sub(r'(\d+)([А-ЯЁ])', r'\1 \2', text)  # Между цифрой и буквой
-    text = re.sub(r'([а-яё])(\d)', r'\1 \2', text)    # Между буквой и цифрой
-    text = re.sub(r'(\))([А-ЯЁ])', r') \2', text)     # После скобки
-    
-    # Форматирование дат
-    text = re.sub(r'(\d{2})\.(\d{2})\.(\d{4})(\d{2})\.(\d{2})\.(\d{4})', 
-                  r'\1.\2.\3 \4.\5.\6', text)
-    
-    # Исправление склеенных дат 4a) и 4b)
-    text = re.sub(r'4a\)(\d{2}\.\d{2}\.\d{4})4b\)(\d{2}\.\d{2}\.\d{4})', 
-                  r'4a) \1 4b) \2', text)
-    
-    # Разделение полей по номерам
-    text = re.sub(r'(\d+\.)([А-ЯЁ])', r'\1 \2', text)
-    text = re.sub(r'(\d+[аб]\))([А-ЯЁ\d])', r'\1 \2', text)
-    text = re.sub(r'(\d+[сc]\))([А-ЯЁ])', r'\1 \2', text)
-    
-    # Удаление повторяющихся символов
-    text = re.sub(r'(\*\*[0-9\s]+\*\*)+', '', text)
-    text = re.sub(r'\*\*+', '', text)
-    text = re.sub(r'(00\s+){3,}', '', text)
-    
-    # Разбивка на строки и очистка
-    lines = text.split('\n')
-    cleaned_lines = []
-    
-    for line in lines:
-        line = line.strip()
-        
-        # Пропускаем пустые строки
-        if not line:
-            continue
-            
-        # Пропускаем строки только с повторяющимися символами
-        if re.match(r'^[0\s\*\.]+$', line) and len(line) > 10:
-            continue
-            
-        # Пропускаем строки только со звездочками
-        if re.match(r'^\*+$', line):
-            continue
-        
-        cleaned_lines.append(line)
-    
-    # Объединяем очищенные строки
-    cleaned_text = '\n'.join(cleaned_lines)
-    
-    # Финальная очистка
-    cleaned_text = re.sub(r'\n{3,}', '\n\n', cleaned_text)
-    cleaned_text = re.sub(r'\s{3,}', ' ', cleaned_text)  # Множественные пробелы
-    
-    return cleaned_text.strip()
+from utils.text_extractor import clean_ocr_result
 
 
 def display_bbox_visualization_improved(ocr_result):
@@ -1188,6 +1106,10 @@ elif "📄 Режим OCR" in page:
                     pass
                 
                 with st.spinner("🔄 Обработка документа..."):
+                    # Корневой span трассировки: адаптер vLLM, контейнеры и постобработка - дочерние
+                    ocr_span = tracer.start_span(
+                        "streamlit.ocr", root=True, model=selected_model, mode=execution_mode
+                    ).activate()
                     try:
                         # Реальная интеграция с моделью
                         from models.model_loader import ModelLoader
@@ -1332,7 +1254,8 @@ elif "📄 Режим OCR" in page:
                                 text = model.chat(processed_image, "Извлеките весь текст из этого документа, сохраняя структуру и форматирование.")
                         
                         # Очистка и улучшение результата
-                        text = clean_ocr_result(text)
+                        with tracer.span("postprocess.clean_ocr_result", chars=len(text)):
+                            text = clean_ocr_result(text)
                         
                         if "vLLM" not in execution_mode:
                             processing_time = time.time() - start_time
@@ -1364,8 +1287,12 @@ elif "📄 Режим OCR" in page:
                         st.rerun()
                         
                     except Exception as e:
+                        ocr_span.end(e)
                         st.error(f"❌ Ошибка при обработке: {str(e)}")
                         st.info("💡 Попробуйте выбрать другую модель или проверьте, что модель загружена корректно")
+                    finally:
+                        # st.rerun()/st.stop() тоже завершают span
+                        ocr_span.end()
             else:
                 st.error("❌ Пожалуйста, сначала загрузите изображение")
     
@@ -8,31 +8,24 @@ import time
 import psutil
 import os
 
+from utils.gpu_telemetry import get_telemetry
+
 def get_gpu_info():
     """Получение информации о GPU"""
     try:
-        result = subprocess.run([
-            "nvidia-smi", 
-            "--query-gpu=index,name,memory.total,memory.free,memory.used,utilization.gpu",
-            "--format=csv,noheader,nounits"
-        ], capture_output=True, text=True, check=True)
-        
-        lines = result.stdout.strip().split('\n')
-        gpus = []
-        
-        for line in lines:
-            parts = [p.strip() for p in line.split(',')]
-            if len(parts) >= 6:
-                gpus.append({
-                    'index': int(parts[0]),
-                    'name': parts[1],
-                    'total_mb': int(parts[2]),
-                    'free_mb': int(parts[3]),
-                    'used_mb': int(parts[4]),
-                    'utilization': int(parts[5])
-                })
-        
-        return gpus
+        # NVML без запуска nvidia-smi
+        sample = get_telemetry().latest(max_age=0)
+        return [
+            {
+                'index': gpu.index,
+                'name': gpu.name,
+                'total_mb': int(gpu.memory_total_mb),
+                'free_mb': int(gpu.memory_free_mb),
+                'used_mb': int(gpu.memory_used_mb),
+                'utilization': int(gpu.utilization_percent or 0)
+            }
+            for gpu in sample.gpus
+        ]
     except Exception as e:
         print(f"❌ Ошибка получения информации о GPU: {e}")
         return []
@@ -40,26 +33,15 @@ def get_gpu_info():
 def get_gpu_processes():
     """Получение процессов, использующих GPU"""
     try:
-        result = subprocess.run([
-            "nvidia-smi", 
-            "--query-compute-apps=pid,process_name,used_memory",
-            "--format=csv,noheader,nounits"
-        ], capture_output=True, text=True, check=True)
-        
-        lines = result.stdout.strip().split('\n')
-        processes = []
-        
-        for line in lines:
-            if line.strip():
-                parts = [p.strip() for p in line.split(',')]
-                if len(parts) >= 3:
-                    processes.append({
-                        'pid': int(parts[0]),
-                        'name': parts[1],
-                        'memory_mb': int(parts[2])
-                    })
-        
-        return processes
+        sample = get_telemetry().latest(max_age=0)
+        return [
+            {
+                'pid': process.pid,
+                'name': process.name,
+                'memory_mb': int(process.used_memory_mb)
+            }
+            for process in sample.processes
+        ]
     except Exception as e:
         print(f"❌ Ошибка получения GPU процессов: {e}")
         return []
@@ -5,6 +5,10 @@ from typing import Dict, Any, Optional, List
 from PIL import Image
 import torch
 from utils.logger import logger
+from utils.compiled_generation import build_compiled_generator, compile_settings, execution_mode
+from utils.cpu_inference import configure_cpu_execution
+from utils.metrics import GenerationTimer
+from utils.quantization import profile_load_kwargs, resolve_profile
 
 
 class BaseModel(ABC):
@@ -18,16 +22,23 @@ class BaseModel(ABC):
             config: Model configuration dictionary containing:
                 - model_path: HuggingFace model identifier
                 - precision: Model precision (fp16, bf16, int8, int4)
+                - quantization_profile: Execution profile (fp32, fp16, bf16, int8,
+                  int4_nf4, cpu_int8_dynamic); overrides precision
                 - device_map: Device mapping strategy
+                - execution_mode: 'default' or 'compiled' (static KV cache + torch.compile)
+                - cpu: CPU execution settings (profile, intra/inter-op threads, replicas)
         """
         self.config = config
         self.model_path = config.get('model_path', '')
         self.model_id = self.model_path  # Alias for compatibility
         self.precision = config.get('precision', 'fp16')
+        self.quantization_profile = resolve_profile(config)
         self.device_map = config.get('device_map', 'auto')
         self.model = None
         self.processor = None
         self.device = self._get_device()
+        self.execution_mode = execution_mode(config)
+        self.compiled_generator = None
         
     def _get_device(self) -> str:
         """Determine optimal device for model inference - FORCE GPU USAGE."""
@@ -58,29 +69,62 @@ class BaseModel(ABC):
         if torch.cuda.is_available():
             logger.info("FORCING GPU usage with device_map='auto'")
             load_kwargs['device_map'] = 'auto'  # Force auto device mapping to GPU
-            
-            # GPU precision settings
-            if self.precision == "fp16":
-                load_kwargs['torch_dtype'] = torch.float16
-            elif self.precision == "bf16":
-                load_kwargs['torch_dtype'] = torch.bfloat16
-            elif self.precision == "int8":
-                load_kwargs['load_in_8bit'] = True
-            elif self.precision == "int4":
-                from transformers import BitsAndBytesConfig
-                load_kwargs['quantization_config'] = BitsAndBytesConfig(
-                    load_in_4bit=True,
-                    bnb_4bit_compute_dtype=torch.float16,
-                    bnb_4bit_use_double_quant=True,
-                    bnb_4bit_quant_type="nf4"
-                )
         else:
-            # CPU fallback (will be slow)
-            logger.warning("⚠️ NO GPU AVAILABLE - USING CPU (VERY SLOW)")
-            load_kwargs['torch_dtype'] = torch.float32
+            # CPU mode: explicit thread pools (replica workers pin their own)
+            logger.warning("⚠️ NO GPU AVAILABLE - USING CPU")
+            configure_cpu_execution(self.config)
+        
+        # Precision and quantization from the execution profile
+        # (cpu_int8_dynamic is applied by the loader after loading)
+        load_kwargs.update(profile_load_kwargs(self.quantization_profile))
         
         return load_kwargs
     
+    def _attn_implementation(self, default: Optional[str] = "eager") -> Optional[str]:
+        """
+        Attention backend for loading.
+        
+        Compiled mode needs a compilable backend; otherwise the configured
+        ``attn_implementation`` (set by the loader's backend probe) is used.
+        """
+        if self.execution_mode == 'compiled':
+            return compile_settings(self.config)['attn_implementation']
+        return self.config.get('attn_implementation', default)
+    
+    def _setup_compiled_generation(self, name: str, warmup_token_id: Optional[int] = None) -> None:
+        """
+        Prepare the compiled execution mode after the model is loaded.
+        
+        Does nothing unless the config sets ``execution_mode: compiled``.
+        
+        Args:
+            name: Model name for logs
+            warmup_token_id: Token used for warm-up compilation (skipped if None)
+        """
+        self.compiled_generator = build_compiled_generator(
+            self.model, self.config, name, warmup_token_id=warmup_token_id
+        )
+    
+    def _model_generate(self, inputs: Dict[str, Any], **gen_kwargs) -> torch.Tensor:
+        """
+        Call ``model.generate()`` through the compiled path when enabled.
+        
+        A ``GenerationTimer`` streamer records prefill/decode latency and
+        token counts unless the caller passes its own streamer.
+        
+        Args:
+            inputs: Model inputs
+            **gen_kwargs: generate() parameters
+            
+        Returns:
+            Generated token ids
+        """
+        if gen_kwargs.get('num_beams', 1) == 1:
+            gen_kwargs.setdefault('streamer', GenerationTimer(self.model_path))
+        if self.compiled_generator is not None:
+            return self.compiled_generator.generate(inputs, **gen_kwargs)
+        return self.model.generate(**inputs, **gen_kwargs)
+    
     @abstractmethod
     def load_model(self) -> None:
         """Load model and processor from HuggingFace."""
@@ -100,6 +144,53 @@ class BaseModel(ABC):
         """
         pass
     
+    def process_batch(
+        self,
+        images: List[Image.Image],
+        prompt: Optional[str] = None,
+        **kwargs
+    ) -> List[str]:
+        """
+        Process several images with the same prompt.
+        
+        Default implementation runs images one by one. Override in
+        subclasses that can batch generation on the device.
+        
+        Args:
+            images: List of PIL Images
+            prompt: Optional prompt shared by all images
+            **kwargs: Additional generation parameters
+            
+        Returns:
+            List of outputs in the same order as images
+        """
+        if prompt is None:
+            return [self.process_image(image) for image in images]
+        return [self.process_image(image, prompt, **kwargs) for image in images]
+
+    def process_prompts(
+        self,
+        image: Image.Image,
+        prompts: List[str],
+        **kwargs
+    ) -> List[str]:
+        """
+        Run several prompts against the same image.
+
+        Default implementation runs prompts one by one. Override in
+        subclasses that can share image preprocessing and the vision
+        encoder between prompts.
+
+        Args:
+            image: PIL Image object
+            prompts: Prompts to run
+            **kwargs: Additional generation parameters
+
+        Returns:
+            List of outputs in the same order as prompts
+        """
+        return [self.process_image(image, prompt, **kwargs) for prompt in prompts]
+
     def extract_fields(self, text: str, fields: List[str]) -> Dict[str, str]:
         """
         Extract structured fields from text.
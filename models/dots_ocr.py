@@ -15,6 +15,7 @@ from PIL import Image
 
 from models.base_model import BaseModel
 from utils.logger import logger
+from utils.layout_decoding import build_layout_logits_processor, is_layout_prompt, parse_layout
 
 
 class DotsOCRModel(BaseModel):
@@ -167,8 +168,20 @@ class DotsOCRModel(BaseModel):
             
             inputs = inputs.to("cuda")
             
+            # Layout prompts: decoding is constrained to the layout JSON grammar
+            generation_kwargs = {}
+            layout = is_layout_prompt(prompt)
+            if layout:
+                from transformers import LogitsProcessorList
+                
+                processor = build_layout_logits_processor(
+                    self.processor.tokenizer, inputs.input_ids.shape[1], self.config
+                )
+                if processor is not None:
+                    generation_kwargs['logits_processor'] = LogitsProcessorList([processor])
+            
             # Inference: Generation of the output (exact Modal implementation)
-            generated_ids = self.model.generate(**inputs, max_new_tokens=24000)
+            generated_ids = self.model.generate(**inputs, max_new_tokens=24000, **generation_kwargs)
             
             generated_ids_trimmed = [
                 out_ids[len(in_ids):] 
@@ -182,6 +195,8 @@ class DotsOCRModel(BaseModel):
             )
             
             # Return parsed JSON (exact Modal implementation)
+            if layout:
+                return parse_layout(output_text)
             return json.loads(output_text)
             
         except json.JSONDecodeError as e:
@@ -17,6 +17,9 @@ import traceback
 
 from models.base_model import BaseModel
 from utils.logger import logger
+from utils.vision_cache import TensorLRUCache, VisionCacheContext, image_cache_key, install_vision_cache
+from utils.repetition_guard import build_stopping_criteria, log_repetition_report
+from utils.layout_decoding import build_layout_logits_processor, finalize_layout_json, is_layout_prompt
 
 
 class DotsOCRVideoProcessorFixedModel(BaseModel):
@@ -28,6 +31,18 @@ class DotsOCRVideoProcessorFixedModel(BaseModel):
         self.processor = None
         self.max_new_tokens = config.get('max_new_tokens', 512)
         
+        # Кеш выходов vision encoder: повторные промпты по той же странице
+        # (fallback-промпты, официальные промпты) не пересчитывают vision tower
+        self.vision_cache_enabled = config.get('vision_cache', True)
+        self.vision_cache = TensorLRUCache(
+            max_entries=config.get('vision_cache_size', 16),
+            max_device_entries=config.get('vision_cache_device_entries', 4)
+        )
+        self._vision_context = VisionCacheContext()
+        
+        # Отчет repetition guard о последней генерации (сэкономленные токены)
+        self.last_repetition_report: Optional[Dict[str, Any]] = None
+        
         # Отключаем параллелизм токенизатора
         os.environ["TOKENIZERS_PARALLELISM"] = "false"
         
@@ -114,7 +129,7 @@ class DotsOCRVideoProcessorFixedModel(BaseModel):
             load_kwargs.update({
                 'torch_dtype': torch.float16,
                 'trust_remote_code': True,
-                'attn_implementation': "eager",
+                'attn_implementation': self._attn_implementation("eager"),
                 'low_cpu_mem_usage': True,
                 'use_safetensors': True
             })
@@ -434,6 +449,14 @@ class DotsOCRVideoProcessorFixedModel(BaseModel):
                 logger.info(f"EOS token: {tokenizer.eos_token} (ID: {tokenizer.eos_token_id})")
                 logger.info(f"PAD token: {tokenizer.pad_token} (ID: {tokenizer.pad_token_id})")
             
+            tower = getattr(self.model, 'vision_tower', None)
+            if self.vision_cache_enabled and tower is not None:
+                install_vision_cache(tower, self.vision_cache, self._vision_context)
+            
+            # Compiled режим: static KV cache + torch.compile, прогрев при загрузке
+            warmup_token_id = getattr(getattr(self.processor, 'tokenizer', None), 'eos_token_id', None)
+            self._setup_compiled_generation("dots.ocr", warmup_token_id)
+            
             logger.info("✅ dots.ocr loaded successfully with video_processor fix")
             
         except Exception as e:
@@ -468,8 +491,12 @@ class DotsOCRVideoProcessorFixedModel(BaseModel):
             logger.warning(f"Image preprocessing failed: {e}")
             return image
     
-    def _safe_generate_improved(self, inputs: Dict, prompt_type: str = "simple") -> str:
-        """Улучшенная генерация с предотвращением повторений."""
+    def _safe_generate_improved(self, inputs: Dict, prompt_type: str = "simple", layout: bool = False) -> str:
+        """Улучшенная генерация с предотвращением повторений.
+        
+        Для layout-промптов генерация ограничена грамматикой JSON
+        (bbox, category, text), и результат всегда парсится json.loads.
+        """
         try:
             # Убеждаемся что все входные данные в float16
             device = next(self.model.parameters()).device
@@ -498,7 +525,7 @@ class DotsOCRVideoProcessorFixedModel(BaseModel):
             
             # Оптимизированные параметры генерации для предотвращения повторений
             generation_kwargs = {
-                'max_new_tokens': 256,  # Уменьшено для стабильности
+                'max_new_tokens': self.max_new_tokens,  # зацикливание обрезает repetition guard
                 'min_new_tokens': 1,    # Минимум 1 токен
                 'do_sample': True,      # Включаем sampling для разнообразия
                 'temperature': 0.7,     # Умеренная температура
@@ -516,32 +543,74 @@ class DotsOCRVideoProcessorFixedModel(BaseModel):
             # Для простых промптов используем более консервативные параметры
             if prompt_type in ["minimal", "simple"]:
                 generation_kwargs.update({
-                    'max_new_tokens': 128,
+                    'max_new_tokens': min(self.max_new_tokens, 512),
                     'temperature': 0.3,
                     'repetition_penalty': 1.5
                 })
             
+            # Останавливаем генерацию при зацикливании, не дожидаясь max_new_tokens
+            from transformers import StoppingCriteriaList
+            
+            prompt_length = model_inputs['input_ids'].shape[1]
+            criteria = build_stopping_criteria(
+                prompt_length,
+                generation_kwargs['max_new_tokens'],
+                self.config,
+                self.processor.tokenizer
+            )
+            if criteria is not None:
+                generation_kwargs['stopping_criteria'] = StoppingCriteriaList([criteria])
+            
+            layout_processor = None
+            if layout:
+                layout_processor = build_layout_logits_processor(
+                    self.processor.tokenizer, prompt_length, self.config
+                )
+            if layout_processor is not None:
+                from transformers import LogitsProcessorList
+                
+                # Грамматика сама исключает невалидную структуру: sampling и
+                # штрафы за повторы только ломали бы повторяющиеся ключи JSON
+                generation_kwargs.update({
+                    'max_new_tokens': self.max_new_tokens,
+                    'do_sample': False,
+                    'repetition_penalty': 1.0,
+                    'no_repeat_ngram_size': 0,
+                    'logits_processor': LogitsProcessorList([layout_processor])
+                })
+                for key in ('temperature', 'top_p', 'top_k'):
+                    generation_kwargs.pop(key, None)
+                if criteria is not None:
+                    criteria.max_new_tokens = self.max_new_tokens
+            
             # Генерируем ответ
             with torch.no_grad():
                 # Принудительно устанавливаем autocast для консистентности
                 with torch.autocast(device_type='cuda', dtype=target_dtype, enabled=True):
-                    generated_ids = self.model.generate(
-                        **model_inputs,
+                    generated_ids = self._model_generate(
+                        model_inputs,
                         **generation_kwargs
                     )
             
             # Декодируем результат
             generated_ids_trimmed = [
-                out_ids[len(in_ids):] 
-                for in_ids, out_ids in zip(model_inputs['input_ids'], generated_ids)
+                criteria.trim(row, out_ids[prompt_length:]) if criteria is not None else out_ids[prompt_length:]
+                for row, out_ids in enumerate(generated_ids)
             ]
             
+            self.last_repetition_report = criteria.report(len(generated_ids_trimmed)) if criteria is not None else None
+            log_repetition_report("dots.ocr", self.last_repetition_report)
+            
             output_text = self.processor.batch_decode(
                 generated_ids_trimmed, 
                 skip_special_tokens=True, 
                 clean_up_tokenization_spaces=True
             )[0]
             
+            if layout:
+                # Обрезанный по max_new_tokens JSON закрывается после последнего элемента
+                return finalize_layout_json(output_text)
+            
             # Постобработка для удаления артефактов
             output_text = output_text.strip()
             
@@ -624,7 +693,13 @@ class DotsOCRVideoProcessorFixedModel(BaseModel):
                     raise e2
             
             # Генерируем ответ с улучшенными параметрами
-            output_text = self._safe_generate_improved(inputs, prompt_type)
+            keys = []
+            grid_thw = inputs.get('image_grid_thw') if hasattr(inputs, 'get') else None
+            if self.vision_cache_enabled and grid_thw is not None and len(grid_thw) == 1:
+                keys = [image_cache_key(processed_image, {'model_path': self.model_path})]
+            
+            with self._vision_context.activate(keys):
+                output_text = self._safe_generate_improved(inputs, prompt_type, layout=is_layout_prompt(prompt))
             
             return output_text
             
@@ -704,6 +779,8 @@ class DotsOCRVideoProcessorFixedModel(BaseModel):
     def unload(self) -> None:
         """Выгружаем модель."""
         try:
+            self.vision_cache.clear()
+            self.compiled_generator = None
             if self.model is not None:
                 del self.model
                 self.model = None
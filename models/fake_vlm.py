@@ -0,0 +1,84 @@
+"""Fake VLM with deterministic output and modelled latency.
+
+Stands in for a real model in load tests and CI: no weights, no GPU.
+Output text is derived from the input image and prompt, latency follows
+the prefill/decode model of ``utils.fake_backend`` (batches share decode
+steps), and generation is reported to ``/metrics`` like a real
+``generate()`` call.
+
+Registered in ``ModelLoader`` only with ``ENABLE_FAKE_MODELS=1`` (or
+``ModelLoader.register_fake_models()`` from a test harness); then
+available in api.py as ``model=fake_vlm``. Settings come from a
+``fake_vlm`` entry in config.yaml if present, otherwise from
+``FakeVLMModel.DEFAULT_CONFIG``.
+"""
+
+from typing import Any, Dict, List, Optional
+from PIL import Image
+
+from models.base_model import BaseModel
+from utils.fake_backend import DEFAULT_FAKE_SETTINGS, fake_settings, fake_tokens, generate_batch
+from utils.logger import logger
+from utils.metrics import GenerationTimer
+
+
+class FakeVLMModel(BaseModel):
+    """Deterministic fake VLM for load tests."""
+
+    # Used by ModelLoader when config.yaml has no entry for the model
+    DEFAULT_CONFIG: Dict[str, Any] = {
+        "name": "Fake VLM (load tests)",
+        "model_path": "fake/vlm",
+        "precision": "fp32",
+        "max_new_tokens": 256,
+        **DEFAULT_FAKE_SETTINGS,
+    }
+
+    # No weights: ModelLoader skips attention probing and quantization patches
+    SYNTHETIC = True
+
+    def __init__(self, config: Dict[str, Any]):
+        super().__init__(config)
+        self.settings = fake_settings(config)
+        self.max_new_tokens = config.get("max_new_tokens", 256)
+
+    def load_model(self) -> None:
+        """Nothing to load."""
+        logger.info(f"Fake VLM ready: {self.settings}")
+
+    def generate(self, images: List[Any], prompts: List[Optional[str]],
+                 max_new_tokens: Optional[int] = None) -> List[str]:
+        """
+        Generate outputs for a batch of images.
+
+        Args:
+            images: PIL images or arrays
+            prompts: Prompt per image
+            max_new_tokens: Generation limit (default from config)
+
+        Returns:
+            Generated text per image
+        """
+        limit = max_new_tokens or self.max_new_tokens
+        token_lists = [fake_tokens(image, prompt, limit, self.settings) for image, prompt in zip(images, prompts)]
+        generate_batch(token_lists, self.settings, GenerationTimer(self.model_path))
+        return [" ".join(tokens) for tokens in token_lists]
+
+    def process_image(self, image: Image.Image, prompt: Optional[str] = None, **kwargs) -> str:
+        return self.generate([image], [prompt], kwargs.get("max_new_tokens"))[0]
+
+    def process_batch(self, images: List[Image.Image], prompt: Optional[str] = None, **kwargs) -> List[str]:
+        return self.generate(images, [prompt] * len(images), kwargs.get("max_new_tokens"))
+
+    def process_prompts(self, image: Image.Image, prompts: List[str], **kwargs) -> List[str]:
+        return self.generate([image] * len(prompts), prompts, kwargs.get("max_new_tokens"))
+
+    def chat(self, image: Image.Image, message: Optional[str] = None, history: List[Dict[str, str]] = None,
+             prompt: Optional[str] = None, max_new_tokens: Optional[int] = None, **kwargs) -> str:
+        return self.generate([image], [prompt or message], max_new_tokens)[0]
+
+    def extract_text(self, image: Image.Image, language: Optional[str] = None, **kwargs) -> str:
+        return self.process_image(image, f"ocr:{language}", **kwargs)
+
+    def extract_text_batch(self, images: List[Image.Image], language: Optional[str] = None, **kwargs) -> List[str]:
+        return self.process_batch(images, f"ocr:{language}", **kwargs)
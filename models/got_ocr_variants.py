@@ -13,7 +13,11 @@ from PIL import Image
 import torch
 
 from models.base_model import BaseModel
+from utils.cpu_inference import configure_cpu_execution
 from utils.logger import logger
+from utils.quantization import profile_load_kwargs
+from utils.repetition_guard import build_stopping_criteria, log_repetition_report
+from utils.text_extractor import TextExtractor
 
 
 class GOTOCRUCASModel(BaseModel):
@@ -50,11 +54,8 @@ class GOTOCRUCASModel(BaseModel):
                 'device_map': self.device_map,
             }
             
-            # Set precision
-            if self.precision == "fp16":
-                load_kwargs['torch_dtype'] = torch.float16
-            elif self.precision == "int8":
-                load_kwargs['load_in_8bit'] = True
+            # Precision and quantization from the execution profile
+            load_kwargs.update(profile_load_kwargs(self.quantization_profile))
             
             # Load model
             self.model = AutoModel.from_pretrained(
@@ -172,6 +173,10 @@ class GOTOCRHFModel(BaseModel):
         # GOT-OCR specific settings
         self.ocr_type = config.get('ocr_type', 'format')
         self.ocr_color = config.get('ocr_color', '')
+        
+        # Loops are cut by the repetition guard, so the budget can fit full pages
+        self.max_new_tokens = config.get('max_new_tokens', 1024)
+        self.last_repetition_report: Optional[Dict[str, Any]] = None
     
     def load_model(self) -> None:
         """Load GOT-OCR HF model."""
@@ -194,12 +199,16 @@ class GOTOCRHFModel(BaseModel):
                 'trust_remote_code': True,
                 'device_map': self.device_map,
             }
+            attn_implementation = self._attn_implementation(None)
+            if attn_implementation:
+                load_kwargs['attn_implementation'] = attn_implementation
+            
+            # Precision and quantization from the execution profile
+            load_kwargs.update(profile_load_kwargs(self.quantization_profile))
             
-            # Set precision
-            if self.precision == "fp16":
-                load_kwargs['torch_dtype'] = torch.float16
-            elif self.precision == "int8":
-                load_kwargs['load_in_8bit'] = True
+            # CPU mode: explicit thread pools (replica workers pin their own)
+            if device == "cpu":
+                configure_cpu_execution(self.config)
             
             # Load model - используем правильный класс для GOT-OCR HF
             self.model = AutoModelForImageTextToText.from_pretrained(
@@ -208,6 +217,7 @@ class GOTOCRHFModel(BaseModel):
             )
             
             self.model.eval()
+            self._setup_compiled_generation("GOT-OCR HF", self.processor.tokenizer.eos_token_id)
             logger.info("GOT-OCR HF loaded successfully")
             
         except Exception as e:
@@ -223,7 +233,7 @@ class GOTOCRHFModel(BaseModel):
         """Process image with GOT-OCR HF - FIXED IMPLEMENTATION WITH TIMEOUT.
         
         Args:
-            image: PIL Image to process
+            image: PIL Image or RGB array to process
             ocr_type: OCR type ('format', 'ocr', 'multi-crop')
             ocr_color: Optional color specification
             
@@ -239,8 +249,8 @@ class GOTOCRHFModel(BaseModel):
             
             logger.info(f"Processing image with GOT-OCR HF (type: {ocr_type})")
             
-            # Convert to RGB if needed
-            if image.mode != 'RGB':
+            # Convert to RGB if needed (RGB arrays go to the processor as is)
+            if isinstance(image, Image.Image) and image.mode != 'RGB':
                 image = image.convert('RGB')
             
             # Process image using OFFICIAL GOT-OCR HF API from documentation
@@ -252,14 +262,25 @@ class GOTOCRHFModel(BaseModel):
             # Process inputs exactly as in official documentation
             inputs = self.processor(image, return_tensors="pt", format=format_text).to(device)
             
+            from transformers import StoppingCriteriaList
+            
+            prompt_length = inputs["input_ids"].shape[1]
+            criteria = build_stopping_criteria(
+                prompt_length,
+                self.max_new_tokens,
+                self.config,
+                self.processor.tokenizer
+            )
+            guard_kwargs = {'stopping_criteria': StoppingCriteriaList([criteria])} if criteria else {}
+            
             with torch.no_grad():
                 # ИСПРАВЛЕНО: Еще более агрессивные параметры против зависания
-                generated_ids = self.model.generate(
-                    **inputs,
+                generated_ids = self._model_generate(
+                    inputs,
                     do_sample=False,
                     tokenizer=self.processor.tokenizer,
                     stop_strings="<|im_end|>",
-                    max_new_tokens=128,      # СИЛЬНО УМЕНЬШЕНО с 512 до 128
+                    max_new_tokens=self.max_new_tokens,  # зацикливание обрезает repetition guard
                     num_beams=1,             # Отключаем beam search
                     early_stopping=True,     # Ранняя остановка
                     pad_token_id=self.processor.tokenizer.eos_token_id,
@@ -267,14 +288,18 @@ class GOTOCRHFModel(BaseModel):
                     repetition_penalty=1.5,  # УВЕЛИЧЕНО против повторений
                     no_repeat_ngram_size=2,  # УМЕНЬШЕНО для более агрессивной фильтрации
                     use_cache=True,
-                    # Убираем проблемные параметры
+                    **guard_kwargs
                 )
                 
+                new_tokens = generated_ids[0, prompt_length:]
+                if criteria is not None:
+                    new_tokens = criteria.trim(0, new_tokens)
+                
                 # Decode exactly as in official documentation
-                result = self.processor.decode(
-                    generated_ids[0, inputs["input_ids"].shape[1]:], 
-                    skip_special_tokens=True
-                )
+                result = self.processor.decode(new_tokens, skip_special_tokens=True)
+            
+            self.last_repetition_report = criteria.report() if criteria is not None else None
+            log_repetition_report("GOT-OCR HF", self.last_repetition_report)
             
             # ДОБАВЛЕНО: Проверка на мусорный вывод
             if self._is_garbage_output(result):
@@ -289,28 +314,7 @@ class GOTOCRHFModel(BaseModel):
     
     def _is_garbage_output(self, text: str) -> bool:
         """Проверяет, является ли вывод мусорным."""
-        if not text or len(text) < 10:
-            return False
-        
-        # Индикаторы мусорного вывода
-        garbage_indicators = [
-            "Champion", "kaps", "ADDR", "ĠĠĠ", "ĊĊĊ", 
-            "▁▁▁", "ĉĉĉ", "ġġġ", "Ċ", "ĠĠ"
-        ]
-        
-        # Если найдено много индикаторов мусора
-        garbage_count = sum(1 for indicator in garbage_indicators if indicator in text)
-        if garbage_count >= 3:
-            return True
-        
-        # Если текст состоит в основном из повторяющихся токенов
-        words = text.split()
-        if len(words) > 10:
-            unique_words = set(words)
-            if len(unique_words) / len(words) < 0.3:  # Менее 30% уникальных слов
-                return True
-        
-        return False
+        return TextExtractor.is_garbage_output(text)
     
     def _basic_inference(self, image: Image.Image) -> str:
         """Basic inference fallback."""
@@ -322,6 +326,7 @@ class GOTOCRHFModel(BaseModel):
     
     def unload(self) -> None:
         """Unload model from memory."""
+        self.compiled_generator = None
         if self.model is not None:
             del self.model
             self.model = None
@@ -25,7 +25,16 @@ from models.dots_ocr_ultimate_fix import DotsOCRUltimateFixModel
 from models.phi3_vision import Phi3VisionModel
 from models.got_ocr_variants import GOTOCRUCASModel, GOTOCRHFModel
 from models.deepseek_ocr import DeepSeekOCRModel
+from models.fake_vlm import FakeVLMModel
 from utils.model_cache import ModelCacheManager, check_model_availability
+from utils.attention_probe import select_attn_implementation
+from utils.quantization import (
+    REFERENCE_PROFILES,
+    QualificationStore,
+    apply_post_load_quantization,
+    resolve_profile,
+)
+from utils.speculative import speculative_settings
 from utils.logger import logger
 
 try:
@@ -41,9 +50,9 @@ class EmergencyModelLoader:
     EMERGENCY Model Loader - Исправления критических ошибок
     
     Основные исправления:
-    1. Принудительное отключение Flash Attention
+    1. Выбор attention backend по результатам проверки (flash_attention_2 -> sdpa -> eager)
     2. Отключение квантизации (8bit/4bit)
-    3. Принудительное использование eager attention
+    3. Eager attention, если проверка отключена
     4. Улучшенная обработка CUDA ошибок
     5. Автоматическое восстановление GPU состояния
     """
@@ -70,6 +79,9 @@ class EmergencyModelLoader:
     # Cache for loaded model instances
     _loaded_models: Dict[str, BaseModel] = {}
     
+    # Speculative decoding: target key -> {"draft": draft key, "instance": dedicated draft instance}
+    _speculative_pairs: Dict[str, dict] = {}
+    
     # Cache manager
     _cache_manager = ModelCacheManager()
     
@@ -88,9 +100,10 @@ class EmergencyModelLoader:
                 logger.warning(f"⚠️ Не удалось загрузить аварийные исправления: {e}")
                 cls._emergency_fixes = {
                     "model_loader_patches": {
-                        "force_eager_attention": True,
-                        "disable_flash_attention": True,
-                        "disable_quantization": True,
+                        "probe_attention": True,
+                        "force_eager_attention": False,
+                        "disable_flash_attention": False,
+                        "require_qualified_quantization": True,
                         "enable_cuda_recovery": True,
                         "max_retries": 3,
                         "fallback_to_cpu": False
@@ -98,6 +111,16 @@ class EmergencyModelLoader:
                 }
         return cls._emergency_fixes
     
+    @classmethod
+    def register_fake_models(cls) -> None:
+        """
+        Регистрация моделей без весов (fake_vlm) для нагрузочных тестов и CI.
+        
+        В рабочем развертывании не вызывается: модели доступны только при
+        ENABLE_FAKE_MODELS=1 или после явного вызова из тестового стенда.
+        """
+        cls.MODEL_REGISTRY["fake_vlm"] = FakeVLMModel
+    
     @classmethod
     def _emergency_cuda_recovery(cls):
         """Экстренное восстановление CUDA состояния"""
@@ -138,32 +161,117 @@ class EmergencyModelLoader:
         fixes = cls._load_emergency_fixes()
         patches = fixes.get("model_loader_patches", {})
         
-        # Принудительные исправления
-        if patches.get("force_eager_attention", True):
-            model_config["attn_implementation"] = "eager"
-            logger.info("🔧 Принудительно установлен eager attention")
-        
-        if patches.get("disable_flash_attention", True):
-            model_config["use_flash_attention"] = False
-            logger.info("🔧 Flash Attention отключен")
-        
-        if patches.get("disable_quantization", True):
-            model_config["load_in_8bit"] = False
-            model_config["load_in_4bit"] = False
-            logger.info("🔧 Квантизация отключена")
+        # Attention backend: самый быстрый из прошедших проверку на этом GPU/драйвере
+        if patches.get("probe_attention", False):
+            cls._apply_attention_probe(model_config)
+        else:
+            if patches.get("force_eager_attention", True):
+                model_config["attn_implementation"] = "eager"
+                logger.info("🔧 Принудительно установлен eager attention")
+            
+            if patches.get("disable_flash_attention", True):
+                model_config["use_flash_attention"] = False
+                logger.info("🔧 Flash Attention отключен")
         
-        # Принудительное использование fp16 для стабильности
-        if model_config.get("precision") not in ["fp16", "fp32"]:
-            model_config["precision"] = "fp16"
-            logger.info("🔧 Принудительно установлен fp16")
+        # Профиль квантизации: в production только прошедшие квалификацию
+        cls._apply_quantization_profile(model_config, patches)
         
         # Дополнительные настройки безопасности
-        model_config["torch_dtype"] = "float16"
         model_config["device_map"] = "auto"
         model_config["trust_remote_code"] = True
         
         return model_config
     
+    @classmethod
+    def _apply_quantization_profile(cls, model_config: dict, patches: dict) -> None:
+        """Выбор профиля квантизации; непрошедшие квалификацию профили заменяются эталонным"""
+        device = "cuda" if TORCH_AVAILABLE and torch.cuda.is_available() else "cpu"
+        profile = resolve_profile(model_config, device)
+        
+        if patches.get("require_qualified_quantization", True):
+            allowed, reason = QualificationStore().is_allowed(model_config.get("model_path", ""), profile, device)
+            if not allowed:
+                fallback = REFERENCE_PROFILES[device]
+                logger.warning(f"⚠️ Профиль {profile} не разрешен ({reason}), используем {fallback}")
+                profile = fallback
+        
+        # Квантизация задается только профилем
+        model_config["quantization_profile"] = profile
+        model_config["load_in_8bit"] = False
+        model_config["load_in_4bit"] = False
+        logger.info(f"🔧 Профиль квантизации: {profile}")
+    
+    @classmethod
+    def _apply_attention_probe(cls, model_config: dict) -> None:
+        """Выбор attention backend по сохраненным результатам проверки (или новой проверке)"""
+        if not TORCH_AVAILABLE:
+            model_config["attn_implementation"] = "eager"
+            return
+        
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        if device == "cpu":
+            dtype = torch.float32
+        else:
+            dtype = torch.bfloat16 if model_config.get("precision") == "bf16" else torch.float16
+        
+        try:
+            backend = select_attn_implementation(model_config.get("model_path"), device=device, dtype=dtype)
+        except Exception as e:
+            logger.warning(f"⚠️ Проверка attention backend не удалась, используем eager: {e}")
+            backend = "eager"
+        
+        model_config["attn_implementation"] = backend
+        model_config["use_flash_attention"] = backend == "flash_attention_2"
+        logger.info(f"🔧 Attention backend по результатам проверки: {backend}")
+    
+    @classmethod
+    def _attach_speculative_draft(cls, model_key: str, model: BaseModel, model_config: dict) -> None:
+        """Загрузка draft-модели для speculative decoding и подключение к целевой модели"""
+        settings = speculative_settings(model_config)
+        if settings is None:
+            return
+        
+        draft_key = settings["draft_model"]
+        if draft_key == model_key or not hasattr(model, "attach_draft"):
+            logger.warning(f"⚠️ Speculative decoding не поддерживается для {model_key} с draft {draft_key}")
+            return
+        
+        draft = None
+        try:
+            # Отдельный экземпляр draft вне _loaded_models: общий экземпляр той же
+            # модели обслуживает свои запросы в другом слоте планировщика
+            # параллельно с целевой моделью
+            draft = cls.load_model(draft_key, cache=False)
+            model.attach_draft(draft, settings)
+            cls._speculative_pairs[model_key] = {"draft": draft_key, "instance": draft}
+            logger.info(f"🔧 Speculative decoding: {model_key} + draft {draft_key}")
+        except Exception as e:
+            if draft is not None and hasattr(draft, 'unload'):
+                draft.unload()
+            logger.warning(f"⚠️ Не удалось подключить draft {draft_key} к {model_key}, работаем без него: {e}")
+    
+    @classmethod
+    def _release_speculative_draft(cls, model_key: str) -> None:
+        """Отключение и выгрузка draft-модели выгружаемой целевой модели"""
+        pair = cls._speculative_pairs.pop(model_key, None)
+        if pair is None:
+            return
+        target = cls._loaded_models.get(model_key)
+        if target is not None:
+            target.detach_draft()
+        draft = pair["instance"]
+        if hasattr(draft, 'unload'):
+            draft.unload()
+    
+    @classmethod
+    def get_speculative_stats(cls) -> dict:
+        """Acceptance rate и ускорение speculative decoding по загруженным целевым моделям"""
+        return {
+            target_key: cls._loaded_models[target_key].get_speculative_stats()
+            for target_key in cls._speculative_pairs
+            if target_key in cls._loaded_models
+        }
+    
     @classmethod
     def load_config(cls) -> dict:
         """Load configuration from YAML file."""
@@ -212,6 +320,7 @@ class EmergencyModelLoader:
         model_key: str,
         force_reload: bool = False,
         precision: str = "auto",
+        cache: bool = True,
         **kwargs
     ) -> BaseModel:
         """
@@ -221,6 +330,8 @@ class EmergencyModelLoader:
             model_key: Model identifier from config
             force_reload: Force reload even if cached
             precision: Model precision (auto uses config)
+            cache: Register the instance in _loaded_models; False loads a
+                dedicated instance (e.g. a draft model) the caller owns
             **kwargs: Additional arguments for model initialization
             
         Returns:
@@ -234,7 +345,7 @@ class EmergencyModelLoader:
         max_retries = fixes.get("model_loader_patches", {}).get("max_retries", 3)
         
         # Check if already loaded
-        if not force_reload and model_key in cls._loaded_models:
+        if cache and not force_reload and model_key in cls._loaded_models:
             logger.info(f"Using cached model instance: {model_key}")
             return cls._loaded_models[model_key]
         
@@ -247,31 +358,34 @@ class EmergencyModelLoader:
         
         # Load configuration
         config = cls.load_config()
+        model_class = cls.MODEL_REGISTRY[model_key]
         
-        if model_key not in config["models"]:
+        if model_key in config["models"]:
+            model_config = config["models"][model_key].copy()
+        elif hasattr(model_class, "DEFAULT_CONFIG"):
+            # Модели без записи в config.yaml (fake_vlm) используют собственные настройки
+            model_config = dict(model_class.DEFAULT_CONFIG)
+        else:
             raise ValueError(f"Model '{model_key}' not found in config.yaml")
         
-        model_config = config["models"][model_key].copy()
-        
-        # Применяем аварийные исправления
-        model_config = cls._apply_emergency_patches(model_config)
-        
-        # Override precision if specified
+        # Override precision if specified (before the quantization profile is chosen)
         if precision != "auto":
             model_config["precision"] = precision
+            model_config.pop("quantization_profile", None)
             logger.info(f"Using specified precision: {precision}")
         else:
             logger.info(f"Using config precision: {model_config.get('precision', 'fp16')} (auto-selection disabled)")
         
-        # Check cache status
-        is_cached, cache_msg = cls.check_model_cache(model_key)
-        if is_cached:
-            logger.info(f"Model found in cache: {cache_msg}")
-        else:
-            logger.warning(f"Model not in cache: {cache_msg}")
-        
-        # Get model class
-        model_class = cls.MODEL_REGISTRY[model_key]
+        # Применяем аварийные исправления (синтетическим моделям без весов не нужны)
+        if not getattr(model_class, "SYNTHETIC", False):
+            model_config = cls._apply_emergency_patches(model_config)
+            
+            # Check cache status
+            is_cached, cache_msg = cls.check_model_cache(model_key)
+            if is_cached:
+                logger.info(f"Model found in cache: {cache_msg}")
+            else:
+                logger.warning(f"Model not in cache: {cache_msg}")
         
         # Специальная логика для проблемных моделей
         if model_key == "dots_ocr":
@@ -295,7 +409,7 @@ class EmergencyModelLoader:
                 
                 logger.info(f"Loading model: {model_key}")
                 logger.info(f"Model path: {model_config.get('model_path')}")
-                logger.info(f"Precision: {init_kwargs.get('precision')}")
+                logger.info(f"Precision: {init_kwargs.get('precision')} (profile: {init_kwargs.get('quantization_profile')})")
                 logger.info(f"Flash Attention: {init_kwargs.get('use_flash_attention')}")
                 logger.info(f"Attention Implementation: {init_kwargs.get('attn_implementation')}")
                 
@@ -304,10 +418,18 @@ class EmergencyModelLoader:
                 
                 # Load model weights
                 model.load_model()
+                if model.model is not None:
+                    apply_post_load_quantization(model.model, model.quantization_profile)
+                
+                if not cache:
+                    logger.info(f"✅ Loaded dedicated instance: {model_key}")
+                    return model
                 
                 # Cache the instance
                 cls._loaded_models[model_key] = model
                 
+                cls._attach_speculative_draft(model_key, model, model_config)
+                
                 logger.info(f"✅ Successfully loaded model: {model_key}")
                 return model
                 
@@ -330,10 +452,10 @@ class EmergencyModelLoader:
                     continue
                 
                 # Специальная обработка квантизации ошибок
-                elif "load_in_8bit" in error_str or "load_in_4bit" in error_str:
+                elif "bitsandbytes" in error_str or "load_in_8bit" in error_str or "load_in_4bit" in error_str:
                     logger.error(f"⚠️ Квантизация ошибка (попытка {attempt + 1}): {e}")
-                    init_kwargs["load_in_8bit"] = False
-                    init_kwargs["load_in_4bit"] = False
+                    device = "cuda" if TORCH_AVAILABLE and torch.cuda.is_available() else "cpu"
+                    init_kwargs["quantization_profile"] = REFERENCE_PROFILES[device]
                     continue
                 
                 # Другие ошибки
@@ -363,6 +485,7 @@ class EmergencyModelLoader:
         """Unload a model from memory with emergency cleanup."""
         if model_key in cls._loaded_models:
             try:
+                cls._release_speculative_draft(model_key)
                 model = cls._loaded_models[model_key]
                 if hasattr(model, 'unload'):
                     model.unload()
@@ -409,6 +532,7 @@ class EmergencyModelLoader:
             "cuda_available": TORCH_AVAILABLE and torch.cuda.is_available(),
             "applied_fixes": fixes.get("model_loader_patches", {}),
             "loaded_models": cls.get_loaded_models(),
+            "speculative_pairs": {target: pair["draft"] for target, pair in cls._speculative_pairs.items()},
             "available_vram_gb": cls.get_available_vram(),
             "critical_errors_detected": [
                 "CUDA device-side assert triggered",
@@ -417,9 +541,11 @@ class EmergencyModelLoader:
                 "transformers version incompatibility"
             ],
             "fixes_applied": [
-                "Force eager attention",
+                "Probe attention backends" if fixes.get("model_loader_patches", {}).get("probe_attention")
+                else "Force eager attention",
                 "Disable Flash Attention",
-                "Disable quantization",
+                "Qualified quantization profiles only"
+                if fixes.get("model_loader_patches", {}).get("require_qualified_quantization") else "Reference precision",
                 "Enable CUDA recovery",
                 "Emergency GPU cleanup"
             ]
@@ -429,4 +555,8 @@ class EmergencyModelLoader:
 
 
 # Заменяем основной ModelLoader на аварийную версию
-ModelLoader = EmergencyModelLoader
\ No newline at end of file
+ModelLoader = EmergencyModelLoader
+
+# Модели без весов доступны только по явному флагу (нагрузочные тесты, CI)
+if os.getenv("ENABLE_FAKE_MODELS") == "1":
+    ModelLoader.register_fake_models()
\ No newline at end of file
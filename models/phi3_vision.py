@@ -50,33 +50,35 @@ class Phi3VisionModel(BaseModel):
             # Build loading kwargs
             load_kwargs = self._get_load_kwargs()
             
-            # CRITICAL: Force eager attention to avoid Flash Attention issues
-            load_kwargs['attn_implementation'] = "eager"
+            # Attention backend from config (set by the loader's backend probe),
+            # eager if nothing was probed
+            attn_implementation = self._attn_implementation("eager")
+            use_flash = attn_implementation == "flash_attention_2"
+            load_kwargs['attn_implementation'] = attn_implementation
             
             # Remove invalid parameters that cause errors
             load_kwargs.pop('_attn_implementation', None)
             load_kwargs.pop('use_flash_attention_2', None)
             
             # Load model
-            logger.info("Loading model weights...")
+            logger.info(f"Loading model weights (attention: {attn_implementation})...")
             
-            # Try multiple approaches to disable Flash Attention
+            # Remote code reads several config flags, keep them consistent
             try:
                 # Method 1: Pre-load config and modify it
                 from transformers import AutoConfig
                 config = AutoConfig.from_pretrained(self.model_path, trust_remote_code=True)
                 
-                # Force disable Flash Attention in config - ALL possible attributes
                 if hasattr(config, '_attn_implementation'):
-                    config._attn_implementation = "eager"
+                    config._attn_implementation = attn_implementation
                 if hasattr(config, 'attn_implementation'):
-                    config.attn_implementation = "eager"
+                    config.attn_implementation = attn_implementation
                 if hasattr(config, 'use_flash_attention_2'):
-                    config.use_flash_attention_2 = False
+                    config.use_flash_attention_2 = use_flash
                 if hasattr(config, '_flash_attn_2_enabled'):
-                    config._flash_attn_2_enabled = False
+                    config._flash_attn_2_enabled = use_flash
                 if hasattr(config, 'flash_attention'):
-                    config.flash_attention = False
+                    config.flash_attention = use_flash
                 
                 # Load with modified config
                 self.model = AutoModelForCausalLM.from_pretrained(
@@ -95,7 +97,7 @@ class Phi3VisionModel(BaseModel):
                 
                 # Method 2: Try with environment variable
                 import os
-                os.environ['TRANSFORMERS_ATTN_IMPLEMENTATION'] = 'eager'
+                os.environ['TRANSFORMERS_ATTN_IMPLEMENTATION'] = attn_implementation
                 
                 try:
                     # Remove device_map for CPU to avoid accelerate requirement
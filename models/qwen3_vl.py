@@ -12,12 +12,24 @@ Key improvements over Qwen2-VL:
 - Better video understanding
 """
 
+import time
 from typing import Any, Dict, List, Optional, Union
 from PIL import Image
+import numpy as np
 import torch
 
 from models.base_model import BaseModel
 from utils.logger import logger
+from utils.repetition_guard import build_stopping_criteria, log_repetition_report
+from utils.metrics import GenerationTimer
+from utils.speculative import SpeculativeDecoder
+from utils.vision_cache import (
+    TensorLRUCache,
+    VisionCacheContext,
+    image_cache_key,
+    install_vision_cache,
+    move_to_device,
+)
 
 
 class Qwen3VLModel(BaseModel):
@@ -31,6 +43,25 @@ class Qwen3VLModel(BaseModel):
         # Qwen3-VL specific settings
         self.min_pixels = config.get('min_pixels', 256)
         self.max_pixels = config.get('max_pixels', 1280)
+        
+        # Image preprocessing and vision encoder outputs are cached per image,
+        # so several prompts on the same page run the vision tower once
+        self.vision_cache_enabled = config.get('vision_cache', True)
+        self.vision_cache = TensorLRUCache(
+            max_entries=config.get('vision_cache_size', 32),
+            max_device_entries=config.get('vision_cache_device_entries', 4)
+        )
+        self.pixel_cache = TensorLRUCache(
+            max_entries=config.get('vision_cache_size', 32),
+            max_device_entries=0
+        )
+        self._vision_context = VisionCacheContext()
+        
+        # Summary of early stops in the last generate() call
+        self.last_repetition_report: Optional[Dict[str, Any]] = None
+        
+        # Assisted generation with a draft model (attached by the loader)
+        self.speculative_decoder: Optional[SpeculativeDecoder] = None
     
     def load_model(self) -> None:
         """Load Qwen3-VL model."""
@@ -52,12 +83,9 @@ class Qwen3VLModel(BaseModel):
             # Build loading kwargs using base class method
             load_kwargs = self._get_load_kwargs()
             
-            # Force float32 on CPU for better compatibility
-            if not torch.cuda.is_available():
-                load_kwargs['torch_dtype'] = torch.float32
-            
-            # ПРИНУДИТЕЛЬНО ОТКЛЮЧАЕМ Flash Attention для совместимости
-            load_kwargs['attn_implementation'] = "eager"  # Принудительно eager attention
+            # Attention backend из конфигурации (результат проверки загрузчика),
+            # по умолчанию eager
+            load_kwargs['attn_implementation'] = self._attn_implementation("eager")
             
             # Убираем любые упоминания Flash Attention
             if 'use_flash_attention' in load_kwargs:
@@ -95,6 +123,12 @@ class Qwen3VLModel(BaseModel):
                     raise attr_error
             
             self.model.eval()
+            
+            if self.vision_cache_enabled:
+                self._install_vision_cache()
+            
+            self._setup_compiled_generation("Qwen3-VL", self.processor.tokenizer.eos_token_id)
+            
             logger.info("Qwen3-VL loaded successfully")
             
         except Exception as e:
@@ -103,16 +137,17 @@ class Qwen3VLModel(BaseModel):
     
     def process_image(
         self,
-        image: Union[Image.Image, str],
+        image: Union[Image.Image, np.ndarray, str],
         prompt: str = "Describe this image in detail.",
         **kwargs
     ) -> str:
         """Process image with Qwen3-VL.
         
         Args:
-            image: PIL Image or image URL
+            image: PIL Image, RGB array or image URL
             prompt: Text prompt
-            **kwargs: Additional generation parameters
+            **kwargs: Additional generation parameters; ``document_type``
+                keys the speculative decoding metrics
             
         Returns:
             Model response
@@ -120,61 +155,21 @@ class Qwen3VLModel(BaseModel):
         if self.model is None:
             raise RuntimeError("Model not loaded")
         
+        if not isinstance(image, str):
+            return self.process_prompts(image, [prompt], **kwargs)[0]
+        
         try:
             logger.info("Processing image with Qwen3-VL")
             
-            # Prepare messages
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "image", "image": image},
-                        {"type": "text", "text": prompt}
-                    ]
-                }
-            ]
-            
-            # Apply chat template and tokenize
-            inputs = self.processor.apply_chat_template(
-                messages,
-                tokenize=True,
-                add_generation_prompt=True,
-                return_dict=True,
-                return_tensors="pt"
-            )
+            # Prepare and tokenize inputs
+            inputs = self._prepare_inputs([image], prompt)
             
             # Move to device
             device = next(self.model.parameters()).device
             inputs = inputs.to(device)
             
-            # Generation parameters
-            gen_kwargs = {
-                'max_new_tokens': kwargs.get('max_new_tokens', 128),
-                'do_sample': kwargs.get('do_sample', False),
-            }
-            
-            if kwargs.get('temperature'):
-                gen_kwargs['temperature'] = kwargs['temperature']
-            if kwargs.get('top_p'):
-                gen_kwargs['top_p'] = kwargs['top_p']
-            if kwargs.get('top_k'):
-                gen_kwargs['top_k'] = kwargs['top_k']
-            
-            # Generate
-            with torch.no_grad():
-                generated_ids = self.model.generate(**inputs, **gen_kwargs)
-            
-            # Decode
-            generated_ids_trimmed = [
-                out_ids[len(in_ids):]
-                for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
-            ]
-            
-            output = self.processor.batch_decode(
-                generated_ids_trimmed,
-                skip_special_tokens=True,
-                clean_up_tokenization_spaces=False
-            )[0]
+            # Generate and decode
+            output = self._generate(inputs, kwargs)[0]
             
             logger.info("Processing completed")
             return output
@@ -183,6 +178,344 @@ class Qwen3VLModel(BaseModel):
             logger.error(f"Error: {e}")
             raise
     
+    def process_batch(
+        self,
+        images: List[Image.Image],
+        prompt: Optional[str] = "Describe this image in detail.",
+        **kwargs
+    ) -> List[str]:
+        """Process several images with one batched generate call.
+        
+        Args:
+            images: List of PIL Images
+            prompt: Text prompt shared by all images
+            **kwargs: Additional generation parameters
+            
+        Returns:
+            Model responses in input order
+        """
+        if self.model is None:
+            raise RuntimeError("Model not loaded")
+        
+        if not images:
+            return []
+        
+        prompt = prompt or "Describe this image in detail."
+        
+        try:
+            logger.info(f"Processing batch of {len(images)} images with Qwen3-VL")
+            
+            inputs = self._prepare_inputs(images, prompt)
+            
+            device = next(self.model.parameters()).device
+            inputs = inputs.to(device)
+            
+            outputs = self._generate(inputs, kwargs)
+            
+            logger.info("Batch processing completed")
+            return outputs
+            
+        except Exception as e:
+            logger.error(f"Error: {e}")
+            raise
+    
+    def process_prompts(
+        self,
+        image: Union[Image.Image, np.ndarray, str],
+        prompts: List[str],
+        **kwargs
+    ) -> List[str]:
+        """Run several prompts over the same image in one batched generate call.
+        
+        The image is preprocessed once and the vision tower runs once; its
+        output is shared by every prompt in the batch and cached for later
+        calls on the same image.
+        
+        Args:
+            image: PIL Image, RGB array or image URL
+            prompts: Text prompts
+            **kwargs: Additional generation parameters
+            
+        Returns:
+            Model responses in prompt order
+        """
+        if self.model is None:
+            raise RuntimeError("Model not loaded")
+        
+        if not prompts:
+            return []
+        
+        if isinstance(image, str):
+            # URLs are fetched by the chat template, one prompt at a time
+            return [self.process_image(image, prompt, **kwargs) for prompt in prompts]
+        
+        try:
+            logger.info(f"Processing {len(prompts)} prompt(s) on one image with Qwen3-VL")
+            
+            inputs, key = self._prepare_prompt_inputs(image, prompts)
+            
+            device = next(self.model.parameters()).device
+            inputs = move_to_device(inputs, device)
+            keys = [key] * len(prompts) if key else []
+            
+            with self._vision_context.activate(keys):
+                outputs = self._generate(inputs, kwargs)
+            
+            logger.info("Processing completed")
+            return outputs
+            
+        except Exception as e:
+            logger.error(f"Error: {e}")
+            raise
+    
+    def _generate(self, inputs, kwargs: Dict[str, Any]) -> List[str]:
+        """Run generate() with the repetition guard and decode new tokens.
+        
+        Rows that fall into a repetition loop are stopped early and cut
+        after the first copy of the repeated unit. Single-sequence calls
+        use the draft model when one is attached.
+        """
+        from transformers import StoppingCriteriaList
+        
+        gen_kwargs = self._build_gen_kwargs(kwargs)
+        prompt_length = inputs["input_ids"].shape[1]
+        criteria = build_stopping_criteria(
+            prompt_length,
+            gen_kwargs['max_new_tokens'],
+            self.config,
+            self.processor.tokenizer
+        )
+        if criteria is not None:
+            gen_kwargs['stopping_criteria'] = StoppingCriteriaList([criteria])
+        
+        document_type = kwargs.get('document_type', 'general')
+        decoder = self.speculative_decoder
+        speculate = decoder is not None and decoder.should_speculate(inputs, document_type)
+        
+        start = time.perf_counter()
+        with torch.no_grad():
+            if speculate:
+                gen_kwargs.setdefault('streamer', GenerationTimer(self.model_path))
+                generated_ids = decoder.generate(inputs, document_type, **gen_kwargs)
+            else:
+                generated_ids = self._model_generate(inputs, **gen_kwargs)
+        
+        if decoder is not None and not speculate and generated_ids.shape[0] == 1:
+            decoder.record_baseline(
+                document_type,
+                generated_ids.shape[1] - prompt_length,
+                time.perf_counter() - start
+            )
+        
+        new_tokens = [
+            criteria.trim(row, ids) if criteria is not None else ids
+            for row, ids in enumerate(generated_ids[:, prompt_length:])
+        ]
+        
+        self.last_repetition_report = criteria.report(len(new_tokens)) if criteria is not None else None
+        log_repetition_report("Qwen3-VL", self.last_repetition_report)
+        
+        return self.processor.batch_decode(
+            new_tokens,
+            skip_special_tokens=True,
+            clean_up_tokenization_spaces=False
+        )
+    
+    def _install_vision_cache(self) -> None:
+        """Wrap the vision tower so repeated images reuse cached outputs."""
+        tower = getattr(getattr(self.model, 'model', None), 'visual', None)
+        tower = tower or getattr(self.model, 'visual', None)
+        
+        if tower is None:
+            logger.warning("Vision tower not found, vision encoder cache disabled")
+            return
+        
+        install_vision_cache(tower, self.vision_cache, self._vision_context)
+    
+    def _image_key(self, image: Union[Image.Image, np.ndarray]) -> Optional[str]:
+        """Cache key for an image under the current processor settings."""
+        if not self.vision_cache_enabled:
+            return None
+        return image_cache_key(image, {
+            'model_path': self.model_path,
+            'min_pixels': self.min_pixels,
+            'max_pixels': self.max_pixels
+        })
+    
+    def _prepare_prompt_inputs(
+        self,
+        image: Union[Image.Image, np.ndarray],
+        prompts: List[str]
+    ):
+        """Build generate() inputs for several prompts over one image.
+        
+        Returns:
+            Tuple of (inputs dict, image cache key or None)
+        """
+        key = self._image_key(image)
+        pixel_inputs = self.pixel_cache.get(key) if key else None
+        
+        if pixel_inputs is None:
+            processed = self.processor.image_processor(images=[image], return_tensors="pt")
+            pixel_inputs = {
+                'pixel_values': processed['pixel_values'],
+                'image_grid_thw': processed['image_grid_thw']
+            }
+            if key:
+                self.pixel_cache.put(key, pixel_inputs, on_device=False)
+        
+        grid = pixel_inputs['image_grid_thw']
+        texts = [
+            self._expand_image_tokens(
+                self.processor.apply_chat_template(
+                    self._build_messages(None, prompt),
+                    tokenize=False,
+                    add_generation_prompt=True
+                ),
+                grid
+            )
+            for prompt in prompts
+        ]
+        
+        # Left padding keeps generated tokens aligned at the end of each row
+        self.processor.tokenizer.padding_side = "left"
+        inputs = dict(self.processor.tokenizer(texts, padding=True, return_tensors="pt"))
+        
+        # Every prompt refers to the same image; the cached vision tower
+        # encodes the repeated patches only once
+        inputs['pixel_values'] = pixel_inputs['pixel_values'].repeat(len(prompts), 1)
+        inputs['image_grid_thw'] = grid.repeat(len(prompts), 1)
+        
+        if hasattr(self.processor, 'create_mm_token_type_ids'):
+            inputs['mm_token_type_ids'] = torch.tensor(
+                self.processor.create_mm_token_type_ids(inputs['input_ids'].tolist())
+            )
+        
+        return inputs, key
+    
+    def _expand_image_tokens(self, text: str, image_grid_thw: torch.Tensor) -> str:
+        """Expand each image placeholder to the number of merged patches."""
+        image_token = self.processor.image_token
+        merge_length = self.processor.image_processor.merge_size ** 2
+        placeholder = "<|placeholder|>"
+        
+        for grid in image_grid_thw:
+            if image_token not in text:
+                break
+            text = text.replace(image_token, placeholder * int(grid.prod() // merge_length), 1)
+        
+        return text.replace(placeholder, image_token)
+    
+    def attach_draft(self, draft: "Qwen3VLModel", settings: Optional[Dict[str, Any]] = None) -> None:
+        """Use a smaller loaded model of the same family as the draft for assisted generation.
+        
+        Args:
+            draft: Loaded draft model sharing this model's tokenizer
+            settings: Speculative settings (see ``utils.speculative``)
+            
+        Raises:
+            RuntimeError: If either model is not loaded
+            ValueError: If the tokenizers differ
+        """
+        if self.model is None or getattr(draft, 'model', None) is None:
+            raise RuntimeError("Target and draft models must be loaded before attaching a draft")
+        if draft.processor.tokenizer.get_vocab() != self.processor.tokenizer.get_vocab():
+            raise ValueError(f"Draft model {draft.model_path} does not share the tokenizer of {self.model_path}")
+        
+        self.detach_draft()
+        self.speculative_decoder = SpeculativeDecoder(self.model, draft.model, settings, name="Qwen3-VL")
+        logger.info(f"Qwen3-VL: speculative decoding with draft {draft.model_path}")
+    
+    def detach_draft(self) -> None:
+        """Stop using the draft model."""
+        if self.speculative_decoder is not None:
+            self.speculative_decoder.detach()
+            self.speculative_decoder = None
+    
+    def get_speculative_stats(self) -> Optional[Dict[str, Any]]:
+        """Acceptance rate and speedup per document type, or None without a draft."""
+        if self.speculative_decoder is None:
+            return None
+        return self.speculative_decoder.get_stats()
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Vision encoder and pixel cache statistics."""
+        return {
+            'enabled': self.vision_cache_enabled,
+            'vision_encoder': self.vision_cache.stats(),
+            'pixels': self.pixel_cache.stats()
+        }
+    
+    def _prepare_inputs(
+        self,
+        images: List[Union[Image.Image, np.ndarray, str]],
+        prompt: str
+    ):
+        """Build processor inputs for one prompt over one or more images.
+        
+        NumPy arrays (e.g. from PreprocessingEngine) are handed straight to
+        the image processor without converting them back to PIL.
+        """
+        batched = len(images) > 1
+        if batched:
+            # Left padding keeps generated tokens aligned at the end of each row
+            self.processor.tokenizer.padding_side = "left"
+        
+        if any(isinstance(image, np.ndarray) for image in images):
+            text = self.processor.apply_chat_template(
+                self._build_messages(None, prompt),
+                tokenize=False,
+                add_generation_prompt=True
+            )
+            return self.processor(
+                text=[text] * len(images),
+                images=list(images),
+                padding=batched,
+                return_tensors="pt"
+            )
+        
+        conversations = [self._build_messages(image, prompt) for image in images]
+        return self.processor.apply_chat_template(
+            conversations if batched else conversations[0],
+            tokenize=True,
+            add_generation_prompt=True,
+            return_dict=True,
+            return_tensors="pt",
+            padding=batched
+        )
+    
+    @staticmethod
+    def _build_messages(image: Any, prompt: str) -> List[Dict[str, Any]]:
+        """Build a single-turn chat with one image and a text prompt."""
+        image_content = {"type": "image"}
+        if image is not None:
+            image_content["image"] = image
+        return [
+            {
+                "role": "user",
+                "content": [
+                    image_content,
+                    {"type": "text", "text": prompt}
+                ]
+            }
+        ]
+    
+    def _build_gen_kwargs(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Build generate() parameters from call kwargs."""
+        gen_kwargs = {
+            'max_new_tokens': kwargs.get('max_new_tokens', self.config.get('max_new_tokens', 128)),
+            'do_sample': kwargs.get('do_sample', False),
+        }
+        
+        if kwargs.get('temperature'):
+            gen_kwargs['temperature'] = kwargs['temperature']
+        if kwargs.get('top_p'):
+            gen_kwargs['top_p'] = kwargs['top_p']
+        if kwargs.get('top_k'):
+            gen_kwargs['top_k'] = kwargs['top_k']
+        
+        return gen_kwargs
+    
     def chat(
         self,
         image: Union[Image.Image, str],
@@ -204,7 +537,8 @@ class Qwen3VLModel(BaseModel):
     def extract_text(
         self,
         image: Union[Image.Image, str],
-        language: Optional[str] = None
+        language: Optional[str] = None,
+        document_type: Optional[str] = None
     ) -> str:
         """Extract text from image using Qwen3-VL's enhanced OCR.
         
@@ -213,16 +547,51 @@ class Qwen3VLModel(BaseModel):
         Args:
             image: PIL Image or URL
             language: Optional language hint
+            document_type: Document type of the request (passport, invoice, ...);
+                keys the speculative decoding metrics (default: "ocr")
             
         Returns:
             Extracted text
         """
+        return self.process_image(
+            image, self.build_ocr_prompt(language), max_new_tokens=2048, document_type=document_type or "ocr"
+        )
+    
+    def extract_text_batch(
+        self,
+        images: List[Image.Image],
+        language: Optional[str] = None,
+        document_type: Optional[str] = None
+    ) -> List[str]:
+        """Extract text from several images (e.g. page tiles) in one batch.
+        
+        Args:
+            images: List of PIL Images
+            language: Optional language hint
+            document_type: Document type of the request (default: "ocr")
+            
+        Returns:
+            Extracted text per image
+        """
+        return self.process_batch(
+            images, self.build_ocr_prompt(language), max_new_tokens=2048, document_type=document_type or "ocr"
+        )
+    
+    @staticmethod
+    def build_ocr_prompt(language: Optional[str] = None) -> str:
+        """Build the text extraction prompt.
+        
+        Args:
+            language: Optional language hint
+            
+        Returns:
+            OCR prompt
+        """
         prompt = "Extract all text from this image. "
         if language:
             prompt += f"The text is in {language}. "
         prompt += "Maintain the original structure and formatting."
-        
-        return self.process_image(image, prompt, max_new_tokens=2048)
+        return prompt
     
     def analyze_document(
         self,
@@ -245,8 +614,8 @@ class Qwen3VLModel(BaseModel):
             "tables": "Identify and extract all tables from this document in markdown format."
         }
         
-        prompt = prompts.get(focus, prompts["general"])
-        return self.process_image(image, prompt, max_new_tokens=2048)
+        focus = focus if focus in prompts else "general"
+        return self.process_image(image, prompts[focus], max_new_tokens=2048, document_type=f"analysis_{focus}")
     
     def visual_reasoning(
         self,
@@ -263,10 +632,14 @@ class Qwen3VLModel(BaseModel):
             Reasoning result
         """
         prompt = f"{question}\n\nThink step by step and provide detailed reasoning."
-        return self.process_image(image, prompt, max_new_tokens=1024)
+        return self.process_image(image, prompt, max_new_tokens=1024, document_type="reasoning")
     
     def unload(self) -> None:
         """Unload model from memory."""
+        self.vision_cache.clear()
+        self.pixel_cache.clear()
+        self.compiled_generator = None
+        self.detach_draft()
         if self.model is not None:
             del self.model
             self.model = None
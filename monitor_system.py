@@ -7,27 +7,27 @@ import time
 import requests
 import os
 import psutil
-import torch
 from datetime import datetime
 
+from utils.gpu_telemetry import get_telemetry
+
 def check_gpu_status():
     """Проверяет статус GPU"""
-    if torch.cuda.is_available():
-        gpu_name = torch.cuda.get_device_name(0)
-        total_memory = torch.cuda.get_device_properties(0).total_memory / 1024**3
-        allocated_memory = torch.cuda.memory_allocated(0) / 1024**3
-        cached_memory = torch.cuda.memory_reserved(0) / 1024**3
-        
-        return {
-            "available": True,
-            "name": gpu_name,
-            "total_memory_gb": round(total_memory, 2),
-            "allocated_memory_gb": round(allocated_memory, 2),
-            "cached_memory_gb": round(cached_memory, 2),
-            "free_memory_gb": round(total_memory - cached_memory, 2)
-        }
-    else:
+    # Память всего устройства (включая vLLM контейнеры), а не только этого процесса
+    gpu = get_telemetry().latest().gpu(0)
+    if gpu is None:
         return {"available": False}
+    
+    return {
+        "available": True,
+        "name": gpu.name,
+        "total_memory_gb": round(gpu.memory_total_mb / 1024, 2),
+        "allocated_memory_gb": round(gpu.memory_used_mb / 1024, 2),
+        "cached_memory_gb": round(gpu.memory_used_mb / 1024, 2),
+        "free_memory_gb": round(gpu.memory_free_mb / 1024, 2),
+        "utilization_percent": gpu.utilization_percent,
+        "temperature_c": gpu.temperature_c
+    }
 
 def check_streamlit_status():
     """Проверяет статус Streamlit"""
@@ -120,6 +120,10 @@ def print_status_report():
         print(f"   ✅ {gpu_status['name']}")
         print(f"   📊 Память: {gpu_status['allocated_memory_gb']:.2f}GB / {gpu_status['total_memory_gb']:.2f}GB")
         print(f"   🆓 Свободно: {gpu_status['free_memory_gb']:.2f}GB")
+        if gpu_status["utilization_percent"] is not None:
+            print(f"   📈 Утилизация: {gpu_status['utilization_percent']:.0f}%")
+        if gpu_status["temperature_c"] is not None:
+            print(f"   🌡️ Температура: {gpu_status['temperature_c']:.0f}°C")
     else:
         print(f"   ❌ GPU недоступна")
     
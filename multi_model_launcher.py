@@ -4,14 +4,17 @@
 """
 
 import json
+import shlex
 import subprocess
-import time
 import requests
 import os
 import argparse
 from pathlib import Path
 from typing import Dict, List, Optional, Any
 
+from utils.gpu_telemetry import get_telemetry
+from utils.container_registry import get_container_registry
+
 class MultiModelLauncher:
     def __init__(self, config_file: str = "vllm_models_config.json"):
         self.config_file = config_file
@@ -48,45 +51,38 @@ class MultiModelLauncher:
     
     def check_gpu_memory(self) -> Dict[str, Any]:
         """Проверка доступной памяти GPU"""
-        success, output = self.run_command("nvidia-smi --query-gpu=memory.total,memory.used,memory.free --format=csv,noheader,nounits")
-        
-        if success:
-            lines = output.strip().split('\n')
-            gpu_info = []
-            
-            for i, line in enumerate(lines):
-                parts = line.split(', ')
-                if len(parts) == 3:
-                    total, used, free = map(int, parts)
-                    gpu_info.append({
-                        'gpu_id': i,
-                        'total_mb': total,
-                        'used_mb': used,
-                        'free_mb': free,
-                        'usage_percent': round((used / total) * 100, 1)
-                    })
-            
-            return {'success': True, 'gpus': gpu_info}
-        else:
-            return {'success': False, 'error': output}
+        try:
+            # Замер через NVML без запуска nvidia-smi
+            sample = get_telemetry().latest(max_age=0)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+        
+        if not sample.gpus:
+            return {'success': False, 'error': 'GPU не обнаружены'}
+        
+        gpu_info = []
+        for gpu in sample.gpus:
+            gpu_info.append({
+                'gpu_id': gpu.index,
+                'total_mb': int(gpu.memory_total_mb),
+                'used_mb': int(gpu.memory_used_mb),
+                'free_mb': int(gpu.memory_free_mb),
+                'usage_percent': round(gpu.memory_percent, 1)
+            })
+        
+        return {'success': True, 'gpus': gpu_info}
     
     def get_running_containers(self) -> List[Dict[str, str]]:
         """Получение списка запущенных контейнеров vLLM"""
-        success, output = self.run_command("docker ps --filter ancestor=vllm/vllm-openai:latest --format json")
-        
         containers = []
-        if success and output:
-            for line in output.strip().split('\n'):
-                try:
-                    container_info = json.loads(line)
-                    containers.append({
-                        'id': container_info['ID'],
-                        'name': container_info['Names'],
-                        'ports': container_info['Ports'],
-                        'status': container_info['Status']
-                    })
-                except json.JSONDecodeError:
-                    continue
+        for name, state in get_container_registry().containers(running_only=True).items():
+            if state.image == "vllm/vllm-openai:latest":
+                containers.append({
+                    'id': state.id[:12],
+                    'name': name,
+                    'ports': ', '.join(f"{host}->{inner}/tcp" for inner, host in state.ports.items()),
+                    'status': f"{state.status} ({state.health})"
+                })
         
         return containers
     
@@ -100,23 +96,29 @@ class MultiModelLauncher:
             return True
         return False
     
+    def health_probe(self, port: int) -> bool:
+        """Проверка /health модели"""
+        try:
+            response = requests.get(f"http://localhost:{port}/health", timeout=5)
+            return response.status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+    
     def wait_for_model(self, port: int, model_name: str, timeout: int = 300) -> bool:
         """Ожидание готовности модели"""
         print(f"⏳ Ожидание готовности {model_name} на порту {port}...")
         
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            try:
-                response = requests.get(f"http://localhost:{port}/health", timeout=5)
-                if response.status_code == 200:
-                    print(f"✅ {model_name} готова!")
-                    return True
-            except requests.exceptions.ConnectionError:
-                pass
-            except Exception as e:
-                print(f"⚠️ Ошибка проверки {model_name}: {e}")
-            
-            time.sleep(10)
+        # События Docker (health_status, die) вместо опроса каждые 10 секунд
+        container_name = self.configs[model_name]['container_name']
+        ready, state = get_container_registry().wait_until_ready(
+            container_name, timeout, probe=lambda _: self.health_probe(port)
+        )
+        if ready:
+            print(f"✅ {model_name} готова!")
+            return True
+        if state is not None and state.stopped:
+            print(f"❌ Контейнер {container_name} завершился (код {state.exit_code})")
+            return False
         
         print(f"❌ {model_name} не запустилась за {timeout} секунд")
         return False
@@ -145,6 +147,10 @@ class MultiModelLauncher:
             -p {port}:{port} \
             -v {self.cache_path}:/root/.cache/huggingface/hub:ro \
             --shm-size=8g \
+            --health-cmd "curl -f http://localhost:{port}/health" \
+            --health-interval 5s \
+            --health-retries 3 \
+            --health-start-period 300s \
             vllm/vllm-openai:latest \
             --model {model_name} \
             --trust-remote-code \
@@ -159,6 +165,15 @@ class MultiModelLauncher:
         if vllm_params.get('enforce_eager'):
             docker_command += " --enforce-eager"
         
+        # Speculative decoding с draft-моделью того же семейства
+        # (в текущих версиях vLLM --speculative-config заменил --speculative-model)
+        if vllm_params.get('speculative_model'):
+            speculative_config = {
+                "model": vllm_params['speculative_model'],
+                "num_speculative_tokens": int(vllm_params.get('num_speculative_tokens', 5))
+            }
+            docker_command += f" --speculative-config {shlex.quote(json.dumps(speculative_config))}"
+        
         print(f"🚀 Запуск {model_name} на порту {port}...")
         print(f"📦 Контейнер: {container_name}")
         print(f"💾 Размер модели: {config['size_gb']} ГБ")
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Measure CPU throughput scaling of model replicas from 1 to N cores.
+
+Each run starts a ReplicaPool (one process per replica, pinned to its own
+physical cores, single-threaded by default) and pushes the same documents
+through the shared queue. The report shows documents/s, speedup over one
+replica and scaling efficiency (speedup / replicas).
+
+Without a model key a small transformer encoder stands in for the model,
+so the pool itself can be checked on any machine.
+
+Usage:
+    python scripts/benchmark_cpu_replicas.py got_ocr_hf --images samples/ --max-replicas 8
+    python scripts/benchmark_cpu_replicas.py --count 64
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any, Callable, List
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import torch
+from PIL import Image, ImageDraw
+
+from utils.cpu_inference import ModelReplicaFactory, cpu_supports_bf16, cpu_topology, measure_scaling
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+
+
+class EncoderWorkloadFactory:
+    """Stand-in model: a transformer encoder layer over a fixed sequence."""
+
+    def __call__(self) -> Callable[[Any], Any]:
+        torch.manual_seed(0)
+        layer = torch.nn.TransformerEncoderLayer(d_model=256, nhead=4, dim_feedforward=1024, batch_first=True).eval()
+        tokens = torch.randn(1, 256, 256)
+
+        def run(payload: Any) -> float:
+            with torch.no_grad():
+                output = tokens
+                for _ in range(4):
+                    output = layer(output)
+            return float(output.mean())
+
+        return run
+
+
+def print_section(title: str):
+    """Print section header."""
+    print(f"\n{'='*60}")
+    print(f"{title}")
+    print(f"{'='*60}\n")
+
+
+def synthetic_pages(count: int) -> List[Image.Image]:
+    """Simple text pages for OCR runs without an image directory."""
+    pages = []
+    for index in range(count):
+        image = Image.new("RGB", (768, 256), "white")
+        draw = ImageDraw.Draw(image)
+        draw.text((32, 32), f"Invoice No. {1000 + index}", fill="black")
+        draw.text((32, 96), "Total: 48 350.00 RUB", fill="black")
+        pages.append(image)
+    return pages
+
+
+def load_images(directory: str, count: int) -> List[Image.Image]:
+    """Images from a directory, repeated up to ``count``."""
+    paths = sorted(p for p in Path(directory).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+    if not paths:
+        raise SystemExit(f"No images in {directory}")
+    images = [Image.open(path).convert("RGB") for path in paths]
+    return [images[index % len(images)] for index in range(max(count, len(images)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU replica throughput scaling")
+    parser.add_argument("model_key", nargs="?", help="Model key from config.yaml (default: synthetic workload)")
+    parser.add_argument("--images", help="Directory with document images")
+    parser.add_argument("--count", type=int, default=32, help="Documents per run")
+    parser.add_argument("--max-replicas", type=int, help="Largest replica count (default: all cores)")
+    parser.add_argument("--threads-per-replica", type=int, default=1)
+    parser.add_argument("--output", help="Write results as JSON")
+    args = parser.parse_args()
+
+    topology = cpu_topology()
+    cores = sum(len(socket_cores) for socket_cores in topology.values())
+    max_replicas = min(args.max_replicas or cores, cores // args.threads_per_replica)
+    counts = sorted({1, *[n for n in (2, 4, 8, 16, 32, 64) if n < max_replicas], max_replicas})
+
+    if args.model_key:
+        factory = ModelReplicaFactory(args.model_key)
+        payloads = load_images(args.images, args.count) if args.images else synthetic_pages(args.count)
+    else:
+        factory = EncoderWorkloadFactory()
+        payloads = list(range(args.count))
+
+    print_section(
+        f"{args.model_key or 'synthetic encoder'}: {len(payloads)} documents, replicas {counts}, "
+        f"{args.threads_per_replica} thread(s) each"
+    )
+    print(f"Sockets: {len(topology)}, physical cores: {cores}, native bf16: {cpu_supports_bf16()}")
+
+    rows = measure_scaling(factory, payloads, counts, args.threads_per_replica, topology)
+
+    print(f"\n{'Replicas':>8} {'Docs/s':>10} {'Speedup':>8} {'Efficiency':>10}")
+    for row in rows:
+        print(f"{row['replicas']:>8} {row['items_per_second']:>10} {row['speedup']:>8} {row['efficiency']:>10}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({
+            "model": args.model_key,
+            "threads_per_replica": args.threads_per_replica,
+            "topology": {str(socket): socket_cores for socket, socket_cores in topology.items()},
+            "results": rows,
+        }, indent=2), encoding="utf-8")
+        print(f"\n💾 Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""Benchmark generate() throughput: eager vs SDPA attention vs compiled mode.
+
+The compiled mode is the ``execution_mode: compiled`` path of the model
+wrappers (static KV cache + torch.compile of the decode step). Without
+``--model-path`` a small randomly initialized Qwen3-VL text decoder is
+used, so the script runs offline; pass a HuggingFace model id or local
+path to benchmark real weights.
+
+Usage:
+    python scripts/benchmark_generation.py
+    python scripts/benchmark_generation.py --model-path Qwen/Qwen3-VL-2B-Instruct --new-tokens 128
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import torch
+
+from utils.compiled_generation import CompiledGenerator, DEFAULT_COMPILE_SETTINGS
+
+MODES = ("eager", "sdpa", "compiled")
+
+
+def print_section(title: str):
+    """Print section header."""
+    print(f"\n{'='*60}")
+    print(f"{title}")
+    print(f"{'='*60}\n")
+
+
+def tiny_model_factory(device: str, dtype: torch.dtype) -> Callable[[str], torch.nn.Module]:
+    """Return a loader for a small random Qwen3-VL (same weights for every backend)."""
+    from transformers import Qwen3VLConfig, Qwen3VLForConditionalGeneration
+
+    config = Qwen3VLConfig(
+        text_config=dict(
+            hidden_size=256, intermediate_size=704, num_hidden_layers=4,
+            num_attention_heads=8, num_key_value_heads=2, head_dim=32, vocab_size=4096,
+            rope_scaling={"rope_type": "default", "mrope_section": [4, 6, 6], "mrope_interleaved": True}
+        ),
+        vision_config=dict(depth=1, hidden_size=32, intermediate_size=64, num_heads=2, out_hidden_size=256),
+    )
+    torch.manual_seed(0)
+    state = Qwen3VLForConditionalGeneration(config).state_dict()
+
+    def load(attn_implementation: str) -> torch.nn.Module:
+        config._attn_implementation = attn_implementation
+        model = Qwen3VLForConditionalGeneration(config)
+        model.load_state_dict(state)
+        return model.to(device=device, dtype=dtype).eval()
+
+    return load
+
+
+def pretrained_model_factory(model_path: str, device: str, dtype: torch.dtype) -> Callable[[str], torch.nn.Module]:
+    """Return a loader for real weights."""
+    from transformers import AutoModelForImageTextToText
+
+    def load(attn_implementation: str) -> torch.nn.Module:
+        model = AutoModelForImageTextToText.from_pretrained(
+            model_path,
+            torch_dtype=dtype,
+            attn_implementation=attn_implementation,
+            trust_remote_code=True
+        )
+        return model.to(device).eval()
+
+    return load
+
+
+def measure(generate: Callable[[], torch.Tensor], new_tokens: int, runs: int, device: str) -> Dict[str, float]:
+    """Time ``generate`` and return tokens/s statistics."""
+    timings: List[float] = []
+    for _ in range(runs):
+        if device == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        with torch.no_grad():
+            generate()
+        if device == "cuda":
+            torch.cuda.synchronize()
+        timings.append(time.perf_counter() - start)
+
+    best = min(timings)
+    return {
+        "tokens_per_second": round(new_tokens / best, 1),
+        "best_seconds": round(best, 4),
+        "mean_seconds": round(sum(timings) / len(timings), 4),
+    }
+
+
+def benchmark_device(
+    load: Callable[[str], torch.nn.Module],
+    device: str,
+    prompt_length: int,
+    new_tokens: int,
+    runs: int
+) -> List[Dict[str, Any]]:
+    """Benchmark all modes on one device."""
+    results = []
+
+    for mode in MODES:
+        model = load("eager" if mode == "eager" else DEFAULT_COMPILE_SETTINGS["attn_implementation"])
+        vocab_size = model.config.get_text_config().vocab_size
+        input_ids = torch.randint(10, vocab_size - 10, (1, prompt_length), device=device)
+        inputs = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+        gen_kwargs = {"max_new_tokens": new_tokens, "min_new_tokens": new_tokens, "do_sample": False}
+
+        warmup_seconds = 0.0
+        if mode == "compiled":
+            generator = CompiledGenerator(model, name="benchmark")
+            start = time.perf_counter()
+            with torch.no_grad():
+                generator.generate(inputs, **gen_kwargs)
+            warmup_seconds = round(time.perf_counter() - start, 2)
+            if not generator.enabled:
+                print(f"   compiled: unavailable ({generator.failure})")
+                continue
+            run = lambda: generator.generate(inputs, **gen_kwargs)
+        else:
+            with torch.no_grad():
+                model.generate(**inputs, **gen_kwargs)
+            run = lambda: model.generate(**inputs, **gen_kwargs)
+
+        stats = measure(run, new_tokens, runs, device)
+        stats.update({"device": device, "mode": mode, "warmup_seconds": warmup_seconds})
+        results.append(stats)
+        print(f"   {mode:<9} {stats['tokens_per_second']:>9.1f} tok/s   "
+              f"(best {stats['best_seconds']}s, warm-up {warmup_seconds}s)")
+
+        del model
+        if device == "cuda":
+            torch.cuda.empty_cache()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark eager / SDPA / compiled generation")
+    parser.add_argument("--model-path", help="HF model id or path (default: small random Qwen3-VL)")
+    parser.add_argument("--prompt-length", type=int, default=256)
+    parser.add_argument("--new-tokens", type=int, default=64)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--output", help="Write results as JSON")
+    args = parser.parse_args()
+
+    devices = ["cpu"] + (["cuda"] if torch.cuda.is_available() else [])
+    results = []
+
+    for device in devices:
+        dtype = torch.float16 if device == "cuda" else torch.float32
+        if args.model_path:
+            load = pretrained_model_factory(args.model_path, device, dtype)
+        else:
+            load = tiny_model_factory(device, dtype)
+
+        print_section(f"Device: {device} ({dtype})")
+        results += benchmark_device(load, device, args.prompt_length, args.new_tokens, args.runs)
+
+    if args.output:
+        report = {
+            "model": args.model_path or "tiny-random-qwen3-vl",
+            "prompt_length": args.prompt_length,
+            "new_tokens": args.new_tokens,
+            "torch": torch.__version__,
+            "results": results,
+        }
+        Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"\n💾 Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""Micro-benchmarks of the CPU-side hot paths with a regression gate.
+
+Covers post-processing and ingest that run on every request:
+clean_ocr_result, BBoxVisualizer.parse_bbox_from_json,
+XMLTableParser.parse_table_xml, HTMLTableRenderer.table_to_markdown,
+OCROutputProcessor.process_ocr_output, ImageProcessor.preprocess,
+validate_file (api.py) and PNG + base64 encoding of the vLLM adapter.
+
+Fixtures are the model outputs saved in the repository's JSON result
+files plus synthetic dots.ocr layouts with 50, 200 and 500 elements.
+
+The baseline (benchmarks/hot_paths_baseline.json) stores timings
+normalized by a reference workload; ``--check`` exits with status 1 if
+any hot path is slower than its baseline by more than ``--tolerance``
+(apparent regressions are re-measured ``--retries`` times first).
+
+Usage:
+    python scripts/benchmark_hot_paths.py --check
+    python scripts/benchmark_hot_paths.py --only parse_bbox --check --tolerance 0.15
+    python scripts/benchmark_hot_paths.py --save-baseline --runs 3
+"""
+
+import argparse
+import base64
+import io
+import json
+import random
+import re
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from PIL import Image, ImageDraw
+
+from utils.microbench import (
+    DEFAULT_TOLERANCE, Benchmark, compare, format_duration, load_report, merge_best, run_benchmarks, save_report,
+    strip_samples
+)
+
+DEFAULT_BASELINE = project_root / "benchmarks" / "hot_paths_baseline.json"
+
+# Saved model outputs used as realistic fixtures
+RESULT_FILES = (
+    "new_dots_ocr_features_test.json",
+    "dots_ocr_chat_fix_results.json",
+    "official_prompts_test_results.json",
+    "two_models_comparison_20260124_184423.json",
+    "test_export.json",
+)
+TEXT_KEYS = ("response", "text", "raw_text")
+TABLE_PATTERN = re.compile(r"<table[^>]*>.*?</table>", re.DOTALL | re.IGNORECASE)
+
+LAYOUT_SIZES = (50, 200, 500)
+CATEGORIES = ("Text", "Title", "Section-header", "List-item", "Table", "Picture", "Formula", "Caption",
+              "Page-header", "Page-footer", "Footnote")
+WORDS = ("счет", "фактура", "поставщик", "ИНН", "7702123456", "сумма", "НДС", "итого", "договор",
+         "invoice", "total", "amount", "date", "24.01.2026", "руб.", "Консультация", "50,000")
+
+
+def repo_outputs() -> List[str]:
+    """Model outputs stored in the repository's JSON result files."""
+    texts: List[str] = []
+
+    def collect(value: Any):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if key in TEXT_KEYS and isinstance(item, str) and item.strip():
+                    texts.append(item)
+                else:
+                    collect(item)
+        elif isinstance(value, list):
+            for item in value:
+                collect(item)
+
+    for name in RESULT_FILES:
+        path = project_root / name
+        if path.exists():
+            collect(json.loads(path.read_text(encoding="utf-8")))
+    return texts
+
+
+def synthetic_table(rows: int, cols: int = 4, seed: int = 0) -> str:
+    """HTML table as produced by dots.ocr."""
+    rng = random.Random(seed)
+    lines = ["<table><thead><tr>" + "".join(f"<td>Колонка {c + 1}</td>" for c in range(cols)) + "</tr></thead><tbody>"]
+    for _ in range(rows):
+        lines.append("<tr>" + "".join(f"<td>{rng.choice(WORDS)} {rng.randint(1, 9999)}</td>" for _ in range(cols))
+                     + "</tr>")
+    lines.append("</tbody></table>")
+    return "".join(lines)
+
+
+def synthetic_layout(elements: int, seed: int = 0) -> str:
+    """dots.ocr layout JSON with ``elements`` elements on an A4 page."""
+    rng = random.Random(seed)
+    layout = []
+    for index in range(elements):
+        category = rng.choice(CATEGORIES)
+        x1, y1 = rng.randint(0, 1500), int(index * 2300 / elements)
+        element: Dict[str, Any] = {"bbox": [x1, y1, x1 + rng.randint(50, 600), y1 + rng.randint(10, 60)],
+                                   "category": category}
+        if category == "Table":
+            element["text"] = synthetic_table(rng.randint(3, 12), seed=index)
+        elif category == "Formula":
+            element["text"] = r"$$\sum_{i=1}^{n} x_i = " + str(rng.randint(1, 99)) + "$$"
+        elif category != "Picture":
+            element["text"] = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 25)))
+        layout.append(element)
+    return json.dumps(layout, ensure_ascii=False)
+
+
+def layout_text(elements: int) -> str:
+    """Plain text of a synthetic layout (what OCR post-processing sees)."""
+    return "\n\n".join(element.get("text", "") for element in json.loads(synthetic_layout(elements)))
+
+
+def synthetic_page(size=(1654, 2339)) -> Image.Image:
+    """A4 page at 200 dpi with lines of text."""
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    for row in range(60):
+        draw.text((100, 80 + row * 36), f"Line {row + 1}: invoice item {row * 7 % 13} total {row * 3.5:.2f}",
+                  fill="black")
+    draw.rectangle((100, 1400, 1500, 1900), outline="black", width=3)
+    return image
+
+
+def encoded(image: Image.Image, fmt: str, **options) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+
+def repo_tables() -> List[str]:
+    return [table for text in repo_outputs() for table in TABLE_PATTERN.findall(text)]
+
+
+def repo_layouts() -> List[str]:
+    return [text for text in repo_outputs() if text.lstrip().startswith("[{")]
+
+
+def bench_clean_ocr_result(texts: List[str]):
+    from utils.text_extractor import clean_ocr_result
+    return lambda: [clean_ocr_result(text) for text in texts]
+
+
+def bench_parse_bbox(layouts: List[str]):
+    from utils.bbox_visualizer import BBoxVisualizer
+    visualizer = BBoxVisualizer()
+    return lambda: [visualizer.parse_bbox_from_json(layout) for layout in layouts]
+
+
+def bench_parse_table_xml(tables: List[str]):
+    from utils.xml_table_parser import XMLTableParser
+    parser = XMLTableParser()
+    return lambda: [parser.parse_table_xml(table) for table in tables]
+
+
+def bench_table_to_markdown(tables: List[str]):
+    from utils.html_table_renderer import HTMLTableRenderer
+    renderer = HTMLTableRenderer()
+    return lambda: [renderer.table_to_markdown(table) for table in tables]
+
+
+def bench_process_ocr_output(texts: List[str]):
+    from utils.ocr_output_processor import OCROutputProcessor
+    processor = OCROutputProcessor()
+    return lambda: [processor.process_ocr_output(text, "benchmark") for text in texts]
+
+
+def bench_preprocess(image: Image.Image):
+    from utils.image_processor import ImageProcessor
+    return lambda: ImageProcessor.preprocess(image)
+
+
+def bench_validate_file(content: bytes, filename: str):
+    from api import validate_file
+    upload = SimpleNamespace(filename=filename)
+    return lambda: validate_file(upload, content)
+
+
+def bench_encode_png_base64(image: Image.Image):
+    # Same steps as VLLMStreamlitAdapter.process_image before the request
+    def encode():
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, format="PNG")
+        return base64.b64encode(buffer.getvalue()).decode("utf-8")
+    return encode
+
+
+def hot_path_benchmarks() -> List[Benchmark]:
+    """All hot-path benchmarks."""
+    benchmarks = [
+        Benchmark("clean_ocr_result[repo]", lambda: bench_clean_ocr_result(repo_outputs()), "postprocess"),
+        Benchmark("parse_bbox_from_json[repo]", lambda: bench_parse_bbox(repo_layouts()), "postprocess"),
+        Benchmark("parse_table_xml[repo]", lambda: bench_parse_table_xml(repo_tables()), "postprocess"),
+        Benchmark("table_to_markdown[repo]", lambda: bench_table_to_markdown(repo_tables()), "postprocess"),
+        Benchmark("process_ocr_output[repo]", lambda: bench_process_ocr_output(repo_outputs()), "postprocess"),
+    ]
+    for size in LAYOUT_SIZES:
+        benchmarks += [
+            Benchmark(f"clean_ocr_result[layout{size}]",
+                      lambda size=size: bench_clean_ocr_result([layout_text(size)]), "postprocess"),
+            Benchmark(f"parse_bbox_from_json[layout{size}]",
+                      lambda size=size: bench_parse_bbox([synthetic_layout(size)]), "postprocess"),
+            Benchmark(f"process_ocr_output[layout{size}]",
+                      lambda size=size: bench_process_ocr_output([layout_text(size)]), "postprocess"),
+        ]
+    benchmarks += [
+        Benchmark("parse_table_xml[rows100]", lambda: bench_parse_table_xml([synthetic_table(100)]), "postprocess"),
+        Benchmark("table_to_markdown[rows100]", lambda: bench_table_to_markdown([synthetic_table(100)]),
+                  "postprocess"),
+        Benchmark("preprocess[a4]", lambda: bench_preprocess(synthetic_page()), "ingest"),
+        Benchmark("validate_file[a4_png]",
+                  lambda: bench_validate_file(encoded(synthetic_page(), "PNG"), "page.png"), "ingest"),
+        Benchmark("validate_file[a4_jpeg]",
+                  lambda: bench_validate_file(encoded(synthetic_page(), "JPEG", quality=90), "page.jpg"), "ingest"),
+        Benchmark("encode_png_base64[a4]", lambda: bench_encode_png_base64(synthetic_page()), "ingest"),
+    ]
+    return benchmarks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CPU-side hot paths")
+    parser.add_argument("--only", help="Run only benchmarks whose name contains this string")
+    parser.add_argument("--repeat", type=int, default=7, help="Samples per benchmark")
+    parser.add_argument("--min-time", type=float, default=0.05, help="Minimum sample duration in seconds")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--check", action="store_true", help="Exit with status 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed slowdown before failing (0.25 = 25%%)")
+    parser.add_argument("--runs", type=int, default=1,
+                        help="Full runs, keeping the best score per benchmark (use 3+ for baselines)")
+    parser.add_argument("--retries", type=int, default=2, help="Reruns confirming an apparent regression")
+    parser.add_argument("--raw", action="store_true", help="Compare raw seconds instead of normalized scores")
+    parser.add_argument("--output", help="Save the full report (with samples) as JSON")
+    args = parser.parse_args()
+
+    def progress(name: str, result: Dict[str, Any]):
+        print(f"  {name:<40} {format_duration(result['median']):>10}  ±{format_duration(result['iqr']):>10}")
+
+    print("Running hot-path benchmarks...")
+    report = run_benchmarks(hot_path_benchmarks(), args.repeat, args.min_time, args.only, progress)
+    for run in range(1, args.runs):
+        print(f"Run {run + 1}/{args.runs}...")
+        report = merge_best(report, run_benchmarks(hot_path_benchmarks(), args.repeat, args.min_time, args.only))
+    for name, reason in report["skipped"].items():
+        print(f"  {name:<40} skipped ({reason})")
+
+    if args.output:
+        save_report(report, args.output)
+        print(f"\n💾 Report saved to {args.output}")
+
+    if args.save_baseline:
+        baseline = strip_samples(report)
+        if args.only and Path(args.baseline).exists():
+            # Partial run: update only the benchmarks that ran (scores are normalized,
+            # so entries from different runs stay comparable)
+            previous = load_report(args.baseline)
+            baseline["results"] = {**previous["results"], **baseline["results"]}
+        save_report(baseline, args.baseline)
+        print(f"\n💾 Baseline saved to {args.baseline}")
+        return
+
+    if not Path(args.baseline).exists():
+        print(f"\nNo baseline at {args.baseline} (create one with --save-baseline)")
+        sys.exit(1 if args.check else 0)
+
+    baseline = load_report(args.baseline)
+    comparisons = compare(report, baseline, args.tolerance, normalize=not args.raw)
+    for _ in range(args.retries):
+        suspects = {comparison.name for comparison in comparisons if comparison.regressed}
+        if not suspects:
+            break
+        print(f"\nRe-running {len(suspects)} suspected regression(s)...")
+        benchmarks = [benchmark for benchmark in hot_path_benchmarks() if benchmark.name in suspects]
+        report = merge_best(report, run_benchmarks(benchmarks, args.repeat, args.min_time))
+        comparisons = compare(report, baseline, args.tolerance, normalize=not args.raw)
+    print(f"\nAgainst baseline (tolerance {args.tolerance:.0%}):")
+    for comparison in comparisons:
+        marker = "❌" if comparison.regressed else "✅"
+        print(f"  {marker} {comparison.name:<40} {comparison.change:+7.1%}")
+
+    missing = sorted(set(report["results"]) - {comparison.name for comparison in comparisons})
+    for name in missing:
+        print(f"  ➕ {name:<40} no baseline")
+
+    regressions = [comparison for comparison in comparisons if comparison.regressed]
+    if regressions:
+        print(f"\n❌ {len(regressions)} hot path(s) regressed by more than {args.tolerance:.0%}")
+        if args.check:
+            sys.exit(1)
+    else:
+        print("\n✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
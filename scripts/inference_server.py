@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Run the GPU-owning inference process for multi-worker api.py deployments.
+
+The server loads each model once and runs the model calls of every API
+worker connected to it; workers hand over decoded images through shared
+memory (see ``utils.inference_worker``). Start it before the API:
+
+    python scripts/inference_server.py --preload qwen3_vl_2b
+    INFERENCE_SERVER=/tmp/chatvlmllm-inference.sock uvicorn api:app --workers 4
+
+``INFERENCE_AUTHKEY`` sets the shared secret of the connection handshake
+(required with ``--address host:port``). Calls are scheduled with the
+``scheduler`` section of config.yaml, across all workers.
+"""
+
+import argparse
+import os
+import signal
+import sys
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from models import ModelLoader
+from utils.inference_worker import DEFAULT_ADDRESS, InferenceServer
+from utils.scheduler import FairScheduler, scheduler_settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve model calls of API workers from one process")
+    parser.add_argument("--address", default=os.getenv("INFERENCE_SERVER", DEFAULT_ADDRESS),
+                        help="Unix socket path or host:port")
+    parser.add_argument("--max-workers", type=int, default=32, help="Calls accepted concurrently")
+    parser.add_argument("--preload", nargs="*", default=[], help="Models to load before accepting calls")
+    args = parser.parse_args()
+
+    authkey = os.getenv("INFERENCE_AUTHKEY")
+    server = InferenceServer(
+        args.address,
+        authkey=authkey.encode() if authkey else None,
+        scheduler=FairScheduler(scheduler_settings(ModelLoader.load_config())),
+        max_workers=args.max_workers
+    )
+    for model_name in args.preload:
+        print(f"⏳ Loading {model_name}...")
+        server.get_model(model_name)
+
+    signal.signal(signal.SIGTERM, lambda *_: server.close())
+    print(f"✅ Inference server on {args.address} (pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""Load test api.py or an OpenAI-compatible endpoint (vLLM) with a sweep.
+
+Closed loop sweeps concurrency (``--levels 1 4 16``), open loop sweeps the
+arrival rate in requests per second (``--mode open --levels 2 5 10``).
+Each level reports throughput, p50/p95/p99 latency, TTFT and tokens/s;
+the full report (with git commit and settings) is saved as JSON so runs
+before and after a change can be compared.
+
+Without a GPU, use the fake backend: ``--in-process fake-openai`` or
+``--in-process api`` (api.py with ``model=fake_vlm``) run the app inside
+this process; ``--serve-fake 8000`` serves the fake OpenAI endpoint for
+other clients (needs uvicorn). In-process runs buffer responses, so TTFT
+is only meaningful against a real server. The fake settings flags apply
+to the fake OpenAI backend; ``fake_vlm`` in api.py reads its settings from
+a ``fake_vlm`` entry in config.yaml (defaults otherwise). A separately
+running api.py serves ``fake_vlm`` only when started with
+``ENABLE_FAKE_MODELS=1``; ``--in-process api`` registers it itself.
+
+Usage:
+    python scripts/load_test.py --url http://localhost:8000 --target openai --levels 1 4 16 --requests 64
+    python scripts/load_test.py --url http://localhost:8001 --target api-ocr --model qwen3_vl_2b
+    python scripts/load_test.py --in-process fake-openai --mode open --levels 5 10 20 --duration 10
+    python scripts/load_test.py --serve-fake 8000 --per-token-ms 8
+
+``--store`` also appends every request to the performance history
+(``utils.perf_store``) with source "benchmark", next to production samples.
+"""
+
+import argparse
+import io
+import sys
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from PIL import Image, ImageDraw
+
+from utils.fake_backend import DEFAULT_FAKE_SETTINGS, FakeOpenAIServer
+from utils.loadtest import ApiTarget, OpenAIChatTarget, Target, format_report, run_sweep, save_report
+from utils.perf_store import PerfRecorder, PerformanceStore
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+
+
+def load_images(path: str = None, variants: int = 16) -> tuple:
+    """
+    Image bytes and MIME type.
+
+    A file is sent as is, a directory contributes all its images, and
+    without a path ``variants`` distinct synthetic text pages are drawn
+    (distinct pages keep api.py from coalescing the requests).
+    """
+    if path:
+        files = sorted(p for p in Path(path).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS) \
+            if Path(path).is_dir() else [Path(path)]
+        suffix = files[0].suffix.lower().lstrip(".")
+        mime = "image/jpeg" if suffix in ("jpg", "jpeg") else f"image/{suffix or 'png'}"
+        return [file.read_bytes() for file in files], mime
+
+    pages = []
+    for variant in range(variants):
+        image = Image.new("RGB", (800, 1000), "white")
+        draw = ImageDraw.Draw(image)
+        draw.text((40, 10), f"Document {variant + 1}", fill="black")
+        for row in range(30):
+            draw.text((40, 40 + row * 31), f"Line {row + 1}: item {(row + variant) * 7 % 13} total {row * 3.5:.2f}",
+                      fill="black")
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        pages.append(buffer.getvalue())
+    return pages, "image/png"
+
+
+def fake_overrides(args) -> dict:
+    return {key: getattr(args, key) for key in DEFAULT_FAKE_SETTINGS if getattr(args, key, None) is not None}
+
+
+def record_results(target: Target, recorder: PerfRecorder, endpoint: str) -> None:
+    """Record every request sent by ``target`` (latency, success, tokens)."""
+    send = target.send
+
+    async def send_and_record(client):
+        result = await send(client)
+        # The OpenAI model id is only resolved once the sweep starts
+        model = target.payload_info().get("model") or "unknown"
+        recorder.record(model, result.latency, result.ok, source="benchmark", endpoint=endpoint,
+                        tokens=result.output_tokens, extra={"target": target.name})
+        return result
+
+    target.send = send_and_record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test with a concurrency or rate sweep")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--url", help="Base URL of the endpoint")
+    source.add_argument("--in-process", choices=["api", "fake-openai"], help="Run the app inside this process")
+    source.add_argument("--serve-fake", type=int, metavar="PORT", help="Serve the fake OpenAI endpoint and exit")
+    parser.add_argument("--target", choices=["openai", "api-ocr", "api-chat"], help="Endpoint type")
+    parser.add_argument("--model", help="api.py model key or OpenAI model id")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed", help="Load model")
+    parser.add_argument("--levels", type=float, nargs="+", default=[1, 2, 4, 8],
+                        help="Concurrencies (closed) or requests per second (open)")
+    parser.add_argument("--requests", type=int, default=32, help="Requests per level (closed loop)")
+    parser.add_argument("--duration", type=float, help="Seconds per level (required for open loop)")
+    parser.add_argument("--arrival", choices=["poisson", "constant"], default="poisson", help="Open-loop arrivals")
+    parser.add_argument("--max-in-flight", type=int, help="Open loop: drop arrivals above this many outstanding")
+    parser.add_argument("--warmup", type=int, default=2, help="Unrecorded requests before the sweep")
+    parser.add_argument("--image", help="Image file or directory (default: synthetic text pages)")
+    parser.add_argument("--variants", type=int, default=16, help="Distinct synthetic pages")
+    parser.add_argument("--prompt", default="Extract all text from this image.", help="Prompt (chat/openai)")
+    parser.add_argument("--max-tokens", type=int, default=256, help="Generation limit (chat/openai)")
+    parser.add_argument("--no-stream", action="store_true", help="Non-streaming OpenAI requests (no TTFT)")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Request timeout in seconds")
+    parser.add_argument("--output", help="Save the JSON report here")
+    parser.add_argument("--store", help="Also append requests to this performance history database")
+    for key, default in DEFAULT_FAKE_SETTINGS.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(default), help=f"Fake OpenAI backend (default {default})")
+    args = parser.parse_args()
+
+    if args.serve_fake:
+        try:
+            import uvicorn
+        except ImportError:
+            print("❌ uvicorn is required to serve the fake backend: pip install uvicorn")
+            sys.exit(1)
+        uvicorn.run(FakeOpenAIServer(fake_overrides(args)).app(), host="0.0.0.0", port=args.serve_fake)
+        return
+
+    if args.mode == "open" and args.duration is None:
+        parser.error("--duration is required for open loop")
+
+    transport = None
+    base_url = args.url
+    target_kind = args.target
+    model = args.model
+    if args.in_process == "fake-openai":
+        import httpx
+        transport = httpx.ASGITransport(app=FakeOpenAIServer(fake_overrides(args)).app())
+        base_url, target_kind = "http://fake-openai", target_kind or "openai"
+    elif args.in_process == "api":
+        import httpx
+        import api
+        from models import ModelLoader
+        ModelLoader.register_fake_models()
+        transport = httpx.ASGITransport(app=api.app)
+        base_url, target_kind, model = "http://api", target_kind or "api-ocr", model or "fake_vlm"
+
+    if target_kind is None:
+        parser.error("--target is required with --url")
+
+    images, mime = load_images(args.image, args.variants)
+    if target_kind == "openai":
+        target = OpenAIChatTarget(images, args.prompt, model, args.max_tokens, mime, stream=not args.no_stream)
+    else:
+        target = ApiTarget(images, target_kind.split("-", 1)[1], model or "qwen3_vl_2b", args.prompt,
+                           args.max_tokens, filename=f"page.{mime.split('/')[1]}", mime=mime)
+
+    recorder = None
+    if args.store:
+        recorder = PerfRecorder(PerformanceStore(args.store))
+        record_results(target, recorder, "/v1/chat/completions" if target_kind == "openai" else f"/{target_kind.split('-', 1)[1]}")
+
+    print(f"🚀 {target.name} @ {base_url}: {args.mode} loop, levels {args.levels}")
+    report = run_sweep(
+        target, base_url,
+        mode=args.mode,
+        levels=args.levels,
+        requests=args.requests if args.mode == "closed" else None,
+        duration=args.duration,
+        warmup=args.warmup,
+        arrival=args.arrival,
+        max_in_flight=args.max_in_flight,
+        timeout=args.timeout,
+        transport=transport,
+    )
+    print(format_report(report))
+
+    if recorder is not None:
+        recorder.close()
+        print(f"🗄️ Requests recorded in {args.store}")
+
+    if args.output:
+        save_report(report, args.output)
+        print(f"\n💾 Report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""Qualify quantization profiles of a model against a golden set.
+
+Each profile is loaded through ModelLoader, runs OCR on every golden set
+image and is compared with the reference profile (fp16 on GPU, fp32 on
+CPU). Weight memory, peak memory, tokens/s and character error rate are
+recorded; passing profiles are stored in the qualification file that the
+loader checks before using a quantized profile in production.
+
+A golden set is a directory of images, each with a ``.txt`` file holding
+the expected text. ``--synthesize`` renders a small synthetic set.
+
+Usage:
+    python scripts/qualify_quantization.py qwen3_vl_2b --golden-dir golden/ --profiles int8 int4_nf4
+    python scripts/qualify_quantization.py qwen3_vl_2b --synthesize golden/
+    python scripts/qualify_quantization.py --check-config
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import torch
+import yaml
+from PIL import Image, ImageDraw, ImageFont
+
+from models.model_loader import ModelLoader
+from utils.quantization import (
+    DEFAULT_QUALIFICATION_THRESHOLDS,
+    QUANTIZATION_PROFILES,
+    REFERENCE_PROFILES,
+    QualificationStore,
+    load_golden_set,
+    qualification_result,
+    run_golden_set,
+    validate_production_config,
+    weight_memory_gb,
+)
+
+SYNTHETIC_DOCUMENTS = {
+    "invoice": "INVOICE No. 2024-117\nDate: 12.03.2024\nSupplier: Nord Trade LLC\nTotal: 48 350.00 RUB\nVAT 20%: 8 058.33 RUB",
+    "letter": "Dear colleagues,\nthe quarterly report is attached.\nPlease send your comments by Friday.\nBest regards, Anna Petrova",
+    "table": "Item Qty Price\nPaper A4 10 350.00\nToner cartridge 2 4 200.00\nStapler 1 890.00",
+}
+
+
+def print_section(title: str):
+    """Print section header."""
+    print(f"\n{'='*60}")
+    print(f"{title}")
+    print(f"{'='*60}\n")
+
+
+def synthesize_golden_set(directory: str) -> None:
+    """Render the synthetic documents as images with their expected text."""
+    output = Path(directory)
+    output.mkdir(parents=True, exist_ok=True)
+    font = ImageFont.load_default(size=32)
+
+    for name, text in SYNTHETIC_DOCUMENTS.items():
+        lines = text.split("\n")
+        image = Image.new("RGB", (1024, 96 + 56 * len(lines)), "white")
+        draw = ImageDraw.Draw(image)
+        for index, line in enumerate(lines):
+            draw.text((48, 48 + 56 * index), line, fill="black", font=font)
+        image.save(output / f"{name}.png")
+        (output / f"{name}.txt").write_text(text, encoding="utf-8")
+
+    print(f"🖼️ Synthetic golden set written to {output}")
+
+
+def recognize_with(model) -> Any:
+    """OCR function for a loaded model wrapper."""
+    def recognize(image_path: str) -> str:
+        image = Image.open(image_path).convert("RGB")
+        if hasattr(model, "extract_text"):
+            result = model.extract_text(image)
+        else:
+            result = model.process_image(image)
+        return result if isinstance(result, str) else str(result)
+    return recognize
+
+
+def token_counter(model) -> Any:
+    """Count output tokens with the model's tokenizer (words as a fallback)."""
+    tokenizer = getattr(getattr(model, "processor", None), "tokenizer", None) or getattr(model, "tokenizer", None)
+    if tokenizer is None:
+        return lambda text: len(text.split())
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def qualify_profile(
+    model_key: str,
+    profile: str,
+    samples: List[Dict[str, Any]],
+    reference_cer: Optional[float],
+    thresholds: Dict[str, float]
+) -> Dict[str, Any]:
+    """Load one profile, run the golden set and unload."""
+    cuda = torch.cuda.is_available()
+    if cuda:
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats()
+
+    model = ModelLoader.load_model(model_key, force_reload=True, quantization_profile=profile)
+    try:
+        weights_gb = weight_memory_gb(model.model)
+        golden = run_golden_set(recognize_with(model), samples, token_counter(model))
+        peak_gb = torch.cuda.max_memory_allocated() / 1024 ** 3 if cuda else None
+    finally:
+        ModelLoader.unload_model(model_key)
+
+    return qualification_result(profile, golden, weights_gb, peak_gb, reference_cer, thresholds)
+
+
+def format_report(model_key: str, results: List[Dict[str, Any]]) -> str:
+    """Accuracy-vs-throughput table in Markdown."""
+    lines = [
+        f"## Quantization profiles: {model_key}",
+        "",
+        "| Profile | Passed | CER | ΔCER vs ref | Tokens/s | Weights GB | Peak GB | Reason |",
+        "|---|---|---|---|---|---|---|---|",
+    ]
+    for result in results:
+        delta = (
+            f"{result['cer'] - result['reference_cer']:+.4f}"
+            if result['cer'] is not None and result['reference_cer'] is not None else "-"
+        )
+        lines.append(
+            f"| {result['profile']} | {'✅' if result['passed'] else '❌'} | {result['cer']} | {delta} | "
+            f"{result['tokens_per_second']} | {result['weights_gb']} | {result['peak_gb'] or '-'} | {result['reason']} |"
+        )
+    return "\n".join(lines)
+
+
+def check_config(config_path: Path) -> int:
+    """Validate that every configured model uses an allowed profile."""
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+
+    problems = validate_production_config(config)
+    if not problems:
+        print("✅ All configured quantization profiles are qualified")
+        return 0
+
+    for problem in problems:
+        print(f"❌ {problem['model']}: profile {problem['profile']} - {problem['reason']}")
+    return 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Qualify quantization profiles against a golden set")
+    parser.add_argument("model_key", nargs="?", help="Model key from config.yaml")
+    parser.add_argument("--profiles", nargs="+", choices=sorted(QUANTIZATION_PROFILES),
+                        help="Profiles to qualify (default: all profiles for this device)")
+    parser.add_argument("--golden-dir", help="Golden set directory (images + .txt)")
+    parser.add_argument("--synthesize", metavar="DIR", help="Render a synthetic golden set into DIR and use it")
+    parser.add_argument("--max-cer", type=float, default=DEFAULT_QUALIFICATION_THRESHOLDS["max_cer"])
+    parser.add_argument("--max-cer-increase", type=float, default=DEFAULT_QUALIFICATION_THRESHOLDS["max_cer_increase"])
+    parser.add_argument("--output", help="Write results as JSON")
+    parser.add_argument("--markdown", help="Write the report table as Markdown")
+    parser.add_argument("--check-config", action="store_true", help="Validate config.yaml profiles and exit")
+    args = parser.parse_args()
+
+    if args.check_config:
+        sys.exit(check_config(project_root / "config.yaml"))
+    if not args.model_key:
+        parser.error("model_key is required unless --check-config is given")
+
+    if args.synthesize:
+        synthesize_golden_set(args.synthesize)
+    golden_dir = args.golden_dir or args.synthesize
+    if not golden_dir:
+        parser.error("--golden-dir or --synthesize is required")
+
+    samples = load_golden_set(golden_dir)
+    if not samples:
+        parser.error(f"No golden set samples in {golden_dir}")
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    reference = REFERENCE_PROFILES[device]
+    profiles = args.profiles or [
+        name for name, spec in QUANTIZATION_PROFILES.items() if spec["device"] in ("any", device)
+    ]
+    # The reference runs first: the others are measured against its CER
+    profiles = [reference] + [profile for profile in profiles if profile != reference]
+    thresholds = {"max_cer": args.max_cer, "max_cer_increase": args.max_cer_increase}
+
+    print_section(f"Qualifying {args.model_key} on {device}: {', '.join(profiles)} ({len(samples)} samples)")
+
+    store = QualificationStore()
+    model_path = ModelLoader.load_config()["models"][args.model_key].get("model_path", "")
+    results = []
+    reference_cer = None
+
+    for profile in profiles:
+        spec = QUANTIZATION_PROFILES[profile]
+        if spec["device"] not in ("any", device):
+            print(f"   {profile:<17} skipped (needs {spec['device']})")
+            continue
+
+        try:
+            result = qualify_profile(args.model_key, profile, samples, reference_cer, thresholds)
+        except Exception as e:
+            result = {
+                "profile": profile, "passed": False, "reason": f"{type(e).__name__}: {e}",
+                "cer": None, "reference_cer": reference_cer, "tokens_per_second": None,
+                "weights_gb": None, "peak_gb": None, "samples": [],
+            }
+
+        store.put(model_path, profile, result, device=device)
+        results.append(result)
+        print(f"   {profile:<17} {'PASS' if result['passed'] else 'FAIL'}  "
+              f"CER {result['cer']}  {result['tokens_per_second']} tok/s  {result['reason']}")
+
+        if profile == reference:
+            reference_cer = result["cer"]
+            if reference_cer is None:
+                print("   ❌ Reference profile failed, other profiles cannot be compared")
+                break
+
+    report = format_report(args.model_key, results)
+    print(f"\n{report}")
+
+    if args.markdown:
+        Path(args.markdown).write_text(report + "\n", encoding="utf-8")
+    if args.output:
+        Path(args.output).write_text(json.dumps({
+            "model": args.model_key,
+            "model_path": model_path,
+            "device": device,
+            "thresholds": thresholds,
+            "results": results,
+        }, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"\n💾 Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
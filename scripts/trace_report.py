@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Flame-style breakdown of the slowest traced requests.
+
+Reads spans exported with ``TRACING=jsonl`` (api.py, app.py and the vLLM
+adapter) and prints, for the slowest N traces, every span on a timeline
+bar with its total and self time, followed by the self time per span name
+over those traces (where the time went: PNG encoding, health probes,
+container switches, vLLM, post-processing).
+
+Usage:
+    TRACING=jsonl uvicorn api:app --port 8001
+    python scripts/trace_report.py logs/traces.jsonl --top 5
+    python scripts/trace_report.py logs/traces.jsonl --name "POST /ocr" --json slow.json
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from utils.tracing import format_trace, load_spans, slowest_traces, stage_totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the slowest traced requests")
+    parser.add_argument("trace_file", nargs="?", default="logs/traces.jsonl", help="JSONL span file")
+    parser.add_argument("--top", type=int, default=5, help="Number of slowest traces")
+    parser.add_argument("--name", help="Only traces whose root span starts with this name")
+    parser.add_argument("--width", type=int, default=40, help="Timeline bar width")
+    parser.add_argument("--json", help="Also save the selected traces to a JSON file")
+    args = parser.parse_args()
+
+    if not Path(args.trace_file).exists():
+        print(f"❌ Trace file not found: {args.trace_file} (run with TRACING=jsonl)")
+        sys.exit(1)
+
+    spans = load_spans(args.trace_file)
+    traces = slowest_traces(spans, args.top, args.name)
+    if not traces:
+        print("No matching traces")
+        return
+
+    print(f"{len(spans)} spans, {len(traces)} slowest traces\n")
+    for trace in traces:
+        print(format_trace(trace, args.width))
+        print()
+
+    print("Self time by span over these traces:")
+    totals = stage_totals(traces)
+    overall = sum(seconds for _, seconds in totals) or 1.0
+    for name, seconds in totals:
+        print(f"  {seconds * 1000:10.1f} ms  {seconds / overall:6.1%}  {name}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(traces, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"\n💾 Traces saved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,9 +12,14 @@ import subprocess
 from typing import Dict, List, Optional, Tuple
 import streamlit as st
 
+from utils.tracing import tracer
+from utils.container_registry import ContainerState, get_container_registry
+
 class SingleContainerManager:
     def __init__(self):
         self.client = docker.from_env()
+        # Состояние контейнеров из потока событий Docker (без опроса API)
+        self.registry = get_container_registry()
         
         # Конфигурация доступных моделей
         self.models_config = {
@@ -63,40 +68,27 @@ class SingleContainerManager:
         self.compose_file = "docker-compose-vllm.yml"
         self.current_active_model = None
     
+    @tracer.traced("container.status")
     def get_container_status(self, container_name: str) -> Dict:
         """Получение детального статуса контейнера"""
-        try:
-            container = self.client.containers.get(container_name)
-            
-            # Получаем health status
-            health_status = "unknown"
-            if "Health" in container.attrs.get("State", {}):
-                health_status = container.attrs["State"]["Health"]["Status"]
-            
-            return {
-                "exists": True,
-                "running": container.status == "running",
-                "status": container.status,
-                "health": health_status,
-                "created": container.attrs.get("Created", ""),
-                "started_at": container.attrs.get("State", {}).get("StartedAt", "")
-            }
-        except docker.errors.NotFound:
+        state = self.registry.get(container_name)
+        if state is None:
             return {
                 "exists": False,
                 "running": False,
                 "status": "not_found",
                 "health": "unknown"
             }
-        except Exception as e:
-            return {
-                "exists": False,
-                "running": False,
-                "status": "error",
-                "health": "unknown",
-                "error": str(e)
-            }
+        
+        return {
+            "exists": True,
+            "running": state.running,
+            "status": state.status,
+            "health": state.health,
+            "started_at": state.started_at
+        }
     
+    @tracer.traced("container.health_probe")
     def check_api_health(self, port: int, timeout: int = 5) -> Tuple[bool, str]:
         """Проверка здоровья API модели"""
         try:
@@ -123,22 +115,26 @@ class SingleContainerManager:
         except Exception as e:
             return False, f"API error: {str(e)}"
     
+    def is_model_ready(self, config: Dict, state: Optional[ContainerState]) -> bool:
+        """Готовность модели: healthcheck Docker, для контейнеров без него - запрос к API"""
+        if state is None or not state.running:
+            return False
+        if state.health != "none":
+            return state.health == "healthy"
+        return self.check_api_health(config["port"])[0]
+    
+    @tracer.traced("container.get_active_model")
     def get_active_model(self) -> Optional[str]:
         """Определение текущей активной модели"""
         for model_key, config in self.models_config.items():
-            container_status = self.get_container_status(config["container_name"])
-            
-            # Проверяем, что контейнер запущен
-            if container_status["running"]:
-                # Проверяем API доступность (это более надежный индикатор)
-                api_healthy, api_message = self.check_api_health(config["port"])
-                if api_healthy:
-                    self.current_active_model = model_key
-                    return model_key
+            if self.is_model_ready(config, self.registry.get(config["container_name"])):
+                self.current_active_model = model_key
+                return model_key
         
         self.current_active_model = None
         return None
     
+    @tracer.traced("container.stop_all")
     def stop_all_containers(self) -> Tuple[List[str], List[str]]:
         """Остановка всех vLLM контейнеров (прямое управление Docker)"""
         stopped = []
@@ -163,6 +159,7 @@ class SingleContainerManager:
         
         return stopped, failed
     
+    @tracer.traced("container.start_single_container")
     def start_single_container(self, model_key: str) -> Tuple[bool, str]:
         """Запуск одного контейнера (с остановкой всех остальных)"""
         
@@ -172,12 +169,8 @@ class SingleContainerManager:
         config = self.models_config[model_key]
         
         # ИСПРАВЛЕНИЕ: Проверяем, не активна ли уже эта модель
-        current_active = self.get_active_model()
-        if current_active == model_key:
-            # Дополнительная проверка API
-            api_healthy, api_message = self.check_api_health(config["port"])
-            if api_healthy:
-                return True, f"Модель {config['display_name']} уже активна и готова к работе"
+        if self.is_model_ready(config, self.registry.get(config["container_name"])):
+            return True, f"Модель {config['display_name']} уже активна и готова к работе"
         
         # Шаг 1: Останавливаем все контейнеры (включая неактивные)
         st.info("🛑 Остановка всех активных контейнеров...")
@@ -190,8 +183,9 @@ class SingleContainerManager:
         if failed:
             st.warning(f"⚠️ Ошибки остановки: {'; '.join(failed)}")
         
-        # Пауза для освобождения памяти
-        time.sleep(3)
+        # Ожидание удаления остановленных контейнеров (событие destroy) для освобождения памяти
+        for stopped_key in stopped:
+            self.registry.wait_until_gone(self.models_config[stopped_key]["container_name"], timeout=30)
         
         # Шаг 2: Запускаем целевой контейнер
         st.info(f"🚀 Запуск {config['display_name']}...")
@@ -200,12 +194,13 @@ class SingleContainerManager:
             # ИСПРАВЛЕНИЕ: Прямой запуск через Docker API
             docker_cmd = self._build_docker_command(model_key, config)
             
-            result = subprocess.run(docker_cmd, capture_output=True, text=True, timeout=60)
+            with tracer.span("container.docker_run", model=model_key):
+                result = subprocess.run(docker_cmd, capture_output=True, text=True, timeout=60)
             
             if result.returncode != 0:
                 return False, f"Ошибка запуска контейнера: {result.stderr}"
             
-            # Шаг 3: Ожидание готовности
+            # Шаг 3: Ожидание готовности по событиям Docker (start, health_status, die)
             st.info(f"⏳ Ожидание готовности модели (до {config['startup_time']} сек)...")
             
             start_time = time.time()
@@ -214,33 +209,35 @@ class SingleContainerManager:
             progress_bar = st.progress(0)
             status_text = st.empty()
             
-            while time.time() - start_time < max_wait:
-                elapsed = time.time() - start_time
-                progress = min(elapsed / max_wait, 1.0)
-                progress_bar.progress(progress)
-                
-                # Проверяем статус контейнера
-                container_status = self.get_container_status(config["container_name"])
-                
-                if container_status["running"]:
-                    # Проверяем API
-                    api_healthy, api_message = self.check_api_health(config["port"], timeout=3)
-                    
-                    if api_healthy:
-                        progress_bar.progress(1.0)
-                        status_text.success(f"✅ {config['display_name']} готов к работе!")
-                        self.current_active_model = model_key
-                        return True, f"Модель {config['display_name']} успешно запущена"
-                    else:
-                        status_text.info(f"🔄 Загрузка модели... ({api_message})")
+            def show_progress(state: Optional[ContainerState]):
+                progress_bar.progress(min((time.time() - start_time) / max_wait, 1.0))
+                if state is not None and state.running:
+                    status_text.info(f"🔄 Загрузка модели... (health: {state.health})")
                 else:
-                    status_text.info(f"🔄 Запуск контейнера... ({container_status['status']})")
-                
-                time.sleep(2)
+                    status_text.info(f"🔄 Запуск контейнера... ({state.status if state else 'created'})")
+            
+            with tracer.span("container.wait_ready", model=model_key):
+                ready, state = self.registry.wait_until_ready(
+                    config["container_name"],
+                    timeout=max_wait,
+                    probe=lambda _: self.check_api_health(config["port"], timeout=3)[0],
+                    on_change=show_progress
+                )
+            
+            if ready:
+                progress_bar.progress(1.0)
+                status_text.success(f"✅ {config['display_name']} готов к работе!")
+                self.current_active_model = model_key
+                return True, f"Модель {config['display_name']} успешно запущена"
             
-            # Таймаут
             progress_bar.empty()
             status_text.empty()
+            if state is not None and state.stopped:
+                return False, f"Контейнер {config['container_name']} завершился (код {state.exit_code})"
+            if state is not None and state.health == "unhealthy":
+                return False, f"Модель {config['display_name']} не прошла healthcheck"
+            
+            # Таймаут
             return False, f"Таймаут запуска модели {config['display_name']} ({max_wait} сек)"
             
         except Exception as e:
@@ -255,7 +252,12 @@ class SingleContainerManager:
             "--name", config["container_name"],
             "--gpus", "all",
             "-p", f"{config['port']}:8000",
-            "--shm-size=8g"
+            "--shm-size=8g",
+            # Healthcheck как в docker-compose: готовность приходит событием health_status
+            "--health-cmd", "curl -f http://localhost:8000/health",
+            "--health-interval", "5s",
+            "--health-retries", "3",
+            "--health-start-period", f"{config['startup_time']}s"
         ]
         
         # Монтирование кеша HuggingFace для Windows
@@ -285,9 +287,32 @@ class SingleContainerManager:
             "--disable-log-requests",
             "--enable-prefix-caching"
         ])
+        cmd.extend(self._speculative_args(config))
         
         return cmd
     
+    @staticmethod
+    def _speculative_args(config: Dict) -> List[str]:
+        """
+        Параметры speculative decoding для vLLM (draft-модель того же семейства).
+        
+        Текущие версии vLLM принимают один JSON-параметр --speculative-config
+        вместо прежних --speculative-model / --num-speculative-tokens.
+        """
+        if not config.get("speculative_model"):
+            return []
+        
+        spec = {
+            "model": config["speculative_model"],
+            "num_speculative_tokens": int(config.get("num_speculative_tokens", 5))
+        }
+        return ["--speculative-config", json.dumps(spec)]
+    
+    @staticmethod
+    def _memory_gb(config: Dict) -> float:
+        """Память модели вместе с draft-моделью speculative decoding"""
+        return config["memory_gb"] + config.get("draft_memory_gb", 0.0)
+    
     def get_system_status(self) -> Dict:
         """Получение полного статуса системы"""
         active_model = self.get_active_model()
@@ -301,9 +326,13 @@ class SingleContainerManager:
             api_message = "Not checked"
             
             if container_status["running"]:
-                api_healthy, api_message = self.check_api_health(config["port"])
+                if container_status["health"] != "none":
+                    api_healthy = container_status["health"] == "healthy"
+                    api_message = f"Docker health: {container_status['health']}"
+                else:
+                    api_healthy, api_message = self.check_api_health(config["port"])
                 if api_healthy:
-                    total_memory += config["memory_gb"]
+                    total_memory += self._memory_gb(config)
             
             models_status[model_key] = {
                 "config": config,
@@ -346,7 +375,7 @@ class SingleContainerManager:
             
             # Формируем описание опции
             status_icon = "🟢" if model_status["is_active"] else "⚪"
-            option_text = f"{status_icon} {config['display_name']} ({config['memory_gb']} ГБ)"
+            option_text = f"{status_icon} {config['display_name']} ({self._memory_gb(config)} ГБ)"
             
             model_options.append(option_text)
             model_keys.append(model_key)
@@ -377,7 +406,9 @@ class SingleContainerManager:
             with col1:
                 st.write(f"**Модель:** {selected_config['model_path']}")
                 st.write(f"**Порт:** {selected_config['port']}")
-                st.write(f"**Память:** {selected_config['memory_gb']} ГБ")
+                st.write(f"**Память:** {self._memory_gb(selected_config)} ГБ")
+                if selected_config.get("speculative_model"):
+                    st.write(f"**Draft-модель:** {selected_config['speculative_model']}")
             
             with col2:
                 st.write(f"**Время запуска:** ~{selected_config['startup_time']} сек")
@@ -441,7 +472,7 @@ class SingleContainerManager:
                     else:
                         st.write(f"❌ {model_status['api_message']}")
                     
-                    st.write(f"Память: {config['memory_gb']} ГБ")
+                    st.write(f"Память: {self._memory_gb(config)} ГБ")
                 
                 with col3:
                     st.write("**Управление:**")
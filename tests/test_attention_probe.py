@@ -0,0 +1,82 @@
+"""Tests for the attention backend capability probe."""
+
+import json
+
+import torch
+
+import utils.attention_probe as attention_probe
+from utils.attention_probe import (
+    CapabilityStore,
+    declared_support,
+    probe_backend,
+    select_attn_implementation,
+)
+
+GEOMETRY = {"num_heads": 4, "num_kv_heads": 2, "head_dim": 16}
+
+
+class TestProbeBackend:
+    """Tests for single-backend probes."""
+
+    def test_cpu_backends(self):
+        """SDPA and eager pass on CPU; flash attention needs CUDA."""
+        assert probe_backend("sdpa", "cpu", torch.float32, GEOMETRY)["ok"]
+        assert probe_backend("eager", "cpu", torch.float32, GEOMETRY)["ok"]
+
+        flash = probe_backend("flash_attention_2", "cpu", torch.float32, GEOMETRY)
+        assert not flash["ok"]
+        assert "CUDA" in flash["error"]
+
+    def test_wrong_output_rejected(self, monkeypatch):
+        """A backend producing wrong values fails the probe."""
+        original = attention_probe._run_backend
+
+        def broken(backend, query, key, value):
+            output = original(backend, query, key, value)
+            return output + 1 if backend == "sdpa" else output
+
+        monkeypatch.setattr(attention_probe, "_run_backend", broken)
+        result = probe_backend("sdpa", "cpu", torch.float32, GEOMETRY)
+
+        assert not result["ok"]
+        assert "mismatch" in result["error"]
+
+    def test_declared_support(self):
+        """Unknown (remote-code) classes are assumed to support everything."""
+        assert all(declared_support("RemoteOnlyForCausalLM").values())
+
+
+class TestSelectAttnImplementation:
+    """Tests for selection and the persisted capability file."""
+
+    def test_result_persisted_and_reused(self, tmp_path, monkeypatch):
+        calls = []
+        original = attention_probe.probe_model
+
+        def counting_probe(*args, **kwargs):
+            calls.append(args)
+            return original(*args, **kwargs)
+
+        monkeypatch.setattr(attention_probe, "probe_model", counting_probe)
+        monkeypatch.setattr(attention_probe, "model_geometry", lambda path: ("TinyForCausalLM", dict(GEOMETRY)))
+        capability_file = tmp_path / "capabilities.json"
+
+        first = select_attn_implementation("tiny", device="cpu", capability_file=str(capability_file))
+        second = select_attn_implementation("tiny", device="cpu", capability_file=str(capability_file))
+
+        assert first == second == "sdpa"
+        assert len(calls) == 1
+
+        data = json.loads(capability_file.read_text())
+        (entry,) = data.values()
+        assert entry["environment"]["torch"] == torch.__version__
+        (model,) = entry["models"].values()
+        assert model["backends"]["flash_attention_2"]["ok"] is False
+
+        select_attn_implementation("tiny", device="cpu", capability_file=str(capability_file), refresh=True)
+        assert len(calls) == 2
+
+    def test_unreadable_file_ignored(self, tmp_path):
+        path = tmp_path / "broken.json"
+        path.write_text("{not json")
+        assert CapabilityStore(str(path)).load() == {}
@@ -0,0 +1,89 @@
+"""Tests for cascade routing between cheap and large models."""
+
+from utils.cascade import CascadeRouter, field_fill_rate, score_output
+
+CLEAN_TEXT = "Invoice Number: 2024-117\nInvoice Date: 12.03.2024\nTotal amount: $ 48350.00"
+TIERS = [
+    {'model': 'small', 'cost': 1.0},
+    {'model': 'medium', 'cost': 4.0},
+    {'model': 'large', 'cost': 16.0},
+]
+
+
+def router(**settings):
+    return CascadeRouter({'tiers': TIERS, 'threshold': 0.7, **settings})
+
+
+class TestScoring:
+    """Tests for output quality signals."""
+
+    def test_clean_text_scores_high(self):
+        assert score_output(CLEAN_TEXT).score >= 0.7
+
+    def test_failures_score_zero(self):
+        assert score_output("[GOT-OCR HF error: CUDA out of memory]").reasons == ["model error"]
+        assert score_output("   ").score == 0.0
+        assert score_output("ĠĠĠ Champion kaps ADDR ĊĊĊ").reasons == ["garbage output"]
+        assert score_output("row row row row row row row row row row row row").score == 0.0
+
+    def test_json_validity(self):
+        assert score_output('{"blocks": [{"text": "Total"}]}').signals['json_valid']
+        assert score_output('{"blocks": [{"text": "Tot').reasons == ["invalid JSON"]
+        assert score_output("plain text here", expect_json=True).score == 0.0
+
+    def test_expected_fields(self):
+        assert field_fill_rate(CLEAN_TEXT) is None
+        assert field_fill_rate(CLEAN_TEXT, fields=["Invoice Number", "Due date"]) == 0.5
+        assert field_fill_rate(CLEAN_TEXT, 'invoice') > field_fill_rate("Some letter text", 'invoice')
+
+        partial = score_output("Dear colleagues, see you on Friday.", document_type='invoice')
+        assert partial.score < 0.7
+        assert "missing fields" in partial.reasons
+
+
+class TestRouter:
+    """Tests for escalation and reporting."""
+
+    def test_cheap_tier_accepts_clean_page(self):
+        calls = []
+        result = router().route(lambda model: calls.append(model) or CLEAN_TEXT)
+
+        assert calls == ['small']
+        assert result.model == 'small' and result.passed
+
+    def test_escalates_on_low_score_and_errors(self):
+        outputs = {'small': "[GOT-OCR HF: Empty result]", 'large': CLEAN_TEXT}
+
+        def run(model):
+            if model == 'medium':
+                raise RuntimeError("model not loaded")
+            return outputs[model]
+
+        result = router().route(run)
+        assert result.model == 'large'
+        assert [attempt['model'] for attempt in result.attempts] == ['small', 'medium', 'large']
+        assert result.attempts[1]['error'] == "RuntimeError: model not loaded"
+
+    def test_best_output_when_no_tier_passes(self):
+        outputs = {'small': "", 'medium': "ABCDEFGHIJKL", 'large': "[error]"}
+        result = router().route(outputs.get)
+
+        assert not result.passed
+        assert result.model == 'medium'
+
+    def test_hit_rates_and_blended_cost(self):
+        cascade = router()
+        cascade.route(lambda model: CLEAN_TEXT)
+        cascade.route(lambda model: CLEAN_TEXT)
+        cascade.route(lambda model: CLEAN_TEXT if model == 'medium' else "")
+        cascade.route(lambda model: CLEAN_TEXT if model == 'large' else "")
+
+        stats = cascade.get_stats()
+        tiers = {tier['model']: tier for tier in stats['tiers']}
+        assert stats['pages'] == 4
+        assert tiers['small']['hit_rate'] == 0.5
+        assert tiers['medium']['hit_rate'] == 0.5
+        assert tiers['large']['share_of_pages'] == 0.25
+        # 2 x small + (small + medium) + (small + medium + large)
+        assert stats['blended_cost_per_page'] == (2 * 1 + 5 + 21) / 4
+        assert stats['cost_saving'] == round(1 - 7 / 16, 3)
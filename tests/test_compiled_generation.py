@@ -0,0 +1,116 @@
+"""Tests for the compiled (static cache + torch.compile) execution mode."""
+
+import pytest
+import torch
+from torch._dynamo.exc import InternalTorchDynamoError
+
+from utils.compiled_generation import (
+    STATIC_CACHE_AVAILABLE,
+    CompiledGenerator,
+    bucket_length,
+    compile_settings,
+    execution_mode,
+    is_compile_error,
+)
+from utils.repetition_guard import RepetitionStop, RepetitionStoppingCriteria
+
+
+class FakeGenerationConfig:
+    max_new_tokens = 16
+    compile_config = None
+    disable_compile = False
+
+
+class BrokenStaticModel(torch.nn.Module):
+    """Model whose generate() fails with a static cache, as an uncompilable model would."""
+
+    def __init__(self, error=None):
+        from transformers import LlamaConfig
+
+        super().__init__()
+        self.linear = torch.nn.Linear(2, 2)
+        self.config = LlamaConfig(
+            vocab_size=16, hidden_size=8, num_hidden_layers=1, num_attention_heads=2, num_key_value_heads=2
+        )
+        self.generation_config = FakeGenerationConfig()
+        self.error = error or InternalTorchDynamoError("compilation failed")
+        self.calls = []
+
+    def generate(self, input_ids=None, past_key_values=None, **kwargs):
+        self.calls.append(past_key_values is not None)
+        if past_key_values is not None:
+            raise self.error
+        return torch.cat([input_ids, input_ids[:, -1:]], dim=1)
+
+
+class TestSettings:
+    """Tests for config parsing and bucketing."""
+
+    def test_bucket_length(self):
+        buckets = [512, 1024, 2048]
+        assert bucket_length(100, buckets) == 512
+        assert bucket_length(1024, buckets) == 1024
+        assert bucket_length(1025, buckets) == 2048
+        assert bucket_length(5000, buckets) == 6144
+
+    def test_execution_mode(self):
+        assert execution_mode({}) == 'default'
+        assert execution_mode({'execution_mode': 'compiled'}) == 'compiled'
+        assert execution_mode({'execution_mode': 'turbo'}) == 'default'
+
+    def test_settings_overrides(self):
+        settings = compile_settings({'compiled_generation': {'buckets': [256]}})
+        assert settings['buckets'] == [256]
+        assert settings['attn_implementation'] == 'sdpa'
+
+    def test_compile_error_classification(self):
+        assert is_compile_error(InternalTorchDynamoError("graph break"))
+        try:
+            try:
+                raise InternalTorchDynamoError("inductor failed")
+            except InternalTorchDynamoError as e:
+                raise RuntimeError("generate failed") from e
+        except RuntimeError as wrapped:
+            assert is_compile_error(wrapped)
+        assert not is_compile_error(ValueError("bad pixel_values"))
+        assert not is_compile_error(torch.cuda.OutOfMemoryError("CUDA out of memory"))
+
+
+@pytest.mark.skipif(not STATIC_CACHE_AVAILABLE, reason="transformers without StaticCache")
+class TestCompiledGenerator:
+    """Tests for the fallback path."""
+
+    def test_fallback_on_failure(self):
+        """A failing compiled call is retried on the dynamic path and disables compilation."""
+        model = BrokenStaticModel()
+        generator = CompiledGenerator(model, name="fake")
+        criteria = RepetitionStoppingCriteria(prompt_length=2, max_new_tokens=16)
+        criteria.stops[0] = RepetitionStop(0, "periodic", 1, 0, 8, 8)
+
+        output = generator.generate({'input_ids': torch.tensor([[1, 2]])}, stopping_criteria=[criteria])
+
+        assert output.tolist() == [[1, 2, 2]]
+        assert not generator.enabled
+        assert generator.failure
+        assert model.generation_config.disable_compile
+        assert criteria.stops == {}
+
+        generator.generate({'input_ids': torch.tensor([[3]])})
+        assert model.calls[-1] is False
+        assert generator.get_stats()['fallback_calls'] == 2
+
+    @pytest.mark.parametrize("error", [
+        torch.cuda.OutOfMemoryError("CUDA out of memory"),
+        ValueError("pixel_values do not match image_grid_thw"),
+    ])
+    def test_other_errors_keep_compiled_mode(self, error):
+        """Out-of-memory and input errors reach the caller; compilation stays on."""
+        model = BrokenStaticModel(error)
+        generator = CompiledGenerator(model, name="fake")
+
+        with pytest.raises(type(error)):
+            generator.generate({'input_ids': torch.tensor([[1, 2]])})
+
+        assert generator.enabled
+        assert generator.failure is None
+        assert model.calls == [True]
@@ -0,0 +1,133 @@
+"""Tests for the event-driven container state registry."""
+
+import threading
+import time
+
+import pytest
+
+from utils.container_registry import ContainerRegistry, FakeEventSource, model_argument
+
+
+@pytest.fixture
+def source():
+    return FakeEventSource()
+
+
+@pytest.fixture
+def registry(source):
+    registry = ContainerRegistry(source, reconnect_delay=0.01)
+    yield registry
+    registry.stop()
+
+
+def eventually(condition, timeout: float = 5.0) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def later(delay: float, fn, *args):
+    threading.Timer(delay, fn, args).start()
+
+
+class TestContainerRegistry:
+    """Tests for the state table and waits."""
+
+    def test_snapshot_then_events(self, source, registry):
+        existing = source.create("dots-ocr-fixed", ports={8000: 8000}, model="rednote-hilab/dots.ocr", emit=False)
+        source.containers[existing]["State"]["Status"] = "running"
+        registry.start()
+
+        state = registry.get("dots-ocr-fixed")
+        assert state.running and state.ports == {8000: 8000}
+        assert registry.find_model("rednote-hilab/dots.ocr").name == "dots-ocr-fixed"
+
+        qwen = source.create("qwen-vllm", ports={8000: 8004})
+        source.start(qwen)
+        assert eventually(lambda: registry.get("qwen-vllm") is not None and registry.get("qwen-vllm").running)
+        assert set(registry.containers(running_only=True)) == {"dots-ocr-fixed", "qwen-vllm"}
+
+        source.destroy(existing)
+        assert eventually(lambda: registry.get("dots-ocr-fixed") is None)
+        # One inspect per lifecycle event, none for reads
+        assert source.inspects == 2
+
+    def test_wait_until_ready_on_health_event(self, source, registry):
+        registry.start()
+        transitions = []
+        registry.subscribe(lambda old, new: transitions.append(new.health if new else None))
+
+        container = source.create("qwen-vllm")
+        later(0.05, source.start, container)
+        later(0.1, source.set_health, container, "healthy")
+        ready, state = registry.wait_until_ready("qwen-vllm", timeout=5)
+
+        assert ready and state.healthy
+        assert transitions == ["starting", "starting", "healthy"]
+
+    def test_wait_returns_early_when_container_dies(self, source, registry):
+        registry.start()
+        container = source.create("phi-vllm")
+        source.start(container)
+        later(0.05, source.die, container, 137)
+
+        started = time.monotonic()
+        ready, state = registry.wait_until_ready("phi-vllm", timeout=10)
+        assert not ready
+        assert state.stopped and state.exit_code == 137
+        assert time.monotonic() - started < 5
+
+    def test_previous_run_is_waited_out(self, source, registry):
+        old = source.create("qwen-vllm")
+        source.containers[old]["State"].update(Status="exited", ExitCode=0)
+        registry.start()
+
+        def restart():
+            source.destroy(old)
+            new = source.create("qwen-vllm")
+            source.start(new)
+            source.set_health(new, "healthy")
+
+        later(0.05, restart)
+        ready, state = registry.wait_until_ready("qwen-vllm", timeout=5)
+        assert ready and state.id != old
+
+    def test_probe_for_containers_without_healthcheck(self, source, registry):
+        registry.start()
+        container = source.create("plain-vllm", healthcheck=False)
+        source.start(container)
+        probes = []
+
+        def probe(state):
+            probes.append(state.name)
+            return len(probes) >= 3
+
+        ready, _ = registry.wait_until_ready("plain-vllm", timeout=5, probe=probe, probe_interval=0.01)
+        assert ready and len(probes) == 3
+
+    def test_timeout_and_gone(self, source, registry):
+        registry.start()
+        container = source.create("slow-vllm")
+        source.start(container)
+
+        ready, state = registry.wait_until_ready("slow-vllm", timeout=0.05)
+        assert not ready and state.health == "starting"
+        later(0.05, source.destroy, container)
+        assert registry.wait_until_gone("slow-vllm", timeout=5)
+
+    def test_resubscribes_after_stream_ends(self, source, registry):
+        registry.start()
+        source.close()  # daemon restart: stream ends
+        container = source.create("after-restart", emit=False)
+        source.containers[container]["State"]["Status"] = "running"
+
+        assert eventually(lambda: registry.get("after-restart") is not None)
+
+
+def test_model_argument():
+    assert model_argument(["--model", "Qwen/Qwen3-VL-2B-Instruct", "--port", "8000"]) == "Qwen/Qwen3-VL-2B-Instruct"
+    assert model_argument(["--model=rednote-hilab/dots.ocr"]) == "rednote-hilab/dots.ocr"
+    assert model_argument(["--port", "8000"]) is None
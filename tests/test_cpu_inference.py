@@ -0,0 +1,120 @@
+"""Tests for the CPU execution mode and replica pool."""
+
+import os
+import signal
+import time
+
+import pytest
+
+from utils.cpu_inference import (
+    ReplicaPool,
+    cpu_settings,
+    cpu_topology,
+    measure_scaling,
+    plan_replicas,
+    preferred_cpu_profile,
+)
+from utils.quantization import resolve_profile
+
+
+class EchoFactory:
+    """Replica handler that reports its process and thread setup."""
+
+    def __call__(self):
+        import torch
+
+        def handle(payload):
+            if payload == "fail":
+                raise ValueError("bad payload")
+            if payload == "hang":
+                time.sleep(60)
+            return payload * 2, os.getpid(), torch.get_num_threads()
+
+        return handle
+
+
+class TestCpuSettings:
+    """Tests for profile selection and core planning."""
+
+    def test_settings_defaults(self):
+        settings = cpu_settings({'cpu': {'threads_per_replica': 2}})
+        assert settings['threads_per_replica'] == 2
+        assert settings['profile'] == 'auto'
+
+    def test_cpu_profile(self):
+        assert preferred_cpu_profile('cpu_int8_dynamic') == 'cpu_int8_dynamic'
+        assert preferred_cpu_profile() in ('cpu_bf16', 'cpu_int8_dynamic')
+
+        config = {'precision': 'fp16', 'cpu': {'profile': 'cpu_bf16'}}
+        assert resolve_profile(config, 'cpu') == 'cpu_bf16'
+        assert resolve_profile(config, 'cuda') == 'fp16'
+        assert resolve_profile({'quantization_profile': 'fp32', 'cpu': {'profile': 'cpu_bf16'}}, 'cpu') == 'fp32'
+
+    def test_plan_replicas(self):
+        topology = {0: [0, 1, 2, 3], 1: [4, 5, 6]}
+        assert plan_replicas(1, 'auto', topology) == [[0], [1], [2], [3], [4], [5], [6]]
+        assert plan_replicas(2, 'auto', topology) == [[0, 1], [2, 3], [4, 5]]
+        assert plan_replicas(1, 1, topology) == [[0], [4]]
+
+    def test_topology_skips_smt_siblings(self, tmp_path, monkeypatch):
+        layout = {0: (0, 0), 1: (0, 1), 2: (0, 0), 3: (0, 1)}
+        for cpu, (socket, core) in layout.items():
+            topology = tmp_path / f"cpu{cpu}" / "topology"
+            topology.mkdir(parents=True)
+            (topology / "physical_package_id").write_text(f"{socket}\n")
+            (topology / "core_id").write_text(f"{core}\n")
+        monkeypatch.setattr("utils.cpu_inference.available_cpus", lambda: [0, 1, 2, 3])
+
+        assert cpu_topology(str(tmp_path)) == {0: [0, 1]}
+
+
+class TestReplicaPool:
+    """Replica processes behind the shared queue."""
+
+    def test_pool_runs_tasks_in_replicas(self):
+        cpu = min(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else 0
+        with ReplicaPool(EchoFactory(), topology={0: [cpu, cpu]}) as pool:
+            results = pool.map(range(6))
+
+            assert pool.size == 2
+            assert [value for value, _, _ in results] == [0, 2, 4, 6, 8, 10]
+            assert all(pid != os.getpid() for _, pid, _ in results)
+            assert {threads for _, _, threads in results} == {1}
+            assert sum(pool.processed) == 6
+
+            with pytest.raises(RuntimeError, match="bad payload"):
+                pool.submit("fail").result(timeout=30)
+        assert not pool.processes
+
+    def test_dead_replica_fails_its_task(self):
+        """A killed replica fails its running task; the others keep serving."""
+        cpu = min(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else 0
+        with ReplicaPool(EchoFactory(), topology={0: [cpu, cpu]}, health_interval=0.1) as pool:
+            future = pool.submit("hang")
+            deadline = time.monotonic() + 10
+            while not pool._running:
+                assert time.monotonic() < deadline, "task was not dispatched"
+                time.sleep(0.01)
+            (index, _), = pool._running.items()
+            os.kill(pool.processes[index].pid, signal.SIGKILL)
+
+            with pytest.raises(RuntimeError, match=f"Replica {index} died"):
+                future.result(timeout=10)
+            assert [value for value, _, _ in pool.map(range(3))] == [0, 2, 4]
+
+            # Without replicas, calls fail instead of waiting
+            os.kill(pool.processes[1 - index].pid, signal.SIGKILL)
+            deadline = time.monotonic() + 10
+            while len(pool._dead) < 2:
+                assert time.monotonic() < deadline, "dead replica not detected"
+                time.sleep(0.05)
+            with pytest.raises(RuntimeError, match="No replica left"):
+                pool.process_image(1)
+
+    def test_measure_scaling(self):
+        cpu = min(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else 0
+        rows = measure_scaling(EchoFactory(), list(range(4)), [1], topology={0: [cpu]})
+
+        assert rows[0]['replicas'] == 1
+        assert rows[0]['speedup'] == 1.0
+        assert rows[0]['efficiency'] == 1.0
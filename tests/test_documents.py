@@ -0,0 +1,80 @@
+"""Tests for lazy multi-page document iteration."""
+
+import io
+
+import pytest
+from PIL import Image
+
+from utils.documents import (
+    count_pages,
+    dpi_for_budget,
+    is_pdf,
+    iter_document_pages,
+    iter_page_batches,
+)
+from utils.ingest import ImageTooLargeError
+
+
+def _multipage(fmt, sizes, **kwargs):
+    pages = [Image.new('RGB', size, 'white') for size in sizes]
+    buffer = io.BytesIO()
+    pages[0].save(buffer, format=fmt, save_all=True, append_images=pages[1:], **kwargs)
+    return buffer.getvalue()
+
+
+class TestDocumentPages:
+    """Tests for TIFF/PDF page streaming."""
+    
+    def test_tiff_frames(self):
+        """Test TIFF frames are yielded one by one."""
+        content = _multipage('TIFF', [(200, 300), (300, 200), (100, 100)], compression='tiff_lzw')
+        assert count_pages(content) == 3
+        
+        pages = list(iter_document_pages(content, pixel_budget=1024 * 1024))
+        assert [page.index for page in pages] == [0, 1, 2]
+        assert pages[1].size == (300, 200)
+        assert pages[0].array.shape == (300, 200, 3)
+    
+    def test_tiff_frame_megapixel_limit(self):
+        """Test oversized frames are rejected before decoding."""
+        content = _multipage('TIFF', [(100, 100), (4000, 3000)], compression='tiff_lzw')
+        pages = iter_document_pages(content, pixel_budget=1024 * 1024, max_megapixels=5)
+        assert next(pages).index == 0
+        with pytest.raises(ImageTooLargeError):
+            next(pages)
+    
+    def test_pdf_pages_match_budget(self):
+        """Test PDF pages are rasterized at a budget-matched DPI."""
+        pytest.importorskip("pypdfium2")
+        content = _multipage('PDF', [(1240, 1754)] * 3, resolution=150)
+        assert is_pdf(content)
+        assert count_pages(content) == 3
+        
+        budget = 1000 * 1000
+        pages = list(iter_document_pages(content, pixel_budget=budget))
+        assert len(pages) == 3
+        for page in pages:
+            width, height = page.size
+            assert width * height <= budget * 1.05
+            assert page.dpi is not None
+    
+    def test_pdf_page_megapixel_limit(self):
+        """Test oversized PDF pages are rejected before rendering."""
+        pytest.importorskip("pypdfium2")
+        # 200 x 200 inch poster: 207 MP even at the minimum DPI
+        content = _multipage('PDF', [(10, 10), (200, 200)], resolution=1)
+        pages = iter_document_pages(content, pixel_budget=1000 * 1000, max_megapixels=50)
+        assert next(pages).index == 0
+        with pytest.raises(ImageTooLargeError):
+            next(pages)
+    
+    def test_dpi_for_budget(self):
+        """Test DPI selection and clamping for an A4 page."""
+        assert dpi_for_budget(595, 842, 1000 * 1000) == pytest.approx(101.9, abs=0.5)
+        assert dpi_for_budget(595, 842, 10) == 72
+        assert dpi_for_budget(595, 842, 10 ** 9) == 300
+    
+    def test_page_batches(self):
+        """Test batching keeps order and the remainder."""
+        batches = list(iter_page_batches(iter(range(7)), 3))
+        assert batches == [[0, 1, 2], [3, 4, 5], [6]]
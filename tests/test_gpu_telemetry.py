@@ -0,0 +1,85 @@
+"""Tests for the background GPU telemetry sampler."""
+
+import time
+
+import pytest
+
+from utils.gpu_telemetry import (
+    GpuProcess, GpuStats, GpuTelemetry, MockBackend, NoGpuBackend, get_telemetry, set_telemetry
+)
+from utils.metrics import registry
+
+
+@pytest.fixture
+def backend():
+    return MockBackend([
+        GpuStats(0, "Mock A", 12288.0, 2048.0, 10240.0, 40.0, 10.0, 55.0, 120.0,
+                 [GpuProcess(101, "vllm", 2048.0)]),
+        GpuStats(1, "Mock B", 24576.0, 0.0, 24576.0),
+    ])
+
+
+class TestGpuTelemetry:
+    """Tests for sampling, freshness and history."""
+
+    def test_latest_reuses_buffered_sample(self, backend):
+        telemetry = GpuTelemetry(backend, interval=60)
+        first = telemetry.sample()
+        backend.set(0, memory_used_mb=8192.0)
+
+        assert telemetry.latest(max_age=60) is first
+        assert backend.reads == 1
+        fresh = telemetry.latest(max_age=0)
+        assert backend.reads == 2
+        assert fresh.gpu(0).memory_free_mb == 4096.0
+        assert fresh.gpu(0).memory_percent == pytest.approx(200 / 3)
+        assert [process.pid for process in fresh.processes] == [101]
+        assert fresh.gpu(2) is None
+
+    def test_background_sampling_fills_ring_buffer(self, backend):
+        telemetry = GpuTelemetry(backend, interval=0.01, history_size=5).start()
+        try:
+            deadline = time.time() + 5
+            while backend.reads < 8 and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            telemetry.stop()
+
+        assert not telemetry.running
+        history = telemetry.history()
+        assert len(history) == 5
+        assert [sample.ts for sample in history] == sorted(sample.ts for sample in history)
+        reads = backend.reads
+        assert len(telemetry.series("utilization_percent", index=0)) == 5
+        assert telemetry.series("temperature_c", index=1)[0][1] is None
+        assert backend.reads == reads
+
+    def test_failed_read_keeps_last_sample(self, backend):
+        telemetry = GpuTelemetry(backend)
+        good = telemetry.sample()
+        backend.fail(RuntimeError("driver lost"))
+
+        assert telemetry.latest(max_age=0) is good
+        assert telemetry.errors == 1
+        backend.fail(None)
+        assert telemetry.latest(max_age=0) is not good
+
+    def test_no_gpu_backend(self):
+        telemetry = GpuTelemetry(NoGpuBackend()).start()
+
+        assert not telemetry.running
+        assert telemetry.latest().gpus == []
+        assert telemetry.latest().to_dict()["backend"] == "none"
+
+    def test_process_wide_service_feeds_metrics(self, backend):
+        telemetry = GpuTelemetry(backend, interval=60)
+        set_telemetry(telemetry)
+        try:
+            assert get_telemetry() is telemetry
+            body = registry.render()
+        finally:
+            set_telemetry(None)
+
+        assert 'chatvlm_gpu_utilization_percent{device="0"} 40' in body
+        assert 'chatvlm_gpu_temperature_celsius{device="1"}' not in body
+        assert 'chatvlm_gpu_device_memory_used_mb{device="1"} 0' in body
@@ -0,0 +1,209 @@
+"""Tests for the shared-memory inference process."""
+
+import multiprocessing
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.inference_worker import ALIGNMENT, InferenceClient, InferenceServer, ShmRing
+from utils.scheduler import ClientDisconnected, DeadlineExceeded, Ticket, scheduled
+
+
+class FakeModel:
+    """Records how inputs arrived; ``slow`` blocks until released."""
+
+    def __init__(self):
+        self.inputs = []
+        self.release = threading.Event()
+
+    def describe(self, image, prompt="Extract all text."):
+        array = np.asarray(image)
+        self.inputs.append(image)
+        return {"prompt": prompt, "shape": list(array.shape), "sum": int(array.sum()),
+                "shared": not array.flags.owndata}
+
+    def process_batch(self, images):
+        return [int(np.asarray(image).sum()) for image in images]
+
+    def slow(self):
+        self.release.wait(5)
+        return "done"
+
+
+FAKE_METHODS = ("describe", "process_batch", "slow")
+
+
+def fake_loader(name: str) -> FakeModel:
+    return FakeModel()
+
+
+def serve(address: str) -> None:
+    """Server in a separate process."""
+    server = InferenceServer(address, loader=fake_loader)
+    server.serve_forever()
+
+
+@pytest.fixture
+def address(tmp_path):
+    return str(tmp_path / "inference.sock")
+
+
+@pytest.fixture
+def server(address):
+    server = InferenceServer(address, loader=fake_loader).start()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def client(server, address):
+    client = InferenceClient(address, ring_size=1024 * 1024)
+    yield client
+    client.close()
+
+
+class TestShmRing:
+    """Tests for the ring buffer allocator."""
+
+    def test_wraps_and_reuses_space_in_order(self):
+        ring = ShmRing(8 * ALIGNMENT)
+        try:
+            first = ring.allocate(3 * ALIGNMENT)
+            second = ring.allocate(3 * ALIGNMENT)
+            assert (first, second) == (0, 3 * ALIGNMENT)
+
+            # Freed out of order: the tail only moves once the first region is free
+            ring.free(second)
+            assert ring.used == 6 * ALIGNMENT
+            ring.free(first)
+            assert ring.used == 0
+
+            a = ring.allocate(5 * ALIGNMENT)
+            ring.allocate(2 * ALIGNMENT)
+            ring.free(a)
+            # 1 slot left at the end, 5 free at the start: the next region wraps
+            assert ring.allocate(4 * ALIGNMENT) == 0
+            with pytest.raises(TimeoutError):
+                ring.allocate(2 * ALIGNMENT, timeout=0.05)
+            with pytest.raises(ValueError):
+                ring.allocate(9 * ALIGNMENT)
+        finally:
+            ring.close()
+
+    def test_write_and_view_share_memory(self):
+        ring = ShmRing(1024 * 1024)
+        reader = ShmRing(name=ring.name, create=False)
+        try:
+            array = np.arange(300, dtype=np.float32).reshape(10, 30)
+            ref = ring.write(array)
+            view = reader.view(ref)
+            np.testing.assert_array_equal(view, array)
+            assert not view.flags.owndata
+            del view
+        finally:
+            reader.close()
+            ring.close()
+
+
+class TestInferenceServer:
+    """Tests for remote model calls."""
+
+    def test_arrays_and_images_travel_through_shared_memory(self, server, client):
+        model = client.model("fake", FAKE_METHODS)
+        array = np.full((20, 30, 3), 2, dtype=np.uint8)
+
+        result = model.describe(array, prompt="Read")
+        assert result == {"prompt": "Read", "shape": [20, 30, 3], "sum": 3600, "shared": True}
+
+        image = Image.fromarray(array)
+        assert model.describe(image)["sum"] == 3600
+        assert isinstance(server.models["fake"].inputs[-1], Image.Image)
+
+        # Keyword arguments go through the ring as well (model.chat(image=...))
+        assert model.describe(image=image, prompt="Read")["sum"] == 3600
+        assert isinstance(server.models["fake"].inputs[-1], Image.Image)
+        assert model.describe(image=array)["shared"]
+
+        assert model.process_batch([array, array[:10]]) == [3600, 1800]
+        # Regions are freed once results arrive
+        assert client.ring.used == 0
+
+    def test_remote_model_forwards_only_model_methods(self, server, client):
+        model = client.model("fake")
+        assert callable(model.extract_text) and callable(model.chat)
+        # Probes for optional attributes must not turn into remote calls
+        assert getattr(model, "vision_cache", None) is None
+        with pytest.raises(AttributeError):
+            model.describe
+
+    def test_one_model_instance_for_all_clients(self, server, client, address):
+        other = InferenceClient(address, ring_size=1024 * 1024)
+        try:
+            client.model("fake", FAKE_METHODS).describe(np.zeros((2, 2), dtype=np.uint8))
+            other.model("fake", FAKE_METHODS).describe(np.zeros((2, 2), dtype=np.uint8))
+            stats = client.stats()
+            assert stats["models"] == ["fake"] and stats["workers"] == 2
+            assert len(server.models["fake"].inputs) == 2
+        finally:
+            other.close()
+
+    def test_ticket_is_forwarded_to_server_scheduler(self, server, client):
+        with scheduled(Ticket("interactive", "alice")):
+            client.model("fake", FAKE_METHODS).describe(np.zeros((2, 2), dtype=np.uint8))
+        assert server.scheduler.get_stats()["classes"]["interactive"]["granted"] == 1
+
+        with pytest.raises(DeadlineExceeded):
+            client.call("fake", "describe", (np.zeros((2, 2), dtype=np.uint8),), ticket=Ticket("api", timeout=0))
+        assert client.ring.used == 0
+
+    def test_cancelled_ticket_drops_queued_call(self, server, client):
+        model = client.model("fake", FAKE_METHODS)
+        running = threading.Thread(target=model.slow)
+        running.start()
+        while not server.scheduler.get_stats()["models"].get("fake", {}).get("busy"):
+            time.sleep(0.01)
+
+        ticket = Ticket("batch", "bob")
+        errors = []
+
+        def queued():
+            try:
+                client.call("fake", "describe", (np.zeros((2, 2), dtype=np.uint8),), ticket=ticket)
+            except ClientDisconnected as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=queued)
+        thread.start()
+        time.sleep(0.2)
+        ticket.cancel()
+        thread.join(2)
+        server.models["fake"].release.set()
+        running.join(2)
+
+        assert len(errors) == 1 and errors[0].priority == "batch"
+        assert server.models["fake"].inputs == []
+
+    def test_server_in_separate_process(self, address):
+        process = multiprocessing.get_context("spawn").Process(target=serve, args=(address,), daemon=True)
+        process.start()
+        try:
+            deadline = time.monotonic() + 20
+            while True:
+                try:
+                    client = InferenceClient(address, ring_size=1024 * 1024)
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    assert time.monotonic() < deadline, "server did not start"
+                    time.sleep(0.1)
+            try:
+                assert client.server_pid == process.pid
+                result = client.model("fake", FAKE_METHODS).describe(np.ones((64, 64, 3), dtype=np.uint8))
+                assert result["sum"] == 64 * 64 * 3 and result["shared"]
+            finally:
+                client.close()
+        finally:
+            process.terminate()
+            process.join(5)
@@ -0,0 +1,83 @@
+"""Tests for decode-once image ingest."""
+
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.ingest import ImageTooLargeError, decode_image_once, sniff_image_header
+from utils.validators import ValidationError, validate_image
+
+
+def _encode(image, fmt, **kwargs):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **kwargs)
+    return buffer.getvalue()
+
+
+class TestSniffImageHeader:
+    """Tests for header-only inspection."""
+    
+    def test_reads_format_and_size(self):
+        """Test format and dimensions come from the header."""
+        content = _encode(Image.new('RGB', (640, 480), 'white'), 'PNG')
+        header = sniff_image_header(content)
+        assert header.format == 'PNG'
+        assert header.size == (640, 480)
+    
+    def test_rejects_megapixel_bomb(self):
+        """Test that a small file with huge dimensions is rejected."""
+        content = _encode(Image.new('1', (10000, 10000)), 'PNG', optimize=True)
+        assert len(content) < 1024 * 1024
+        with pytest.raises(ImageTooLargeError):
+            sniff_image_header(content, max_megapixels=50)
+    
+    def test_rejects_non_image(self):
+        """Test that arbitrary bytes are rejected."""
+        with pytest.raises(ValidationError):
+            sniff_image_header(b"not an image at all")
+    
+    def test_rejects_disallowed_format(self):
+        """Test format allow-list."""
+        content = _encode(Image.new('RGB', (64, 64)), 'GIF')
+        with pytest.raises(ValidationError):
+            sniff_image_header(content)
+
+
+class TestDecodeImageOnce:
+    """Tests for single decode with JPEG draft mode."""
+    
+    def test_decodes_to_rgb_array(self):
+        """Test non-RGB input is decoded to an RGB array."""
+        content = _encode(Image.new('L', (100, 50), 128), 'PNG')
+        ingested = decode_image_once(content)
+        assert isinstance(ingested.array, np.ndarray)
+        assert ingested.array.shape == (50, 100, 3)
+        assert ingested.draft_scale == 1.0
+    
+    def test_jpeg_draft_downscale(self):
+        """Test large JPEGs decode at reduced scale but above the target."""
+        content = _encode(Image.new('RGB', (4000, 3000), 'white'), 'JPEG')
+        target = 1000 * 1000
+        ingested = decode_image_once(content, target_pixels=target)
+        width, height = ingested.size
+        assert width * height >= target
+        assert width < 4000
+        assert ingested.header.size == (4000, 3000)
+    
+    def test_png_not_drafted(self):
+        """Test draft mode only applies to JPEG."""
+        content = _encode(Image.new('RGB', (3000, 3000), 'white'), 'PNG')
+        ingested = decode_image_once(content, target_pixels=500 * 500)
+        assert ingested.size == (3000, 3000)
+
+
+def test_validate_image_uses_header():
+    """Test validate_image keeps its contract."""
+    valid, error = validate_image(_encode(Image.new('RGB', (100, 100)), 'PNG'))
+    assert valid and error is None
+    
+    valid, error = validate_image(_encode(Image.new('RGB', (5, 5)), 'PNG'))
+    assert not valid
+    assert "too small" in error
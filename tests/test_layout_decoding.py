@@ -0,0 +1,121 @@
+"""Tests for grammar-constrained layout JSON decoding."""
+
+import json
+
+import pytest
+import torch
+
+from utils.dots_prompts import dict_promptmode_to_prompt
+from utils.layout_decoding import (
+    LayoutGrammar,
+    LayoutJSONLogitsProcessor,
+    finalize_layout_json,
+    is_layout_prompt,
+    parse_layout,
+)
+
+SAMPLE = (
+    '[{"bbox": [12, 30, 400, 58], "category": "Title", "text": "Счёт-фактура \\"№ 42\\""},\n'
+    ' {"bbox": [1, 2, 3, 4], "category": "Picture"}]'
+)
+
+
+class TestLayoutGrammar:
+    """Tests for the character automaton."""
+
+    def setup_method(self):
+        self.grammar = LayoutGrammar()
+
+    def test_accepts_layout_output(self):
+        """Typical dots.ocr output is a complete document."""
+        state = self.grammar.feed(self.grammar.initial, SAMPLE)
+        assert self.grammar.is_complete(state)
+        assert self.grammar.is_complete(self.grammar.feed(self.grammar.initial, '[]'))
+
+    @pytest.mark.parametrize("text", [
+        '[{"bbox": [1, 2, 3], "category": "Text"}]',
+        '[{"bbox": [1, 2, 3, 4], "category": "Paragraph"}]',
+        '[{"bbox": [1.5, 2, 3, 4], "category": "Text"}]',
+        '[{"bbox": [01, 2, 3, 4], "category": "Text"}]',
+        '[{"category": "Text", "bbox": [1, 2, 3, 4]}]',
+        '[{"bbox": [1, 2, 3, 4], "category": "Text", "score": 1}]',
+        '[{"bbox": [1, 2, 3, 4], "category": "Text"},]',
+    ])
+    def test_rejects_invalid(self, text):
+        """Schema violations make the state invalid."""
+        assert self.grammar.feed(self.grammar.initial, text) is None
+
+
+class TestFinalizeLayoutJson:
+    """Tests for closing truncated output."""
+
+    def test_complete_unchanged(self):
+        assert finalize_layout_json(SAMPLE) == SAMPLE
+
+    def test_truncated_mid_element(self):
+        """Output cut by max_new_tokens keeps the complete elements."""
+        truncated = SAMPLE[:-1] + ', ' + SAMPLE[1:40]
+        data = parse_layout(truncated)
+
+        assert [item["category"] for item in data] == ["Title", "Picture"]
+
+    def test_code_fence_and_garbage(self):
+        assert parse_layout('```json\n' + SAMPLE + '\n```')[1]["bbox"] == [1, 2, 3, 4]
+        assert parse_layout('[{"bbox": [1') == []
+
+
+class TestIsLayoutPrompt:
+    """Tests for layout prompt detection."""
+
+    def test_modes_and_reindented_text(self):
+        prompt = dict_promptmode_to_prompt["prompt_layout_all_en"]
+        reindented = "\n".join("    " + line for line in prompt.splitlines())
+
+        assert is_layout_prompt("layout_all")
+        assert is_layout_prompt(reindented)
+        assert not is_layout_prompt(dict_promptmode_to_prompt["ocr"])
+        assert not is_layout_prompt(None)
+
+
+class TestLayoutJSONLogitsProcessor:
+    """Random scores under the grammar mask always decode to valid JSON."""
+
+    @pytest.fixture(scope="class")
+    def tokenizer(self):
+        tokenizers = pytest.importorskip("tokenizers")
+        from transformers import PreTrainedTokenizerFast
+
+        corpus = [SAMPLE, 'Extract all text. "quoted" \\n back\\slash {"a": 1}\n\t']
+        backend = tokenizers.Tokenizer(tokenizers.models.BPE())
+        backend.pre_tokenizer = tokenizers.pre_tokenizers.ByteLevel(add_prefix_space=False)
+        backend.decoder = tokenizers.decoders.ByteLevel()
+        backend.train_from_iterator(corpus * 50, tokenizers.trainers.BpeTrainer(
+            vocab_size=400,
+            special_tokens=["<eos>"],
+            initial_alphabet=tokenizers.pre_tokenizers.ByteLevel.alphabet()
+        ))
+        return PreTrainedTokenizerFast(tokenizer_object=backend, eos_token="<eos>")
+
+    def test_random_generation_is_valid(self, tokenizer):
+        eos = tokenizer.eos_token_id
+        prompt_token = 5
+
+        for seed in range(5):
+            torch.manual_seed(seed)
+            processor = LayoutJSONLogitsProcessor(tokenizer, prompt_length=1)
+            ids = torch.tensor([[prompt_token], [prompt_token]])
+
+            for _ in range(300):
+                scores = processor(ids, torch.randn(2, len(tokenizer)))
+                ids = torch.cat([ids, scores.argmax(-1, keepdim=True)], dim=1)
+                if all(eos in row for row in ids.tolist()):
+                    break
+
+            for row in ids.tolist():
+                generated = row[1:]
+                if eos in generated:
+                    generated = generated[:generated.index(eos)]
+                data = json.loads(finalize_layout_json(tokenizer.decode(generated)))
+                assert isinstance(data, list)
+                for item in data:
+                    assert all(isinstance(value, int) for value in item["bbox"])
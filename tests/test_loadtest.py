@@ -0,0 +1,115 @@
+"""Tests for the load-testing harness and the fake VLM backend."""
+
+import os
+
+import numpy as np
+import pytest
+
+from models.fake_vlm import FakeVLMModel
+from utils.fake_backend import FASTAPI_AVAILABLE, FakeOpenAIServer, fake_settings, fake_tokens
+from utils.loadtest import (
+    HTTPX_AVAILABLE, LevelResult, OpenAIChatTarget, RequestResult, arrival_times, metric_value, percentile,
+    run_sweep, summarize
+)
+
+FAST = {"prefill_ms": 1.0, "per_token_ms": 0.5, "output_tokens": 8}
+
+
+def in_process(server: FakeOpenAIServer) -> "httpx.ASGITransport":
+    import httpx
+    return httpx.ASGITransport(app=server.app())
+
+
+class TestStatistics:
+    """Tests for percentiles, arrivals and level summaries."""
+
+    def test_percentile_interpolates(self):
+        values = [float(v) for v in range(1, 101)]
+        assert percentile(values, 50) == pytest.approx(50.5)
+        assert percentile(values, 99) == pytest.approx(99.01)
+        assert percentile([3.0], 95) == 3.0
+        assert percentile([], 50) is None
+
+    def test_arrivals(self):
+        assert arrival_times(4, 1.0, "constant") == [0.0, 0.25, 0.5, 0.75]
+        poisson = arrival_times(50, 10.0, seed=1)
+        assert poisson == arrival_times(50, 10.0, seed=1)
+        assert 400 < len(poisson) < 600
+        assert poisson == sorted(poisson)
+
+    def test_summary_counts_errors_and_tokens(self):
+        level = LevelResult("closed", 2, 2.0, [
+            RequestResult(True, 0.1, 0.05, 10, 200),
+            RequestResult(True, 0.3, 0.07, 30, 200),
+            RequestResult(False, 0.2, status=503, error="busy"),
+        ])
+        summary = summarize(level)
+
+        assert summary["ok"] == 2 and summary["errors"] == 1
+        assert summary["statuses"] == {"200": 2, "503": 1}
+        assert summary["throughput_rps"] == 1.0
+        assert summary["latency"]["p50"] == pytest.approx(0.2)
+        assert summary["tokens_per_second"] == 20.0
+        assert summary["sample_errors"] == ["busy"]
+
+    def test_metric_value_matches_labels(self):
+        text = ('chatvlm_tokens_total{model="fake_vlm",direction="out"} 42\n'
+                'chatvlm_tokens_total{model="fake_vlm",direction="in"} 7\n')
+        assert metric_value(text, "chatvlm_tokens_total", model="fake_vlm", direction="out") == 42
+
+
+class TestFakeBackend:
+    """Tests for determinism of the fake model."""
+
+    def test_outputs_are_deterministic(self):
+        settings = fake_settings(FAST)
+        image = np.zeros((8, 8, 3), dtype=np.uint8)
+        first = fake_tokens(image, "ocr", 256, settings)
+
+        assert first == fake_tokens(image.copy(), "ocr", 256, settings)
+        assert first != fake_tokens(image, "other prompt", 256, settings)
+        assert 4 <= len(first) <= 12
+        assert len(fake_tokens(image, "ocr", 2, settings)) <= 2
+
+    def test_fake_model_batches(self):
+        model = FakeVLMModel({**FakeVLMModel.DEFAULT_CONFIG, **FAST})
+        model.load_model()
+        images = [np.full((4, 4, 3), value, dtype=np.uint8) for value in range(3)]
+
+        assert model.process_batch(images) == [model.process_image(image) for image in images]
+
+    def test_fake_model_registered_only_on_request(self, monkeypatch):
+        from models import ModelLoader
+        if os.getenv("ENABLE_FAKE_MODELS") != "1":
+            assert "fake_vlm" not in ModelLoader.MODEL_REGISTRY
+        monkeypatch.setattr(ModelLoader, "MODEL_REGISTRY", dict(ModelLoader.MODEL_REGISTRY))
+
+        ModelLoader.register_fake_models()
+        assert ModelLoader.MODEL_REGISTRY["fake_vlm"] is FakeVLMModel
+
+
+@pytest.mark.skipif(not (HTTPX_AVAILABLE and FASTAPI_AVAILABLE), reason="httpx and fastapi are required")
+class TestHarness:
+    """Tests for closed and open loop runs against the in-process fake server."""
+
+    def test_closed_loop_sweep(self):
+        server = FakeOpenAIServer(FAST)
+        report = run_sweep(OpenAIChatTarget([b"page-1", b"page-2"]), "http://fake", mode="closed",
+                           levels=[1, 3], requests=6, warmup=1, transport=in_process(server))
+
+        assert report["metadata"]["payload"]["model"] == "fake/vlm"
+        assert [level["level"] for level in report["levels"]] == [1, 3]
+        for level in report["levels"]:
+            assert level["ok"] == 6 and level["errors"] == 0
+            assert level["ttft"]["p50"] <= level["latency"]["p50"]
+            assert level["output_tokens"] > 0
+        assert server.requests == 13
+
+    def test_open_loop_and_stream_usage(self):
+        server = FakeOpenAIServer(FAST)
+        report = run_sweep(OpenAIChatTarget(b"page"), "http://fake", mode="open", levels=[40],
+                           duration=0.25, arrival="constant", warmup=0, transport=in_process(server))
+        level = report["levels"][0]
+
+        assert level["requests"] == 10 and level["ok"] == 10
+        assert level["output_tokens"] == server.completion_tokens
@@ -0,0 +1,107 @@
+"""Tests for the Prometheus-style metrics registry and instrumentation."""
+
+import asyncio
+import threading
+import time
+
+import torch
+
+from utils.metrics import (
+    OTHER_MODEL, REQUESTS, STAGE_SECONDS, TOKENS, GenerationTimer, MetricsMiddleware, MetricsRegistry,
+    TimedLock, model_call
+)
+
+
+def sample(text: str, line_prefix: str) -> float:
+    """Value of the first exposition line starting with a prefix."""
+    for line in text.splitlines():
+        if line.startswith(line_prefix):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"{line_prefix} not rendered")
+
+
+class TestRegistry:
+    """Tests for metric types and the exposition format."""
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram("latency_seconds", "Latency", ("stage",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 3.0):
+            histogram.labels("decode").observe(value)
+
+        text = registry.render()
+        assert "# TYPE latency_seconds histogram" in text
+        assert sample(text, 'latency_seconds_bucket{stage="decode",le="0.1"}') == 1
+        assert sample(text, 'latency_seconds_bucket{stage="decode",le="1"}') == 3
+        assert sample(text, 'latency_seconds_bucket{stage="decode",le="+Inf"}') == 4
+        assert sample(text, 'latency_seconds_sum{stage="decode"}') == 4.25
+        assert sample(text, 'latency_seconds_count{stage="decode"}') == 4
+
+    def test_counters_gauges_and_escaping(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("requests_total", "Requests", ("endpoint",))
+        counter.labels('/ocr "x"').inc()
+        counter.labels('/ocr "x"').inc(2)
+        registry.gauge("ratio", "Ratio", ("cache",)).set_function(lambda: [(("model",), 0.5)])
+
+        text = registry.render()
+        assert sample(text, 'requests_total{endpoint="/ocr \\"x\\""}') == 3
+        assert sample(text, 'ratio{cache="model"}') == 0.5
+        assert registry.counter("requests_total", "Requests", ("endpoint",)) is counter
+
+
+class TestInstrumentation:
+    """Tests for generation timing and model queue metrics."""
+
+    def test_generation_timer_splits_model_call(self):
+        prefill = STAGE_SECONDS.labels("prefill", "timer-test")
+        before = prefill.count
+
+        with model_call("timer-test"):
+            timer = GenerationTimer()
+            timer.put(torch.zeros(2, 30))  # prompt ids
+            time.sleep(0.02)
+            for _ in range(4):
+                timer.put(torch.zeros(2))  # one new token per row
+            timer.end()
+
+        assert prefill.count == before + 1
+        assert prefill.sum >= 0.02
+        assert STAGE_SECONDS.labels("preprocessing", "timer-test").count == 1
+        assert STAGE_SECONDS.labels("postprocessing", "timer-test").count == 1
+        assert TOKENS.labels("timer-test", "in").value == 60
+        assert TOKENS.labels("timer-test", "out").value == 8
+
+    def test_timed_lock_records_queue_wait(self):
+        lock = TimedLock("lock-test")
+        waited = threading.Event()
+
+        with lock:
+            waiter = threading.Thread(target=lambda: (lock.acquire(), lock.release(), waited.set()))
+            waiter.start()
+            time.sleep(0.05)
+            assert lock._depth.value == 1
+        waiter.join()
+
+        wait = STAGE_SECONDS.labels("queue_wait", "lock-test")
+        assert waited.is_set()
+        assert wait.count == 2
+        assert wait.sum >= 0.05
+        assert lock._depth.value == 0
+
+    def test_middleware_bounds_model_label(self):
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200})
+
+        async def send(message):
+            pass
+
+        known = {"label-known"}
+        middleware = MetricsMiddleware(app, model_label=lambda m: m if m in known else OTHER_MODEL)
+        for model in ("label-known", "bogus-1", "bogus-2"):
+            scope = {"type": "http", "query_string": f"model={model}".encode()}
+            asyncio.run(middleware(scope, None, send))
+
+        assert REQUESTS.labels("unmatched", "label-known", "200").value == 1
+        assert REQUESTS.labels("unmatched", OTHER_MODEL, "200").value == 2
+        assert not any("bogus" in line for line in REQUESTS.render())
@@ -0,0 +1,54 @@
+"""Tests for the micro-benchmark runner and regression gate."""
+
+import time
+
+from utils.microbench import Benchmark, compare, measure, merge_best, run_benchmarks, strip_samples
+
+
+def report_with(scores):
+    return {"results": {name: {"score": score, "min": score} for name, score in scores.items()}}
+
+
+class TestMeasure:
+    """Tests for timing and normalization."""
+
+    def test_measure_calibrates_loops(self):
+        result = measure(lambda: sum(range(100)), repeat=3, min_time=0.005, reference=lambda: None)
+
+        assert result["loops"] > 1
+        assert len(result["samples"]) == 3
+        assert result["min"] <= result["median"]
+        assert result["reference_min"] > 0
+
+    def test_run_skips_missing_dependencies(self):
+        def missing():
+            raise ImportError("No module named 'pandas'")
+
+        report = run_benchmarks(
+            [Benchmark("sleep", lambda: lambda: time.sleep(0.001)), Benchmark("tables", missing)],
+            repeat=2, min_time=0.002
+        )
+
+        assert list(report["results"]) == ["sleep"]
+        assert report["results"]["sleep"]["score"] > 0
+        assert "pandas" in report["skipped"]["tables"]
+        assert "samples" not in strip_samples(report)["results"]["sleep"]
+
+
+class TestGate:
+    """Tests for baseline comparison."""
+
+    def test_compare_flags_regressions_over_tolerance(self):
+        baseline = report_with({"parse": 1.0, "clean": 2.0, "removed": 1.0})
+        comparisons = {c.name: c for c in compare(report_with({"parse": 1.3, "clean": 2.2, "new": 5.0}), baseline)}
+
+        assert set(comparisons) == {"parse", "clean"}
+        assert comparisons["parse"].regressed
+        assert not comparisons["clean"].regressed
+        assert not compare(report_with({"parse": 1.3}), baseline, tolerance=0.5)[0].regressed
+
+    def test_merge_best_keeps_lower_score(self):
+        merged = merge_best(report_with({"parse": 1.4, "clean": 2.0}), report_with({"parse": 1.1, "clean": 2.5}))
+
+        assert merged["results"]["parse"]["score"] == 1.1
+        assert merged["results"]["clean"]["score"] == 2.0
@@ -0,0 +1,161 @@
+"""Tests for the performance history store and the analyzer built on it."""
+
+import json
+import os
+import random
+from datetime import datetime
+
+import pytest
+
+from utils.perf_store import PerfRecorder, PerformanceStore, Sample
+from utils.performance_analyzer import PerformanceAnalyzer
+
+
+def ts(day: str, hour: int = 12) -> float:
+    return datetime.fromisoformat(f"{day}T{hour:02d}:00:00").timestamp()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = PerformanceStore(str(tmp_path / "history.sqlite3"))
+    yield store
+    store.close()
+
+
+def write_benchmark(directory, name: str, times, model: str = "qwen3_vl_2b", timestamp: str = "2026-01-20T10:00:00"):
+    path = directory / name
+    path.write_text(json.dumps({
+        "model": model,
+        "timestamp": timestamp,
+        "results": [{"file": "page.png", "tests": [
+            {"success": t is not None, "processing_time": t} for t in times
+        ]}],
+    }), encoding="utf-8")
+    return path
+
+
+class TestPerformanceStore:
+    """Tests for recording and querying samples."""
+
+    def test_summary_by_model_and_document_type(self, store):
+        store.record_many([
+            Sample("qwen3_vl_2b", 1.0, document_type="invoice", ts=ts("2026-01-20")),
+            Sample("qwen3_vl_2b", 3.0, document_type="passport", ts=ts("2026-01-21")),
+            Sample("qwen3_vl_2b", None, success=False, document_type="invoice", ts=ts("2026-01-21")),
+            Sample("got_ocr_hf", 2.0, ts=ts("2026-01-21")),
+        ])
+
+        summary = store.summary()
+        assert set(summary) == {"qwen3_vl_2b", "got_ocr_hf"}
+        qwen = summary["qwen3_vl_2b"]
+        assert qwen["count"] == 3
+        assert qwen["successes"] == 2
+        assert qwen["success_rate"] == pytest.approx(200 / 3)
+        assert qwen["mean_latency"] == pytest.approx(2.0)
+        assert (qwen["first_day"], qwen["last_day"]) == ("2026-01-20", "2026-01-21")
+
+        invoices = store.summary("qwen3_vl_2b", document_type="invoice")["qwen3_vl_2b"]
+        assert invoices["count"] == 2
+        assert invoices["mean_latency"] == pytest.approx(1.0)
+        assert store.summary("qwen3_vl_2b", since="2026-01-21")["qwen3_vl_2b"]["count"] == 2
+        assert store.document_types("qwen3_vl_2b") == ["invoice", "passport"]
+
+    def test_percentiles_within_bucket_resolution(self, store):
+        rng = random.Random(0)
+        latencies = [rng.lognormvariate(0, 0.6) for _ in range(2000)]
+        store.record_many(Sample("qwen3_vl_2b", latency) for latency in latencies)
+
+        ordered = sorted(latencies)
+        result = store.percentiles("qwen3_vl_2b", (50, 95, 99))
+        for quantile in (50, 95, 99):
+            exact = ordered[int(len(ordered) * quantile / 100) - 1]
+            assert result[quantile] == pytest.approx(exact, rel=0.05)
+        assert store.percentiles("unknown_model", (50,)) == {50: None}
+
+    def test_trend_per_day(self, store):
+        store.record_many([
+            Sample("qwen3_vl_2b", 1.0, ts=ts("2026-01-20")),
+            Sample("qwen3_vl_2b", 2.0, ts=ts("2026-01-20")),
+            Sample("qwen3_vl_2b", 4.0, success=False, ts=ts("2026-01-22")),
+            Sample("qwen3_vl_2b", 4.0, ts=ts("2026-01-22")),
+        ])
+
+        trend = store.trend("qwen3_vl_2b")
+        assert [day["day"] for day in trend] == ["2026-01-20", "2026-01-22"]
+        assert [day["count"] for day in trend] == [2, 2]
+        assert [day["success_rate"] for day in trend] == [100.0, 50.0]
+        assert trend[0]["mean_latency"] == pytest.approx(1.5)
+        assert trend[1]["p95"] == pytest.approx(4.0, rel=0.05)
+
+    def test_legacy_reports_imported_once(self, store, tmp_path):
+        reports = tmp_path / "reports"
+        reports.mkdir()
+        path = write_benchmark(reports, "benchmark_results_1.json", [1.0, 2.0, None])
+        (reports / "final_working_models.json").write_text(json.dumps(
+            {"qwen3_vl_2b": {"status": "tested_working", "last_tested": "2026-01-20 10:00:00"}}
+        ), encoding="utf-8")
+
+        assert store.import_legacy_reports(str(reports)) == 3
+        assert store.import_legacy_reports(str(reports)) == 0
+        assert store.summary()["qwen3_vl_2b"]["count"] == 3
+        assert store.model_status()["qwen3_vl_2b"]["status"] == "tested_working"
+
+        # A rewritten report replaces its samples instead of adding to them
+        write_benchmark(reports, "benchmark_results_1.json", [1.0, 2.0, 3.0, 4.0])
+        os.utime(path, (path.stat().st_atime, path.stat().st_mtime + 10))
+        assert store.import_legacy_reports(str(reports)) == 4
+        summary = store.summary()["qwen3_vl_2b"]
+        assert summary["count"] == 4
+        assert summary["success_rate"] == 100.0
+
+    def test_recorder_writes_in_background(self, store):
+        recorder = PerfRecorder(store, flush_interval=0.05)
+        for i in range(10):
+            recorder.record("qwen3_vl_2b", 0.1 * (i + 1), source="api", endpoint="/ocr")
+        recorder.flush()
+
+        assert store.summary()["qwen3_vl_2b"]["count"] == 10
+        recorder.record("qwen3_vl_2b", 1.0)
+        recorder.close()
+        assert store.summary()["qwen3_vl_2b"]["count"] == 11
+        assert recorder.dropped == 0
+
+
+class TestPerformanceAnalyzer:
+    """Tests for the analyzer queries."""
+
+    def test_comparison_and_trends(self, store, tmp_path):
+        write_benchmark(tmp_path, "benchmark_results_1.json", [1.0, 2.0, 2.0, 1.0])
+        store.record_many(Sample("got_ocr_hf", 5.0, success=i < 3, ts=ts("2026-01-21")) for i in range(4))
+
+        analyzer = PerformanceAnalyzer(str(tmp_path), store=store)
+        rows = analyzer.get_model_comparison_rows()
+        assert [row["Модель"] for row in rows] == ["qwen3_vl_2b", "got_ocr_hf"]
+        assert rows[0]["Статус"] == "✅ Отлично"
+        assert rows[0]["Всего тестов"] == 4
+        assert rows[1]["Успешность (%)"] == 75.0
+        assert rows[1]["Статус"] == "⚠️ Хорошо"
+
+        trends = analyzer.get_performance_trends("qwen3_vl_2b")
+        assert trends["timestamps"] == ["2026-01-20"]
+        assert trends["processing_times"] == [pytest.approx(1.5)]
+        assert "error" in analyzer.get_performance_trends("missing")
+
+        stats = analyzer.get_summary_statistics()
+        assert stats["total_models"] == 2
+        assert stats["total_tests_run"] == 8
+        assert analyzer.get_latency_percentiles("got_ocr_hf", (50,))["p50"] == pytest.approx(5.0, rel=0.05)
+
+    def test_model_details(self, store, tmp_path):
+        store.record_many([
+            Sample("qwen3_vl_2b", 1.0, document_type="invoice", ts=ts("2026-01-20")),
+            Sample("qwen3_vl_2b", 2.0, ts=ts("2026-01-21")),
+        ])
+        analyzer = PerformanceAnalyzer(str(tmp_path), store=store)
+
+        details = analyzer.get_model_details("qwen3_vl_2b")
+        assert details["test_history_count"] == 2
+        assert details["document_types"] == ["invoice", "unknown"]
+        assert details["performance_metrics"]["latest_avg_time"] == pytest.approx(2.0)
+        assert details["recent_tests"][0]["latency"] == pytest.approx(2.0)
+        assert "error" in analyzer.get_model_details("missing")
@@ -0,0 +1,152 @@
+"""Tests for the blank-page and near-duplicate prefilter."""
+
+import cv2
+import numpy as np
+
+from utils.image_processor import ImageProcessor
+from utils.prefilter import HashIndex, PageFilter, hamming, page_signature
+
+
+def text_page(seed: int, height: int = 800, width: int = 600) -> np.ndarray:
+    """White page with random text lines."""
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width, 3), 250, dtype=np.uint8)
+    for y in range(60, height - 60, 40):
+        x = 50
+        while x < width - 120:
+            word = "".join(rng.choice(list("ABCDEFGHKLMNOPRSTUVXYZ0123456789"), rng.integers(2, 8)))
+            cv2.putText(page, word, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (20, 20, 20), 1)
+            x += 20 + 14 * len(word)
+    return page
+
+
+def rescan(page: np.ndarray, seed: int = 0) -> np.ndarray:
+    """Same page with sensor noise and a small shift."""
+    rng = np.random.default_rng(seed)
+    shifted = np.roll(page, (3, 2), axis=(0, 1))
+    noise = rng.normal(0, 6, page.shape)
+    return np.clip(shifted.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+
+
+def reencode(page: np.ndarray) -> bytes:
+    """Same page uploaded again as PNG."""
+    return cv2.imencode(".png", page)[1].tobytes()
+
+
+def invoice(number: str, name: str, amount: str) -> np.ndarray:
+    """Invoice filled in from one template."""
+    page = np.full((1100, 850, 3), 250, dtype=np.uint8)
+    cv2.rectangle(page, (40, 40), (810, 160), (30, 30, 30), 3)
+    cv2.putText(page, "ACME SUPPLY CO. - INVOICE", (70, 110), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (20, 20, 20), 3)
+    cv2.putText(page, f"Invoice No: {number}", (60, 230), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (20, 20, 20), 2)
+    cv2.putText(page, f"Bill to: {name}", (60, 280), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (20, 20, 20), 2)
+    for row, y in enumerate(range(360, 760, 50)):
+        cv2.line(page, (40, y), (810, y), (60, 60, 60), 2)
+        cv2.putText(page, f"Item {row + 1}", (60, y + 35), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (20, 20, 20), 1)
+    cv2.putText(page, f"Total: {amount}", (560, 820), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (20, 20, 20), 2)
+    return page
+
+
+def blank_page(seed: int = 0) -> np.ndarray:
+    """Slightly noisy sheet with a dark scanner edge."""
+    rng = np.random.default_rng(seed)
+    page = np.clip(rng.normal(235, 4, (800, 600, 3)), 0, 255).astype(np.uint8)
+    page[:, :8] = 30
+    return page
+
+
+class TestSignatures:
+    """Tests for ink density and perceptual hashes."""
+
+    def test_blank_detection(self):
+        assert ImageProcessor.is_blank_page(blank_page())
+        assert not ImageProcessor.is_blank_page(text_page(1))
+
+    def test_rescan_is_near_duplicate(self):
+        page = text_page(1)
+        same = page_signature(rescan(page))
+        original = page_signature(page)
+        other = page_signature(text_page(2))
+
+        assert hamming(original.phash, same.phash) <= 6
+        assert hamming(original.phash, other.phash) > 6
+        assert ImageProcessor.perceptual_hash(page) == original.phash
+
+    def test_content_digest(self):
+        page = text_page(1)
+        assert page_signature(reencode(page)).digest == page_signature(page).digest
+        assert page_signature(rescan(page)).digest != page_signature(page).digest
+
+
+class TestHashIndex:
+    """Tests for the near-duplicate index."""
+
+    def test_find_and_evict(self):
+        index = HashIndex(max_entries=2)
+        index.add('a', page_signature(text_page(1)), "text a")
+        index.add('b', page_signature(text_page(2)), "text b")
+
+        key, _, value = index.find(page_signature(reencode(text_page(2))))
+        assert (key, value) == ('b', "text b")
+        assert index.find(page_signature(text_page(3))) is None
+        # Close hashes, different ink: not the same page
+        assert index.find(page_signature(rescan(text_page(2)))) is None
+
+        index.add('c', page_signature(text_page(3)))
+        assert index.find(page_signature(text_page(1))) is None
+        assert len(index) == 2
+
+
+class TestSession:
+    """Tests for per-job decisions and savings."""
+
+    def test_batch_dedupe_and_savings(self):
+        session = PageFilter().session('got_ocr_hf', dedupe='batch')
+        pages = [text_page(1), blank_page(), reencode(text_page(1)), text_page(2)]
+
+        decisions = [session.check(index, page) for index, page in enumerate(pages)]
+        assert [decision.action for decision in decisions] == ['process', 'blank', 'duplicate', 'process']
+        assert decisions[2].duplicate_of == 0
+
+        session.complete(0, decisions[0], "page one", 2.0)
+        session.complete(3, decisions[3], "page two", 4.0)
+        assert session.resolve(decisions[2]) == "page one"
+
+        report = session.report()
+        assert report == {'pages': 4, 'processed': 2, 'blank_skipped': 1, 'duplicates': 1,
+                          'gpu_seconds_saved': 6.0}
+
+    def test_same_template_forms_are_not_duplicates(self):
+        """Invoices from one template have close hashes but different text."""
+        forms = [
+            invoice("2024-0001", "John Smith", "1,250.00"),
+            invoice("2024-0002", "Maria Garcia", "3,980.10"),
+            invoice("2024-0003", "Li Wei", "77.35"),
+            invoice("2024-0004", "Olga Petrova", "12,400.00"),
+            invoice("2024-0005", "Ahmed Khan", "505.50"),
+        ]
+        assert hamming(page_signature(forms[0]).phash, page_signature(forms[1]).phash) <= 6
+
+        session = PageFilter().session('got_ocr_hf', dedupe='batch')
+        assert [session.check(index, form).action for index, form in enumerate(forms)] == ['process'] * 5
+
+    def test_dedupe_off_by_default(self):
+        session = PageFilter().session('got_ocr_hf')
+        assert [session.check(index, text_page(1)).action for index in range(2)] == ['process', 'process']
+
+    def test_recent_results_per_model_and_client(self):
+        page_filter = PageFilter()
+        first = page_filter.session('got_ocr_hf', dedupe='recent', client='key:alice')
+        decision = first.check(0, text_page(1))
+        first.complete(0, decision, "page one", 1.0)
+
+        again = page_filter.session('got_ocr_hf', dedupe='recent', client='key:alice').check(0, reencode(text_page(1)))
+        assert again.action == 'duplicate' and again.recent
+        assert again.result == "page one"
+
+        other_client = page_filter.session('got_ocr_hf', dedupe='recent', client='key:bob')
+        assert other_client.check(0, text_page(1)).action == 'process'
+        other_model = page_filter.session('qwen3_vl_2b', dedupe='recent', client='key:alice')
+        assert other_model.check(0, text_page(1)).action == 'process'
+        off = page_filter.session('got_ocr_hf', dedupe='off', client='key:alice')
+        assert off.check(0, text_page(1)).action == 'process'
@@ -0,0 +1,98 @@
+"""Tests for quantization profiles and their qualification."""
+
+import torch
+
+from utils.quantization import (
+    BNB_CONFIG_AVAILABLE,
+    QualificationStore,
+    apply_post_load_quantization,
+    character_error_rate,
+    load_golden_set,
+    passes,
+    profile_load_kwargs,
+    qualification_result,
+    resolve_profile,
+    run_golden_set,
+    validate_production_config,
+    weight_memory_gb,
+)
+
+
+class TestProfiles:
+    """Tests for profile selection and load kwargs."""
+
+    def test_resolve_profile(self):
+        assert resolve_profile({'quantization_profile': 'int4_nf4'}, 'cuda') == 'int4_nf4'
+        assert resolve_profile({'precision': 'int4'}, 'cuda') == 'int4_nf4'
+        assert resolve_profile({'load_in_8bit': True}, 'cuda') == 'int8'
+        assert resolve_profile({}, 'cuda') == 'fp16'
+
+    def test_resolve_profile_by_device(self):
+        """Profiles that cannot run on the device fall back to its reference."""
+        assert resolve_profile({'quantization_profile': 'int8'}, 'cpu') == 'fp32'
+        assert resolve_profile({'quantization_profile': 'cpu_int8_dynamic'}, 'cuda') == 'fp16'
+        assert resolve_profile({'quantization_profile': 'cpu_int8_dynamic'}, 'cpu') == 'cpu_int8_dynamic'
+        assert resolve_profile({'quantization_profile': 'int2'}, 'cpu') == 'fp32'
+
+    def test_load_kwargs(self):
+        assert profile_load_kwargs('bf16') == {'torch_dtype': torch.bfloat16}
+        if BNB_CONFIG_AVAILABLE:
+            config = profile_load_kwargs('int4_nf4')['quantization_config']
+            assert config.load_in_4bit and config.bnb_4bit_quant_type == 'nf4'
+
+    def test_dynamic_int8(self):
+        """The CPU profile quantizes Linear layers in place and shrinks the weights."""
+        model = torch.nn.Sequential(torch.nn.Linear(256, 256), torch.nn.ReLU(), torch.nn.Linear(256, 8))
+        x = torch.randn(4, 256)
+        expected = model(x)
+        fp32_gb = weight_memory_gb(model)
+
+        assert apply_post_load_quantization(model, 'cpu_int8_dynamic') is model
+        assert weight_memory_gb(model) < fp32_gb / 3
+        assert torch.allclose(model(x), expected, atol=0.05)
+
+
+class TestQualification:
+    """Tests for golden set scoring and the qualification store."""
+
+    def test_character_error_rate(self):
+        assert character_error_rate("Total: 100", "Total:  100") == 0.0
+        assert character_error_rate("abcd", "abed") == 0.25
+        assert character_error_rate("", "") == 0.0
+
+    def test_golden_set_run(self, tmp_path):
+        (tmp_path / "a.png").write_bytes(b"")
+        (tmp_path / "a.txt").write_text("hello world", encoding="utf-8")
+        (tmp_path / "orphan.txt").write_text("no image", encoding="utf-8")
+
+        samples = load_golden_set(str(tmp_path))
+        assert [sample['name'] for sample in samples] == ['a']
+
+        golden = run_golden_set(lambda path: "hello word", samples, lambda text: len(text.split()))
+        assert golden['cer'] == round(1 / 11, 4)
+        assert golden['samples'][0]['tokens'] == 2
+
+    def test_passes(self):
+        assert passes({'cer': 0.02}, None) == (True, "ok")
+        assert not passes({'cer': 0.08}, None)[0]
+        assert not passes({'cer': 0.04}, 0.01)[0]
+        assert passes({'cer': 0.015}, 0.01)[0]
+
+    def test_store_gates_profiles(self, tmp_path):
+        store = QualificationStore(str(tmp_path / "qualification.json"))
+        golden = {'cer': 0.01, 'tokens_per_second': 10.0, 'samples': []}
+
+        assert store.is_allowed("org/model", "fp32", "cpu") == (True, "reference profile")
+        assert not store.is_allowed("org/model", "cpu_int8_dynamic", "cpu")[0]
+
+        store.put("org/model", "cpu_int8_dynamic", qualification_result(
+            "cpu_int8_dynamic", golden, 0.5, None, reference_cer=0.005
+        ), device="cpu")
+        assert store.is_allowed("org/model", "cpu_int8_dynamic", "cpu") == (True, "qualified")
+
+        config = {'models': {
+            'ok': {'model_path': 'org/model', 'quantization_profile': 'cpu_int8_dynamic'},
+            'bad': {'model_path': 'org/other', 'quantization_profile': 'cpu_int8_dynamic'},
+        }}
+        problems = validate_production_config(config, store, device="cpu")
+        assert [problem['model'] for problem in problems] == ['bad']
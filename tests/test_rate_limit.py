@@ -0,0 +1,111 @@
+"""Tests for GCRA rate limiting."""
+
+import multiprocessing
+
+import pytest
+
+from utils.rate_limit import (
+    Limit, MemoryLimitStore, RateLimiter, SqliteLimitStore, gcra, key_digest, rate_limit_settings
+)
+
+
+def hit_many(path: str, count: int, results) -> None:
+    """Worker process sharing the SQLite store."""
+    limiter = RateLimiter({'requests_per_minute': 50}, SqliteLimitStore(path))
+    client = limiter.identify(address="10.0.0.1")
+    results.put(sum(limiter.hit(client).allowed for _ in range(count)))
+    limiter.close()
+
+
+class TestGcra:
+    """Tests for the GCRA step."""
+
+    def test_burst_then_refill(self):
+        limit = Limit(60)  # one unit per second, bursts of 60
+        tat = None
+        for _ in range(60):
+            decision, tat = gcra(tat, 1000.0, limit)
+            assert decision.allowed
+        assert decision.remaining == 0
+
+        denied, tat_after = gcra(tat, 1000.0, limit)
+        assert not denied.allowed and tat_after == tat
+        assert denied.retry_after == pytest.approx(1.0)
+
+        decision, _ = gcra(tat, 1001.0, limit)
+        assert decision.allowed
+
+    def test_cost_and_oversized_calls(self):
+        limit = Limit(10)
+        decision, tat = gcra(None, 0.0, limit, cost=4)
+        assert decision.allowed and decision.remaining == 6
+
+        # Larger than the burst: allowed on a full bucket, then in debt
+        decision, tat = gcra(None, 0.0, limit, cost=25)
+        assert decision.allowed and decision.remaining == 0
+        denied, _ = gcra(tat, 60.0, limit, cost=1)
+        assert not denied.allowed
+        assert denied.retry_after == pytest.approx(36.0)
+
+
+class TestStores:
+    """Tests for eviction and shared state."""
+
+    def test_memory_store_evicts_idle_keys(self):
+        store = MemoryLimitStore(sweep_interval=0)
+        limiter = RateLimiter({'requests_per_minute': 6000}, store)
+        for i in range(100):
+            limiter.hit(limiter.identify(address=f"10.0.0.{i}"))
+        assert len(store) <= 100
+
+        # Refilled buckets are dropped on the next sweep
+        store.update("probe", lambda tat, now: gcra(tat, now, Limit(1e9)))
+        store._sweep(store._next_sweep + 1)
+        assert len(store) == 0
+
+    def test_sqlite_store_is_shared_between_processes(self, tmp_path):
+        path = str(tmp_path / "limits.sqlite3")
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=hit_many, args=(path, 30, results)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(30)
+
+        assert sum(results.get(timeout=5) for _ in workers) == 50
+
+
+class TestRateLimiter:
+    """Tests for clients and quotas."""
+
+    def test_api_key_quotas(self):
+        settings = rate_limit_settings({'rate_limit': {
+            'requests_per_minute': 2,
+            'pages_per_minute': 10,
+            'keys': {'partner-key': {'pages_per_minute': 100}, f"sha256:{key_digest('nightly')}": {
+                'requests_per_minute': 1000, 'pages_per_minute': None}},
+        }})
+        limiter = RateLimiter(settings)
+
+        partner = limiter.identify(api_key="partner-key", address="10.0.0.1")
+        assert partner.id.startswith("key:") and partner.limits["pages"].rate == 100
+        assert partner.limits["requests"].rate == 2
+        assert limiter.hit(partner, "pages", cost=50).remaining == 50
+
+        nightly = limiter.identify(api_key="nightly", address="10.0.0.1")
+        assert limiter.hit(nightly, "pages", cost=5000).allowed
+        assert limiter.hit(nightly, "pages").remaining is None
+
+        # Unknown keys are limited by address
+        anonymous = limiter.identify(api_key="made-up", address="10.0.0.2")
+        assert anonymous.id == "ip:10.0.0.2"
+        assert [limiter.hit(anonymous).allowed for _ in range(3)] == [True, True, False]
+
+    def test_denied_decision_headers(self):
+        limiter = RateLimiter({'requests_per_minute': 1})
+        client = limiter.identify(address="10.0.0.3")
+        assert limiter.hit(client).headers()["X-RateLimit-Remaining"] == "0"
+
+        headers = limiter.hit(client).headers()
+        assert headers["Retry-After"] == "60"
+        assert "X-RateLimit-Reset" in headers
@@ -0,0 +1,177 @@
+"""Tests for repetition-loop detection and early stopping."""
+
+import json
+
+import torch
+
+from utils.repetition_guard import (
+    RepetitionStoppingCriteria,
+    StreamWatchdog,
+    chunk_content,
+    detector_settings,
+    find_repetition,
+    iter_sse_chunks,
+)
+
+
+def _document_tokens(count: int = 300):
+    """Token stream without loops (distinct ids)."""
+    return list(range(1000, 1000 + count))
+
+
+class TestFindRepetition:
+    """Tests for the loop detector."""
+
+    def test_clean_sequence(self):
+        """Ordinary output is not flagged."""
+        assert find_repetition(_document_tokens()) is None
+
+    def test_single_token_loop(self):
+        """A token repeated over and over is a period-1 loop."""
+        tokens = _document_tokens(40) + [7] * 60
+        match = find_repetition(tokens)
+
+        assert match.kind == "periodic"
+        assert match.period == 1
+        assert match.start == 40
+        assert match.keep_length == 41
+
+    def test_line_loop(self):
+        """A repeated multi-token line is detected with its period."""
+        line = [11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22]
+        tokens = _document_tokens(50) + line * 6
+        match = find_repetition(tokens)
+
+        assert match.kind == "periodic"
+        assert match.period == len(line)
+        assert match.start == 50
+
+    def test_short_repeats_allowed(self):
+        """Short legitimate repeats (e.g. '00 00 00') are not loops."""
+        tokens = _document_tokens(100) + [5, 6] * 3 + _document_tokens(20)
+        assert find_repetition(tokens) is None
+
+    def test_ngram_loop_with_variation(self):
+        """Loops with a changing counter are caught by the n-gram check."""
+        line = list(range(20, 32))
+        tokens = []
+        for counter in range(10):
+            tokens += line + [500 + counter]
+        match = find_repetition(tokens)
+
+        assert match is not None
+        assert match.kind == "ngram"
+        assert match.period == len(line) + 1
+
+    def test_identical_table_rows_survive(self):
+        """A table with 20 identical rows is content, not a loop."""
+        vocab = {1: "|", 2: " 0 ", 3: "\n"}
+        row = [1, 2, 1, 2, 1, 2, 1, 3]
+        tokens = _document_tokens(30) + row * 20
+
+        assert find_repetition(tokens) is not None
+        assert find_repetition(tokens, decode=lambda ids: "".join(vocab.get(i, "x") for i in ids)) is None
+
+        html = StreamWatchdog(max_tokens=2048, check_every=1)
+        markdown = StreamWatchdog(max_tokens=2048, check_every=1)
+        for _ in range(20):
+            assert not html.feed("<tr><td>0</td><td>0</td><td>0</td></tr>\n")
+            assert not markdown.feed("| 0 | 0 | 0 |\n")
+        assert html.trimmed_text() == html.text
+        assert not markdown.report()["trimmed"]
+
+    def test_settings_from_config(self):
+        """Model config overrides detector defaults."""
+        settings = detector_settings({"repetition_guard": {"min_span": 16}})
+        assert settings["min_span"] == 16
+        assert settings["max_period"] == 48
+
+
+class TestRepetitionStoppingCriteria:
+    """Tests for the generate() stopping criterion."""
+
+    def test_stops_looping_row_only(self):
+        """Only the looping row is stopped; tokens saved are reported."""
+        prompt = [[1, 2, 3, 4], [1, 2, 3, 4]]
+        looping = _document_tokens(10) + [9] * 54
+        clean = _document_tokens(64)
+        input_ids = torch.tensor([prompt[0] + looping, prompt[1] + clean])
+
+        criteria = RepetitionStoppingCriteria(prompt_length=4, max_new_tokens=1024)
+        done = criteria(input_ids, None)
+
+        assert done.tolist() == [True, False]
+        report = criteria.report(rows=2)
+        assert report["trimmed"] and report["loops_stopped"] == 1
+        assert report["tokens_saved"] == 1024 - 64
+        assert list(criteria.trim(0, looping)) == _document_tokens(10) + [9]
+        assert list(criteria.trim(1, clean)) == clean
+
+    def test_finished_rows_not_flagged(self):
+        """Rows padded after EOS are not treated as loops."""
+        eos = 2
+        row = _document_tokens(10) + [eos] * 54
+        criteria = RepetitionStoppingCriteria(prompt_length=0, max_new_tokens=256, stop_token_ids=[eos])
+
+        assert criteria(torch.tensor([row]), None).tolist() == [False]
+
+    def test_skips_between_checks(self):
+        """The detector only runs every ``check_every`` tokens."""
+        row = [9] * 65
+        criteria = RepetitionStoppingCriteria(prompt_length=0, max_new_tokens=256, check_every=4)
+
+        assert criteria(torch.tensor([row]), None).tolist() == [False]
+        assert criteria(torch.tensor([row + [9, 9, 9]]), None).tolist() == [True]
+
+    def test_checks_after_multi_token_step(self):
+        """Assisted decoding appends several tokens per step past a check boundary."""
+        row = [9] * 65
+        criteria = RepetitionStoppingCriteria(prompt_length=0, max_new_tokens=256, check_every=4)
+
+        assert criteria(torch.tensor([row]), None).tolist() == [False]
+        assert criteria(torch.tensor([row + [9] * 5]), None).tolist() == [True]
+
+
+class TestStreamWatchdog:
+    """Tests for the streaming watchdog used with vLLM."""
+
+    def test_aborts_looping_stream(self):
+        """A looping text stream is aborted and trimmed to one copy."""
+        watchdog = StreamWatchdog(max_tokens=2048, check_every=1)
+        watchdog.feed("Invoice 42\n")
+
+        aborted = False
+        for _ in range(60):
+            if watchdog.feed("| 00 | 00 "):
+                aborted = True
+                break
+
+        assert aborted
+        assert watchdog.trimmed_text().startswith("Invoice 42")
+        assert len(watchdog.trimmed_text()) < len(watchdog.text)
+        report = watchdog.report()
+        assert report["loop_detected"]
+        assert report["tokens_saved"] == 2048 - report["tokens_received"]
+
+    def test_words_split_across_chunks(self):
+        """Words split between chunks are tokenized once."""
+        watchdog = StreamWatchdog(max_tokens=100)
+        for chunk in ["Hel", "lo wor", "ld."]:
+            watchdog.feed(chunk)
+
+        assert watchdog._tokens == ["Hello", "world", "."]
+        assert watchdog.report()["tokens_saved"] == 0
+
+    def test_sse_parsing(self):
+        """Content deltas are read from OpenAI-compatible SSE lines."""
+        lines = [
+            b"data: " + json.dumps({"choices": [{"delta": {"content": "Hi"}}]}).encode(),
+            b"",
+            b"data: " + json.dumps({"choices": [], "usage": {"total_tokens": 5}}).encode(),
+            b"data: [DONE]",
+            b"data: " + json.dumps({"choices": [{"delta": {"content": "late"}}]}).encode(),
+        ]
+        chunks = list(iter_sse_chunks(lines))
+
+        assert [chunk_content(c) for c in chunks] == ["Hi", ""]
+        assert chunks[1]["usage"]["total_tokens"] == 5
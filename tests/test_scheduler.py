@@ -0,0 +1,157 @@
+"""Tests for priority and deadline-aware model scheduling."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from utils.metrics import registry
+from utils.scheduler import (
+    ClientDisconnected, DeadlineExceeded, FairScheduler, Ticket, current_ticket, scheduled, scheduler_settings
+)
+
+
+def waiting(scheduler: FairScheduler, model: str) -> int:
+    queue = scheduler.get_stats()["models"].get(model)
+    return sum(queue["waiting"].values()) if queue else 0
+
+
+def wait_for_queue(scheduler: FairScheduler, model: str, count: int, timeout: float = 2.0) -> None:
+    deadline = time.monotonic() + timeout
+    while waiting(scheduler, model) < count:
+        assert time.monotonic() < deadline, "waiters did not queue up"
+        time.sleep(0.005)
+
+
+def run_in_order(scheduler: FairScheduler, model: str, tickets) -> list:
+    """Queue tickets one by one behind a held model and return the grant order."""
+    order = []
+    scheduler.acquire(model, Ticket("interactive", "holder"))
+    threads = []
+    for name, ticket in tickets:
+        def run(name=name, ticket=ticket):
+            with scheduler.slot(model, ticket):
+                order.append(name)
+        thread = threading.Thread(target=run)
+        thread.start()
+        threads.append(thread)
+        wait_for_queue(scheduler, model, len(threads))
+    scheduler.release(model)
+    for thread in threads:
+        thread.join(2)
+    return order
+
+
+class TestOrdering:
+    """Tests for weighted fair queuing between classes and clients."""
+
+    def test_interactive_overtakes_queued_batch(self):
+        scheduler = FairScheduler()
+        tickets = [(f"batch{i}", Ticket("batch", "nightly")) for i in range(4)]
+        tickets += [(f"ui{i}", Ticket("interactive", "user")) for i in range(2)]
+
+        order = run_in_order(scheduler, "sched-priority", tickets)
+
+        # Queued batch work delays interactive calls by at most one batch call
+        assert order == ["ui0", "batch0", "ui1", "batch1", "batch2", "batch3"]
+
+    def test_batch_is_not_starved(self):
+        scheduler = FairScheduler({'weights': {'interactive': 2, 'batch': 1}})
+        tickets = [(f"batch{i}", Ticket("batch")) for i in range(2)]
+        tickets += [(f"ui{i}", Ticket("interactive")) for i in range(6)]
+
+        order = run_in_order(scheduler, "sched-starve", tickets)
+
+        # Batch gets one call for every two interactive calls
+        assert order.index("batch1") < order.index("ui5")
+
+    def test_clients_share_their_class(self):
+        scheduler = FairScheduler()
+        tickets = [(f"a{i}", Ticket("api", "client-a")) for i in range(4)]
+        tickets += [(f"b{i}", Ticket("api", "client-b")) for i in range(2)]
+
+        order = run_in_order(scheduler, "sched-clients", tickets)
+
+        assert order == ["a0", "b0", "a1", "b1", "a2", "a3"]
+
+
+class TestDropping:
+    """Tests for deadline and disconnect handling."""
+
+    def test_deadline_drops_waiting_request(self):
+        scheduler = FairScheduler()
+        dropped = registry.counter(
+            "chatvlm_scheduler_dropped_total", "", ("model", "priority", "reason")
+        ).labels("sched-deadline", "api", "deadline")
+        before = dropped.value
+        scheduler.acquire("sched-deadline", Ticket("batch"))
+
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            scheduler.acquire("sched-deadline", Ticket("api", timeout=0.05))
+        assert time.monotonic() - start < 1.0
+
+        scheduler.release("sched-deadline")
+        assert dropped.value == before + 1
+        assert scheduler.get_stats()["classes"]["api"]["dropped"]["deadline"] == 1
+        # The queue is not left blocked by the dropped request
+        assert scheduler.acquire("sched-deadline", Ticket("api", timeout=0.5)) == 0.0
+
+    def test_cancel_wakes_and_drops_waiter(self):
+        scheduler = FairScheduler()
+        scheduler.acquire("sched-cancel", Ticket("batch"))
+        ticket = Ticket("interactive", "browser")
+        errors = []
+
+        def wait():
+            try:
+                scheduler.acquire("sched-cancel", ticket)
+            except ClientDisconnected as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=wait)
+        thread.start()
+        wait_for_queue(scheduler, "sched-cancel", 1)
+        ticket.cancel()
+        thread.join(1)
+
+        assert not thread.is_alive()
+        assert len(errors) == 1 and errors[0].priority == "interactive"
+        assert waiting(scheduler, "sched-cancel") == 0
+        scheduler.release("sched-cancel")
+
+    def test_expired_ticket_never_reaches_free_model(self):
+        scheduler = FairScheduler()
+        ticket = Ticket("api", timeout=0)
+
+        with pytest.raises(DeadlineExceeded):
+            scheduler.acquire("sched-free", ticket)
+        assert scheduler.get_stats()["models"]["sched-free"]["busy"] is False
+
+
+class TestTickets:
+    """Tests for tickets, settings and context propagation."""
+
+    def test_ticket_follows_worker_threads(self):
+        scheduler = FairScheduler()
+        ticket = scheduler.ticket("interactive", "alice")
+
+        async def handler():
+            with scheduled(ticket):
+                return await asyncio.to_thread(current_ticket)
+
+        assert asyncio.run(handler()) is ticket
+        assert current_ticket() is None
+        assert ticket.run(current_ticket) is ticket
+
+    def test_settings_and_deadlines(self):
+        settings = scheduler_settings({'scheduler': {'weights': {'batch': 2}, 'max_deadline': 10}})
+        assert settings['weights'] == {'interactive': 8, 'api': 4, 'batch': 2}
+        assert settings['deadlines']['api'] == 300
+
+        scheduler = FairScheduler({'max_deadline': 10})
+        assert scheduler.ticket("batch").deadline is None
+        assert scheduler.ticket("api").remaining() <= 10
+        with pytest.raises(ValueError):
+            Ticket("urgent")
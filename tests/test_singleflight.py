@@ -0,0 +1,190 @@
+"""Tests for in-flight coalescing of identical requests."""
+
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.scheduler import ClientDisconnected, FairScheduler, Ticket, scheduled
+from utils.singleflight import SingleFlight, content_digest, request_key
+
+
+def slow(result, started: threading.Event = None, calls: list = None, delay: float = 0.2):
+    """Blocking request that records its executions."""
+    def run():
+        if calls is not None:
+            calls.append(result)
+        if started is not None:
+            started.set()
+        time.sleep(delay)
+        return result
+    return run
+
+
+class TestRequestKey:
+    """Tests for request identity."""
+
+    def test_same_content_same_key(self):
+        array = np.zeros((4, 4, 3), dtype=np.uint8)
+        image = Image.fromarray(array)
+
+        assert content_digest(array) == content_digest(array.copy())
+        assert content_digest(image) == content_digest(image.copy())
+        assert request_key(b"page", "got_ocr_hf", max_tokens=512) == request_key(b"page", "got_ocr_hf", max_tokens=512)
+
+    def test_params_change_key(self):
+        base = request_key(b"page", "qwen3_vl_2b", "Extract text", max_tokens=512)
+        assert base != request_key(b"page", "qwen3_vl_2b", "Extract text", max_tokens=256)
+        assert base != request_key(b"page", "qwen3_vl_2b", "Describe", max_tokens=512)
+        assert base != request_key(b"page", "qwen3_vl_8b", "Extract text", max_tokens=512)
+        assert base != request_key(b"other", "qwen3_vl_2b", "Extract text", max_tokens=512)
+
+
+class TestSingleFlight:
+    """Tests for the single-flight layer."""
+
+    def test_threads_share_one_execution(self):
+        flight = SingleFlight()
+        calls, results = [], []
+        started = threading.Event()
+
+        leader = threading.Thread(target=lambda: results.append(flight.do("k", slow("text", started, calls))))
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=lambda: results.append(flight.do("k", slow("other", calls=calls))))
+                     for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        for thread in [leader, *followers]:
+            thread.join()
+
+        assert calls == ["text"]
+        assert results == ["text"] * 4
+        stats = flight.get_stats()
+        assert stats['executions'] == 1
+        assert stats['coalesced'] == 3
+        assert stats['max_waiters'] == 3
+        assert stats['in_flight'] == 0
+
+    def test_finished_requests_run_again(self):
+        flight = SingleFlight()
+        calls = []
+        flight.do("k", slow(1, calls=calls, delay=0))
+        flight.do("k", slow(2, calls=calls, delay=0))
+
+        assert calls == [1, 2]
+        assert flight.get_stats()['coalesced'] == 0
+
+    def test_exception_shared(self):
+        flight = SingleFlight()
+
+        async def main():
+            def fail():
+                time.sleep(0.1)
+                raise ValueError("model failed")
+            return await asyncio.gather(
+                flight.do_async("k", fail), flight.do_async("k", fail), return_exceptions=True
+            )
+
+        errors = asyncio.run(main())
+        assert [type(error) for error in errors] == [ValueError, ValueError]
+        assert flight.get_stats()['executions'] == 1
+
+    def test_async_and_thread_callers_coalesce(self):
+        flight = SingleFlight()
+        calls = []
+        started = threading.Event()
+
+        async def main():
+            leader = asyncio.ensure_future(flight.do_async("k", slow("a", started, calls)))
+            await asyncio.to_thread(started.wait)
+            other = flight.do_async("other", slow("b", calls=calls, delay=0))
+            thread_result = asyncio.to_thread(flight.do, "k", slow("c", calls=calls))
+            return await asyncio.gather(leader, other, thread_result)
+
+        assert asyncio.run(main()) == ["a", "b", "a"]
+        assert sorted(calls) == ["a", "b"]
+        assert flight.get_stats() == pytest.approx({
+            'calls': 3, 'executions': 2, 'coalesced': 1, 'coalesced_rate': 0.333,
+            'in_flight': 0, 'max_waiters': 1,
+        })
+
+
+class TestSharedTickets:
+    """Tests for scheduling coalesced requests."""
+
+    @staticmethod
+    def queued_model_call(scheduler: FairScheduler, model: str, executions: list):
+        def run():
+            executions.append(model)
+            with scheduler.slot(model):
+                return "text"
+        return run
+
+    @staticmethod
+    def wait_queued(scheduler: FairScheduler, model: str, priority: str) -> None:
+        deadline = time.monotonic() + 2
+        while not scheduler.get_stats()["models"].get(model, {}).get("waiting", {}).get(priority):
+            assert time.monotonic() < deadline, "call did not queue up"
+            time.sleep(0.005)
+
+    def test_leader_disconnect_does_not_drop_follower(self):
+        flight, scheduler = SingleFlight(), FairScheduler()
+        executions = []
+        leader_ticket, follower_ticket = Ticket("batch", "leader"), Ticket("interactive", "follower")
+        scheduler.acquire("sf-model", Ticket("api", "holder"))
+
+        async def call(ticket):
+            with scheduled(ticket):
+                return await flight.do_async("k", self.queued_model_call(scheduler, "sf-model", executions))
+
+        async def main():
+            leader = asyncio.ensure_future(call(leader_ticket))
+            await asyncio.to_thread(self.wait_queued, scheduler, "sf-model", "batch")
+            follower = asyncio.ensure_future(call(follower_ticket))
+            # The follower's class applies to the queued execution
+            await asyncio.to_thread(self.wait_queued, scheduler, "sf-model", "interactive")
+
+            leader_ticket.cancel()
+            await asyncio.sleep(0.05)
+            scheduler.release("sf-model")
+            return await asyncio.gather(leader, follower, return_exceptions=True)
+
+        assert asyncio.run(main()) == ["text", "text"]
+        assert executions == ["sf-model"]
+        stats = scheduler.get_stats()["classes"]
+        assert stats["interactive"]["granted"] == 1
+        assert stats["batch"]["dropped"]["disconnected"] == 0
+
+    def test_execution_dropped_when_all_callers_leave(self):
+        flight, scheduler = SingleFlight(), FairScheduler()
+        tickets = [Ticket("api", "a"), Ticket("api", "b")]
+        scheduler.acquire("sf-gone", Ticket("api", "holder"))
+
+        def call(ticket, errors):
+            try:
+                ticket.run(flight.do, "k", self.queued_model_call(scheduler, "sf-gone", []))
+            except ClientDisconnected as e:
+                errors.append(e)
+
+        errors = []
+        threads = [threading.Thread(target=call, args=(ticket, errors)) for ticket in tickets]
+        threads[0].start()
+        self.wait_queued(scheduler, "sf-gone", "api")
+        threads[1].start()
+        while flight.get_stats()["coalesced"] < 1:
+            time.sleep(0.005)
+
+        tickets[0].cancel()
+        time.sleep(0.05)
+        assert scheduler.get_stats()["models"]["sf-gone"]["waiting"]["api"] == 1
+        tickets[1].cancel()
+        for thread in threads:
+            thread.join(2)
+
+        assert len(errors) == 2
+        assert scheduler.get_stats()["models"]["sf-gone"]["waiting"]["api"] == 0
+        scheduler.release("sf-gone")
@@ -0,0 +1,146 @@
+"""Tests for speculative decoding with a draft model."""
+
+import threading
+
+import pytest
+import torch
+
+from utils.speculative import SpeculativeDecoder, SpeculativeStats, count_forwards, speculative_settings
+
+try:
+    from transformers import Qwen3VLConfig, Qwen3VLForConditionalGeneration
+    QWEN3_VL_AVAILABLE = True
+except ImportError:
+    QWEN3_VL_AVAILABLE = False
+
+
+def tiny_qwen3_vl(seed: int, hidden_size: int = 64) -> "Qwen3VLForConditionalGeneration":
+    """Small random Qwen3-VL; the vision geometry matches across hidden sizes."""
+    config = Qwen3VLConfig(
+        text_config=dict(
+            hidden_size=hidden_size, intermediate_size=2 * hidden_size, num_hidden_layers=2,
+            num_attention_heads=4, num_key_value_heads=2, head_dim=16, vocab_size=1000,
+            rope_scaling={"rope_type": "default", "mrope_section": [2, 3, 3], "mrope_interleaved": True}
+        ),
+        vision_config=dict(
+            depth=2, hidden_size=32, intermediate_size=64, num_heads=2, out_hidden_size=hidden_size,
+            patch_size=16, spatial_merge_size=2, temporal_patch_size=2,
+            deepstack_visual_indexes=[0, 1], num_position_embeddings=64
+        ),
+        image_token_id=999,
+        video_token_id=998,
+    )
+    torch.manual_seed(seed)
+    return Qwen3VLForConditionalGeneration(config).eval()
+
+
+def image_inputs():
+    input_ids = torch.tensor([[5, 6, 7] + [999] * 6 + [8, 9, 10, 11]])
+    torch.manual_seed(1)
+    return {
+        'input_ids': input_ids,
+        'attention_mask': torch.ones_like(input_ids),
+        'pixel_values': torch.randn(24, 1536),
+        'image_grid_thw': torch.tensor([[1, 4, 6]]),
+        'mm_token_type_ids': (input_ids == 999).long(),
+    }
+
+
+GEN_KWARGS = {'max_new_tokens': 24, 'min_new_tokens': 24, 'do_sample': False}
+
+
+class TestSettings:
+    """Tests for config parsing and metrics."""
+
+    def test_disabled_without_draft(self):
+        assert speculative_settings({}) is None
+        assert speculative_settings({'speculative': {'num_assistant_tokens': 3}}) is None
+
+    def test_settings_defaults(self):
+        settings = speculative_settings({'speculative': {'draft_model': 'qwen3_vl_2b'}})
+        assert settings['draft_model'] == 'qwen3_vl_2b'
+        assert settings['num_assistant_tokens'] == 5
+
+    def test_stats_summary(self):
+        stats = SpeculativeStats()
+        stats.record('ocr', new_tokens=40, target_forwards=10, draft_forwards=40, seconds=2.0)
+        stats.record_baseline('ocr', new_tokens=40, seconds=4.0)
+        stats.record('layout', new_tokens=10, target_forwards=10, draft_forwards=10, seconds=1.0)
+
+        summary = stats.to_dict()
+        assert summary['ocr']['accepted_tokens'] == 30
+        assert summary['ocr']['acceptance_rate'] == 0.75
+        assert summary['ocr']['tokens_per_target_forward'] == 4.0
+        assert summary['ocr']['speedup'] == 2.0
+        assert summary['layout']['acceptance_rate'] == 0.0
+        assert summary['layout']['speedup'] is None
+
+    def test_count_forwards(self):
+        linear = torch.nn.Linear(2, 2)
+        with count_forwards(linear) as counts:
+            linear(torch.zeros(1, 2))
+            linear(torch.zeros(1, 2))
+        linear(torch.zeros(1, 2))
+        assert counts == [2]
+        assert not linear._forward_hooks
+
+    def test_count_forwards_ignores_other_threads(self):
+        linear = torch.nn.Linear(2, 2)
+        with count_forwards(linear) as counts:
+            other = threading.Thread(target=linear, args=(torch.zeros(1, 2),))
+            other.start()
+            other.join()
+            linear(torch.zeros(1, 2))
+        assert counts == [1]
+
+
+@pytest.mark.skipif(not QWEN3_VL_AVAILABLE, reason="transformers without Qwen3-VL")
+class TestSpeculativeDecoder:
+    """Assisted generation on small random Qwen3-VL models."""
+
+    def test_identical_draft_accepts_with_image(self):
+        """A draft equal to the target sees the image and has its tokens accepted."""
+        target, draft = tiny_qwen3_vl(0), tiny_qwen3_vl(0)
+        inputs = image_inputs()
+        with torch.no_grad():
+            reference = target.generate(**inputs, **GEN_KWARGS)
+
+        decoder = SpeculativeDecoder(target, draft, {'schedule': 'constant', 'confidence_threshold': 0.0})
+        with torch.no_grad():
+            output = decoder.generate(inputs, 'ocr', **GEN_KWARGS)
+
+        assert torch.equal(output, reference)
+        stats = decoder.get_stats()['by_document_type']['ocr']
+        assert stats['acceptance_rate'] > 0.9
+        assert stats['tokens_per_target_forward'] > 3
+
+    def test_smaller_draft_keeps_target_output(self):
+        """A draft with a different hidden size encodes the image itself."""
+        target, draft = tiny_qwen3_vl(0), tiny_qwen3_vl(2, hidden_size=32)
+        inputs = image_inputs()
+        with torch.no_grad():
+            reference = target.generate(**inputs, **GEN_KWARGS)
+
+        decoder = SpeculativeDecoder(target, draft)
+        with torch.no_grad():
+            output = decoder.generate(inputs, 'ocr', **GEN_KWARGS)
+
+        assert torch.equal(output, reference)
+        # Outside the call the draft runs on its own inputs only
+        text_only = {'input_ids': torch.tensor([[5, 6, 7]])}
+        with torch.no_grad():
+            patched = draft.generate(**text_only, **GEN_KWARGS)
+        decoder.detach()
+        assert 'prepare_inputs_for_generation' not in vars(draft)
+        with torch.no_grad():
+            assert torch.equal(patched, draft.generate(**text_only, **GEN_KWARGS))
+
+    def test_baseline_sampling(self):
+        target, draft = tiny_qwen3_vl(0), tiny_qwen3_vl(0)
+        decoder = SpeculativeDecoder(target, draft, {'baseline_every': 3})
+        single = {'input_ids': torch.tensor([[5, 6]])}
+        batch = {'input_ids': torch.tensor([[5, 6], [7, 8]])}
+
+        assert not decoder.should_speculate(batch, 'ocr')
+        assert [decoder.should_speculate(single, 'ocr') for _ in range(4)] == [False, True, True, False]
+        assert not decoder.should_speculate(single, 'tables')
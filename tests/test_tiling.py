@@ -0,0 +1,159 @@
+"""Tests for tiled processing of oversized images."""
+
+import json
+
+from PIL import Image
+
+from utils.tiling import (
+    Tile,
+    TilingPolicy,
+    get_pixel_budget,
+    merge_tile_grid,
+    merge_tile_layouts,
+    merge_tile_texts,
+    process_tiled,
+    select_tiling_policy,
+    split_into_tiles,
+)
+
+
+class TestTilingPolicy:
+    """Tests for automatic tiling policy selection."""
+    
+    def test_small_image_not_tiled(self):
+        """Images within the pixel budget are processed whole."""
+        assert select_tiling_policy((800, 600), "qwen3_vl_2b") is None
+    
+    def test_mild_downscale_not_tiled(self):
+        """Slightly oversized images are downscaled, not tiled."""
+        assert select_tiling_policy((1200, 1000), "qwen3_vl_2b") is None
+    
+    def test_a3_drawing_tiled(self):
+        """A3 scans at 300 DPI are tiled within the model budget."""
+        policy = select_tiling_policy((4961, 3508), "qwen3_vl_2b")
+        assert policy is not None
+        assert policy.tile_width * policy.tile_height <= policy.pixel_budget
+        assert policy.overlap > 0
+    
+    def test_receipt_keeps_full_width(self):
+        """Long narrow receipts are cut into full-width strips."""
+        policy = select_tiling_policy((800, 6000), "got_ocr_hf")
+        assert policy is not None
+        assert policy.tile_width == 800
+    
+    def test_budget_lookup(self):
+        """Model families resolve to their own pixel budgets."""
+        assert get_pixel_budget("qwen3_vl_8b") == get_pixel_budget("qwen_vl_7b")
+        assert get_pixel_budget("got_ocr_hf") == 1024 * 1024
+        assert get_pixel_budget("qwen3_vl_2b", {"max_pixels": 512}) == 512 * 28 * 28
+
+
+class TestSplitAndMerge:
+    """Tests for tile splitting and output merging."""
+    
+    def test_tiles_cover_image(self):
+        """Tiles overlap and cover the whole page."""
+        image = Image.new('RGB', (3000, 2000), color='white')
+        policy = TilingPolicy(tile_width=1000, tile_height=1000, overlap=100, pixel_budget=1000 * 1000)
+        tiles = split_into_tiles(image, policy)
+        
+        assert max(t.box[2] for t in tiles) == 3000
+        assert max(t.box[3] for t in tiles) == 2000
+        assert all(t.image.size[0] <= 1000 and t.image.size[1] <= 1000 for t in tiles)
+        first_row = sorted((t for t in tiles if t.row == 0), key=lambda t: t.col)
+        assert first_row[1].box[0] < first_row[0].box[2]
+    
+    def test_merge_texts_drops_overlap(self):
+        """Lines repeated in overlap bands appear once."""
+        merged = merge_tile_texts([
+            "ACME Store\nInvoice #12345\nDate: 2024-01-15",
+            "Date: 2024-01-15\nMilk 2x $3.50\nTotal: $150.00",
+            "Tota1: $150.00\nThank you for shopping",
+        ])
+        assert merged.split("\n") == [
+            "ACME Store",
+            "Invoice #12345",
+            "Date: 2024-01-15",
+            "Milk 2x $3.50",
+            "Total: $150.00",
+            "Thank you for shopping",
+        ]
+    
+    def test_merge_layouts_deduplicates(self):
+        """Elements seen in two tiles are merged into page coordinates."""
+        image = Image.new('RGB', (10, 10))
+        top = Tile(image=image, box=(0, 0, 1000, 1000), row=0, col=0)
+        bottom = Tile(image=image, box=(0, 900, 1000, 1900), row=1, col=0)
+        
+        merged = merge_tile_layouts([
+            (top, [{"bbox": [10, 920, 500, 990], "category": "Text", "text": "Total: 100"}]),
+            (bottom, [
+                {"bbox": [10, 20, 500, 90], "category": "Text", "text": "Total: 100"},
+                {"bbox": [10, 200, 500, 260], "category": "Text", "text": "Thank you"},
+            ]),
+        ])
+        
+        assert len(merged) == 2
+        assert merged[0]["text"] == "Total: 100"
+        assert merged[1]["bbox"] == [10, 1100, 500, 1160]
+    
+    def test_process_tiled_single_batch(self):
+        """All tiles are passed to the model in one call."""
+        image = Image.new('RGB', (800, 6000), color='white')
+        policy = select_tiling_policy(image.size, "got_ocr_hf")
+        calls = []
+        
+        def infer(images):
+            calls.append(len(images))
+            return [f"tile {i}" for i in range(len(images))]
+        
+        result = process_tiled(image, infer, policy)
+        assert len(calls) == 1
+        assert result["tiles"] == calls[0]
+        assert result["grid"][1] == 1
+
+    def test_merge_grid_reads_columns(self):
+        """Columns are merged top to bottom, then concatenated left to right."""
+        image = Image.new('RGB', (2000, 1900))
+        policy = TilingPolicy(tile_width=1100, tile_height=1000, overlap=100, pixel_budget=1100 * 1000)
+        tiles = split_into_tiles(image, policy)
+        assert [(t.row, t.col) for t in tiles] == [(0, 0), (0, 1), (1, 0), (1, 1)]
+
+        # The right column has fewer lines: nothing may be paired by index
+        outputs = [
+            "Invoice 12345\nSeller ACME\nTotal 150",
+            "Page 1 of 2",
+            "Total 150\nThank you",
+            "Signature\nStamp",
+        ]
+        assert merge_tile_grid(tiles, outputs).split("\n") == [
+            "Invoice 12345",
+            "Seller ACME",
+            "Total 150",
+            "Thank you",
+            "Page 1 of 2",
+            "Signature",
+            "Stamp",
+        ]
+
+        # Tile order must not matter, only positions
+        reordered = [tiles[i] for i in (3, 2, 1, 0)]
+        assert merge_tile_grid(reordered, outputs[::-1]) == merge_tile_grid(tiles, outputs)
+
+    def test_process_tiled_merges_layout_elements(self):
+        """dots.ocr tiles are merged as layout elements in page coordinates."""
+        image = Image.new('RGB', (2000, 1000))
+        policy = TilingPolicy(tile_width=1100, tile_height=1000, overlap=200, pixel_budget=1100 * 1000)
+
+        def infer(images):
+            return [
+                '[{"bbox": [950, 10, 1090, 60], "category": "Text", "text": "Total"}]',
+                '[{"bbox": [50, 10, 190, 60], "category": "Text", "text": "Total"},'
+                ' {"bbox": [300, 10, 500, 60], "category": "Text", "text": "150 USD"}]',
+            ]
+
+        elements = json.loads(process_tiled(image, infer, policy, layout=True)["text"])
+        assert [(e["text"], e["bbox"]) for e in elements] == [
+            ("Total", [950, 10, 1090, 60]),
+            ("150 USD", [1200, 10, 1400, 60]),
+        ]
@@ -0,0 +1,116 @@
+"""Tests for request tracing and trace analysis."""
+
+import asyncio
+import time
+
+import pytest
+
+from utils.tracing import (
+    JsonlExporter, Tracer, format_trace, load_spans, parse_traceparent, slowest_traces, stage_totals
+)
+
+
+class MemoryExporter:
+    """Collects exported spans."""
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span.to_dict())
+
+
+def make_tracer():
+    exporter = MemoryExporter()
+    return Tracer(exporter), exporter.spans
+
+
+class TestSpans:
+    """Tests for span nesting and propagation."""
+
+    def test_parse_traceparent(self):
+        header = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+        assert parse_traceparent(header) == ("4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7")
+        assert parse_traceparent("00-xyz-00f067aa0ba902b7-01") is None
+        assert parse_traceparent(f"00-{'0' * 32}-00f067aa0ba902b7-01") is None
+        assert parse_traceparent(None) is None
+
+    def test_nesting_and_header_injection(self):
+        tracer, spans = make_tracer()
+        with tracer.span("request") as root:
+            with tracer.span("vllm.request"):
+                headers = tracer.inject({})
+        child, parent = spans
+
+        assert child["trace_id"] == parent["trace_id"] == root.trace_id
+        assert child["parent_id"] == parent["span_id"]
+        assert parse_traceparent(headers["traceparent"]) == (root.trace_id, child["span_id"])
+        assert tracer.current_span() is None
+
+    def test_context_follows_worker_threads(self):
+        tracer, spans = make_tracer()
+
+        @tracer.traced("model_call")
+        def work():
+            return tracer.current_span().name
+
+        async def handler():
+            with tracer.span("POST /ocr", traceparent="00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"):
+                return await asyncio.to_thread(work)
+
+        assert asyncio.run(handler()) == "model_call"
+        names = {span["name"]: span for span in spans}
+        assert names["POST /ocr"]["parent_id"] == "00f067aa0ba902b7"
+        assert names["model_call"]["parent_id"] == names["POST /ocr"]["span_id"]
+
+    def test_errors_and_disabled_tracer(self):
+        tracer, spans = make_tracer()
+        with pytest.raises(ValueError):
+            with tracer.span("postprocess"):
+                raise ValueError("bad output")
+        assert spans[0]["error"] == "ValueError: bad output"
+
+        disabled = Tracer()
+        with disabled.span("noop") as span:
+            span.set_attribute("ignored", True)
+        assert disabled.inject({}) == {}
+
+
+class TestAnalysis:
+    """Tests for the JSONL export and flame-style report."""
+
+    def test_jsonl_roundtrip_and_slowest(self, tmp_path):
+        path = tmp_path / "traces.jsonl"
+        exporter = JsonlExporter(str(path))
+        tracer = Tracer(exporter)
+        for name, delay in (("fast", 0.0), ("slow", 0.05), ("other", 0.0)):
+            with tracer.span(name, root=True):
+                with tracer.span("vllm.request"):
+                    time.sleep(delay)
+        exporter.close()
+
+        spans = load_spans(str(path))
+        assert len(spans) == 6
+        assert [trace_roots_name(trace) for trace in slowest_traces(spans, 1)] == ["slow"]
+        assert [trace_roots_name(trace) for trace in slowest_traces(spans, 5, name="fast")] == ["fast"]
+
+    def test_format_and_self_time(self):
+        spans = [
+            {"trace_id": "t", "span_id": "a", "parent_id": None, "name": "streamlit.ocr", "start": 0.0, "duration": 1.0},
+            {"trace_id": "t", "span_id": "b", "parent_id": "a", "name": "encode_png", "start": 0.0, "duration": 0.2},
+            {"trace_id": "t", "span_id": "c", "parent_id": "a", "name": "vllm.request", "start": 0.2, "duration": 0.7,
+             "error": "timeout"},
+        ]
+        text = format_trace(spans, width=10)
+
+        assert "1000.0 ms" in text
+        assert "  encode_png" in text
+        assert "vllm.request [error]" in text
+        assert dict(stage_totals([spans])) == pytest.approx(
+            {"vllm.request": 0.7, "encode_png": 0.2, "streamlit.ocr": 0.1}
+        )
+
+
+def trace_roots_name(trace):
+    """Name of the root span of a trace."""
+    return next(span["name"] for span in trace if span["parent_id"] is None)
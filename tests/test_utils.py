@@ -5,7 +5,8 @@ from PIL import Image
 import numpy as np
 
 from utils.image_processor import ImageProcessor
-from utils.text_extractor import TextExtractor
+from utils.preprocessing import PreprocessingEngine, summarize_timings
+from utils.text_extractor import TextExtractor, clean_ocr_result
 from utils.field_parser import FieldParser
 from utils.markdown_renderer import MarkdownRenderer
 
@@ -65,6 +66,53 @@ class TestImageProcessor:
         assert info["height"] == 1000
 
 
+class TestPreprocessingEngine:
+    """Tests for the NumPy preprocessing engine."""
+    
+    @pytest.fixture
+    def skewed_page(self):
+        """Create a page with ruled lines rotated by 3 degrees."""
+        from PIL import ImageDraw
+        page = Image.new('RGB', (1200, 1600), color='white')
+        draw = ImageDraw.Draw(page)
+        for y in range(150, 1450, 40):
+            draw.line([(150, y), (1050, y)], fill='black', width=3)
+        return page.rotate(3, fillcolor='white')
+    
+    def test_preprocess_array(self, sample_image):
+        """Test array output with stage timings."""
+        result = ImageProcessor.preprocess_array(sample_image, max_dimension=1500)
+        assert isinstance(result.array, np.ndarray)
+        assert result.array.dtype == np.uint8
+        assert max(result.array.shape[:2]) == 1500
+        assert "decode" in result.timings
+        assert "total" in result.timings
+    
+    def test_deskew_on_proxy(self, skewed_page):
+        """Test skew estimation and correction."""
+        result = PreprocessingEngine(deskew=True, resize=False, enhance=False).process(skewed_page)
+        assert abs(abs(result.skew_angle) - 3) < 0.5
+        
+        engine = PreprocessingEngine()
+        proxy, _ = engine.make_proxy(result.array)
+        assert abs(engine.estimate_skew(proxy)) < 0.5
+    
+    def test_crop_borders(self):
+        """Test border crop estimated on the proxy."""
+        page = np.full((2000, 1500, 3), 255, dtype=np.uint8)
+        page[400:1200, 300:900] = 0
+        cropped = ImageProcessor.crop_borders(Image.fromarray(page))
+        assert abs(cropped.size[0] - 620) <= 10
+        assert abs(cropped.size[1] - 820) <= 10
+    
+    def test_preprocess_batch(self, sample_image):
+        """Test batch preprocessing in a process pool."""
+        results = ImageProcessor.preprocess_batch([sample_image] * 3, max_workers=2, max_dimension=1000)
+        assert len(results) == 3
+        assert all(r.array.shape == (500, 1000, 3) for r in results)
+        assert "total" in summarize_timings(results)
+
+
 class TestTextExtractor:
     """Tests for TextExtractor class."""
     
@@ -128,6 +176,12 @@ class TestTextExtractor:
         bad_text = "!!!###$$$%%%^^^&&&***"
         bad_score = TextExtractor.calculate_confidence_score(bad_text)
         assert bad_score < 0.7  # Should have lower confidence
+    
+    def test_clean_ocr_result(self):
+        """Test OCR result cleanup (glued fields, star runs, blank lines)."""
+        text = "Дата24.01.2026\n\n\n**12 34**\nИтого  100руб"
+        assert clean_ocr_result(text) == "Дата 24.01.2026\nИтого  100руб"
+        assert clean_ocr_result("") == ""
 
 
 class TestFieldParser:
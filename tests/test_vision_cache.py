@@ -0,0 +1,142 @@
+"""Tests for the vision encoder output cache."""
+
+import numpy as np
+import torch
+from PIL import Image
+
+from utils.vision_cache import (
+    TensorLRUCache,
+    VisionCacheContext,
+    image_cache_key,
+    install_vision_cache,
+)
+
+
+class FakeVisionTower(torch.nn.Module):
+    """Qwen-style tower: one output row per patch, plus a per-layer list."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+        self.patches_seen = 0
+
+    def forward(self, pixel_values, grid_thw=None):
+        self.calls += 1
+        self.patches_seen += pixel_values.shape[0]
+        hidden = pixel_values * 2
+        return {"hidden": hidden, "layers": [hidden + 1, hidden + 2]}
+
+
+def _image_patches(value: float, count: int = 4) -> torch.Tensor:
+    return torch.full((count, 3), value)
+
+
+class TestImageCacheKey:
+    """Tests for cache key derivation."""
+
+    def test_same_pixels_same_key(self):
+        """PIL and repeated array inputs with equal pixels share a key."""
+        array = np.random.randint(0, 255, (32, 48, 3), dtype=np.uint8)
+        assert image_cache_key(array) == image_cache_key(array.copy())
+        assert image_cache_key(Image.fromarray(array)) == image_cache_key(Image.fromarray(array))
+
+    def test_processor_config_changes_key(self):
+        """Different processor settings produce different keys."""
+        array = np.zeros((8, 8, 3), dtype=np.uint8)
+        assert image_cache_key(array, {"max_pixels": 1280}) != image_cache_key(array, {"max_pixels": 640})
+
+
+class TestTensorLRUCache:
+    """Tests for the two-tier LRU."""
+
+    def test_eviction_order(self):
+        """Least recently used entries are evicted first."""
+        cache = TensorLRUCache(max_entries=2, max_device_entries=2)
+        cache.put("a", torch.zeros(1))
+        cache.put("b", torch.zeros(1))
+        cache.get("a")
+        cache.put("c", torch.zeros(1))
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert len(cache) == 2
+
+    def test_spill_to_cpu_tier(self):
+        """Entries beyond the device budget stay cached in the CPU tier."""
+        cache = TensorLRUCache(max_entries=4, max_device_entries=1)
+        cache.put("a", torch.zeros(1))
+        cache.put("b", torch.zeros(1))
+
+        stats = cache.stats()
+        assert stats["entries"] == 2
+        assert stats["device_entries"] == 1
+
+        assert cache.get("a", device="cpu") is not None
+        assert cache.stats()["device_entries"] == 1
+
+
+class TestInstallVisionCache:
+    """Tests for the cached vision tower forward."""
+
+    def setup_method(self):
+        self.tower = FakeVisionTower()
+        self.cache = TensorLRUCache(max_entries=8, max_device_entries=8)
+        self.context = VisionCacheContext()
+        install_vision_cache(self.tower, self.cache, self.context)
+
+    def test_passthrough_without_keys(self):
+        """Calls outside an active context run the original forward."""
+        pixels = _image_patches(1.0)
+        output = self.tower(pixels, grid_thw=torch.tensor([[1, 2, 2]]))
+
+        assert self.tower.calls == 1
+        assert torch.equal(output["hidden"], pixels * 2)
+        assert len(self.cache) == 0
+
+    def test_repeated_image_encoded_once(self):
+        """A batch of prompts over one image runs the tower on one copy."""
+        pixels = _image_patches(1.0).repeat(3, 1)
+        grid = torch.tensor([[1, 2, 2]]).repeat(3, 1)
+
+        with self.context.activate(["page"] * 3):
+            output = self.tower(pixels, grid_thw=grid)
+
+        assert self.tower.calls == 1
+        assert self.tower.patches_seen == 4
+        assert torch.equal(output["hidden"], pixels * 2)
+        assert torch.equal(output["layers"][1], pixels * 2 + 2)
+
+    def test_cached_across_calls(self):
+        """Later calls on the same image reuse the cached output."""
+        grid = torch.tensor([[1, 2, 2]])
+        with self.context.activate(["page"]):
+            self.tower(_image_patches(1.0), grid_thw=grid)
+        with self.context.activate(["page"]):
+            output = self.tower(_image_patches(1.0), grid_thw=grid)
+
+        assert self.tower.calls == 1
+        assert torch.equal(output["hidden"], _image_patches(2.0))
+        assert self.cache.stats()["hits"] == 1
+
+    def test_mixed_images_keep_order(self):
+        """Outputs for different images are concatenated in input order."""
+        pixels = torch.cat([_image_patches(1.0), _image_patches(5.0, count=8)])
+        grid = torch.tensor([[1, 2, 2], [1, 2, 4]])
+
+        with self.context.activate(["a", "b"]):
+            output = self.tower(pixels, grid_thw=grid)
+
+        assert self.tower.calls == 2
+        assert torch.equal(output["hidden"], pixels * 2)
+
+    def test_cached_entry_not_mutated(self):
+        """Callers reassigning output fields do not corrupt the cache."""
+        grid = torch.tensor([[1, 2, 2]])
+        with self.context.activate(["page"]):
+            first = self.tower(_image_patches(1.0), grid_thw=grid)
+        first["hidden"] = None
+
+        with self.context.activate(["page"]):
+            second = self.tower(_image_patches(1.0), grid_thw=grid)
+
+        assert torch.equal(second["hidden"], _image_patches(2.0))
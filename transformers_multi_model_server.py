@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 """
-Многомодельный сервер на базе Transformers с 8-bit квантизацией
+Многомодельный сервер на базе Transformers с профилями квантизации
 Поддерживает загрузку и переключение между моделями
 """
 
@@ -16,6 +16,14 @@ from transformers import AutoModelForCausalLM, AutoProcessor
 from flask import Flask, request, jsonify
 import gc
 
+from utils.quantization import (
+    REFERENCE_PROFILES,
+    QualificationStore,
+    apply_post_load_quantization,
+    profile_load_kwargs,
+    resolve_profile,
+)
+
 class MultiModelTransformersServer:
     def __init__(self):
         self.models = {}  # Загруженные модели
@@ -85,6 +93,10 @@ class MultiModelTransformersServer:
         }
         
         self.loading_status = {}  # Статус загрузки моделей
+        self.model_profiles = {}  # Профиль квантизации загруженных моделей
+        
+        # Профиль по умолчанию (GPU); используется, только если прошел квалификацию
+        self.default_profile = "int8"
         
     def get_gpu_memory_info(self):
         """Получение информации о GPU памяти"""
@@ -123,6 +135,17 @@ class MultiModelTransformersServer:
         
         return True, f"Достаточно памяти: {available_memory:.1f} GB доступно"
     
+    def select_profile(self, model_name, device):
+        """Профиль квантизации: настроенный для модели, если прошел квалификацию, иначе эталонный"""
+        config = {"quantization_profile": self.supported_models[model_name].get("quantization_profile", self.default_profile)}
+        profile = resolve_profile(config, device)
+        
+        allowed, reason = QualificationStore().is_allowed(model_name, profile, device)
+        if not allowed:
+            print(f"⚠️ Профиль {profile} для {model_name} не разрешен ({reason}), используем {REFERENCE_PROFILES[device]}")
+            return REFERENCE_PROFILES[device]
+        return profile
+    
     def load_model(self, model_name):
         """Загрузка модели с оптимизациями"""
         if model_name in self.models:
@@ -155,28 +178,27 @@ class MultiModelTransformersServer:
             }
             
             if gpu_info["available"] and gpu_info["free_gb"] >= model_config["memory_8bit_gb"]:
-                # GPU загрузка с 8-bit квантизацией
-                print(f"🎮 Загрузка на GPU с 8-bit квантизацией...")
+                device = "cuda"
                 load_params.update({
-                    "torch_dtype": torch.bfloat16,
                     "device_map": "auto",
-                    "load_in_8bit": True,
                     "max_memory": {0: f"{model_config['max_memory_gb']}GB"}
                 })
             else:
-                # CPU загрузка
-                print(f"💻 Загрузка на CPU...")
-                load_params.update({
-                    "torch_dtype": torch.float32,
-                    "device_map": "cpu"
-                })
+                device = "cpu"
+                load_params["device_map"] = "cpu"
+            
+            profile = self.select_profile(model_name, device)
+            print(f"{'🎮' if device == 'cuda' else '💻'} Загрузка на {device.upper()} с профилем {profile}...")
+            load_params.update(profile_load_kwargs(profile))
             
             # Загрузка модели
             print(f"🧠 Загрузка модели {model_config['name']}...")
             model = AutoModelForCausalLM.from_pretrained(model_name, **load_params)
+            apply_post_load_quantization(model, profile)
             
             # Сохранение в кеше
             self.models[model_name] = model
+            self.model_profiles[model_name] = profile
             self.processors[model_name] = processor
             self.loading_status[model_name] = "loaded"
             
@@ -209,6 +231,7 @@ class MultiModelTransformersServer:
             
             if model_name in self.loading_status:
                 del self.loading_status[model_name]
+            self.model_profiles.pop(model_name, None)
             
             # Очистка GPU кеша
             if torch.cuda.is_available():
@@ -314,7 +337,7 @@ class MultiModelTransformersServer:
                 "text": output_text.strip(),
                 "model": model_name,
                 "generation_time": generation_time,
-                "method": "transformers_8bit"
+                "method": f"transformers_{self.model_profiles.get(model_name)}"
             }
             
         except Exception as e:
@@ -1,6 +1,8 @@
 """Utility modules for image processing and text extraction."""
 
 from .image_processor import ImageProcessor
+from .preprocessing import PreprocessingEngine, PreprocessResult, preprocess_batch
+from .prefilter import PageFilter, HashIndex
 from .text_extractor import TextExtractor
 from .field_parser import FieldParser
 from .markdown_renderer import MarkdownRenderer
@@ -14,6 +16,21 @@ from .validators import (
     validate_text_input,
     sanitize_filename
 )
+from .ingest import (
+    ImageHeader,
+    IngestedImage,
+    ImageTooLargeError,
+    sniff_image_header,
+    decode_image_once
+)
+from .tiling import (
+    TilingPolicy,
+    select_tiling_policy,
+    split_into_tiles,
+    merge_tile_texts,
+    merge_tile_grid,
+    merge_tile_layouts
+)
 from .model_cache import (
     ModelCacheManager,
     check_model_availability,
@@ -23,6 +40,11 @@ from .model_cache import (
 __all__ = [
     # Image processing
     'ImageProcessor',
+    'PreprocessingEngine',
+    'PreprocessResult',
+    'preprocess_batch',
+    'PageFilter',
+    'HashIndex',
     
     # Text extraction
     'TextExtractor',
@@ -55,6 +77,21 @@ __all__ = [
     'validate_text_input',
     'sanitize_filename',
     
+    # Ingest
+    'ImageHeader',
+    'IngestedImage',
+    'ImageTooLargeError',
+    'sniff_image_header',
+    'decode_image_once',
+    
+    # Tiling
+    'TilingPolicy',
+    'select_tiling_policy',
+    'split_into_tiles',
+    'merge_tile_texts',
+    'merge_tile_grid',
+    'merge_tile_layouts',
+    
     # Model cache
     'ModelCacheManager',
     'check_model_availability',
@@ -0,0 +1,387 @@
+"""Attention backend capability probe.
+
+Instead of forcing eager attention everywhere, each backend
+(flash_attention_2 -> sdpa -> eager) is tried once per model class on a
+small synthetic attention forward with the model's head geometry, on the
+target device and dtype. Results are checked against a float32 reference
+and persisted in a JSON capability file keyed by GPU, driver, CUDA, torch
+and transformers versions, so the probe only runs again after a hardware
+or library change.
+
+Usage:
+    backend = select_attn_implementation("Qwen/Qwen3-VL-2B-Instruct")
+
+    python -m utils.attention_probe Qwen/Qwen3-VL-2B-Instruct --refresh
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+
+from utils.logger import logger
+
+try:
+    import transformers
+    TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    TRANSFORMERS_AVAILABLE = False
+
+try:
+    import pynvml
+    NVML_AVAILABLE = True
+except ImportError:
+    NVML_AVAILABLE = False
+
+
+# Preference order: fastest first
+ATTENTION_BACKENDS = ("flash_attention_2", "sdpa", "eager")
+
+DEFAULT_CAPABILITY_FILE = os.environ.get("ATTENTION_CAPABILITY_FILE", "attention_capabilities.json")
+
+# Geometry used when the model config cannot be read
+DEFAULT_GEOMETRY = {"num_heads": 16, "num_kv_heads": 16, "head_dim": 128}
+
+PROBE_SEQUENCE_LENGTH = 128
+
+_store_lock = threading.Lock()
+
+
+def _driver_version() -> str:
+    if not NVML_AVAILABLE:
+        return "unknown"
+    try:
+        pynvml.nvmlInit()
+        version = pynvml.nvmlSystemGetDriverVersion()
+        return version.decode() if isinstance(version, bytes) else str(version)
+    except Exception:
+        return "unknown"
+
+
+def _flash_attn_version() -> Optional[str]:
+    try:
+        import flash_attn
+        return getattr(flash_attn, "__version__", "installed")
+    except ImportError:
+        return None
+
+
+def environment_fingerprint(device: str = "cuda") -> Dict[str, Any]:
+    """
+    Describe the hardware and library versions that decide backend support.
+
+    Args:
+        device: 'cuda' or 'cpu'
+
+    Returns:
+        Dictionary with GPU, driver, CUDA, torch, transformers and flash-attn versions
+    """
+    info: Dict[str, Any] = {
+        "device": device,
+        "torch": torch.__version__,
+        "transformers": transformers.__version__ if TRANSFORMERS_AVAILABLE else None,
+        "flash_attn": _flash_attn_version(),
+    }
+    if device == "cuda" and torch.cuda.is_available():
+        major, minor = torch.cuda.get_device_capability(0)
+        info.update({
+            "gpu": torch.cuda.get_device_name(0),
+            "compute_capability": f"{major}.{minor}",
+            "cuda": torch.version.cuda,
+            "driver": _driver_version(),
+        })
+    return info
+
+
+def environment_key(fingerprint: Dict[str, Any]) -> str:
+    """Stable string key for a fingerprint."""
+    return "|".join(f"{key}={fingerprint[key]}" for key in sorted(fingerprint))
+
+
+def model_geometry(model_path: Optional[str]) -> Tuple[str, Dict[str, int]]:
+    """
+    Read architecture name and attention geometry from the model config.
+
+    Only config.json is read; weights are not loaded.
+
+    Args:
+        model_path: HuggingFace model id or local path
+
+    Returns:
+        (architecture, {num_heads, num_kv_heads, head_dim})
+    """
+    if not model_path or not TRANSFORMERS_AVAILABLE:
+        return model_path or "unknown", dict(DEFAULT_GEOMETRY)
+
+    try:
+        config = transformers.AutoConfig.from_pretrained(model_path, trust_remote_code=True)
+    except Exception as e:
+        logger.warning(f"Attention probe: cannot read config of {model_path}: {e}")
+        return model_path, dict(DEFAULT_GEOMETRY)
+
+    architecture = (getattr(config, "architectures", None) or [type(config).__name__])[0]
+    text_config = config.get_text_config() if hasattr(config, "get_text_config") else config
+
+    num_heads = getattr(text_config, "num_attention_heads", None) or DEFAULT_GEOMETRY["num_heads"]
+    num_kv_heads = getattr(text_config, "num_key_value_heads", None) or num_heads
+    hidden_size = getattr(text_config, "hidden_size", None)
+    head_dim = getattr(text_config, "head_dim", None) or (
+        hidden_size // num_heads if hidden_size else DEFAULT_GEOMETRY["head_dim"]
+    )
+    return architecture, {"num_heads": num_heads, "num_kv_heads": num_kv_heads, "head_dim": head_dim}
+
+
+def declared_support(architecture: str) -> Dict[str, bool]:
+    """
+    Backends the model class declares support for.
+
+    Remote-code classes are not importable here and are assumed to
+    support every backend; the synthetic forward still has to pass.
+    """
+    support = {backend: True for backend in ATTENTION_BACKENDS}
+    model_class = getattr(transformers, architecture, None) if TRANSFORMERS_AVAILABLE else None
+    if model_class is None:
+        return support
+
+    flash = getattr(model_class, "_supports_flash_attn", getattr(model_class, "_supports_flash_attn_2", True))
+    support["flash_attention_2"] = bool(flash)
+    support["sdpa"] = bool(getattr(model_class, "_supports_sdpa", True))
+    return support
+
+
+def _eager_attention(query: torch.Tensor, key: torch.Tensor, value: torch.Tensor) -> torch.Tensor:
+    scores = torch.matmul(query, key.transpose(-1, -2)) / (query.shape[-1] ** 0.5)
+    length = query.shape[-2]
+    causal = torch.ones(length, length, dtype=torch.bool, device=query.device).triu(1)
+    scores = scores.masked_fill(causal, float("-inf"))
+    return torch.matmul(torch.softmax(scores.float(), dim=-1).to(value.dtype), value)
+
+
+def _run_backend(backend: str, query: torch.Tensor, key: torch.Tensor, value: torch.Tensor) -> torch.Tensor:
+    """Run one backend on (batch, heads, seq, head_dim) inputs."""
+    groups = query.shape[1] // key.shape[1]
+
+    if backend == "flash_attention_2":
+        from flash_attn import flash_attn_func
+        # flash-attn layout is (batch, seq, heads, head_dim) and handles GQA itself
+        output = flash_attn_func(
+            query.transpose(1, 2), key.transpose(1, 2), value.transpose(1, 2), causal=True
+        )
+        return output.transpose(1, 2)
+
+    key = key.repeat_interleave(groups, dim=1)
+    value = value.repeat_interleave(groups, dim=1)
+    if backend == "sdpa":
+        return F.scaled_dot_product_attention(query, key, value, is_causal=True)
+    return _eager_attention(query, key, value)
+
+
+def probe_backend(
+    backend: str,
+    device: str,
+    dtype: torch.dtype,
+    geometry: Dict[str, int],
+    iterations: int = 3
+) -> Dict[str, Any]:
+    """
+    Try one attention backend on a synthetic causal forward.
+
+    Args:
+        backend: 'flash_attention_2', 'sdpa' or 'eager'
+        device: Target device
+        dtype: Target dtype
+        geometry: num_heads, num_kv_heads and head_dim of the model
+        iterations: Timed runs after the first call
+
+    Returns:
+        {"ok": bool, "error": str | None, "max_error": float, "ms": float}
+    """
+    if backend == "flash_attention_2":
+        if device != "cuda":
+            return {"ok": False, "error": "flash_attention_2 requires CUDA"}
+        if dtype not in (torch.float16, torch.bfloat16):
+            return {"ok": False, "error": f"flash_attention_2 does not support {dtype}"}
+        if _flash_attn_version() is None:
+            return {"ok": False, "error": "flash_attn is not installed"}
+
+    generator = torch.Generator(device="cpu").manual_seed(0)
+    shape = (1, geometry["num_heads"], PROBE_SEQUENCE_LENGTH, geometry["head_dim"])
+    kv_shape = (1, geometry["num_kv_heads"], PROBE_SEQUENCE_LENGTH, geometry["head_dim"])
+    query, key, value = (
+        torch.randn(s, generator=generator).to(device=device, dtype=dtype)
+        for s in (shape, kv_shape, kv_shape)
+    )
+
+    try:
+        with torch.no_grad():
+            output = _run_backend(backend, query, key, value)
+            if device == "cuda":
+                torch.cuda.synchronize()
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                _run_backend(backend, query, key, value)
+            if device == "cuda":
+                torch.cuda.synchronize()
+            elapsed_ms = (time.perf_counter() - start) * 1000 / max(1, iterations)
+
+            reference = _run_backend("eager", query.float(), key.float(), value.float())
+    except Exception as e:
+        return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+    if not torch.isfinite(output).all():
+        return {"ok": False, "error": "non-finite output"}
+
+    max_error = (output.float() - reference).abs().max().item()
+    tolerance = 1e-4 if dtype == torch.float32 else 2e-2
+    if max_error > tolerance:
+        return {"ok": False, "error": f"output mismatch ({max_error:.3g} > {tolerance})", "max_error": max_error}
+
+    return {"ok": True, "error": None, "max_error": max_error, "ms": round(elapsed_ms, 3)}
+
+
+class CapabilityStore:
+    """JSON file with probe results per environment and model class."""
+
+    def __init__(self, path: str = DEFAULT_CAPABILITY_FILE):
+        """
+        Initialize store.
+
+        Args:
+            path: Capability file path
+        """
+        self.path = Path(path)
+
+    def load(self) -> Dict[str, Any]:
+        """Read the whole file (empty dict if missing or unreadable)."""
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Attention probe: ignoring unreadable {self.path}: {e}")
+            return {}
+
+    def get(self, env_key: str, model_key: str) -> Optional[Dict[str, Any]]:
+        """Stored result for a model class in an environment."""
+        return self.load().get(env_key, {}).get("models", {}).get(model_key)
+
+    def put(self, env_key: str, fingerprint: Dict[str, Any], model_key: str, result: Dict[str, Any]) -> None:
+        """Store a result and write the file atomically."""
+        with _store_lock:
+            data = self.load()
+            entry = data.setdefault(env_key, {"environment": fingerprint, "models": {}})
+            entry["models"][model_key] = result
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+            tmp_path.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp_path, self.path)
+
+
+def probe_model(
+    architecture: str,
+    geometry: Dict[str, int],
+    device: str,
+    dtype: torch.dtype
+) -> Dict[str, Any]:
+    """
+    Probe all backends for one model class.
+
+    Returns:
+        {"best": backend, "backends": {backend: result}, "probed_at": iso time}
+    """
+    support = declared_support(architecture)
+    results: Dict[str, Any] = {}
+
+    for backend in ATTENTION_BACKENDS:
+        if not support[backend]:
+            results[backend] = {"ok": False, "error": f"{architecture} does not support {backend}"}
+            continue
+        results[backend] = probe_backend(backend, device, dtype, geometry)
+
+    best = next((backend for backend in ATTENTION_BACKENDS if results[backend]["ok"]), "eager")
+    return {
+        "best": best,
+        "backends": results,
+        "geometry": geometry,
+        "probed_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def select_attn_implementation(
+    model_path: Optional[str],
+    device: Optional[str] = None,
+    dtype: Optional[torch.dtype] = None,
+    capability_file: Optional[str] = None,
+    refresh: bool = False
+) -> str:
+    """
+    Return the fastest attention backend that passed the probe.
+
+    The probe runs once per model class and environment; later calls read
+    the persisted capability file.
+
+    Args:
+        model_path: HuggingFace model id or local path
+        device: 'cuda' or 'cpu' (default: cuda if available)
+        dtype: Compute dtype (default: float16 on CUDA, float32 on CPU)
+        capability_file: Capability file path (default ``DEFAULT_CAPABILITY_FILE``)
+        refresh: Probe again even if a stored result exists
+
+    Returns:
+        'flash_attention_2', 'sdpa' or 'eager'
+    """
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    dtype = dtype or (torch.float16 if device == "cuda" else torch.float32)
+
+    store = CapabilityStore(capability_file or DEFAULT_CAPABILITY_FILE)
+    fingerprint = environment_fingerprint(device)
+    env_key = environment_key(fingerprint)
+
+    architecture, geometry = model_geometry(model_path)
+    model_key = (
+        f"{architecture}:{str(dtype).replace('torch.', '')}:"
+        f"h{geometry['num_heads']}/{geometry['num_kv_heads']}x{geometry['head_dim']}"
+    )
+
+    if not refresh:
+        stored = store.get(env_key, model_key)
+        if stored is not None:
+            return stored["best"]
+
+    result = probe_model(architecture, geometry, device, dtype)
+    try:
+        store.put(env_key, fingerprint, model_key, result)
+    except OSError as e:
+        logger.warning(f"Attention probe: cannot write {store.path}: {e}")
+
+    failed = {name: r["error"] for name, r in result["backends"].items() if not r["ok"]}
+    logger.info(f"Attention probe for {model_key} on {device}: using {result['best']} (failed: {failed or 'none'})")
+    return result["best"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Probe attention backends for models")
+    parser.add_argument("model_paths", nargs="+", help="HF model ids or local paths")
+    parser.add_argument("--device", choices=["cuda", "cpu"])
+    parser.add_argument("--capability-file", default=DEFAULT_CAPABILITY_FILE)
+    parser.add_argument("--refresh", action="store_true", help="Ignore stored results")
+    args = parser.parse_args()
+
+    for model_path in args.model_paths:
+        backend = select_attn_implementation(
+            model_path, device=args.device, capability_file=args.capability_file, refresh=args.refresh
+        )
+        print(f"{model_path}: {backend}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""Cascade routing: cheapest capable model first, escalate on low quality.
+
+Clean printed pages are handled fine by small OCR models, so sending every
+page to the largest VLM wastes most of its cost. With ``model=auto`` the
+API runs the cascade tiers in order of cost and scores each output:
+
+- text confidence (``TextExtractor.calculate_confidence_score``),
+- garbage detection (raw tokenizer pieces, repeated words),
+- model error markers ("[GOT-OCR HF error: ...]"),
+- JSON validity when the output is (or should be) JSON,
+- fill rate of the expected fields (``FieldParser``) for known document
+  types or an explicit field list.
+
+The first output scoring at or above the threshold is returned; otherwise
+the next tier runs. If no tier passes, the best-scoring output is kept.
+
+config.yaml::
+
+    cascade:
+      threshold: 0.7
+      field_weight: 0.5
+      tiers:
+        - {model: got_ocr_hf, cost: 1.0}
+        - {model: qwen3_vl_2b, cost: 4.0}
+        - {model: qwen3_vl_8b, cost: 16.0}
+
+``cost`` is a relative per-page cost (e.g. GPU-seconds or price); the
+router reports per-tier hit rates and the blended cost per page, where an
+escalated page pays for every tier it went through.
+"""
+
+import json
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.field_parser import FieldParser
+from utils.logger import logger
+from utils.text_extractor import TextExtractor
+
+DEFAULT_CASCADE_SETTINGS: Dict[str, Any] = {
+    'threshold': 0.7,
+    # Share of the score taken by the expected-field fill rate
+    'field_weight': 0.5,
+    'tiers': [
+        {'model': 'got_ocr_hf', 'cost': 1.0},
+        {'model': 'qwen3_vl_2b', 'cost': 4.0},
+        {'model': 'qwen3_vl_8b', 'cost': 16.0},
+    ],
+}
+
+# Document types with a FieldParser parser
+FIELD_PARSERS: Dict[str, Callable[[str], Dict[str, Any]]] = {
+    'passport': FieldParser.parse_passport,
+    'invoice': FieldParser.parse_invoice,
+    'receipt': FieldParser.parse_receipt,
+}
+
+# Error/placeholder strings returned by the model wrappers instead of raising
+ERROR_MARKER = re.compile(r"^\s*\[[^\]]*(error|empty result|некорректный|ошибка)", re.IGNORECASE)
+
+
+def cascade_settings(config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Cascade settings from the application config.
+
+    Args:
+        config: Full config (``cascade`` section)
+
+    Returns:
+        Settings with defaults applied
+    """
+    return {**DEFAULT_CASCADE_SETTINGS, **((config or {}).get('cascade') or {})}
+
+
+@dataclass
+class OutputScore:
+    """Quality score of one model output."""
+
+    score: float
+    signals: Dict[str, Any] = field(default_factory=dict)
+    reasons: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'score': round(self.score, 3), 'signals': self.signals, 'reasons': self.reasons}
+
+
+def field_fill_rate(text: str, document_type: Optional[str] = None,
+                    fields: Optional[List[str]] = None) -> Optional[float]:
+    """
+    Share of expected fields found in the text.
+
+    Args:
+        text: OCR output
+        document_type: 'passport', 'invoice' or 'receipt'
+        fields: Explicit field names (take precedence over the document type)
+
+    Returns:
+        Fill rate in [0, 1], or None if no fields are expected
+    """
+    if fields:
+        values = FieldParser.parse_custom_fields(text, fields)
+    elif document_type in FIELD_PARSERS:
+        values = FIELD_PARSERS[document_type](text)
+    else:
+        return None
+
+    # Only scalar fields count (item lists are optional)
+    scalars = [value for value in values.values() if isinstance(value, str)]
+    if not scalars:
+        return None
+    return sum(1 for value in scalars if value.strip()) / len(scalars)
+
+
+def score_output(
+    text: str,
+    document_type: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    expect_json: bool = False,
+    field_weight: float = DEFAULT_CASCADE_SETTINGS['field_weight']
+) -> OutputScore:
+    """
+    Score an OCR output for the cascade.
+
+    Error markers, garbage and invalid JSON score 0. Otherwise the score
+    is the text confidence, blended with the expected-field fill rate when
+    fields are expected.
+
+    Args:
+        text: Model output
+        document_type: Document type for field expectations
+        fields: Explicit expected fields
+        expect_json: Output must be valid JSON
+        field_weight: Weight of the field fill rate
+
+    Returns:
+        OutputScore
+    """
+    text = text or ""
+    signals: Dict[str, Any] = {'chars': len(text.strip())}
+    reasons: List[str] = []
+
+    if ERROR_MARKER.match(text):
+        return OutputScore(0.0, signals, ["model error"])
+    if not text.strip():
+        return OutputScore(0.0, signals, ["empty output"])
+
+    signals['garbage'] = TextExtractor.is_garbage_output(text)
+    if signals['garbage']:
+        return OutputScore(0.0, signals, ["garbage output"])
+
+    stripped = text.strip()
+    if expect_json or stripped[:1] in ('{', '['):
+        try:
+            json.loads(stripped)
+            signals['json_valid'] = True
+        except ValueError:
+            signals['json_valid'] = False
+            return OutputScore(0.0, signals, ["invalid JSON"])
+
+    confidence = TextExtractor.calculate_confidence_score(text)
+    signals['confidence'] = round(confidence, 3)
+    score = confidence
+
+    fill = field_fill_rate(text, document_type, fields)
+    if fill is not None:
+        signals['field_fill'] = round(fill, 3)
+        score = (1 - field_weight) * confidence + field_weight * fill
+        if fill < 1.0:
+            reasons.append("missing fields")
+    if confidence < 1.0:
+        reasons.append("low text confidence")
+
+    return OutputScore(score, signals, reasons)
+
+
+@dataclass
+class CascadeResult:
+    """Outcome of one routed page."""
+
+    text: str
+    model: Optional[str]
+    tier: Optional[int]
+    score: float
+    passed: bool
+    attempts: List[Dict[str, Any]] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'model': self.model,
+            'tier': self.tier,
+            'score': round(self.score, 3),
+            'passed': self.passed,
+            'attempts': self.attempts,
+        }
+
+
+class CascadeStats:
+    """Per-tier hit rates and blended cost per page."""
+
+    def __init__(self, tiers: List[Dict[str, Any]]):
+        self.tiers = tiers
+        self.pages = 0
+        self.unresolved = 0
+        self.cost = 0.0
+        self.seconds = 0.0
+        self._tiers = {tier['model']: {'attempts': 0, 'accepted': 0, 'errors': 0, 'seconds': 0.0}
+                       for tier in tiers}
+        self._lock = threading.Lock()
+
+    def record(self, result: CascadeResult) -> None:
+        """Record one routed page."""
+        with self._lock:
+            self.pages += 1
+            self.unresolved += 0 if result.passed else 1
+            for attempt in result.attempts:
+                entry = self._tiers[attempt['model']]
+                entry['attempts'] += 1
+                entry['seconds'] += attempt['seconds']
+                entry['errors'] += 1 if attempt.get('error') else 0
+                self.cost += attempt['cost']
+                self.seconds += attempt['seconds']
+            if result.passed:
+                self._tiers[result.model]['accepted'] += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Hit rate = pages accepted by a tier / pages that reached it."""
+        with self._lock:
+            tiers = []
+            for tier in self.tiers:
+                entry = self._tiers[tier['model']]
+                tiers.append({
+                    'model': tier['model'],
+                    'cost': tier['cost'],
+                    **{key: round(value, 3) if isinstance(value, float) else value for key, value in entry.items()},
+                    'hit_rate': round(entry['accepted'] / entry['attempts'], 3) if entry['attempts'] else None,
+                    'share_of_pages': round(entry['accepted'] / self.pages, 3) if self.pages else None,
+                })
+
+            largest = max((tier['cost'] for tier in self.tiers), default=0.0)
+            blended = self.cost / self.pages if self.pages else None
+            return {
+                'pages': self.pages,
+                'unresolved': self.unresolved,
+                'tiers': tiers,
+                'blended_cost_per_page': round(blended, 3) if blended is not None else None,
+                'largest_tier_cost_per_page': largest,
+                'cost_saving': round(1 - blended / largest, 3) if blended is not None and largest else None,
+                'seconds_per_page': round(self.seconds / self.pages, 3) if self.pages else None,
+            }
+
+
+class CascadeRouter:
+    """Runs cascade tiers in order until an output passes the threshold."""
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            settings: Cascade settings (see ``cascade_settings``)
+        """
+        self.settings = {**DEFAULT_CASCADE_SETTINGS, **(settings or {})}
+        self.tiers = [{'cost': 1.0, **tier} for tier in self.settings['tiers']]
+        if not self.tiers:
+            raise ValueError("Cascade needs at least one tier")
+        self.threshold = self.settings['threshold']
+        self.stats = CascadeStats(self.tiers)
+
+    def route(
+        self,
+        run: Callable[[str], str],
+        document_type: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        expect_json: bool = False
+    ) -> CascadeResult:
+        """
+        Route one page through the tiers.
+
+        Args:
+            run: Function running OCR with the given model key
+            document_type: Document type for field expectations
+            fields: Explicit expected fields
+            expect_json: Outputs must be valid JSON
+
+        Returns:
+            CascadeResult with the accepted (or best) output and all attempts
+        """
+        attempts: List[Dict[str, Any]] = []
+        best: Optional[CascadeResult] = None
+
+        for index, tier in enumerate(self.tiers):
+            model = tier['model']
+            start = time.time()
+            try:
+                text = run(model)
+                error = None
+            except Exception as e:
+                text, error = "", f"{type(e).__name__}: {e}"
+                logger.warning(f"Cascade tier {model} failed: {error}")
+            seconds = time.time() - start
+
+            score = score_output(text, document_type, fields, expect_json, self.settings['field_weight'])
+            passed = error is None and score.score >= self.threshold
+            attempts.append({
+                'model': model,
+                'cost': tier['cost'],
+                'seconds': round(seconds, 3),
+                'error': error,
+                **score.to_dict(),
+            })
+
+            if best is None or score.score > best.score:
+                best = CascadeResult(text, model, index, score.score, passed)
+            if passed:
+                best = CascadeResult(text, model, index, score.score, True)
+                break
+            if index + 1 < len(self.tiers):
+                logger.info(f"Cascade: {model} score {score.score:.2f} < {self.threshold}, escalating")
+
+        best.attempts = attempts
+        self.stats.record(best)
+        return best
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-tier hit rates and blended cost."""
+        return {'threshold': self.threshold, **self.stats.to_dict()}
@@ -0,0 +1,332 @@
+"""Static KV cache + torch.compile execution mode for ``generate()``.
+
+By default every wrapper calls ``model.generate()`` with a dynamic KV
+cache, which grows (and reallocates) every step and cannot be compiled.
+The "compiled" execution mode instead:
+
+- preallocates a ``StaticCache`` whose length is the prompt plus the
+  generation budget rounded up to a bucket, so only a handful of shapes
+  ever reach the compiler and caches are reused between calls;
+- lets Transformers run the decode step through ``torch.compile``
+  (``CompileConfig``), on CPU as well as on GPU;
+- compiles the buckets listed for warm-up at load time, so the first
+  request does not pay the compilation cost;
+- falls back to the regular dynamic-cache path for good if compilation
+  fails (torch._dynamo / inductor errors) or a static cache cannot be
+  created. Out-of-memory and input errors are raised to the caller and
+  leave the compiled mode on.
+
+Enable it per model in config.yaml::
+
+    execution_mode: compiled
+    compiled_generation:
+      buckets: [1024, 2048, 4096]
+      warmup_buckets: [2048]
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+import torch
+
+from utils.logger import logger
+
+try:
+    from transformers import StaticCache
+    from transformers.generation.configuration_utils import CompileConfig
+    STATIC_CACHE_AVAILABLE = True
+except ImportError:
+    STATIC_CACHE_AVAILABLE = False
+
+
+EXECUTION_MODES = ('default', 'compiled')
+
+DEFAULT_COMPILE_SETTINGS: Dict[str, Any] = {
+    # Total cache lengths (prompt + max_new_tokens) that get their own graph
+    'buckets': [512, 1024, 2048, 4096, 8192],
+    # Buckets compiled at load time
+    'warmup_buckets': [2048],
+    'mode': 'reduce-overhead',
+    'fullgraph': False,
+    # Attention backend used with compilation (eager attention compiles poorly)
+    'attn_implementation': 'sdpa',
+    # Static caches kept alive for reuse, keyed by (batch, bucket)
+    'max_cached': 2,
+}
+
+# Modules whose exceptions mean the graph could not be traced or compiled
+COMPILE_ERROR_MODULES = ('torch._dynamo', 'torch._inductor')
+
+OUT_OF_MEMORY_ERRORS = (torch.cuda.OutOfMemoryError, MemoryError)
+
+
+def execution_mode(config: Optional[Dict[str, Any]]) -> str:
+    """Return the configured execution mode ('default' or 'compiled')."""
+    mode = (config or {}).get('execution_mode', 'default')
+    if mode not in EXECUTION_MODES:
+        logger.warning(f"Unknown execution_mode '{mode}', using 'default'")
+        return 'default'
+    return mode
+
+
+def compile_settings(config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Compiled-mode settings with ``compiled_generation`` overrides applied."""
+    overrides = (config or {}).get('compiled_generation') or {}
+    return {**DEFAULT_COMPILE_SETTINGS, **overrides}
+
+
+def bucket_length(length: int, buckets: Sequence[int]) -> int:
+    """
+    Round a cache length up to the nearest bucket.
+
+    Lengths beyond the largest bucket are rounded up to a multiple of it,
+    so very long requests still share a few shapes.
+
+    Args:
+        length: Required cache length (prompt + generation budget)
+        buckets: Bucket sizes
+
+    Returns:
+        Bucketed length
+    """
+    ordered = sorted(buckets)
+    for bucket in ordered:
+        if length <= bucket:
+            return bucket
+    largest = ordered[-1]
+    return -(-length // largest) * largest
+
+
+def _new_static_cache(model: torch.nn.Module, batch_size: int, max_cache_len: int) -> Any:
+    config = model.config
+    try:
+        # Transformers 5.x: layers are allocated lazily on first update
+        return StaticCache(config=config, max_cache_len=max_cache_len)
+    except TypeError:
+        parameter = next(model.parameters())
+        return StaticCache(
+            config=config,
+            max_batch_size=batch_size,
+            max_cache_len=max_cache_len,
+            device=parameter.device,
+            dtype=parameter.dtype
+        )
+
+
+def is_compile_error(error: BaseException) -> bool:
+    """
+    Whether an error comes from torch.compile rather than from the inputs.
+
+    Transformers may wrap compiler errors, so the whole cause chain is
+    checked; out-of-memory errors are never treated as compile errors.
+
+    Args:
+        error: Exception raised by a compiled ``generate()`` call
+
+    Returns:
+        True for torch._dynamo / torch._inductor failures
+    """
+    found = False
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, OUT_OF_MEMORY_ERRORS):
+            return False
+        found = found or type(error).__module__.startswith(COMPILE_ERROR_MODULES)
+        error = error.__cause__ or error.__context__
+    return found
+
+
+def reset_generation_state(gen_kwargs: Dict[str, Any]) -> None:
+    """Reset stateful stopping criteria / logits processors / streamer before a retry."""
+    for key in ('stopping_criteria', 'logits_processor'):
+        for item in gen_kwargs.get(key) or []:
+            reset = getattr(item, 'reset', None)
+            if callable(reset):
+                reset()
+    reset = getattr(gen_kwargs.get('streamer'), 'reset', None)
+    if callable(reset):
+        reset()
+
+
+class CompiledGenerator:
+    """Runs ``model.generate()`` with a bucketed static cache and compiled decoding."""
+
+    def __init__(self, model: torch.nn.Module, settings: Optional[Dict[str, Any]] = None, name: str = "model"):
+        """
+        Initialize compiled generator.
+
+        Args:
+            model: Loaded Transformers model with ``generate()``
+            settings: Compiled-mode settings (see ``DEFAULT_COMPILE_SETTINGS``)
+            name: Model name for logs
+        """
+        self.model = model
+        self.settings = {**DEFAULT_COMPILE_SETTINGS, **(settings or {})}
+        self.name = name
+        self.enabled = STATIC_CACHE_AVAILABLE
+        self.failure: Optional[str] = None
+        self._caches: "OrderedDict[Tuple[int, int], Any]" = OrderedDict()
+        self.stats: Dict[str, Any] = {'compiled_calls': 0, 'fallback_calls': 0, 'warmup_seconds': {}}
+
+        if not STATIC_CACHE_AVAILABLE:
+            self.failure = "StaticCache/CompileConfig not available in this transformers version"
+            logger.warning(f"{name}: compiled mode unavailable ({self.failure})")
+            return
+
+        compile_config = CompileConfig(
+            fullgraph=self.settings['fullgraph'],
+            dynamic=False,
+            mode=self.settings['mode']
+        )
+        # Transformers only auto-compiles on accelerators unless asked otherwise
+        compile_config._compile_all_devices = True
+        model.generation_config.compile_config = compile_config
+        model.generation_config.disable_compile = False
+
+    def _cache_for(self, batch_size: int, length: int) -> Any:
+        bucket = bucket_length(length, self.settings['buckets'])
+        key: Tuple[int, int] = (batch_size, bucket)
+
+        cache = self._caches.get(key)
+        if cache is None:
+            cache = _new_static_cache(self.model, batch_size, bucket)
+            self._caches[key] = cache
+            while len(self._caches) > self.settings['max_cached']:
+                self._caches.popitem(last=False)
+        else:
+            cache.reset()
+        self._caches.move_to_end(key)
+        return cache
+
+    def disable(self, error: Exception) -> None:
+        """Switch to the dynamic-cache path for the rest of the session (compile errors only)."""
+        self.enabled = False
+        self.failure = f"{type(error).__name__}: {error}"
+        self._caches.clear()
+        self.model.generation_config.compile_config = None
+        self.model.generation_config.disable_compile = True
+        logger.warning(f"{self.name}: compiled generation disabled, falling back to dynamic cache ({self.failure})")
+
+    def generate(self, inputs: Dict[str, Any], **gen_kwargs) -> torch.Tensor:
+        """
+        Drop-in replacement for ``model.generate(**inputs, **gen_kwargs)``.
+
+        Args:
+            inputs: Model inputs (input_ids, attention_mask, pixel_values, ...)
+            **gen_kwargs: generate() parameters; ``max_new_tokens`` sizes the cache
+
+        Returns:
+            Generated ids, as returned by ``generate()``
+
+        Raises:
+            Errors other than compile errors (out of memory, invalid inputs)
+        """
+        cache = None
+        if self.enabled:
+            input_ids = inputs['input_ids']
+            length = input_ids.shape[1] + gen_kwargs.get('max_new_tokens', self.model.generation_config.max_new_tokens or 0)
+            try:
+                cache = self._cache_for(input_ids.shape[0], length)
+            except (AttributeError, TypeError, ValueError, NotImplementedError) as e:
+                # The model config does not support a static cache
+                self.disable(e)
+
+        if cache is not None:
+            try:
+                output = self.model.generate(**inputs, past_key_values=cache, **gen_kwargs)
+                self.stats['compiled_calls'] += 1
+                return output
+            except Exception as e:
+                if not is_compile_error(e):
+                    raise
+                self.disable(e)
+                reset_generation_state(gen_kwargs)
+
+        self.stats['fallback_calls'] += 1
+        return self.model.generate(**inputs, **gen_kwargs)
+
+    def warmup(self, token_id: int, buckets: Optional[Iterable[int]] = None, new_tokens: int = 4) -> None:
+        """
+        Compile the decode step for the given buckets with a text-only prompt.
+
+        Compile errors disable the compiled mode; other errors (e.g. a model
+        that needs image inputs) only end the warm-up.
+
+        Args:
+            token_id: Any valid text token id (e.g. the EOS or pad token)
+            buckets: Buckets to compile (default ``warmup_buckets``)
+            new_tokens: Decode steps to run per bucket
+        """
+        buckets = list(buckets if buckets is not None else self.settings['warmup_buckets'])
+        device = next(self.model.parameters()).device
+
+        for bucket in buckets:
+            if not self.enabled:
+                return
+            input_ids = torch.full((1, 8), token_id, dtype=torch.long, device=device)
+            inputs = {'input_ids': input_ids, 'attention_mask': torch.ones_like(input_ids)}
+            start = time.time()
+            try:
+                cache = self._cache_for(1, bucket)
+            except (AttributeError, TypeError, ValueError, NotImplementedError) as e:
+                self.disable(e)
+                return
+            try:
+                with torch.no_grad():
+                    self.model.generate(
+                        **inputs,
+                        past_key_values=cache,
+                        max_new_tokens=new_tokens,
+                        min_new_tokens=new_tokens,
+                        do_sample=False
+                    )
+            except Exception as e:
+                if is_compile_error(e):
+                    self.disable(e)
+                elif isinstance(e, OUT_OF_MEMORY_ERRORS):
+                    raise
+                else:
+                    logger.warning(f"{self.name}: warm-up skipped ({type(e).__name__}: {e})")
+                return
+            elapsed = round(time.time() - start, 2)
+            self.stats['warmup_seconds'][bucket] = elapsed
+            logger.info(f"{self.name}: compiled decode step for cache bucket {bucket} in {elapsed}s")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Execution mode state for diagnostics."""
+        return {
+            'enabled': self.enabled,
+            'failure': self.failure,
+            'buckets': list(self.settings['buckets']),
+            'cached_buckets': [key[1] for key in self._caches],
+            **self.stats
+        }
+
+
+def build_compiled_generator(
+    model: torch.nn.Module,
+    config: Optional[Dict[str, Any]],
+    name: str,
+    warmup_token_id: Optional[int] = None
+) -> Optional[CompiledGenerator]:
+    """
+    Create (and warm up) a compiled generator if the model config asks for it.
+
+    Args:
+        model: Loaded model
+        config: Model config (``execution_mode: compiled`` enables it)
+        name: Model name for logs
+        warmup_token_id: Token id for warm-up prompts; warm-up is skipped if None
+
+    Returns:
+        CompiledGenerator, or None in the default execution mode
+    """
+    if execution_mode(config) != 'compiled':
+        return None
+
+    generator = CompiledGenerator(model, compile_settings(config), name=name)
+    if generator.enabled and warmup_token_id is not None:
+        generator.warmup(warmup_token_id)
+    return generator
@@ -0,0 +1,462 @@
+"""Container state cache kept current by the Docker events stream.
+
+Container managers used to re-derive state by polling: ``docker ps`` in
+a subprocess, one Docker API call per model per status check and sleep
+loops while a model starts. ``ContainerRegistry`` reads all containers
+once, then follows Docker's events stream on a background thread. On
+each lifecycle event (create, start, die, health_status, rename, ...)
+it inspects that one container, and on destroy it drops the entry.
+Reads come from the in-memory table: status, health, published ports
+and the served model.
+
+Waiters block on a condition variable that every transition notifies,
+so a startup wait returns as soon as Docker reports the container
+healthy, or reports that it died. There is no fixed sleep. Containers
+without a healthcheck can be given an HTTP probe, which runs between
+events.
+
+The event source is pluggable. ``DockerEventSource`` uses the Docker SDK
+(``pip install docker``), and ``FakeEventSource`` drives the registry in
+tests.
+
+Usage:
+    registry = get_container_registry()
+    state = registry.get("dots-ocr-fixed")
+    ready, state = registry.wait_until_ready("dots-ocr-fixed", timeout=120)
+"""
+
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import docker
+    DOCKER_AVAILABLE = True
+except ImportError:
+    DOCKER_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Events that change state worth re-inspecting (exec_*, attach, ... do not)
+LIFECYCLE_ACTIONS = frozenset({
+    "create", "start", "restart", "die", "stop", "kill", "oom", "pause", "unpause", "rename", "update",
+})
+
+
+@dataclass
+class ContainerState:
+    """Known state of one container."""
+
+    id: str
+    name: str
+    image: str = ""
+    status: str = "unknown"  # created, running, paused, restarting, exited, dead, removed
+    health: str = "none"  # none (no healthcheck), starting, healthy, unhealthy
+    ports: Dict[int, int] = field(default_factory=dict)  # container port -> host port
+    model: Optional[str] = None
+    exit_code: Optional[int] = None
+    started_at: str = ""
+    updated: float = field(default_factory=time.time)
+
+    @property
+    def running(self) -> bool:
+        return self.status == "running"
+
+    @property
+    def healthy(self) -> bool:
+        return self.running and self.health == "healthy"
+
+    @property
+    def stopped(self) -> bool:
+        """Exited, dead or removed: it will not become ready by waiting."""
+        return self.status in ("exited", "dead", "removed")
+
+    @classmethod
+    def from_attrs(cls, attrs: Dict[str, Any]) -> "ContainerState":
+        """State from ``docker inspect`` output."""
+        state = attrs.get("State") or {}
+        config = attrs.get("Config") or {}
+        ports = {}
+        for port, bindings in ((attrs.get("NetworkSettings") or {}).get("Ports") or {}).items():
+            for binding in bindings or []:
+                if binding.get("HostPort"):
+                    ports[int(port.split("/")[0])] = int(binding["HostPort"])
+                    break
+        return cls(
+            id=attrs.get("Id", ""),
+            name=attrs.get("Name", "").lstrip("/"),
+            image=config.get("Image", ""),
+            status=state.get("Status", "unknown"),
+            health=(state.get("Health") or {}).get("Status", "none"),
+            ports=ports,
+            model=model_argument(config.get("Cmd") or []),
+            exit_code=state.get("ExitCode") if state.get("Status") in ("exited", "dead") else None,
+            started_at=state.get("StartedAt", ""),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id, "name": self.name, "image": self.image, "status": self.status, "health": self.health,
+            "ports": dict(self.ports), "model": self.model, "exit_code": self.exit_code,
+            "started_at": self.started_at, "updated": self.updated,
+        }
+
+
+def model_argument(command: List[str]) -> Optional[str]:
+    """Value of ``--model`` in a vLLM command line."""
+    for i, arg in enumerate(command):
+        if arg == "--model" and i + 1 < len(command):
+            return command[i + 1]
+        if arg.startswith("--model="):
+            return arg.split("=", 1)[1]
+    return None
+
+
+class DockerEventSource:
+    """Snapshot, inspect and events of the local Docker daemon."""
+
+    def __init__(self, client: Any = None):
+        if client is None:
+            if not DOCKER_AVAILABLE:
+                raise ImportError("docker is required for the container registry: pip install docker")
+            client = docker.from_env()
+        self.client = client
+        self._stream = None
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [self.client.api.inspect_container(c["Id"]) for c in self.client.api.containers(all=True)]
+
+    def inspect(self, container_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            return self.client.api.inspect_container(container_id)
+        except docker.errors.NotFound:
+            return None
+
+    def events(self, since: float) -> Iterator[Dict[str, Any]]:
+        self._stream = self.client.events(since=int(since), filters={"type": "container"}, decode=True)
+        return iter(self._stream)
+
+    def close(self) -> None:
+        if self._stream is not None:
+            self._stream.close()
+
+
+class FakeEventSource:
+    """
+    In-memory Docker stand-in for tests.
+
+    Helper methods change a container's inspect data and emit the matching
+    event, like the daemon would.
+    """
+
+    def __init__(self):
+        self.containers: Dict[str, Dict[str, Any]] = {}
+        self.inspects = 0
+        self._created = 0
+        self._events: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [dict(attrs) for attrs in self.containers.values()]
+
+    def inspect(self, container_id: str) -> Optional[Dict[str, Any]]:
+        self.inspects += 1
+        attrs = self.containers.get(container_id)
+        return dict(attrs) if attrs is not None else None
+
+    def events(self, since: float) -> Iterator[Dict[str, Any]]:
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            yield event
+
+    def close(self) -> None:
+        self._events.put(None)
+
+    def emit(self, container_id: str, action: str, **attributes: Any) -> None:
+        attrs = self.containers.get(container_id, {})
+        name = attrs.get("Name", "").lstrip("/")
+        self._events.put({
+            "Type": "container", "Action": action, "time": int(time.time()),
+            "Actor": {"ID": container_id, "Attributes": {"name": name, **attributes}},
+        })
+
+    def create(self, name: str, image: str = "vllm/vllm-openai:latest", ports: Optional[Dict[int, int]] = None,
+               model: Optional[str] = None, healthcheck: bool = True, emit: bool = True) -> str:
+        self._created += 1
+        container_id = f"{self._created:012x}"
+        self.containers[container_id] = {
+            "Id": container_id,
+            "Name": f"/{name}",
+            "Config": {"Image": image, "Cmd": ["--model", model] if model else []},
+            "State": {"Status": "created", **({"Health": {"Status": "starting"}} if healthcheck else {})},
+            "NetworkSettings": {"Ports": {
+                f"{inner}/tcp": [{"HostIp": "0.0.0.0", "HostPort": str(outer)}] for inner, outer in (ports or {}).items()
+            }},
+        }
+        if emit:
+            self.emit(container_id, "create")
+        return container_id
+
+    def start(self, container_id: str) -> None:
+        self.containers[container_id]["State"]["Status"] = "running"
+        self.emit(container_id, "start")
+
+    def set_health(self, container_id: str, health: str) -> None:
+        self.containers[container_id]["State"]["Health"] = {"Status": health}
+        self.emit(container_id, f"health_status: {health}")
+
+    def die(self, container_id: str, exit_code: int = 1) -> None:
+        self.containers[container_id]["State"].update(Status="exited", ExitCode=exit_code)
+        self.emit(container_id, "die", exitCode=str(exit_code))
+
+    def destroy(self, container_id: str) -> None:
+        self.emit(container_id, "destroy")
+        del self.containers[container_id]
+
+
+class ContainerRegistry:
+    """
+    In-memory container table following the Docker events stream.
+
+    ``start`` loads a snapshot synchronously, so reads are valid as soon
+    as it returns, then follows events on a background thread. If the
+    stream breaks (daemon restart), the thread reloads the snapshot and
+    resubscribes.
+    """
+
+    def __init__(self, source: Any = None, reconnect_delay: float = 2.0):
+        """
+        Args:
+            source: Event source (default: ``DockerEventSource()``)
+            reconnect_delay: Seconds before resubscribing after a broken stream
+        """
+        self.source = source if source is not None else DockerEventSource()
+        self.reconnect_delay = reconnect_delay
+        self.events_seen = 0
+        self._containers: Dict[str, ContainerState] = {}  # name -> state
+        self._condition = threading.Condition()
+        self._listeners: List[Callable[[Optional[ContainerState], Optional[ContainerState]], None]] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    def start(self) -> "ContainerRegistry":
+        if self._thread is not None:
+            return self
+        self._stop.clear()
+        since = self._load_snapshot()
+        self._thread = threading.Thread(target=self._run, args=(since,), name="container-registry", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self.source.close()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _load_snapshot(self) -> float:
+        since = time.time()
+        states = {}
+        for attrs in self.source.snapshot():
+            state = ContainerState.from_attrs(attrs)
+            states[state.name] = state
+        with self._condition:
+            previous, self._containers = self._containers, states
+            self._condition.notify_all()
+        for name in set(previous) | set(states):
+            if previous.get(name) != states.get(name):
+                self._notify(previous.get(name), states.get(name))
+        return since
+
+    def _run(self, since: float) -> None:
+        while not self._stop.is_set():
+            try:
+                for event in self.source.events(since):
+                    self.apply(event)
+                    since = event.get("time", since)
+                    if self._stop.is_set():
+                        return
+            except Exception as e:
+                logger.warning(f"Docker events stream failed: {e}")
+            if self._stop.wait(self.reconnect_delay):
+                return
+            try:
+                since = self._load_snapshot()
+            except Exception as e:
+                logger.warning(f"Container snapshot failed: {e}")
+
+    # ------------------------------------------------------------------
+    # Events
+    # ------------------------------------------------------------------
+
+    def apply(self, event: Dict[str, Any]) -> None:
+        """Update the table from one Docker event."""
+        if event.get("Type", "container") != "container":
+            return
+        action = event.get("Action", "")
+        kind = action.split(":", 1)[0]
+        actor = event.get("Actor") or {}
+        container_id = actor.get("ID", "")
+        self.events_seen += 1
+
+        if kind == "destroy":
+            self._update_by_id(container_id, None)
+        elif kind in LIFECYCLE_ACTIONS or kind == "health_status":
+            attrs = self.source.inspect(container_id)
+            self._update_by_id(container_id, ContainerState.from_attrs(attrs) if attrs else None)
+
+    def _update_by_id(self, container_id: str, state: Optional[ContainerState]) -> None:
+        with self._condition:
+            old_name = next((name for name, s in self._containers.items() if s.id == container_id), None)
+            old = self._containers.pop(old_name) if old_name is not None else None
+            if state is not None:
+                self._containers[state.name] = state
+            self._condition.notify_all()
+        if old != state:
+            self._notify(old, state)
+
+    def subscribe(self, listener: Callable[[Optional[ContainerState], Optional[ContainerState]], None]) -> None:
+        """Call ``listener(old, new)`` on every transition (None: absent)."""
+        self._listeners.append(listener)
+
+    def _notify(self, old: Optional[ContainerState], new: Optional[ContainerState]) -> None:
+        for listener in list(self._listeners):
+            try:
+                listener(old, new)
+            except Exception as e:
+                logger.warning(f"Container listener failed: {e}")
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+
+    def get(self, name: str) -> Optional[ContainerState]:
+        """State of a container by name (None if it does not exist)."""
+        with self._condition:
+            state = self._containers.get(name)
+            return replace(state) if state is not None else None
+
+    def containers(self, running_only: bool = False) -> Dict[str, ContainerState]:
+        """All known containers by name."""
+        with self._condition:
+            return {name: replace(state) for name, state in self._containers.items()
+                    if state.running or not running_only}
+
+    def find_model(self, model: str) -> Optional[ContainerState]:
+        """Running container serving ``model`` (the ``--model`` argument)."""
+        for state in self.containers(running_only=True).values():
+            if state.model == model:
+                return state
+        return None
+
+    # ------------------------------------------------------------------
+    # Waits
+    # ------------------------------------------------------------------
+
+    def wait_for(self, name: str, predicate: Callable[[Optional[ContainerState]], bool],
+                 timeout: float) -> Tuple[bool, Optional[ContainerState]]:
+        """
+        Block until ``predicate(state)`` holds for a container.
+
+        Returns:
+            (whether the predicate held before the timeout, last state)
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                state = self._containers.get(name)
+                if predicate(state):
+                    return True, replace(state) if state is not None else None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False, replace(state) if state is not None else None
+                self._condition.wait(remaining)
+
+    def wait_until_gone(self, name: str, timeout: float = 30.0) -> bool:
+        """Wait until a container is removed (or stopped, if it is kept)."""
+        return self.wait_for(name, lambda s: s is None or s.stopped, timeout)[0]
+
+    def wait_until_ready(self, name: str, timeout: float, probe: Optional[Callable[[ContainerState], bool]] = None,
+                         probe_interval: float = 5.0,
+                         on_change: Optional[Callable[[Optional[ContainerState]], None]] = None
+                         ) -> Tuple[bool, Optional[ContainerState]]:
+        """
+        Wait until a container can serve requests.
+
+        Ready means Docker health "healthy"; containers without a
+        healthcheck are ready once running and ``probe(state)`` succeeds
+        (probed at most every ``probe_interval`` seconds). Returns early,
+        not ready, if the container exits, turns unhealthy or is removed
+        after the wait began; a stopped state recorded before the wait
+        began is taken as the previous run and waited out.
+
+        Args:
+            name: Container name
+            timeout: Seconds to wait
+            probe: Readiness check for containers without a healthcheck
+            probe_interval: Seconds between probes
+            on_change: Called with the state after every transition (and
+                probe), e.g. to update a progress display
+
+        Returns:
+            (ready, last state)
+        """
+        began = time.time()
+        deadline = time.monotonic() + timeout
+        seen = False
+        last: Any = ()
+        while True:
+            state = self.get(name)
+            if state != last and on_change is not None:
+                on_change(state)
+            last = state
+            if state is not None:
+                fresh = state.updated >= began
+                seen = seen or fresh
+                if state.healthy:
+                    return True, state
+                if fresh and (state.stopped or state.health == "unhealthy"):
+                    return False, state
+                if state.running and state.health == "none" and probe is not None and probe(state):
+                    return True, state
+            elif seen:
+                return False, None
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False, state
+            wait = remaining
+            if state is not None and state.running and state.health == "none" and probe is not None:
+                wait = min(wait, probe_interval)
+            self.wait_for(name, lambda s, last=state: s != last, wait)
+
+
+_registry: Optional[ContainerRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_container_registry() -> ContainerRegistry:
+    """Process-wide registry, started on first use (one events subscription)."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ContainerRegistry().start()
+        return _registry
+
+
+def set_container_registry(registry: Optional[ContainerRegistry]) -> None:
+    """Replace the process-wide registry (tests, custom sources)."""
+    global _registry
+    with _registry_lock:
+        if _registry is not None and _registry is not registry:
+            _registry.stop()
+        _registry = registry
@@ -0,0 +1,564 @@
+"""CPU execution mode for GPU-less worker nodes.
+
+Small OCR models (GOT-OCR HF, 580M) are cheap enough to scale out on CPU
+boxes, but a single process with default threading uses the cores poorly:
+one image at a time, with intra-op threads contending for memory
+bandwidth. This module provides:
+
+- CPU topology detection (physical cores per socket),
+- explicit intra-/inter-op thread settings and core pinning,
+- the preferred reduced-precision CPU profile (bf16 on CPUs with
+  AVX512-BF16/AMX, dynamic int8 otherwise),
+- ``ReplicaPool``: N model replicas in separate processes, each pinned to
+  its own cores; tasks are handed to idle replicas one at a time, and a
+  replica that dies (OOM kill, segfault) fails its task instead of
+  leaving the caller waiting forever,
+- ``measure_scaling``: throughput from 1 to N replicas.
+
+Model config (``cpu`` section):
+
+    cpu:
+      profile: auto            # auto | cpu_bf16 | cpu_int8_dynamic | fp32
+      intra_op_threads: null   # single process: torch default
+      inter_op_threads: 1
+      threads_per_replica: 1
+      replicas_per_socket: auto
+
+Usage:
+    pool = ReplicaPool(ModelReplicaFactory("got_ocr_hf"))
+    with pool:
+        texts = pool.map(images)
+"""
+
+import multiprocessing as mp
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import torch
+
+from utils.logger import logger
+
+DEFAULT_CPU_SETTINGS: Dict[str, Any] = {
+    'profile': 'auto',
+    'intra_op_threads': None,
+    'inter_op_threads': 1,
+    'threads_per_replica': 1,
+    'replicas_per_socket': 'auto',
+}
+
+# CPU flags with native bf16 matmul support
+BF16_CPU_FLAGS = ('avx512_bf16', 'amx_bf16')
+
+_threads_locked = False
+
+
+def cpu_settings(config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    CPU settings of a model config merged with the defaults.
+
+    Args:
+        config: Model config (``cpu`` section)
+
+    Returns:
+        Settings dictionary
+    """
+    settings = dict(DEFAULT_CPU_SETTINGS)
+    settings.update((config or {}).get('cpu') or {})
+    return settings
+
+
+def cpu_flags() -> set:
+    """Feature flags of the first CPU from /proc/cpuinfo (empty if unavailable)."""
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+
+def cpu_supports_bf16() -> bool:
+    """Whether the CPU runs bf16 matmuls natively (AVX512-BF16 or AMX)."""
+    return any(flag in cpu_flags() for flag in BF16_CPU_FLAGS)
+
+
+def preferred_cpu_profile(requested: str = 'auto') -> str:
+    """
+    CPU quantization profile for the ``cpu.profile`` setting.
+
+    ``auto`` selects bf16 where the CPU supports it natively and dynamic
+    int8 otherwise (emulated bf16 is slower than fp32).
+
+    Args:
+        requested: Configured profile or 'auto'
+
+    Returns:
+        Profile name
+    """
+    if requested != 'auto':
+        return requested
+    return 'cpu_bf16' if cpu_supports_bf16() else 'cpu_int8_dynamic'
+
+
+def available_cpus() -> List[int]:
+    """Logical CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def cpu_topology(sysfs: str = "/sys/devices/system/cpu") -> Dict[int, List[int]]:
+    """
+    Physical cores per socket.
+
+    One logical CPU is kept per physical core, so SMT siblings do not end
+    up in different replicas fighting for the same core.
+
+    Args:
+        sysfs: sysfs CPU directory
+
+    Returns:
+        Mapping socket id -> logical CPU ids (one per physical core)
+    """
+    sockets: Dict[int, Dict[int, int]] = {}
+    for cpu in available_cpus():
+        topology = Path(sysfs) / f"cpu{cpu}" / "topology"
+        try:
+            socket = int((topology / "physical_package_id").read_text().strip())
+            core = int((topology / "core_id").read_text().strip())
+        except (OSError, ValueError):
+            return {0: available_cpus()}
+        sockets.setdefault(socket, {}).setdefault(core, cpu)
+
+    if not sockets:
+        return {0: available_cpus()}
+    return {socket: sorted(cores.values()) for socket, cores in sorted(sockets.items())}
+
+
+def plan_replicas(
+    threads_per_replica: int = 1,
+    replicas_per_socket: Any = 'auto',
+    topology: Optional[Dict[int, List[int]]] = None
+) -> List[List[int]]:
+    """
+    Core sets for the replicas.
+
+    Replicas never span sockets; each gets ``threads_per_replica``
+    physical cores of one socket.
+
+    Args:
+        threads_per_replica: Cores (and intra-op threads) per replica
+        replicas_per_socket: Replicas per socket or 'auto' (fill the socket)
+        topology: Socket topology (default: detected)
+
+    Returns:
+        List of core id lists, one per replica
+    """
+    topology = topology if topology is not None else cpu_topology()
+    threads_per_replica = max(1, int(threads_per_replica))
+    plan = []
+    for cores in topology.values():
+        fit = len(cores) // threads_per_replica
+        count = fit if replicas_per_socket in (None, 'auto') else min(fit, int(replicas_per_socket))
+        for index in range(count):
+            plan.append(cores[index * threads_per_replica:(index + 1) * threads_per_replica])
+    return plan
+
+
+def configure_threads(
+    intra_op_threads: Optional[int] = None,
+    inter_op_threads: Optional[int] = None,
+    cores: Optional[Sequence[int]] = None,
+    lock: bool = False
+) -> None:
+    """
+    Set torch thread pools and, optionally, pin the process to cores.
+
+    Once called with ``lock=True`` (replica workers) later calls are
+    ignored, so model loading cannot undo the replica layout.
+
+    Args:
+        intra_op_threads: Threads inside one op (None keeps torch's default)
+        inter_op_threads: Threads running independent ops (None keeps the default)
+        cores: Logical CPUs to pin the process to
+        lock: Ignore later calls in this process
+    """
+    global _threads_locked
+    if _threads_locked:
+        return
+
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, set(cores))
+    if intra_op_threads:
+        torch.set_num_threads(int(intra_op_threads))
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(int(inter_op_threads))
+        except RuntimeError:
+            # Can only be set once, before the first parallel op
+            logger.debug(f"Inter-op threads already initialized, keeping {torch.get_num_interop_threads()}")
+
+    _threads_locked = lock
+
+
+def configure_cpu_execution(config: Optional[Dict[str, Any]]) -> None:
+    """
+    Apply the thread settings of a model config in a CPU-only process.
+
+    Args:
+        config: Model config
+    """
+    settings = cpu_settings(config)
+    configure_threads(settings['intra_op_threads'], settings['inter_op_threads'])
+    logger.info(
+        f"CPU execution: {torch.get_num_threads()} intra-op / "
+        f"{torch.get_num_interop_threads()} inter-op threads"
+    )
+
+
+class ModelReplicaFactory:
+    """Loads a model in a replica process and returns its OCR function."""
+
+    def __init__(self, model_key: str, method: str = "process_image", **load_kwargs):
+        """
+        Args:
+            model_key: Model key from config.yaml
+            method: Model method applied to each task payload
+            **load_kwargs: Extra ModelLoader.load_model arguments
+        """
+        self.model_key = model_key
+        self.method = method
+        self.load_kwargs = load_kwargs
+
+    def __call__(self) -> Callable[[Any], Any]:
+        from models.model_loader import ModelLoader
+
+        model = ModelLoader.load_model(self.model_key, **self.load_kwargs)
+        return getattr(model, self.method)
+
+
+def _replica_main(index: int, cores: List[int], threads: int, inter_op_threads: int,
+                  factory: Callable[[], Callable[[Any], Any]], tasks, results) -> None:
+    """Replica process: pin, load the model, serve tasks until the sentinel."""
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    configure_threads(threads, inter_op_threads, cores, lock=True)
+
+    try:
+        handler = factory()
+    except Exception as e:
+        results.send(("failed", f"{type(e).__name__}: {e}"))
+        return
+    results.send(("ready", None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, payload = task
+        try:
+            results.send((task_id, (True, handler(payload))))
+        except Exception as e:
+            results.send((task_id, (False, f"{type(e).__name__}: {e}")))
+
+
+class ReplicaPool:
+    """
+    Model replicas in separate processes behind one task queue.
+
+    The queue stays in this process: the collector thread hands each task
+    to an idle replica, so it always knows which task a replica is running.
+    Each replica answers on its own pipe, so a killed replica cannot leave
+    a shared queue lock held. Replica processes are checked whenever a
+    pipe closes and every ``health_interval`` seconds; when one dies, its
+    running task fails with a ``RuntimeError``, the other replicas take
+    over the queue, and queued tasks fail once no replica is left.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Callable[[Any], Any]],
+        replicas: Optional[int] = None,
+        threads_per_replica: int = 1,
+        inter_op_threads: int = 1,
+        replicas_per_socket: Any = 'auto',
+        topology: Optional[Dict[int, List[int]]] = None,
+        health_interval: float = 0.5
+    ):
+        """
+        Args:
+            factory: Picklable callable run in each replica; returns the task handler
+            replicas: Replica count (default: every core set of the plan)
+            threads_per_replica: Cores and intra-op threads per replica
+            inter_op_threads: Inter-op threads per replica
+            replicas_per_socket: Replicas per socket or 'auto'
+            topology: Socket topology (default: detected)
+            health_interval: Seconds between checks of the replica processes
+        """
+        self.factory = factory
+        self.health_interval = health_interval
+        self.threads_per_replica = threads_per_replica
+        self.inter_op_threads = inter_op_threads
+        self.core_sets = plan_replicas(threads_per_replica, replicas_per_socket, topology)
+        if not self.core_sets:
+            raise ValueError(f"No core set fits {threads_per_replica} threads per replica")
+        if replicas is not None:
+            if replicas > len(self.core_sets):
+                logger.warning(f"{replicas} replicas requested, only {len(self.core_sets)} fit the cores")
+            self.core_sets = self.core_sets[:replicas]
+
+        self.processes: List[Any] = []
+        self.processed: List[int] = [0] * len(self.core_sets)
+        self._tasks: List[Any] = []
+        self._results: List[Any] = []
+        self._futures: Dict[int, Future] = {}
+        self._pending: Deque[Tuple[int, Any]] = deque()
+        # Replica index -> id of the task it is running
+        self._running: Dict[int, int] = {}
+        self._idle: List[int] = []
+        self._dead: Set[int] = set()
+        self._closing = False
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._collector: Optional[threading.Thread] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.core_sets)
+
+    def start(self, timeout: float = 600.0) -> "ReplicaPool":
+        """
+        Start the replicas and wait until every model is loaded.
+
+        Args:
+            timeout: Seconds to wait for the replicas
+
+        Returns:
+            The pool
+        """
+        context = mp.get_context("spawn")
+        self._tasks = [context.Queue() for _ in self.core_sets]
+        self._results = []
+
+        for index, cores in enumerate(self.core_sets):
+            reader, writer = context.Pipe(duplex=False)
+            process = context.Process(
+                target=_replica_main,
+                args=(index, cores, self.threads_per_replica, self.inter_op_threads,
+                      self.factory, self._tasks[index], writer),
+                daemon=True
+            )
+            process.start()
+            # Only the replica keeps the write end, so its death closes the pipe
+            writer.close()
+            self.processes.append(process)
+            self._results.append(reader)
+
+        deadline = time.time() + timeout
+        for index, reader in enumerate(self._results):
+            try:
+                if not reader.poll(max(0.1, deadline - time.time())):
+                    self.close()
+                    raise TimeoutError(f"Replicas not ready after {timeout}s ({index}/{self.size})")
+                status, error = reader.recv()
+            except EOFError:
+                status, error = "failed", f"exit code {self.processes[index].exitcode}"
+            if status == "failed":
+                self.close()
+                raise RuntimeError(f"Replica {index} failed to start: {error}")
+
+        self._idle = list(range(self.size))
+        self._dead = set()
+        self._closing = False
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        logger.info(f"Replica pool ready: {self.size} x {self.threads_per_replica} thread(s), cores {self.core_sets}")
+        return self
+
+    def _dispatch(self) -> None:
+        """Hand queued tasks to idle replicas (called with the lock held)."""
+        while self._pending and self._idle:
+            index = self._idle.pop()
+            task_id, payload = self._pending.popleft()
+            self._running[index] = task_id
+            self._tasks[index].put((task_id, payload))
+
+    def _check_replicas(self) -> None:
+        """Fail the tasks of replicas that died, and all queued tasks once none is left."""
+        failed: List[Tuple[Future, str]] = []
+        with self._lock:
+            if self._closing:
+                return
+            for index, process in enumerate(self.processes):
+                if index in self._dead or process.is_alive():
+                    continue
+                self._dead.add(index)
+                if index in self._idle:
+                    self._idle.remove(index)
+                error = f"Replica {index} died (exit code {process.exitcode})"
+                logger.error(error)
+                task_id = self._running.pop(index, None)
+                if task_id is not None:
+                    failed.append((self._futures.pop(task_id), error))
+
+            if len(self._dead) == self.size:
+                while self._pending:
+                    task_id, _ = self._pending.popleft()
+                    failed.append((self._futures.pop(task_id), "No replica left"))
+
+        for future, error in failed:
+            future.set_exception(RuntimeError(error))
+
+    def _collect(self) -> None:
+        while not self._closing:
+            readers = {self._results[index]: index
+                       for index in range(self.size) if index not in self._dead}
+            for reader in wait(list(readers), timeout=self.health_interval):
+                try:
+                    task_id, (ok, value) = reader.recv()
+                except (EOFError, OSError):
+                    continue
+                index = readers[reader]
+                self.processed[index] += 1
+                with self._lock:
+                    future = self._futures.pop(task_id, None)
+                    self._running.pop(index, None)
+                    self._idle.append(index)
+                    self._dispatch()
+                if future is None:
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(RuntimeError(value))
+            self._check_replicas()
+
+    def submit(self, payload: Any) -> Future:
+        """
+        Queue one task for the next free replica.
+
+        Args:
+            payload: Task payload (must be picklable)
+
+        Returns:
+            Future with the handler result
+
+        Raises:
+            RuntimeError: The pool is not started or all replicas died
+        """
+        if self._collector is None:
+            raise RuntimeError("Replica pool is not started")
+        future: Future = Future()
+        with self._lock:
+            if len(self._dead) == self.size:
+                raise RuntimeError("No replica left")
+            task_id = self._next_id
+            self._next_id += 1
+            self._futures[task_id] = future
+            self._pending.append((task_id, payload))
+            self._dispatch()
+        return future
+
+    def map(self, payloads: Iterable[Any]) -> List[Any]:
+        """Run tasks on the replicas; results keep the input order."""
+        futures = [self.submit(payload) for payload in payloads]
+        return [future.result() for future in futures]
+
+    def process_image(self, image: Any) -> Any:
+        """Model-compatible single image call."""
+        return self.submit(image).result()
+
+    def process_batch(self, images: List[Any], prompt: Optional[str] = None, **kwargs) -> List[Any]:
+        """Model-compatible batch call: the images are spread across the replicas."""
+        return self.map(images)
+
+    def close(self, timeout: float = 30.0) -> None:
+        """Stop the replicas and the result collector; unfinished tasks fail."""
+        with self._lock:
+            self._closing = True
+        for process, tasks in zip(self.processes, self._tasks):
+            if process.is_alive():
+                tasks.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+
+        if self._collector is not None:
+            self._collector.join(timeout)
+            self._collector = None
+        for reader in self._results:
+            reader.close()
+        self._results = []
+
+        with self._lock:
+            futures = list(self._futures.values())
+            self._futures.clear()
+            self._pending.clear()
+            self._running.clear()
+            self._idle = []
+        for future in futures:
+            future.set_exception(RuntimeError("Replica pool closed"))
+
+    def unload(self) -> None:
+        """Model-compatible unload."""
+        self.close()
+
+    def __enter__(self) -> "ReplicaPool":
+        return self.start() if self._collector is None else self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def measure_scaling(
+    factory: Callable[[], Callable[[Any], Any]],
+    payloads: Sequence[Any],
+    replica_counts: Sequence[int],
+    threads_per_replica: int = 1,
+    topology: Optional[Dict[int, List[int]]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Throughput of the replica pool for each replica count.
+
+    Each pool serves one warm-up task per replica before timing, so model
+    loading and first-call overhead are excluded.
+
+    Args:
+        factory: Replica factory
+        payloads: Tasks processed in each run
+        replica_counts: Replica counts to measure (e.g. 1..N)
+        threads_per_replica: Cores per replica
+        topology: Socket topology (default: detected)
+
+    Returns:
+        One row per replica count with items/s, speedup and scaling efficiency
+    """
+    rows = []
+    for count in replica_counts:
+        with ReplicaPool(factory, replicas=count, threads_per_replica=threads_per_replica,
+                         topology=topology) as pool:
+            pool.map(list(payloads[:pool.size]))
+            start = time.perf_counter()
+            pool.map(payloads)
+            seconds = time.perf_counter() - start
+            rows.append({
+                'replicas': pool.size,
+                'seconds': round(seconds, 3),
+                'items_per_second': round(len(payloads) / seconds, 3),
+                'per_replica': list(pool.processed),
+            })
+
+    base = rows[0]['items_per_second'] if rows else 0
+    for row in rows:
+        row['speedup'] = round(row['items_per_second'] / base, 2) if base else None
+        row['efficiency'] = round(row['speedup'] / row['replicas'], 2) if base else None
+    return rows
@@ -0,0 +1,195 @@
+"""Lazy page iteration for multi-page TIFF and PDF documents.
+
+Pages are decoded one at a time so memory stays bounded regardless of
+document length: TIFF frames are decoded frame by frame and PDF pages
+are rasterized page by page with a local rasterizer (pypdfium2, with
+PyMuPDF as a fallback) at a DPI matched to the model's pixel budget.
+"""
+
+import math
+from dataclasses import dataclass
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+from .ingest import DEFAULT_MAX_MEGAPIXELS, ImageTooLargeError, open_image_lazy
+from .validators import ValidationError
+
+try:
+    import pypdfium2 as pdfium
+    PDFIUM_AVAILABLE = True
+except ImportError:
+    PDFIUM_AVAILABLE = False
+
+try:
+    import fitz  # PyMuPDF
+    PYMUPDF_AVAILABLE = True
+except ImportError:
+    PYMUPDF_AVAILABLE = False
+
+
+PDF_MAGIC = b"%PDF"
+MIN_DPI = 72
+MAX_DPI = 300
+
+
+@dataclass
+class DocumentPage:
+    """Single decoded page of a document."""
+    index: int
+    array: np.ndarray
+    dpi: Optional[float] = None
+
+    @property
+    def size(self):
+        """(width, height) of the decoded page."""
+        return (self.array.shape[1], self.array.shape[0])
+
+
+def is_pdf(content: bytes) -> bool:
+    """Check the PDF signature (may be preceded by a few junk bytes)."""
+    return PDF_MAGIC in content[:1024]
+
+
+def dpi_for_budget(width_pt: float, height_pt: float, pixel_budget: int) -> float:
+    """
+    DPI at which a page of the given size fits the pixel budget.
+
+    Args:
+        width_pt: Page width in PDF points (1/72 inch)
+        height_pt: Page height in PDF points
+        pixel_budget: Target number of pixels
+
+    Returns:
+        DPI clamped to [MIN_DPI, MAX_DPI]
+    """
+    area_in = (width_pt / 72.0) * (height_pt / 72.0)
+    if area_in <= 0:
+        return float(MIN_DPI)
+    dpi = math.sqrt(pixel_budget / area_in)
+    return float(min(MAX_DPI, max(MIN_DPI, dpi)))
+
+
+def count_pages(content: bytes) -> int:
+    """Number of pages/frames without decoding pixel data."""
+    if is_pdf(content):
+        if PDFIUM_AVAILABLE:
+            pdf = pdfium.PdfDocument(content)
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
+        if PYMUPDF_AVAILABLE:
+            with fitz.open(stream=content, filetype="pdf") as doc:
+                return doc.page_count
+        raise ValidationError("PDF support requires pypdfium2 or PyMuPDF")
+
+    return getattr(open_image_lazy(content), "n_frames", 1)
+
+
+def check_page_size(index: int, width: float, height: float, max_megapixels: float) -> None:
+    """Raise ImageTooLargeError if a page would decode to more than ``max_megapixels``."""
+    megapixels = width * height / 1_000_000
+    if megapixels > max_megapixels:
+        raise ImageTooLargeError(
+            f"Page {index + 1} is {megapixels:.1f} MP, maximum is {max_megapixels:.0f} MP"
+        )
+
+
+def iter_image_frames(
+    content: bytes,
+    max_megapixels: float = DEFAULT_MAX_MEGAPIXELS
+) -> Iterator[DocumentPage]:
+    """
+    Decode TIFF (or any multi-frame image) frame by frame.
+
+    Each frame's size is checked from its header before it is decoded.
+    """
+    image = open_image_lazy(content)
+
+    for index in range(getattr(image, "n_frames", 1)):
+        image.seek(index)
+        check_page_size(index, *image.size, max_megapixels)
+        frame = image.convert('RGB') if image.mode != 'RGB' else image.copy()
+        yield DocumentPage(index=index, array=np.asarray(frame))
+
+
+def iter_pdf_pages(
+    content: bytes,
+    pixel_budget: int,
+    max_megapixels: float = DEFAULT_MAX_MEGAPIXELS
+) -> Iterator[DocumentPage]:
+    """
+    Rasterize PDF pages one at a time at a budget-matched DPI.
+
+    The DPI is clamped to ``MIN_DPI``, so huge pages (posters, drawings)
+    may render above the budget; each page's rendered size is checked
+    from its dimensions before it is rasterized.
+    """
+    if PDFIUM_AVAILABLE:
+        pdf = pdfium.PdfDocument(content)
+        try:
+            for index in range(len(pdf)):
+                page = pdf[index]
+                try:
+                    width_pt, height_pt = page.get_size()
+                    dpi = dpi_for_budget(width_pt, height_pt, pixel_budget)
+                    check_page_size(index, width_pt * dpi / 72.0, height_pt * dpi / 72.0, max_megapixels)
+                    bitmap = page.render(scale=dpi / 72.0)
+                    array = np.asarray(bitmap.to_pil().convert('RGB'))
+                finally:
+                    page.close()
+                yield DocumentPage(index=index, array=array, dpi=round(dpi, 1))
+        finally:
+            pdf.close()
+        return
+
+    if PYMUPDF_AVAILABLE:
+        with fitz.open(stream=content, filetype="pdf") as doc:
+            for index, page in enumerate(doc):
+                dpi = dpi_for_budget(page.rect.width, page.rect.height, pixel_budget)
+                check_page_size(
+                    index, page.rect.width * int(dpi) / 72.0, page.rect.height * int(dpi) / 72.0, max_megapixels
+                )
+                pixmap = page.get_pixmap(dpi=int(dpi), alpha=False)
+                array = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(
+                    pixmap.height, pixmap.width, pixmap.n
+                )[:, :, :3].copy()
+                yield DocumentPage(index=index, array=array, dpi=round(dpi, 1))
+        return
+
+    raise ValidationError("PDF support requires pypdfium2 or PyMuPDF")
+
+
+def iter_document_pages(
+    content: bytes,
+    pixel_budget: int,
+    max_megapixels: float = DEFAULT_MAX_MEGAPIXELS
+) -> Iterator[DocumentPage]:
+    """
+    Lazily iterate over the pages of a PDF, multi-page TIFF or single image.
+
+    Args:
+        content: Encoded document bytes
+        pixel_budget: Model pixel budget used to choose the PDF DPI
+        max_megapixels: Per-page decoded (or rendered) size limit
+
+    Yields:
+        DocumentPage objects in page order
+    """
+    if is_pdf(content):
+        yield from iter_pdf_pages(content, pixel_budget, max_megapixels)
+    else:
+        yield from iter_image_frames(content, max_megapixels)
+
+
+def iter_page_batches(pages: Iterator[DocumentPage], batch_size: int) -> Iterator[List[DocumentPage]]:
+    """Group a page iterator into lists of at most ``batch_size`` pages."""
+    batch: List[DocumentPage] = []
+    for page in pages:
+        batch.append(page)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,275 @@
+"""Deterministic fake VLM backend for load tests without a GPU.
+
+Load tests of api.py and the vLLM adapter need a model whose latency
+behaves like a real one (prefill, then one decode step per token, with
+steps slowing down as more sequences share the device) but which needs
+no weights. The fake backend derives its output from a digest of the
+input, so the same image and prompt always produce the same text and the
+same number of tokens, and sleeps for the modelled latency.
+
+Two faces share the latency model:
+- ``FakeVLMModel`` (models/fake_vlm.py) plugs into ``ModelLoader`` as
+  ``fake_vlm`` (with ``ENABLE_FAKE_MODELS=1``) and runs inside api.py
+  like any local model.
+- ``FakeOpenAIServer`` is an OpenAI-compatible ``/v1/chat/completions``
+  server (streaming and non-streaming) standing in for vLLM.
+
+Usage:
+    server = FakeOpenAIServer({"per_token_ms": 5, "output_tokens": 64})
+    uvicorn.run(server.app(), port=8000)
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from utils.singleflight import content_digest
+
+try:
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+    FASTAPI_AVAILABLE = True
+except ImportError:
+    FASTAPI_AVAILABLE = False
+
+
+DEFAULT_FAKE_SETTINGS = {
+    "prefill_ms": 30.0,          # Prefill per sequence (image encoding + prompt)
+    "per_token_ms": 4.0,         # Decode step of a single sequence
+    "batch_step_overhead": 0.1,  # Relative step slowdown per extra sequence in the batch
+    "output_tokens": 48,         # Mean generated tokens (actual count varies by input)
+    "image_tokens": 256,         # Prompt tokens accounted per image
+    "max_num_seqs": 16,          # Sequences decoded together by the fake server
+    "seed": 0,                   # Changes outputs without changing inputs
+}
+
+# Vocabulary of the generated text
+WORDS = (
+    "invoice", "total", "date", "amount", "name", "address", "number", "passport",
+    "receipt", "table", "line", "page", "signature", "tax", "item", "price",
+    "the", "of", "and", "to", "in", "for", "with", "on",
+)
+
+
+def fake_settings(config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Resolve fake backend settings.
+
+    Args:
+        config: Model config or overrides; unknown keys are ignored
+
+    Returns:
+        Settings dictionary with defaults filled in
+    """
+    settings = dict(DEFAULT_FAKE_SETTINGS)
+    for key in DEFAULT_FAKE_SETTINGS:
+        if config and config.get(key) is not None:
+            settings[key] = type(DEFAULT_FAKE_SETTINGS[key])(config[key])
+    return settings
+
+
+def fake_tokens(content: Any, prompt: Optional[str], max_tokens: int,
+                settings: Dict[str, Any]) -> List[str]:
+    """
+    Deterministic output tokens for an input.
+
+    Args:
+        content: Image content (see ``content_digest``)
+        prompt: Prompt text
+        max_tokens: Generation limit
+        settings: Fake backend settings
+
+    Returns:
+        Between half and one and a half times ``output_tokens`` words,
+        capped at ``max_tokens``
+    """
+    seed = hashlib.sha256(f"{content_digest(content)}:{prompt}:{settings['seed']}".encode()).hexdigest()
+    rng = random.Random(int(seed[:16], 16))
+    count = max(1, int(settings["output_tokens"] * (0.5 + rng.random())))
+    return [rng.choice(WORDS) for _ in range(min(count, max(1, max_tokens)))]
+
+
+def prompt_tokens(prompt: Optional[str], images: int, settings: Dict[str, Any]) -> int:
+    """Prompt token count: words of the prompt plus a fixed count per image."""
+    return len((prompt or "").split()) + images * settings["image_tokens"]
+
+
+def prefill_seconds(sequences: int, settings: Dict[str, Any]) -> float:
+    """Prefill time of a batch of sequences."""
+    return settings["prefill_ms"] / 1000 * sequences
+
+
+def step_seconds(active: int, settings: Dict[str, Any]) -> float:
+    """Decode step time with ``active`` sequences sharing the device."""
+    return settings["per_token_ms"] / 1000 * (1 + settings["batch_step_overhead"] * max(0, active - 1))
+
+
+def generate_batch(token_lists: List[List[str]], settings: Dict[str, Any], streamer: Any = None) -> None:
+    """
+    Sleep through prefill and decode of a batch, like ``generate()``.
+
+    Args:
+        token_lists: Output tokens of every sequence
+        settings: Fake backend settings
+        streamer: Optional ``generate()`` streamer; receives the prompt
+            first and then one entry per active sequence per step
+    """
+    if streamer is not None:
+        streamer.put([0] * prompt_tokens(None, len(token_lists), settings))
+    time.sleep(prefill_seconds(len(token_lists), settings))
+    for step in range(max(len(tokens) for tokens in token_lists)):
+        active = sum(1 for tokens in token_lists if len(tokens) > step)
+        time.sleep(step_seconds(active, settings))
+        if streamer is not None:
+            streamer.put([0] * active)
+    if streamer is not None:
+        streamer.end()
+
+
+def message_content(messages: List[Dict[str, Any]]) -> tuple:
+    """
+    Prompt text and image references of OpenAI chat messages.
+
+    Returns:
+        (prompt, images) where images are the image URLs (data URLs included)
+    """
+    texts, images = [], []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                texts.append(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                images.append(part.get("image_url", {}).get("url", ""))
+    return "\n".join(texts), images
+
+
+class FakeOpenAIServer:
+    """OpenAI-compatible chat completions server with modelled latency."""
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None, model_name: str = "fake/vlm"):
+        """
+        Args:
+            settings: Overrides of ``DEFAULT_FAKE_SETTINGS``
+            model_name: Model id reported by ``/v1/models``
+        """
+        if not FASTAPI_AVAILABLE:
+            raise ImportError("fastapi is required for the fake OpenAI server")
+        self.settings = fake_settings(settings)
+        self.model_name = model_name
+        self.active = 0
+        self.requests = 0
+        self.completion_tokens = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # Created lazily inside the event loop serving the app
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.settings["max_num_seqs"])
+        return self._slots
+
+    async def generate(self, tokens: List[str]):
+        """Yield tokens at the modelled pace, sharing steps with concurrent requests."""
+        async with self._semaphore():
+            self.active += 1
+            try:
+                await asyncio.sleep(prefill_seconds(1, self.settings))
+                for token in tokens:
+                    await asyncio.sleep(step_seconds(self.active, self.settings))
+                    yield token
+            finally:
+                self.active -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Served requests and generated tokens."""
+        return {
+            "requests": self.requests,
+            "completion_tokens": self.completion_tokens,
+            "active": self.active,
+            "settings": self.settings,
+        }
+
+    def app(self) -> "FastAPI":
+        """FastAPI application serving the fake model."""
+        app = FastAPI(title="Fake VLM (OpenAI-compatible)")
+
+        @app.get("/health")
+        async def health():
+            return {}
+
+        @app.get("/v1/models")
+        async def models():
+            return {"object": "list", "data": [{"id": self.model_name, "object": "model", "max_model_len": 8192}]}
+
+        @app.get("/stats")
+        async def stats():
+            return self.get_stats()
+
+        @app.post("/v1/chat/completions")
+        async def chat_completions(request: Request):
+            body = await request.json()
+            prompt, images = message_content(body.get("messages", []))
+            max_tokens = int(body.get("max_tokens") or 256)
+            tokens = fake_tokens("\n".join(images), prompt, max_tokens, self.settings)
+            usage = {
+                "prompt_tokens": prompt_tokens(prompt, len(images), self.settings),
+                "completion_tokens": len(tokens),
+                "total_tokens": prompt_tokens(prompt, len(images), self.settings) + len(tokens),
+            }
+            finish_reason = "length" if len(tokens) == max_tokens else "stop"
+            completion_id = f"chatcmpl-{uuid.uuid4().hex[:16]}"
+            with self._lock:
+                self.requests += 1
+                self.completion_tokens += len(tokens)
+
+            if not body.get("stream"):
+                words = [token async for token in self.generate(tokens)]
+                return JSONResponse({
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "model": self.model_name,
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": " ".join(words)},
+                        "finish_reason": finish_reason,
+                    }],
+                    "usage": usage,
+                })
+
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+            def chunk(delta: Dict[str, Any], finish: Optional[str] = None, **extra) -> str:
+                payload = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "model": self.model_name,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+                    **extra,
+                }
+                return f"data: {json.dumps(payload)}\n\n"
+
+            async def events():
+                yield chunk({"role": "assistant", "content": ""})
+                index = 0
+                async for token in self.generate(tokens):
+                    yield chunk({"content": token if index == 0 else f" {token}"})
+                    index += 1
+                yield chunk({}, finish_reason)
+                if include_usage:
+                    payload = {"id": completion_id, "object": "chat.completion.chunk",
+                               "model": self.model_name, "choices": [], "usage": usage}
+                    yield f"data: {json.dumps(payload)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        return app
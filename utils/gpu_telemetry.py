@@ -0,0 +1,375 @@
+"""GPU telemetry sampled in the background instead of per-call nvidia-smi.
+
+Memory status pages, admission checks and launcher scripts used to fork
+``nvidia-smi`` on every call (several times per Streamlit rerun). A
+single ``GpuTelemetry`` service samples every device on a background
+thread into a ring buffer; callers read the latest sample, dashboards
+read the recent history.
+
+Backends:
+    nvml   device memory, utilization, temperature, power and per-process
+           memory via NVML (``pip install nvidia-ml-py``)
+    torch  device memory only (``torch.cuda.mem_get_info``), used when
+           NVML is unavailable
+    mock   fixed values that tests (and GPU-less development) can change
+    none   no devices
+
+``GPU_TELEMETRY`` selects the backend (``auto`` picks nvml, then torch,
+then none) and ``GPU_TELEMETRY_INTERVAL`` the sampling period in seconds.
+
+Usage:
+    telemetry = get_telemetry()
+    gpu = telemetry.latest().gpu(0)
+    if gpu and gpu.memory_free_mb < 6000:
+        ...
+    history = telemetry.history(seconds=60)
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+try:
+    import pynvml
+    NVML_AVAILABLE = True
+except ImportError:
+    NVML_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_HISTORY_SIZE = 300
+
+MB = 1024 ** 2
+
+
+@dataclass
+class GpuProcess:
+    """A process holding memory on a GPU."""
+
+    pid: int
+    name: str
+    used_memory_mb: float
+
+
+@dataclass
+class GpuStats:
+    """One device at one point in time (None where the backend cannot tell)."""
+
+    index: int
+    name: str
+    memory_total_mb: float
+    memory_used_mb: float
+    memory_free_mb: float
+    utilization_percent: Optional[float] = None
+    memory_utilization_percent: Optional[float] = None
+    temperature_c: Optional[float] = None
+    power_w: Optional[float] = None
+    processes: List[GpuProcess] = field(default_factory=list)
+
+    @property
+    def memory_percent(self) -> float:
+        """Used memory as a share of total memory (%)."""
+        return self.memory_used_mb / self.memory_total_mb * 100 if self.memory_total_mb else 0.0
+
+
+@dataclass
+class TelemetrySample:
+    """All devices read at ``ts``."""
+
+    ts: float
+    gpus: List[GpuStats]
+    backend: str = "none"
+
+    def gpu(self, index: int = 0) -> Optional[GpuStats]:
+        """Device by index (None if absent)."""
+        for gpu in self.gpus:
+            if gpu.index == index:
+                return gpu
+        return None
+
+    @property
+    def processes(self) -> List[GpuProcess]:
+        """Processes of all devices."""
+        return [process for gpu in self.gpus for process in gpu.processes]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"ts": self.ts, "backend": self.backend, "gpus": [asdict(gpu) for gpu in self.gpus]}
+
+
+class NoGpuBackend:
+    """Backend of machines without GPUs."""
+
+    name = "none"
+
+    def read(self) -> List[GpuStats]:
+        return []
+
+
+class NvmlBackend:
+    """Reads devices through NVML (initialized once per process)."""
+
+    name = "nvml"
+
+    def __init__(self):
+        if not NVML_AVAILABLE:
+            raise ImportError("pynvml is required for the NVML backend: pip install nvidia-ml-py")
+        pynvml.nvmlInit()
+        self._handles = [pynvml.nvmlDeviceGetHandleByIndex(i) for i in range(pynvml.nvmlDeviceGetCount())]
+        self._names = [self._decode(pynvml.nvmlDeviceGetName(handle)) for handle in self._handles]
+
+    @staticmethod
+    def _decode(value: Any) -> str:
+        return value.decode("utf-8", "replace") if isinstance(value, bytes) else str(value)
+
+    @staticmethod
+    def _optional(fn, *args) -> Any:
+        """NVML query that some devices do not support."""
+        try:
+            return fn(*args)
+        except pynvml.NVMLError:
+            return None
+
+    def read(self) -> List[GpuStats]:
+        gpus = []
+        for index, handle in enumerate(self._handles):
+            memory = pynvml.nvmlDeviceGetMemoryInfo(handle)
+            rates = self._optional(pynvml.nvmlDeviceGetUtilizationRates, handle)
+            temperature = self._optional(pynvml.nvmlDeviceGetTemperature, handle, pynvml.NVML_TEMPERATURE_GPU)
+            power_mw = self._optional(pynvml.nvmlDeviceGetPowerUsage, handle)
+            gpus.append(GpuStats(
+                index=index,
+                name=self._names[index],
+                memory_total_mb=memory.total / MB,
+                memory_used_mb=memory.used / MB,
+                memory_free_mb=memory.free / MB,
+                utilization_percent=float(rates.gpu) if rates is not None else None,
+                memory_utilization_percent=float(rates.memory) if rates is not None else None,
+                temperature_c=float(temperature) if temperature is not None else None,
+                power_w=power_mw / 1000 if power_mw is not None else None,
+                processes=self._processes(handle),
+            ))
+        return gpus
+
+    def _processes(self, handle: Any) -> List[GpuProcess]:
+        running = self._optional(pynvml.nvmlDeviceGetComputeRunningProcesses, handle) or []
+        processes = []
+        for process in running:
+            used = getattr(process, "usedGpuMemory", None)
+            processes.append(GpuProcess(process.pid, process_name(process.pid), used / MB if used else 0.0))
+        return processes
+
+
+class TorchBackend:
+    """Device memory through the CUDA runtime (no utilization or temperature)."""
+
+    name = "torch"
+
+    def __init__(self):
+        import torch
+        if not torch.cuda.is_available():
+            raise RuntimeError("CUDA is not available")
+        self._torch = torch
+        self._names = [torch.cuda.get_device_name(i) for i in range(torch.cuda.device_count())]
+
+    def read(self) -> List[GpuStats]:
+        gpus = []
+        for index, name in enumerate(self._names):
+            free, total = self._torch.cuda.mem_get_info(index)
+            gpus.append(GpuStats(index, name, total / MB, (total - free) / MB, free / MB))
+        return gpus
+
+
+class MockBackend:
+    """
+    Configurable devices for tests.
+
+    Defaults to one idle 12 GB device; ``set`` changes fields
+    (memory_used_mb keeps memory_free_mb consistent) and ``fail`` makes the
+    next reads raise, like a lost driver.
+    """
+
+    name = "mock"
+
+    def __init__(self, gpus: Optional[List[GpuStats]] = None):
+        self.gpus = gpus if gpus is not None else [
+            GpuStats(0, "Mock GPU", 12288.0, 0.0, 12288.0, 0.0, 0.0, 35.0, 20.0)
+        ]
+        self.reads = 0
+        self.error: Optional[Exception] = None
+        self._lock = threading.Lock()
+
+    def set(self, index: int = 0, **fields: Any) -> None:
+        with self._lock:
+            gpu = self.gpus[index]
+            for key, value in fields.items():
+                setattr(gpu, key, value)
+            if "memory_used_mb" in fields and "memory_free_mb" not in fields:
+                gpu.memory_free_mb = gpu.memory_total_mb - gpu.memory_used_mb
+
+    def fail(self, error: Optional[Exception] = None) -> None:
+        self.error = error
+
+    def read(self) -> List[GpuStats]:
+        with self._lock:
+            self.reads += 1
+            if self.error is not None:
+                raise self.error
+            return [GpuStats(**{**asdict(gpu), "processes": [GpuProcess(**asdict(p)) for p in gpu.processes]})
+                    for gpu in self.gpus]
+
+
+def process_name(pid: int) -> str:
+    """Process name by PID ('' if unknown or psutil is missing)."""
+    try:
+        import psutil
+        return psutil.Process(pid).name()
+    except Exception:
+        return ""
+
+
+def backend_from_env() -> Any:
+    """Backend selected by ``GPU_TELEMETRY`` (auto, nvml, torch, mock, none)."""
+    mode = os.getenv("GPU_TELEMETRY", "auto").lower()
+    if mode == "mock":
+        return MockBackend()
+    if mode in ("none", "off"):
+        return NoGpuBackend()
+    candidates = {"auto": (NvmlBackend, TorchBackend), "nvml": (NvmlBackend,), "torch": (TorchBackend,)}
+    for backend in candidates.get(mode, candidates["auto"]):
+        try:
+            return backend()
+        except Exception as e:
+            logger.debug(f"GPU telemetry backend {backend.name} unavailable: {e}")
+    return NoGpuBackend()
+
+
+class GpuTelemetry:
+    """
+    Background GPU sampler with a ring buffer of recent samples.
+
+    Reads never fork processes: ``latest`` returns the buffered sample and
+    only queries the backend itself when that sample is older than
+    ``max_age`` (e.g. right after freeing memory).
+    """
+
+    def __init__(self, backend: Any = None, interval: float = DEFAULT_INTERVAL,
+                 history_size: int = DEFAULT_HISTORY_SIZE):
+        """
+        Args:
+            backend: Device reader (default: ``backend_from_env()``)
+            interval: Seconds between background samples
+            history_size: Samples kept in the ring buffer
+        """
+        self.backend = backend if backend is not None else backend_from_env()
+        self.interval = interval
+        self.errors = 0
+        self._history: deque = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> "GpuTelemetry":
+        """Start the background sampler (no-op if running or without GPUs)."""
+        with self._lock:
+            if self.running or isinstance(self.backend, NoGpuBackend):
+                return self
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="gpu-telemetry", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the background sampler."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def sample(self) -> TelemetrySample:
+        """Read all devices now and append the sample to the history."""
+        try:
+            gpus = self.backend.read()
+        except Exception as e:
+            # Keep serving the last good sample; the next read may recover
+            self.errors += 1
+            logger.warning(f"GPU telemetry read failed: {e}")
+            with self._lock:
+                if self._history:
+                    return self._history[-1]
+            return TelemetrySample(time.time(), [], self.backend.name)
+        sample = TelemetrySample(time.time(), gpus, self.backend.name)
+        with self._lock:
+            self._history.append(sample)
+        return sample
+
+    def latest(self, max_age: Optional[float] = None) -> TelemetrySample:
+        """
+        Most recent sample.
+
+        Args:
+            max_age: Maximum age in seconds; an older (or missing) sample
+                is replaced by a direct read. Default: two intervals while
+                the sampler runs, otherwise always read.
+        """
+        if max_age is None:
+            max_age = 2 * self.interval if self.running else 0.0
+        with self._lock:
+            last = self._history[-1] if self._history else None
+        if last is not None and max_age > 0 and time.time() - last.ts <= max_age:
+            return last
+        return self.sample()
+
+    def history(self, seconds: Optional[float] = None) -> List[TelemetrySample]:
+        """Buffered samples, oldest first (only the last ``seconds`` if given)."""
+        with self._lock:
+            samples = list(self._history)
+        if seconds is not None:
+            cutoff = time.time() - seconds
+            samples = [sample for sample in samples if sample.ts >= cutoff]
+        return samples
+
+    def series(self, field_name: str, index: int = 0, seconds: Optional[float] = None) -> List[tuple]:
+        """(ts, value) pairs of one ``GpuStats`` field of one device, for charts."""
+        points = []
+        for sample in self.history(seconds):
+            gpu = sample.gpu(index)
+            if gpu is not None:
+                points.append((sample.ts, getattr(gpu, field_name)))
+        return points
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+
+_telemetry: Optional[GpuTelemetry] = None
+_telemetry_lock = threading.Lock()
+
+
+def get_telemetry() -> GpuTelemetry:
+    """Process-wide telemetry service, started on first use."""
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is None:
+            interval = float(os.getenv("GPU_TELEMETRY_INTERVAL", str(DEFAULT_INTERVAL)))
+            _telemetry = GpuTelemetry(interval=interval).start()
+        return _telemetry
+
+
+def set_telemetry(telemetry: Optional[GpuTelemetry]) -> None:
+    """Replace the process-wide service (tests, custom backends)."""
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is not None and _telemetry is not telemetry:
+            _telemetry.stop()
+        _telemetry = telemetry
@@ -6,7 +6,13 @@
 import re
 import html
 from typing import List, Dict, Any, Optional
-import streamlit as st
+
+try:
+    import streamlit as st
+    STREAMLIT_AVAILABLE = True
+except ImportError:
+    # Парсинг и конвертация таблиц работают и без UI (API, бенчмарки)
+    STREAMLIT_AVAILABLE = False
 
 class HTMLTableRenderer:
     """Класс для обработки и рендеринга HTML таблиц"""
@@ -1,10 +1,18 @@
 """Image preprocessing utilities."""
 
-from typing import Tuple, Optional
-from PIL import Image, ImageEnhance, ImageFilter
+from typing import List, Optional, Sequence
+from PIL import Image
 import numpy as np
 import cv2
 
+from .preprocessing import (
+    ImageSource,
+    PreprocessingEngine,
+    PreprocessResult,
+    preprocess_batch
+)
+from .prefilter import dhash, ink_density, phash
+
 
 class ImageProcessor:
     """Image preprocessing for OCR optimization."""
@@ -30,23 +38,52 @@ class ImageProcessor:
         Returns:
             Preprocessed PIL Image
         """
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Resize if too large
-        if resize:
-            image = ImageProcessor.resize_if_needed(image, max_dimension)
+        result = PreprocessingEngine(
+            max_dimension=max_dimension,
+            resize=resize,
+            enhance=enhance,
+            denoise=denoise
+        ).process(image)
+        return result.to_pil()
+    
+    @staticmethod
+    def preprocess_array(
+        image: ImageSource,
+        **options
+    ) -> PreprocessResult:
+        """
+        Preprocess image without PIL round-trips.
         
-        # Enhance image quality
-        if enhance:
-            image = ImageProcessor.enhance_image(image)
+        The returned array can be passed directly to model processors.
         
-        # Denoise if requested
-        if denoise:
-            image = ImageProcessor.denoise(image)
+        Args:
+            image: Encoded bytes, path, PIL Image or RGB array
+            **options: PreprocessingEngine options (max_dimension, enhance,
+                denoise, deskew, crop_borders, ...)
+            
+        Returns:
+            PreprocessResult with the RGB array and per-stage timings
+        """
+        return PreprocessingEngine(**options).process(image)
+    
+    @staticmethod
+    def preprocess_batch(
+        images: Sequence[ImageSource],
+        max_workers: Optional[int] = None,
+        **options
+    ) -> List[PreprocessResult]:
+        """
+        Preprocess a batch of images across a process pool.
         
-        return image
+        Args:
+            images: Encoded bytes, paths, PIL Images or arrays
+            max_workers: Number of worker processes (defaults to CPU count)
+            **options: PreprocessingEngine options
+            
+        Returns:
+            PreprocessResult list in input order
+        """
+        return preprocess_batch(images, PreprocessingEngine(**options), max_workers=max_workers)
     
     @staticmethod
     def resize_if_needed(image: Image.Image, max_dimension: int) -> Image.Image:
@@ -69,21 +106,13 @@ class ImageProcessor:
     @staticmethod
     def enhance_image(image: Image.Image) -> Image.Image:
         """Enhance image contrast and sharpness."""
-        # Increase contrast slightly
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(1.2)
-        
-        # Increase sharpness
-        enhancer = ImageEnhance.Sharpness(image)
-        image = enhancer.enhance(1.3)
-        
-        return image
+        return PreprocessingEngine(resize=False).process(image).to_pil()
     
     @staticmethod
     def denoise(image: Image.Image) -> Image.Image:
         """Apply denoising to reduce image noise."""
         # Convert to numpy array
-        img_array = np.array(image)
+        img_array = np.asarray(image)
         
         # Apply bilateral filter for noise reduction
         denoised = cv2.bilateralFilter(img_array, 9, 75, 75)
@@ -94,64 +123,37 @@ class ImageProcessor:
     @staticmethod
     def deskew(image: Image.Image) -> Image.Image:
         """Deskew tilted document images."""
-        # Convert to numpy array
-        img_array = np.array(image)
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-        
-        # Detect edges
-        edges = cv2.Canny(gray, 50, 150, apertureSize=3)
-        
-        # Detect lines using Hough transform
-        lines = cv2.HoughLines(edges, 1, np.pi/180, 200)
-        
-        if lines is not None:
-            # Calculate average angle
-            angles = []
-            for rho, theta in lines[:, 0]:
-                angle = np.degrees(theta) - 90
-                angles.append(angle)
-            
-            median_angle = np.median(angles)
-            
-            # Rotate image
-            if abs(median_angle) > 0.5:  # Only rotate if angle is significant
-                height, width = img_array.shape[:2]
-                center = (width // 2, height // 2)
-                rotation_matrix = cv2.getRotationMatrix2D(center, median_angle, 1.0)
-                rotated = cv2.warpAffine(img_array, rotation_matrix, (width, height),
-                                        flags=cv2.INTER_CUBIC,
-                                        borderMode=cv2.BORDER_REPLICATE)
-                return Image.fromarray(rotated)
-        
-        return image
+        # Skew is estimated on a downsampled proxy, rotation is applied once
+        result = PreprocessingEngine(resize=False, enhance=False, deskew=True).process(image)
+        if result.skew_angle == 0.0:
+            return image
+        return result.to_pil()
     
     @staticmethod
     def crop_borders(image: Image.Image, threshold: int = 240) -> Image.Image:
         """Crop white borders from document images."""
-        img_array = np.array(image)
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-        
-        # Find non-white pixels
-        mask = gray < threshold
-        coords = np.argwhere(mask)
-        
-        if len(coords) == 0:
-            return image
-        
-        # Get bounding box
-        y0, x0 = coords.min(axis=0)
-        y1, x1 = coords.max(axis=0)
-        
-        # Add small margin
-        margin = 10
-        y0 = max(0, y0 - margin)
-        x0 = max(0, x0 - margin)
-        y1 = min(img_array.shape[0], y1 + margin)
-        x1 = min(img_array.shape[1], x1 + margin)
-        
-        # Crop image
-        cropped = img_array[y0:y1, x0:x1]
-        return Image.fromarray(cropped)
+        result = PreprocessingEngine(
+            resize=False,
+            enhance=False,
+            crop_borders=True,
+            border_threshold=threshold
+        ).process(image)
+        return result.to_pil()
+    
+    @staticmethod
+    def perceptual_hash(image: ImageSource) -> int:
+        """64-bit pHash for near-duplicate detection."""
+        return phash(image)
+    
+    @staticmethod
+    def difference_hash(image: ImageSource) -> int:
+        """64-bit dHash for near-duplicate detection."""
+        return dhash(image)
+    
+    @staticmethod
+    def is_blank_page(image: ImageSource, max_ink_density: float = 0.002, ink_delta: int = 48) -> bool:
+        """Check whether a page has (almost) no ink."""
+        return ink_density(image, ink_delta=ink_delta) < max_ink_density
     
     @staticmethod
     def get_image_info(image: Image.Image) -> dict:
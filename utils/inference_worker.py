@@ -0,0 +1,624 @@
+"""Single GPU-owning inference process shared by several API workers.
+
+``uvicorn api:app --workers N`` gives every worker its own model cache, so
+every model would be loaded N times into VRAM. In the split layout the API
+workers stay stateless (upload parsing, validation, decoding, response
+building scale with the cores) and forward model calls to one
+``InferenceServer`` process that owns the models:
+
+- Each API worker (``InferenceClient``) creates a shared-memory ring
+  buffer and writes the decoded images of a call into it; the call message
+  carries only offsets, shapes and dtypes. The server maps the same memory
+  and passes NumPy views (or PIL images over them) to the model, so pixel
+  data is copied once into the ring and never pickled. A region is freed
+  when the call's result arrives.
+- Calls and results travel over a ``multiprocessing.connection`` socket as
+  small pickled tuples.
+- The server schedules calls of all workers in one ``FairScheduler``; the
+  client forwards the priority class, client and remaining deadline of the
+  current ticket, and cancels the call if the ticket is cancelled, so
+  priorities and disconnect handling work across workers.
+
+``RemoteModel`` exposes the inference methods of the server-side model
+(``MODEL_METHODS``), so code written against a model instance works
+unchanged; other attributes (e.g. ``vision_cache``) do not exist on the
+proxy, so ``getattr(model, name, None)`` probes behave as for a model
+without them.
+
+Arrays handed to a model are views of the ring and are valid only until
+the call returns; models must not keep references to their inputs.
+
+Usage:
+    # GPU process
+    InferenceServer("/tmp/chatvlmllm-inference.sock").serve_forever()
+
+    # API worker
+    client = InferenceClient("/tmp/chatvlmllm-inference.sock")
+    model = client.model("qwen3_vl_2b")
+    text = model.extract_text(image)
+"""
+
+import itertools
+import os
+import socket
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from dataclasses import dataclass
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Connection, Listener
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from utils.logger import logger
+from utils.scheduler import (
+    ClientDisconnected, DeadlineExceeded, FairScheduler, RequestDropped, Ticket, current_ticket
+)
+
+DEFAULT_ADDRESS = "/tmp/chatvlmllm-inference.sock"
+DEFAULT_RING_SIZE = 256 * 1024 * 1024
+
+# Ring allocations are aligned for vectorized reads
+ALIGNMENT = 64
+# PIL modes that round-trip through a uint8 array
+ARRAY_IMAGE_MODES = ("RGB", "RGBA", "L")
+# Model methods a RemoteModel forwards to the server
+MODEL_METHODS = (
+    "extract_text", "extract_text_batch", "chat", "process_image", "process_batch", "parse_document"
+)
+# Seconds between checks for cancellation while a call runs remotely
+CANCEL_POLL_INTERVAL = 0.1
+
+_DROPPED_ERRORS = {cls.__name__: cls for cls in (DeadlineExceeded, ClientDisconnected)}
+
+# Segments created by this process (their resource tracker entry stays)
+_created_segments = set()
+
+
+def parse_address(address: str) -> Any:
+    """``host:port`` for TCP, anything else is a Unix socket path."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return (host or "127.0.0.1", int(port))
+    return address
+
+
+def attach_shared_memory(name: str) -> SharedMemory:
+    """
+    Map a segment created by another process.
+
+    Python < 3.13 registers attached segments with the resource tracker,
+    which would unlink the client's ring when this process exits.
+    """
+    shm = SharedMemory(name=name)
+    if shm.name not in _created_segments:
+        try:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+    return shm
+
+
+def hang_up(connection: Connection) -> None:
+    """Shut a connection's socket down, waking a thread blocked in ``recv``."""
+    try:
+        sock = socket.socket(fileno=os.dup(connection.fileno()))
+    except OSError:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    finally:
+        sock.close()
+
+
+@dataclass(frozen=True)
+class ArrayRef:
+    """An array placed in the ring: where it is and how to view it."""
+
+    offset: int
+    shape: Tuple[int, ...]
+    dtype: str
+    image: bool = False
+
+
+class ShmRing:
+    """
+    Variable-size ring buffer over shared memory (single writer process).
+
+    Regions are allocated at the head and may be freed in any order; the
+    tail advances over freed regions, so space is reused in allocation
+    order. ``allocate`` blocks while the ring is full.
+    """
+
+    def __init__(self, size: int = DEFAULT_RING_SIZE, name: Optional[str] = None, create: bool = True):
+        """
+        Args:
+            size: Ring size in bytes (when creating)
+            name: Shared memory name (default: generated)
+            create: Create the segment (writer) or attach to it (reader)
+        """
+        if create:
+            self.shm = SharedMemory(name=name, create=True, size=size)
+            _created_segments.add(self.shm.name)
+        else:
+            self.shm = attach_shared_memory(name)
+        self.owner = create
+        self.size = self.shm.size
+        self._allocations: Deque[List[Any]] = deque()
+        self._by_offset: Dict[int, List[Any]] = {}
+        self._head = 0
+        self._condition = threading.Condition()
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def used(self) -> int:
+        """Bytes held by allocated (including not yet reclaimed) regions."""
+        with self._condition:
+            return sum(allocation[1] for allocation in self._allocations)
+
+    def _place(self, nbytes: int) -> Optional[int]:
+        if not self._allocations:
+            return 0 if nbytes <= self.size else None
+        tail = self._allocations[0][0]
+        wrapped = self._allocations[-1][0] < tail
+        if wrapped:
+            return self._head if self._head + nbytes <= tail else None
+        if self._head + nbytes <= self.size:
+            return self._head
+        return 0 if nbytes <= tail else None
+
+    def allocate(self, nbytes: int, timeout: Optional[float] = None) -> int:
+        """
+        Reserve ``nbytes`` and return their offset.
+
+        Raises:
+            ValueError: The request is larger than the ring
+            TimeoutError: No space was freed within ``timeout`` seconds
+        """
+        nbytes = max(ALIGNMENT, -(-nbytes // ALIGNMENT) * ALIGNMENT)
+        if nbytes > self.size:
+            raise ValueError(f"{nbytes} bytes do not fit a ring of {self.size} bytes")
+        with self._condition:
+            offset = self._place(nbytes)
+            if offset is None:
+                if not self._condition.wait_for(lambda: self._place(nbytes) is not None, timeout):
+                    raise TimeoutError(f"No {nbytes} bytes free in the ring after {timeout}s")
+                offset = self._place(nbytes)
+            allocation = [offset, nbytes, False]
+            self._allocations.append(allocation)
+            self._by_offset[offset] = allocation
+            self._head = offset + nbytes
+            return offset
+
+    def free(self, offset: int) -> None:
+        """Release a region; the tail moves past every freed region at the front."""
+        with self._condition:
+            self._by_offset.pop(offset)[2] = True
+            while self._allocations and self._allocations[0][2]:
+                self._allocations.popleft()
+            if not self._allocations:
+                self._head = 0
+            self._condition.notify_all()
+
+    def write(self, array: np.ndarray, image: bool = False, timeout: Optional[float] = None) -> ArrayRef:
+        """Copy an array into a new region."""
+        array = np.ascontiguousarray(array)
+        offset = self.allocate(array.nbytes, timeout)
+        self.view(ArrayRef(offset, array.shape, array.dtype.str))[...] = array
+        return ArrayRef(offset, tuple(array.shape), array.dtype.str, image)
+
+    def view(self, ref: ArrayRef) -> np.ndarray:
+        """Array over the region of ``ref`` (no copy)."""
+        return np.ndarray(ref.shape, dtype=np.dtype(ref.dtype), buffer=self.shm.buf, offset=ref.offset)
+
+    def close(self) -> None:
+        try:
+            self.shm.close()
+        except BufferError:
+            # Views still referenced somewhere; the mapping goes with the process
+            pass
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+            _created_segments.discard(self.shm.name)
+
+
+def encode_value(value: Any, ring: ShmRing, refs: List[ArrayRef], timeout: Optional[float] = None) -> Any:
+    """Replace arrays and images (also inside lists, tuples and dicts) by ring references."""
+    if isinstance(value, np.ndarray) and value.dtype != object and value.nbytes <= ring.size:
+        ref = ring.write(value, timeout=timeout)
+    elif isinstance(value, Image.Image) and value.mode in ARRAY_IMAGE_MODES:
+        array = np.asarray(value)
+        if array.nbytes > ring.size:
+            return value
+        ref = ring.write(array, image=True, timeout=timeout)
+    elif isinstance(value, (list, tuple)):
+        return type(value)(encode_value(item, ring, refs, timeout) for item in value)
+    elif isinstance(value, dict):
+        return {key: encode_value(item, ring, refs, timeout) for key, item in value.items()}
+    else:
+        return value
+    refs.append(ref)
+    return ref
+
+
+def decode_value(value: Any, ring: ShmRing) -> Any:
+    """Views (or images over views) for the ring references of ``encode_value``."""
+    if isinstance(value, ArrayRef):
+        array = ring.view(value)
+        return Image.fromarray(array) if value.image else array
+    if isinstance(value, (list, tuple)):
+        return type(value)(decode_value(item, ring) for item in value)
+    if isinstance(value, dict):
+        return {key: decode_value(item, ring) for key, item in value.items()}
+    return value
+
+
+def default_loader(model_name: str) -> Any:
+    from models import ModelLoader
+    return ModelLoader.load_model(model_name)
+
+
+class _Session:
+    """One connected API worker."""
+
+    def __init__(self, connection: Connection, session_id: int):
+        self.id = session_id
+        self.connection = connection
+        self.ring: Optional[ShmRing] = None
+        self.tickets: Dict[int, Ticket] = {}
+        self.send_lock = threading.Lock()
+        self.lock = threading.Lock()
+
+    def send(self, message: Tuple) -> None:
+        with self.send_lock:
+            try:
+                self.connection.send(message)
+            except (OSError, EOFError, BrokenPipeError):
+                # The worker is gone; its remaining calls were cancelled
+                pass
+
+
+class InferenceServer:
+    """Owns the models and runs the calls of all connected API workers."""
+
+    def __init__(self, address: str = DEFAULT_ADDRESS, authkey: Optional[bytes] = None,
+                 loader: Callable[[str], Any] = default_loader, scheduler: Optional[FairScheduler] = None,
+                 max_workers: int = 32):
+        """
+        Args:
+            address: Unix socket path or ``host:port``
+            authkey: Shared secret of the connection handshake (required for TCP)
+            loader: Loads a model by name (default: ``ModelLoader.load_model``)
+            scheduler: Scheduler of the model calls (default: default settings)
+            max_workers: Calls accepted concurrently (waiting or running)
+        """
+        self.address = parse_address(address)
+        if isinstance(self.address, tuple) and not authkey:
+            raise ValueError("An authkey is required for TCP addresses")
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+        self.listener = Listener(self.address, authkey=authkey)
+        self.loader = loader
+        self.scheduler = scheduler or FairScheduler()
+        self.models: Dict[str, Any] = {}
+        self.calls = 0
+        self._models_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._sessions: Dict[int, _Session] = {}
+        self._session_ids = itertools.count(1)
+        self._closed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "InferenceServer":
+        """Accept connections on a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, name="inference-accept", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        """Accept API worker connections until ``close``."""
+        logger.info(f"Inference server listening on {self.address}")
+        while not self._closed.is_set():
+            try:
+                connection = self.listener.accept()
+            except Exception as e:
+                if self._closed.is_set():
+                    break
+                logger.warning(f"Inference connection rejected: {e}")
+                continue
+            session = _Session(connection, next(self._session_ids))
+            self._sessions[session.id] = session
+            threading.Thread(target=self._serve, args=(session,), name=f"inference-session-{session.id}",
+                             daemon=True).start()
+
+    def _serve(self, session: _Session) -> None:
+        try:
+            while True:
+                message = session.connection.recv()
+                kind = message[0]
+                if kind == "hello":
+                    session.ring = ShmRing(name=message[1], create=False)
+                    session.send(("hello", os.getpid()))
+                elif kind == "call":
+                    self._executor.submit(self._call, session, *message[1:])
+                elif kind == "cancel":
+                    with session.lock:
+                        ticket = session.tickets.get(message[1])
+                    if ticket is not None:
+                        ticket.cancel()
+                elif kind == "unload":
+                    self._executor.submit(self._reply, session, message[1], self.unload, message[2])
+                elif kind == "stats":
+                    self._executor.submit(self._reply, session, message[1], self.get_stats)
+                elif kind == "close":
+                    break
+        except (EOFError, OSError):
+            pass
+        finally:
+            # Calls of a vanished worker are dropped before they reach a model
+            with session.lock:
+                tickets = list(session.tickets.values())
+            for ticket in tickets:
+                ticket.cancel()
+            self._sessions.pop(session.id, None)
+            session.connection.close()
+            if session.ring is not None:
+                session.ring.close()
+
+    def _reply(self, session: _Session, call_id: int, fn: Callable[..., Any], *args: Any) -> None:
+        try:
+            session.send(("result", call_id, fn(*args)))
+        except Exception as e:
+            session.send(("error", call_id, type(e).__name__, str(e)))
+
+    def _call(self, session: _Session, call_id: int, model_name: str, method: str,
+              args: Tuple, kwargs: Dict[str, Any], ticket_info: Dict[str, Any], cost: float) -> None:
+        ticket = Ticket(ticket_info["priority"], f"{session.id}:{ticket_info['client']}", ticket_info["timeout"])
+        with session.lock:
+            session.tickets[call_id] = ticket
+        try:
+            with self.scheduler.slot(model_name, ticket, cost):
+                model = self.get_model(model_name)
+                result = getattr(model, method)(*decode_value(args, session.ring),
+                                                **decode_value(kwargs, session.ring))
+            self.calls += 1
+            session.send(("result", call_id, result))
+        except Exception as e:
+            if not isinstance(e, RequestDropped):
+                logger.error(f"Inference call {model_name}.{method} failed: {e}")
+            session.send(("error", call_id, type(e).__name__, str(e)))
+        finally:
+            with session.lock:
+                session.tickets.pop(call_id, None)
+
+    def get_model(self, model_name: str) -> Any:
+        """Loaded model (loaded on first use, once per process)."""
+        with self._models_lock:
+            if model_name not in self.models:
+                logger.info(f"Loading model {model_name}")
+                self.models[model_name] = self.loader(model_name)
+            return self.models[model_name]
+
+    def unload(self, model_name: str) -> bool:
+        """Unload a model; False if it was not loaded."""
+        with self._models_lock:
+            model = self.models.pop(model_name, None)
+        if model is None:
+            return False
+        if hasattr(model, "unload"):
+            model.unload()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "models": list(self.models),
+            "workers": len(self._sessions),
+            "calls": self.calls,
+            "scheduler": self.scheduler.get_stats(),
+        }
+
+    def close(self) -> None:
+        self._closed.set()
+        self.listener.close()
+        for session in list(self._sessions.values()):
+            hang_up(session.connection)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+class InferenceClient:
+    """Connection of one API worker to the inference server."""
+
+    def __init__(self, address: str = DEFAULT_ADDRESS, authkey: Optional[bytes] = None,
+                 ring_size: int = DEFAULT_RING_SIZE, write_timeout: Optional[float] = 60.0):
+        """
+        Args:
+            address: Unix socket path or ``host:port`` of the server
+            authkey: Shared secret of the connection handshake
+            ring_size: Bytes of this worker's shared-memory ring
+            write_timeout: Seconds to wait for ring space before failing a call
+        """
+        self.address = address
+        self.write_timeout = write_timeout
+        self.connection = Client(parse_address(address), authkey=authkey)
+        self.ring = ShmRing(ring_size)
+        self.closed = False
+        self._futures: Dict[int, Tuple[Future, List[ArrayRef]]] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+
+        self.connection.send(("hello", self.ring.name))
+        self.server_pid = self.connection.recv()[1]
+        self._receiver = threading.Thread(target=self._receive, name="inference-client", daemon=True)
+        self._receiver.start()
+
+    def _send(self, message: Tuple) -> None:
+        with self._send_lock:
+            self.connection.send(message)
+
+    def _request(self, message: Tuple, refs: List[ArrayRef]) -> Tuple[int, Future]:
+        future: Future = Future()
+        with self._lock:
+            if self.closed:
+                raise ConnectionError(f"Inference server {self.address} is not connected")
+            call_id = next(self._ids)
+            self._futures[call_id] = (future, refs)
+        try:
+            self._send((message[0], call_id) + message[1:])
+        except (OSError, EOFError) as e:
+            self._finish(call_id)
+            self._disconnect()
+            raise ConnectionError(f"Inference server {self.address} is not connected: {e}")
+        return call_id, future
+
+    def _finish(self, call_id: int) -> Optional[Future]:
+        with self._lock:
+            entry = self._futures.pop(call_id, None)
+        if entry is None:
+            return None
+        future, refs = entry
+        for ref in refs:
+            self.ring.free(ref.offset)
+        return future
+
+    def _receive(self) -> None:
+        try:
+            while True:
+                message = self.connection.recv()
+                future = self._finish(message[1])
+                if future is None:
+                    continue
+                if message[0] == "result":
+                    future.set_result(message[2])
+                else:
+                    error = _DROPPED_ERRORS.get(message[2])
+                    future.set_exception(error(message[3]) if error else RuntimeError(f"{message[2]}: {message[3]}"))
+        except (EOFError, OSError):
+            self._disconnect()
+
+    def _disconnect(self) -> None:
+        with self._lock:
+            self.closed = True
+            pending = list(self._futures)
+        for call_id in pending:
+            future = self._finish(call_id)
+            if future is not None and not future.done():
+                future.set_exception(ConnectionError(f"Inference server {self.address} disconnected"))
+
+    def call(self, model_name: str, method: str, args: Tuple = (), kwargs: Optional[Dict[str, Any]] = None,
+             ticket: Optional[Ticket] = None) -> Any:
+        """
+        Run ``model.method(*args, **kwargs)`` in the inference process.
+
+        Arrays and images in the arguments go through the ring; the call is
+        scheduled under ``ticket`` (default: the current ticket) and
+        cancelled remotely when the ticket is cancelled.
+
+        Raises:
+            DeadlineExceeded, ClientDisconnected: Dropped by the server's scheduler
+            ConnectionError: The server is not reachable
+        """
+        ticket = ticket or current_ticket()
+        ticket_info = {
+            "priority": ticket.priority if ticket else "api",
+            "client": ticket.client if ticket else "local",
+            "timeout": ticket.remaining() if ticket else None,
+        }
+        refs: List[ArrayRef] = []
+        try:
+            encoded_args = encode_value(tuple(args), self.ring, refs, self.write_timeout)
+            encoded_kwargs = encode_value(dict(kwargs or {}), self.ring, refs, self.write_timeout)
+        except Exception:
+            for ref in refs:
+                self.ring.free(ref.offset)
+            raise
+        cost = max(1, len(refs))
+        call_id, future = self._request(
+            ("call", model_name, method, encoded_args, encoded_kwargs, ticket_info, cost), refs
+        )
+
+        cancelled = False
+        while True:
+            try:
+                return future.result(timeout=CANCEL_POLL_INTERVAL)
+            except RequestDropped as e:
+                e.priority = ticket_info["priority"]
+                raise
+            except FutureTimeout:
+                if ticket is not None and ticket.cancelled and not cancelled:
+                    cancelled = True
+                    try:
+                        self._send(("cancel", call_id))
+                    except (OSError, EOFError):
+                        pass
+
+    def _simple(self, kind: str, *args: Any) -> Any:
+        _, future = self._request((kind,) + args, [])
+        return future.result()
+
+    def model(self, model_name: str, methods: Optional[Tuple[str, ...]] = None) -> "RemoteModel":
+        """Proxy of a server-side model forwarding ``methods`` (default: ``MODEL_METHODS``)."""
+        return RemoteModel(self, model_name, methods)
+
+    def unload(self, model_name: str) -> bool:
+        """Unload a model in the inference process."""
+        return self._simple("unload", model_name)
+
+    def stats(self) -> Dict[str, Any]:
+        """Loaded models, connected workers and scheduler statistics of the server."""
+        return self._simple("stats")
+
+    def close(self) -> None:
+        """Disconnect (the server hangs up, which ends the receiver) and free the ring."""
+        try:
+            self._send(("close",))
+            self._receiver.join(5)
+        except (OSError, EOFError):
+            pass
+        self.connection.close()
+        self._disconnect()
+        self.ring.close()
+
+
+class RemoteModel:
+    """Model-compatible proxy: method calls run on the inference server."""
+
+    def __init__(self, client: InferenceClient, model_name: str, methods: Optional[Tuple[str, ...]] = None):
+        self.client = client
+        self.model_name = model_name
+        self.methods = frozenset(methods if methods is not None else MODEL_METHODS)
+
+    def __getattr__(self, method: str) -> Callable[..., Any]:
+        # Only known methods: everything else is absent, as on a model without it
+        if method not in self.__dict__.get("methods", ()):
+            raise AttributeError(f"{type(self).__name__} of {self.__dict__.get('model_name')} has no method {method}")
+
+        def remote(*args: Any, **kwargs: Any) -> Any:
+            return self.client.call(self.model_name, method, args, kwargs)
+        remote.__name__ = method
+        return remote
+
+    def unload(self) -> None:
+        """Model-compatible unload."""
+        self.client.unload(self.model_name)
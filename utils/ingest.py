@@ -0,0 +1,163 @@
+"""Decode-once image ingest.
+
+Uploads are inspected in two steps:
+
+1. ``sniff_image_header`` reads only the file header (format, size,
+   frame count) and rejects oversized images by megapixels before any
+   pixel data is decoded, which guards against decompression bombs.
+2. ``decode_image_once`` decodes the pixels exactly once into an RGB
+   array. JPEGs that the model would downscale anyway are decoded at a
+   reduced DCT scale via ``Image.draft``.
+"""
+
+import io
+import math
+import warnings
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .validators import ValidationError
+
+
+class ImageTooLargeError(ValidationError):
+    """Raised when an image exceeds the decoded size limit."""
+    pass
+
+
+DEFAULT_ALLOWED_FORMATS: Tuple[str, ...] = ('JPEG', 'PNG', 'BMP', 'TIFF', 'WEBP', 'MPO')
+DEFAULT_MAX_MEGAPIXELS = 80.0
+
+
+@dataclass
+class ImageHeader:
+    """Image metadata read from the file header."""
+    format: str
+    width: int
+    height: int
+    mode: str
+    n_frames: int = 1
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return (self.width, self.height)
+
+    @property
+    def megapixels(self) -> float:
+        return (self.width * self.height) / 1_000_000
+
+
+@dataclass
+class IngestedImage:
+    """Decoded image with the header it was decoded from."""
+    array: np.ndarray
+    header: ImageHeader
+    draft_scale: float = 1.0
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """(width, height) of the decoded array."""
+        return (self.array.shape[1], self.array.shape[0])
+
+    def to_pil(self) -> Image.Image:
+        """PIL view for code paths that still require PIL Images."""
+        return Image.fromarray(self.array)
+
+
+def open_image_lazy(content: bytes) -> Image.Image:
+    """Open an image without decoding pixels (PIL reads headers lazily)."""
+    with warnings.catch_warnings():
+        # Our own megapixel limit replaces PIL's DecompressionBombWarning
+        warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+        return Image.open(io.BytesIO(content))
+
+
+def sniff_image_header(
+    content: bytes,
+    allowed_formats: Tuple[str, ...] = DEFAULT_ALLOWED_FORMATS,
+    max_megapixels: float = DEFAULT_MAX_MEGAPIXELS
+) -> ImageHeader:
+    """
+    Read format and dimensions from the image header only.
+
+    Args:
+        content: Encoded image bytes
+        allowed_formats: Accepted PIL format names
+        max_megapixels: Maximum decoded size in megapixels
+
+    Returns:
+        ImageHeader
+
+    Raises:
+        ImageTooLargeError: If the decoded image would exceed ``max_megapixels``
+        ValidationError: If the file is not an accepted image
+    """
+    try:
+        image = open_image_lazy(content)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(f"Image is too large to decode: {e}")
+    except Exception as e:
+        raise ValidationError(f"Invalid image file: {e}")
+
+    if image.format not in allowed_formats:
+        raise ValidationError(
+            f"Image format '{image.format}' not supported. Allowed: {', '.join(allowed_formats)}"
+        )
+
+    header = ImageHeader(
+        format=image.format,
+        width=image.width,
+        height=image.height,
+        mode=image.mode,
+        n_frames=getattr(image, "n_frames", 1)
+    )
+
+    if header.width <= 0 or header.height <= 0:
+        raise ValidationError("Image has invalid dimensions")
+
+    if header.megapixels > max_megapixels:
+        raise ImageTooLargeError(
+            f"Image is {header.megapixels:.1f} MP, maximum is {max_megapixels:.0f} MP"
+        )
+
+    return header
+
+
+def decode_image_once(
+    content: bytes,
+    header: Optional[ImageHeader] = None,
+    target_pixels: Optional[int] = None,
+    max_megapixels: float = DEFAULT_MAX_MEGAPIXELS
+) -> IngestedImage:
+    """
+    Decode an image exactly once into an RGB array.
+
+    Args:
+        content: Encoded image bytes
+        header: Header from ``sniff_image_header`` (sniffed again if None)
+        target_pixels: Pixel count the model will downscale to; JPEGs larger
+            than this are decoded at a reduced DCT scale that stays at or
+            above the target
+        max_megapixels: Maximum decoded size, used when sniffing
+
+    Returns:
+        IngestedImage with the decoded array
+    """
+    if header is None:
+        header = sniff_image_header(content, max_megapixels=max_megapixels)
+
+    image = open_image_lazy(content)
+    draft_scale = 1.0
+
+    if target_pixels and image.format == 'JPEG' and header.width * header.height > target_pixels * 4:
+        scale = math.sqrt(target_pixels / (header.width * header.height))
+        requested = (max(1, int(header.width * scale)), max(1, int(header.height * scale)))
+        image.draft('RGB', requested)
+        draft_scale = image.size[0] / header.width
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    return IngestedImage(array=np.asarray(image), header=header, draft_scale=draft_scale)
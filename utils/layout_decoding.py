@@ -0,0 +1,444 @@
+"""Grammar-constrained decoding for dots.ocr layout JSON.
+
+Layout prompts ask dots.ocr for a JSON list of elements::
+
+    [{"bbox": [x1, y1, x2, y2], "category": "Text", "text": "..."}, ...]
+
+Unconstrained generation sometimes breaks this structure (unescaped
+quotes, truncated arrays, invented categories), which used to require
+retries and regex repair. This module provides:
+
+- ``LAYOUT_JSON_SCHEMA`` for vLLM guided decoding (``guided_json``);
+- ``LayoutGrammar``: a character automaton for the same structure;
+- ``LayoutJSONLogitsProcessor``: masks tokens that would leave the
+  grammar during Transformers ``generate()``;
+- ``finalize_layout_json`` / ``parse_layout``: close output cut off by
+  ``max_new_tokens`` at the last complete element so it always parses.
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import torch
+
+from .dots_prompts import dict_promptmode_to_prompt
+
+try:
+    from transformers import LogitsProcessor
+    TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    LogitsProcessor = object
+    TRANSFORMERS_AVAILABLE = False
+
+
+LAYOUT_CATEGORIES: Tuple[str, ...] = (
+    'Caption', 'Footnote', 'Formula', 'List-item', 'Page-footer', 'Page-header',
+    'Picture', 'Section-header', 'Table', 'Text', 'Title'
+)
+
+LAYOUT_ELEMENT_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "bbox": {
+            "type": "array",
+            "items": {"type": "integer", "minimum": 0},
+            "minItems": 4,
+            "maxItems": 4
+        },
+        "category": {"type": "string", "enum": list(LAYOUT_CATEGORIES)},
+        "text": {"type": "string"}
+    },
+    "required": ["bbox", "category"],
+    "additionalProperties": False
+}
+
+LAYOUT_JSON_SCHEMA: Dict[str, Any] = {
+    "type": "array",
+    "items": LAYOUT_ELEMENT_SCHEMA
+}
+
+# Prompt modes (keys of dict_promptmode_to_prompt) that produce layout JSON
+LAYOUT_PROMPT_MODES: Tuple[str, ...] = ('prompt_layout_all_en', 'layout_all')
+
+_WHITESPACE = ' \t\n\r'
+_MAX_WHITESPACE_RUN = 16
+_MAX_INT_DIGITS = 5
+_HEX_DIGITS = '0123456789abcdefABCDEF'
+
+State = Tuple[int, Any]
+
+
+def is_layout_prompt(prompt: Optional[str]) -> bool:
+    """
+    Check whether a prompt (or prompt mode) asks for layout JSON.
+
+    Whitespace is normalized, so re-indented copies of the official
+    prompt (e.g. in the Streamlit UI) are recognized too.
+    """
+    if not prompt:
+        return False
+    if prompt in LAYOUT_PROMPT_MODES:
+        return True
+
+    normalized = " ".join(prompt.split())
+    return any(
+        normalized == " ".join(dict_promptmode_to_prompt[mode].split())
+        for mode in LAYOUT_PROMPT_MODES
+        if mode in dict_promptmode_to_prompt
+    )
+
+
+class LayoutGrammar:
+    """
+    Character automaton for the dots.ocr layout list.
+
+    The grammar follows the key order dots.ocr emits (bbox, category,
+    optional text) and allows JSON whitespace between tokens. A state is
+    ``(pc, sub)``: the index of the current operation and its progress.
+    """
+
+    def __init__(self, categories: Sequence[str] = LAYOUT_CATEGORIES):
+        self.categories = tuple(f'{category}"' for category in categories)
+        self.ops, self.element_end = self._compile()
+
+    def _compile(self) -> Tuple[List[Tuple], int]:
+        program: List[Any] = []
+
+        def lit(text: str) -> None:
+            program.append(('lit', text))
+
+        def ws() -> None:
+            program.append(('ws',))
+
+        # root: [ element (, element)* ] or []
+        ws()
+        lit('[')
+        ws()
+        program.append(('choice', {'{': 'element', ']': 'tail'}))
+
+        program.append('element')
+        ws(); lit('"bbox"'); ws(); lit(':'); ws(); lit('['); ws()
+        for index in range(4):
+            program.append(('int',))
+            ws()
+            if index < 3:
+                lit(',')
+                ws()
+        lit(']'); ws(); lit(','); ws(); lit('"category"'); ws(); lit(':'); ws(); lit('"')
+        program.append(('enum',))
+        ws()
+        program.append(('choice', {'}': 'after_element', ',': 'text_field'}))
+
+        program.append('text_field')
+        ws(); lit('"text"'); ws(); lit(':'); ws(); lit('"')
+        program.append(('str',))
+        ws()
+        program.append(('choice', {'}': 'after_element'}))
+
+        program.append('after_element')
+        ws()
+        program.append(('choice', {',': 'next_element', ']': 'tail'}))
+
+        program.append('next_element')
+        ws()
+        program.append(('choice', {'{': 'element'}))
+
+        program.append('tail')
+        ws()
+        program.append(('end',))
+
+        # Resolve labels to operation indices
+        labels: Dict[str, int] = {}
+        ops: List[Tuple] = []
+        for item in program:
+            if isinstance(item, str):
+                labels[item] = len(ops)
+            else:
+                ops.append(item)
+
+        resolved = []
+        for op in ops:
+            if op[0] == 'choice':
+                op = ('choice', {ch: labels[target] for ch, target in op[1].items()})
+            resolved.append(op)
+
+        return resolved, labels['after_element']
+
+    @property
+    def initial(self) -> State:
+        return (0, 0)
+
+    def step(self, state: State, ch: str) -> Optional[State]:
+        """Advance by one character; None if the character is not allowed."""
+        pc, sub = state
+
+        while True:
+            op = self.ops[pc]
+            kind = op[0]
+
+            if kind == 'ws':
+                if ch in _WHITESPACE and sub < _MAX_WHITESPACE_RUN:
+                    return (pc, sub + 1)
+                pc, sub = pc + 1, 0
+                continue
+
+            if kind == 'lit':
+                text = op[1]
+                if ch != text[sub]:
+                    return None
+                return (pc + 1, 0) if sub + 1 == len(text) else (pc, sub + 1)
+
+            if kind == 'choice':
+                target = op[1].get(ch)
+                return (target, 0) if target is not None else None
+
+            if kind == 'int':
+                # sub: digits read so far, -1 after a leading zero
+                if '0' <= ch <= '9':
+                    if sub == -1 or sub >= _MAX_INT_DIGITS:
+                        return None
+                    return (pc, -1) if sub == 0 and ch == '0' else (pc, sub + 1)
+                if sub == 0:
+                    return None
+                pc, sub = pc + 1, 0
+                continue
+
+            if kind == 'enum':
+                prefix = (sub or '') + ch
+                if prefix in self.categories:
+                    return (pc + 1, 0)
+                if any(category.startswith(prefix) for category in self.categories):
+                    return (pc, prefix)
+                return None
+
+            if kind == 'str':
+                # sub: 0 plain, 1 after backslash, 2..5 inside \uXXXX
+                if sub == 0:
+                    if ch == '"':
+                        return (pc + 1, 0)
+                    if ch == '\\':
+                        return (pc, 1)
+                    return None if ord(ch) < 0x20 else (pc, 0)
+                if sub == 1:
+                    if ch in '"\\/bfnrt':
+                        return (pc, 0)
+                    return (pc, 2) if ch == 'u' else None
+                if ch not in _HEX_DIGITS:
+                    return None
+                return (pc, 0) if sub == 5 else (pc, sub + 1)
+
+            return None  # 'end'
+
+    def feed(self, state: Optional[State], text: str) -> Optional[State]:
+        """Advance by a string; None as soon as a character is rejected."""
+        for ch in text:
+            if state is None:
+                return None
+            state = self.step(state, ch)
+        return state
+
+    def is_complete(self, state: Optional[State]) -> bool:
+        """True once the closing bracket has been produced."""
+        if state is None:
+            return False
+        pc = state[0]
+        while self.ops[pc][0] == 'ws':
+            pc += 1
+        return self.ops[pc][0] == 'end'
+
+
+def finalize_layout_json(text: str, grammar: Optional[LayoutGrammar] = None) -> str:
+    """
+    Make layout output parseable in one pass.
+
+    Complete output is returned unchanged (stripped). Output cut off by
+    the token budget is closed after the last complete element.
+
+    Args:
+        text: Raw model output
+        grammar: Grammar instance (a default one is created if None)
+
+    Returns:
+        JSON text that ``json.loads`` accepts
+    """
+    grammar = grammar or LayoutGrammar()
+    text = text.strip()
+
+    # Tolerate a markdown fence around unconstrained output
+    if text.startswith('```'):
+        text = text.split('\n', 1)[1] if '\n' in text else ''
+        text = text.rsplit('```', 1)[0].strip()
+
+    state: Optional[State] = grammar.initial
+    last_complete = None
+
+    for index, ch in enumerate(text):
+        state = grammar.step(state, ch)
+        if state is None:
+            break
+        if state[0] == grammar.element_end and state[1] == 0:
+            last_complete = index + 1
+
+    if grammar.is_complete(state):
+        return text
+
+    if last_complete is None:
+        return '[]'
+    return text[:last_complete] + ']'
+
+
+def parse_layout(text: str) -> List[Dict[str, Any]]:
+    """Parse layout output into a list of ``{bbox, category, text}`` elements."""
+    return json.loads(finalize_layout_json(text))
+
+
+class VocabularyIndex:
+    """
+    Per-tokenizer token table with grammar masks cached per state.
+
+    Computing the allowed set for a state scans the vocabulary once;
+    the result is reused by every later request with the same tokenizer.
+    """
+
+    def __init__(self, tokenizer: Any, grammar: LayoutGrammar):
+        self.grammar = grammar
+        self.tokens = self._token_strings(tokenizer)
+
+        # Tokens grouped by first character: one grammar step rejects a whole group
+        self.groups: Dict[str, List[int]] = {}
+        for token_id, text in enumerate(self.tokens):
+            if text:
+                self.groups.setdefault(text[0], []).append(token_id)
+
+        self._allowed: Dict[State, List[int]] = {}
+        self._masks: Dict[Tuple[Any, int, str], torch.Tensor] = {}
+
+    @staticmethod
+    def _token_strings(tokenizer: Any) -> List[str]:
+        """Decoded text of every token id; special tokens map to ''."""
+        special = set(getattr(tokenizer, 'all_special_ids', []) or [])
+        tokens = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+        return [
+            '' if token is None or token_id in special else tokenizer.convert_tokens_to_string([token])
+            for token_id, token in enumerate(tokens)
+        ]
+
+    def allowed(self, state: State) -> List[int]:
+        """Token ids that keep the output inside the grammar from ``state``."""
+        if state not in self._allowed:
+            allowed = []
+            for first, token_ids in self.groups.items():
+                after_first = self.grammar.step(state, first)
+                if after_first is None:
+                    continue
+                for token_id in token_ids:
+                    if self.grammar.feed(after_first, self.tokens[token_id][1:]) is not None:
+                        allowed.append(token_id)
+            self._allowed[state] = allowed
+        return self._allowed[state]
+
+    def mask(self, key: Any, allowed: List[int], vocab_size: int, device: torch.device) -> torch.Tensor:
+        """Boolean mask (True = blocked) for a state, cached per device."""
+        cache_key = (key, vocab_size, str(device))
+        if cache_key not in self._masks:
+            mask = torch.ones(vocab_size, dtype=torch.bool, device=device)
+            mask[[t for t in allowed if t < vocab_size]] = False
+            self._masks[cache_key] = mask
+        return self._masks[cache_key]
+
+
+_VOCABULARY_INDEXES: Dict[Tuple[int, Tuple[str, ...]], VocabularyIndex] = {}
+
+
+def vocabulary_index(tokenizer: Any, grammar: LayoutGrammar) -> VocabularyIndex:
+    """Shared VocabularyIndex for a tokenizer/grammar pair."""
+    key = (id(tokenizer), grammar.categories)
+    if key not in _VOCABULARY_INDEXES:
+        _VOCABULARY_INDEXES[key] = VocabularyIndex(tokenizer, grammar)
+    return _VOCABULARY_INDEXES[key]
+
+
+class LayoutJSONLogitsProcessor(LogitsProcessor):
+    """Logits processor that keeps generation inside the layout grammar."""
+
+    def __init__(
+        self,
+        tokenizer: Any,
+        prompt_length: int,
+        grammar: Optional[LayoutGrammar] = None,
+        eos_token_ids: Optional[Sequence[int]] = None
+    ):
+        """
+        Initialize logits processor.
+
+        Args:
+            tokenizer: Tokenizer of the model
+            prompt_length: Length of the (padded) prompt in input_ids
+            grammar: Grammar instance (default layout grammar if None)
+            eos_token_ids: Tokens allowed once the JSON is complete
+        """
+        self.grammar = grammar or LayoutGrammar()
+        self.prompt_length = prompt_length
+        self.index = vocabulary_index(tokenizer, self.grammar)
+
+        if eos_token_ids is None:
+            eos_token_ids = [tokenizer.eos_token_id]
+        self.eos_token_ids = [int(t) for t in eos_token_ids if t is not None]
+
+        self._rows: Dict[int, Tuple[int, Optional[State]]] = {}
+
+    def reset(self) -> None:
+        """Forget per-row states (before re-running generation)."""
+        self._rows.clear()
+
+    def allowed_tokens(self, state: Optional[State]) -> List[int]:
+        """Token ids allowed from ``state`` (EOS only once the JSON is complete)."""
+        if state is None or self.grammar.is_complete(state):
+            return self.eos_token_ids
+        return self.index.allowed(state) or self.eos_token_ids
+
+    def _row_state(self, row: int, generated: Sequence[int]) -> Optional[State]:
+        consumed, state = self._rows.get(row, (0, self.grammar.initial))
+        for token_id in generated[consumed:]:
+            if token_id in self.eos_token_ids:
+                state = None
+                break
+            text = self.index.tokens[token_id] if token_id < len(self.index.tokens) else ''
+            state = self.grammar.feed(state, text)
+        self._rows[row] = (len(generated), state)
+        return state
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        generated = input_ids[:, self.prompt_length:].tolist()
+        for row, tokens in enumerate(generated):
+            state = self._row_state(row, tokens)
+            done = state is None or self.grammar.is_complete(state)
+            mask = self.index.mask(
+                ('eos', tuple(self.eos_token_ids)) if done else state,
+                self.allowed_tokens(state),
+                scores.shape[-1],
+                scores.device
+            )
+            scores[row] = scores[row].masked_fill(mask, float('-inf'))
+        return scores
+
+
+def build_layout_logits_processor(
+    tokenizer: Any,
+    prompt_length: int,
+    config: Optional[Dict[str, Any]] = None
+) -> Optional[LayoutJSONLogitsProcessor]:
+    """
+    Create the layout logits processor, or None if disabled.
+
+    Args:
+        tokenizer: Tokenizer of the model
+        prompt_length: Length of the prompt in input_ids
+        config: Model config (``constrained_layout: false`` disables it)
+
+    Returns:
+        LayoutJSONLogitsProcessor or None
+    """
+    if not TRANSFORMERS_AVAILABLE or (config or {}).get('constrained_layout', True) is False:
+        return None
+    return LayoutJSONLogitsProcessor(tokenizer, prompt_length)
@@ -0,0 +1,567 @@
+"""Load-testing harness for api.py and OpenAI-compatible endpoints.
+
+Drives an endpoint at a series of load levels and reports, per level,
+throughput, latency percentiles (p50/p95/p99), time to first token and
+generated tokens per second. Two load models:
+
+- closed loop: ``concurrency`` workers, each sending its next request as
+  soon as the previous one returns (measures capacity at a fixed number
+  of users);
+- open loop: requests arrive at ``rate`` per second (Poisson or constant
+  spacing) regardless of completions, so queueing shows up in latency.
+  Latency is measured from the scheduled arrival, not from when the
+  client got around to sending, to avoid coordinated omission.
+
+Targets:
+- ``openai``: ``/v1/chat/completions`` of vLLM (or the fake server),
+  streamed; TTFT is the first content chunk, tokens come from ``usage``.
+- ``api-ocr`` / ``api-chat``: ``/ocr`` and ``/chat`` of api.py; tokens
+  per second come from the ``chatvlm_tokens_total`` delta of ``/metrics``
+  (api.py responses are not streamed, so TTFT equals latency there).
+
+Targets cycle through a list of images: api.py coalesces identical
+in-flight requests, so a single repeated image measures coalescing
+rather than the model.
+
+Usage:
+    report = run_sweep(OpenAIChatTarget(image_bytes), "http://localhost:8000",
+                       mode="closed", levels=[1, 4, 16], requests=64)
+    save_report(report, "benchmarks/openai.json")
+"""
+
+import asyncio
+import base64
+import json
+import math
+import random
+import subprocess
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+
+@dataclass
+class RequestResult:
+    """Outcome of one request."""
+
+    ok: bool
+    latency: float
+    ttft: Optional[float] = None
+    output_tokens: Optional[int] = None
+    status: int = 0
+    error: Optional[str] = None
+
+
+@dataclass
+class LevelResult:
+    """All requests of one load level."""
+
+    mode: str
+    level: float
+    duration: float
+    results: List[RequestResult] = field(default_factory=list)
+    dropped: int = 0
+    output_tokens: Optional[int] = None
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """
+    Percentile with linear interpolation between closest ranks.
+
+    Args:
+        values: Samples
+        q: Percentile in [0, 100]
+
+    Returns:
+        Percentile value, or None without samples
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def distribution(values: List[float]) -> Optional[Dict[str, float]]:
+    """Mean, p50/p95/p99 and max of samples in seconds."""
+    if not values:
+        return None
+    return {
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def summarize(level: LevelResult) -> Dict[str, Any]:
+    """
+    Summary of a load level.
+
+    Args:
+        level: Collected results
+
+    Returns:
+        Dictionary with throughput, latency/TTFT distributions and tokens/s
+    """
+    ok = [result for result in level.results if result.ok]
+    statuses: Dict[str, int] = {}
+    for result in level.results:
+        statuses[str(result.status)] = statuses.get(str(result.status), 0) + 1
+
+    tokens = level.output_tokens
+    if tokens is None and ok and all(result.output_tokens is not None for result in ok):
+        tokens = sum(result.output_tokens for result in ok)
+    duration = level.duration or float("nan")
+
+    return {
+        "mode": level.mode,
+        "level": level.level,
+        "duration": level.duration,
+        "requests": len(level.results),
+        "ok": len(ok),
+        "errors": len(level.results) - len(ok),
+        "dropped": level.dropped,
+        "error_rate": (len(level.results) - len(ok)) / len(level.results) if level.results else 0.0,
+        "statuses": statuses,
+        "throughput_rps": len(ok) / duration,
+        "latency": distribution([result.latency for result in ok]),
+        "ttft": distribution([result.ttft for result in ok if result.ttft is not None]),
+        "output_tokens": tokens,
+        "tokens_per_second": tokens / duration if tokens is not None else None,
+        "sample_errors": sorted({result.error for result in level.results if result.error})[:5],
+    }
+
+
+class Target:
+    """Endpoint under test."""
+
+    name = "target"
+    images: List[bytes] = []
+    _sent = 0
+
+    def next_image(self) -> bytes:
+        """Next image of the rotation."""
+        image = self.images[self._sent % len(self.images)]
+        self._sent += 1
+        return image
+
+    def payload_info(self) -> Dict[str, Any]:
+        """Request parameters recorded in the report."""
+        return {}
+
+    async def send(self, client: "httpx.AsyncClient") -> RequestResult:
+        raise NotImplementedError
+
+    async def output_tokens(self, client: "httpx.AsyncClient") -> Optional[int]:
+        """Server-side generated token counter, if the target exposes one."""
+        return None
+
+
+class OpenAIChatTarget(Target):
+    """Streaming ``/v1/chat/completions`` with an image."""
+
+    name = "openai"
+
+    def __init__(self, images: Union[bytes, List[bytes]], prompt: str = "Extract all text from this image.",
+                 model: Optional[str] = None, max_tokens: int = 256, mime: str = "image/png",
+                 stream: bool = True):
+        """
+        Args:
+            images: Encoded image(s) sent as a data URL, used in rotation
+            prompt: Text prompt
+            model: Model id (default: first model of ``/v1/models``)
+            max_tokens: Generation limit
+            mime: Image MIME type
+            stream: Stream the response (needed for TTFT)
+        """
+        self.prompt = prompt
+        self.model = model
+        self.max_tokens = max_tokens
+        self.stream = stream
+        self.mime = mime
+        self.images = [images] if isinstance(images, bytes) else list(images)
+
+    def payload_info(self) -> Dict[str, Any]:
+        return {"model": self.model, "prompt": self.prompt, "max_tokens": self.max_tokens, "stream": self.stream}
+
+    async def resolve_model(self, client: "httpx.AsyncClient") -> None:
+        if self.model is None:
+            response = await client.get("/v1/models")
+            response.raise_for_status()
+            self.model = response.json()["data"][0]["id"]
+
+    def body(self) -> Dict[str, Any]:
+        image_url = f"data:{self.mime};base64,{base64.b64encode(self.next_image()).decode()}"
+        body = {
+            "model": self.model,
+            "messages": [{
+                "role": "user",
+                "content": [
+                    {"type": "image_url", "image_url": {"url": image_url}},
+                    {"type": "text", "text": self.prompt},
+                ],
+            }],
+            "max_tokens": self.max_tokens,
+            "temperature": 0.0,
+            "stream": self.stream,
+        }
+        if self.stream:
+            body["stream_options"] = {"include_usage": True}
+        return body
+
+    async def send(self, client: "httpx.AsyncClient") -> RequestResult:
+        start = time.perf_counter()
+        if not self.stream:
+            response = await client.post("/v1/chat/completions", json=self.body())
+            latency = time.perf_counter() - start
+            if response.status_code != 200:
+                return RequestResult(False, latency, status=response.status_code, error=response.text[:200])
+            usage = response.json().get("usage") or {}
+            return RequestResult(True, latency, latency, usage.get("completion_tokens"), 200)
+
+        ttft, chunks, usage = None, 0, None
+        async with client.stream("POST", "/v1/chat/completions", json=self.body()) as response:
+            if response.status_code != 200:
+                text = (await response.aread()).decode(errors="replace")
+                return RequestResult(False, time.perf_counter() - start, status=response.status_code, error=text[:200])
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                usage = chunk.get("usage") or usage
+                for choice in chunk.get("choices", []):
+                    if choice.get("delta", {}).get("content"):
+                        chunks += 1
+                        if ttft is None:
+                            ttft = time.perf_counter() - start
+        latency = time.perf_counter() - start
+        tokens = usage.get("completion_tokens") if usage else chunks
+        return RequestResult(True, latency, ttft, tokens, 200)
+
+
+class ApiTarget(Target):
+    """``/ocr`` or ``/chat`` of api.py."""
+
+    def __init__(self, images: Union[bytes, List[bytes]], endpoint: str = "ocr", model: str = "qwen3_vl_2b",
+                 prompt: str = "Extract all text.", max_tokens: int = 256,
+                 filename: str = "page.png", mime: str = "image/png"):
+        """
+        Args:
+            images: Uploaded image file content(s), used in rotation
+            endpoint: 'ocr' or 'chat'
+            model: api.py model key
+            prompt: Chat prompt (chat only)
+            max_tokens: Generation limit (chat only)
+            filename: Upload file name
+            mime: Upload MIME type
+        """
+        if endpoint not in ("ocr", "chat"):
+            raise ValueError(f"Unknown api.py endpoint: {endpoint}")
+        self.name = f"api-{endpoint}"
+        self.images = [images] if isinstance(images, bytes) else list(images)
+        self.endpoint = endpoint
+        self.model = model
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.filename = filename
+        self.mime = mime
+
+    def payload_info(self) -> Dict[str, Any]:
+        info = {"endpoint": f"/{self.endpoint}", "model": self.model}
+        if self.endpoint == "chat":
+            info.update(prompt=self.prompt, max_tokens=self.max_tokens)
+        return info
+
+    async def send(self, client: "httpx.AsyncClient") -> RequestResult:
+        files = {"file": (self.filename, self.next_image(), self.mime)}
+        start = time.perf_counter()
+        if self.endpoint == "ocr":
+            response = await client.post("/ocr", params={"model": self.model}, files=files)
+        else:
+            response = await client.post(
+                "/chat",
+                params={"max_tokens": self.max_tokens, "temperature": 0.0},
+                data={"model": self.model, "prompt": self.prompt},
+                files=files,
+            )
+        latency = time.perf_counter() - start
+        if response.status_code != 200:
+            return RequestResult(False, latency, status=response.status_code, error=response.text[:200])
+        return RequestResult(True, latency, status=200)
+
+    async def output_tokens(self, client: "httpx.AsyncClient") -> Optional[int]:
+        try:
+            response = await client.get("/metrics")
+        except httpx.HTTPError:
+            return None
+        if response.status_code != 200:
+            return None
+        return int(metric_value(response.text, "chatvlm_tokens_total", model=self.model, direction="out"))
+
+
+def metric_value(text: str, name: str, **labels: str) -> float:
+    """
+    Sum of a metric over the exposition lines matching the labels.
+
+    Args:
+        text: Prometheus text exposition
+        name: Metric name
+        **labels: Label values that must match
+
+    Returns:
+        Sum of matching samples (0 if none)
+    """
+    total = 0.0
+    for line in text.splitlines():
+        if not line.startswith(name + "{"):
+            continue
+        series, value = line.rsplit(" ", 1)
+        if all(f'{key}="{expected}"' in series for key, expected in labels.items()):
+            total += float(value)
+    return total
+
+
+async def closed_loop(client: "httpx.AsyncClient", target: Target, concurrency: int,
+                      requests: Optional[int] = None, duration: Optional[float] = None) -> LevelResult:
+    """
+    Closed-loop load: ``concurrency`` workers sending back to back.
+
+    Args:
+        client: HTTP client bound to the endpoint
+        target: Endpoint under test
+        concurrency: Number of workers
+        requests: Total requests to send (across workers)
+        duration: Stop sending new requests after this many seconds
+
+    Returns:
+        Level result
+    """
+    if requests is None and duration is None:
+        raise ValueError("closed loop needs requests or duration")
+    level = LevelResult("closed", concurrency, 0.0)
+    remaining = [requests if requests is not None else math.inf]
+    start = time.perf_counter()
+
+    async def worker():
+        while remaining[0] > 0 and (duration is None or time.perf_counter() - start < duration):
+            remaining[0] -= 1
+            level.results.append(await send_safely(client, target))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    level.duration = time.perf_counter() - start
+    return level
+
+
+def arrival_times(rate: float, duration: float, arrival: str = "poisson", seed: int = 0) -> List[float]:
+    """
+    Request arrival offsets of an open-loop run.
+
+    Args:
+        rate: Mean requests per second
+        duration: Length of the arrival window in seconds
+        arrival: 'poisson' (exponential gaps) or 'constant'
+        seed: Random seed for Poisson arrivals
+
+    Returns:
+        Sorted offsets in seconds from the start
+    """
+    if rate <= 0:
+        raise ValueError("rate must be positive")
+    if arrival == "constant":
+        return [i / rate for i in range(int(rate * duration))]
+    if arrival != "poisson":
+        raise ValueError(f"Unknown arrival process: {arrival}")
+    rng = random.Random(seed)
+    times, now = [], rng.expovariate(rate)
+    while now < duration:
+        times.append(now)
+        now += rng.expovariate(rate)
+    return times
+
+
+async def open_loop(client: "httpx.AsyncClient", target: Target, rate: float, duration: float,
+                    arrival: str = "poisson", seed: int = 0,
+                    max_in_flight: Optional[int] = None) -> LevelResult:
+    """
+    Open-loop load: requests arrive on a schedule regardless of completions.
+
+    Args:
+        client: HTTP client bound to the endpoint
+        target: Endpoint under test
+        rate: Mean arrival rate in requests per second
+        duration: Arrival window in seconds
+        arrival: 'poisson' or 'constant'
+        seed: Random seed for Poisson arrivals
+        max_in_flight: Drop arrivals while this many requests are
+            outstanding (protects the client; drops are reported)
+
+    Returns:
+        Level result; latency counts from the scheduled arrival
+    """
+    level = LevelResult("open", rate, 0.0)
+    in_flight = [0]
+    start = time.perf_counter()
+
+    async def fire(scheduled: float):
+        in_flight[0] += 1
+        try:
+            result = await send_safely(client, target)
+        finally:
+            in_flight[0] -= 1
+        # Time spent waiting behind a late client loop counts as latency
+        delay = max(0.0, time.perf_counter() - start - scheduled - result.latency)
+        result.latency += delay
+        if result.ttft is not None:
+            result.ttft += delay
+        level.results.append(result)
+
+    tasks = []
+    for scheduled in arrival_times(rate, duration, arrival, seed):
+        wait = start + scheduled - time.perf_counter()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        if max_in_flight is not None and in_flight[0] >= max_in_flight:
+            level.dropped += 1
+            continue
+        tasks.append(asyncio.ensure_future(fire(scheduled)))
+    await asyncio.gather(*tasks)
+    level.duration = time.perf_counter() - start
+    return level
+
+
+async def send_safely(client: "httpx.AsyncClient", target: Target) -> RequestResult:
+    """Send one request; transport errors become failed results."""
+    start = time.perf_counter()
+    try:
+        return await target.send(client)
+    except Exception as e:
+        return RequestResult(False, time.perf_counter() - start, error=f"{type(e).__name__}: {e}")
+
+
+async def run_sweep_async(target: Target, base_url: str, mode: str = "closed",
+                          levels: Optional[List[float]] = None, requests: Optional[int] = None,
+                          duration: Optional[float] = None, warmup: int = 1,
+                          arrival: str = "poisson", seed: int = 0, max_in_flight: Optional[int] = None,
+                          timeout: float = 300.0, transport: Any = None) -> Dict[str, Any]:
+    """
+    Run a concurrency (closed loop) or rate (open loop) sweep.
+
+    Args:
+        target: Endpoint under test
+        base_url: Endpoint base URL
+        mode: 'closed' or 'open'
+        levels: Concurrencies (closed) or request rates (open)
+        requests: Requests per level (closed loop)
+        duration: Seconds per level (open loop; optional cap for closed loop)
+        warmup: Requests sent once before the sweep and not recorded
+        arrival: Open-loop arrival process
+        seed: Open-loop random seed
+        max_in_flight: Open-loop cap on outstanding requests
+        timeout: Per-request timeout in seconds
+        transport: Optional httpx transport (e.g. ``httpx.ASGITransport``
+            for an in-process app)
+
+    Returns:
+        Report with metadata and one summary per level
+    """
+    if not HTTPX_AVAILABLE:
+        raise ImportError("httpx is required for load tests: pip install httpx")
+    if mode not in ("closed", "open"):
+        raise ValueError(f"Unknown load mode: {mode}")
+    if mode == "open" and duration is None:
+        raise ValueError("open loop needs duration")
+    levels = levels or [1]
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits,
+                                 transport=transport) as client:
+        if isinstance(target, OpenAIChatTarget):
+            await target.resolve_model(client)
+        for _ in range(warmup):
+            await send_safely(client, target)
+
+        summaries = []
+        for level in levels:
+            tokens_before = await target.output_tokens(client)
+            if mode == "closed":
+                result = await closed_loop(client, target, int(level), requests, duration)
+            else:
+                result = await open_loop(client, target, float(level), duration, arrival, seed, max_in_flight)
+            tokens_after = await target.output_tokens(client)
+            if tokens_before is not None and tokens_after is not None:
+                result.output_tokens = tokens_after - tokens_before
+            summaries.append(summarize(result))
+
+    return {
+        "metadata": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "target": target.name,
+            "base_url": base_url,
+            "payload": target.payload_info(),
+            "mode": mode,
+            "levels": levels,
+            "requests_per_level": requests,
+            "duration_per_level": duration,
+            "warmup": warmup,
+            "arrival": arrival if mode == "open" else None,
+            "seed": seed,
+        },
+        "levels": summaries,
+    }
+
+
+def run_sweep(target: Target, base_url: str, **kwargs: Any) -> Dict[str, Any]:
+    """Synchronous wrapper of ``run_sweep_async``."""
+    return asyncio.run(run_sweep_async(target, base_url, **kwargs))
+
+
+def git_commit() -> Optional[str]:
+    """Commit of the working tree, for comparing reports across changes."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def save_report(report: Dict[str, Any], path: str) -> None:
+    """Write a report as JSON, creating parent directories."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(path).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Table of a report: one line per level."""
+    unit = "conc" if report["metadata"]["mode"] == "closed" else "rps"
+    lines = [f"{unit:>6} {'ok':>5} {'err':>4} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} "
+             f"{'p99 ms':>8} {'ttft50':>8} {'tok/s':>8}"]
+
+    def ms(value):
+        return f"{value * 1000:8.1f}" if value is not None else f"{'-':>8}"
+
+    for level in report["levels"]:
+        latency = level["latency"] or {}
+        ttft = level["ttft"] or {}
+        tokens = level["tokens_per_second"]
+        lines.append(
+            f"{level['level']:>6g} {level['ok']:>5} {level['errors']:>4} {level['throughput_rps']:7.2f} "
+            f"{ms(latency.get('p50'))} {ms(latency.get('p95'))} {ms(latency.get('p99'))} "
+            f"{ms(ttft.get('p50'))} {f'{tokens:8.1f}' if tokens is not None else '-':>8}"
+        )
+    return "\n".join(lines)
@@ -16,6 +16,9 @@ from enum import Enum
 import threading
 import logging
 
+from utils.gpu_telemetry import get_telemetry
+from utils.container_registry import get_container_registry
+
 try:
     import torch
     TORCH_AVAILABLE = True
@@ -60,43 +63,24 @@ class MemoryController:
         self.memory_threshold_gb = 2.0  # Минимальный резерв памяти
         self.cleanup_lock = threading.Lock()
         
-    def get_gpu_memory_info(self) -> MemoryInfo:
-        """Получение информации о GPU памяти"""
-        if not TORCH_AVAILABLE or not torch.cuda.is_available():
+    def get_gpu_memory_info(self, max_age: Optional[float] = None) -> MemoryInfo:
+        """
+        Получение информации о GPU памяти
+        
+        Args:
+            max_age: Допустимый возраст замера в секундах (0 - прочитать сейчас),
+                по умолчанию последний замер фонового сэмплера
+        """
+        gpu = get_telemetry().latest(max_age).gpu(0)
+        if gpu is None or not gpu.memory_total_mb:
             return MemoryInfo(0, 0, 0, 0)
         
-        try:
-            # Используем nvidia-smi для точной информации
-            result = subprocess.run([
-                "nvidia-smi", 
-                "--query-gpu=memory.total,memory.used,memory.free",
-                "--format=csv,noheader,nounits"
-            ], capture_output=True, text=True, check=True)
-            
-            line = result.stdout.strip().split('\n')[0]
-            total_mb, used_mb, free_mb = map(int, line.split(', '))
-            
-            total_gb = total_mb / 1024
-            used_gb = used_mb / 1024
-            free_gb = free_mb / 1024
-            utilization = (used_gb / total_gb) * 100
-            
-            return MemoryInfo(total_gb, used_gb, free_gb, utilization)
-            
-        except Exception as e:
-            logger.warning(f"Ошибка получения GPU памяти: {e}")
-            # Fallback на PyTorch
-            try:
-                props = torch.cuda.get_device_properties(0)
-                total_gb = props.total_memory / (1024 ** 3)
-                allocated_gb = torch.cuda.memory_allocated(0) / (1024 ** 3)
-                reserved_gb = torch.cuda.memory_reserved(0) / (1024 ** 3)
-                free_gb = total_gb - reserved_gb
-                utilization = (reserved_gb / total_gb) * 100
-                
-                return MemoryInfo(total_gb, reserved_gb, free_gb, utilization)
-            except:
-                return MemoryInfo(0, 0, 0, 0)
+        return MemoryInfo(
+            gpu.memory_total_mb / 1024,
+            gpu.memory_used_mb / 1024,
+            gpu.memory_free_mb / 1024,
+            gpu.memory_percent
+        )
     
     def get_system_memory_info(self) -> MemoryInfo:
         """Получение информации о системной памяти"""
@@ -147,44 +131,34 @@ class MemoryController:
         killed_processes = []
         
         try:
-            result = subprocess.run([
-                "nvidia-smi", 
-                "--query-compute-apps=pid,process_name,used_memory",
-                "--format=csv,noheader,nounits"
-            ], capture_output=True, text=True, check=True)
-            
-            for line in result.stdout.strip().split('\n'):
-                if not line.strip():
+            # Свежий замер: список процессов мог измениться после очистки
+            for gpu_process in get_telemetry().latest(max_age=0).processes:
+                pid = gpu_process.pid
+                name = gpu_process.name
+                memory_mb = int(gpu_process.used_memory_mb)
+                
+                if pid in exclude_pids:
                     continue
-                    
-                parts = [p.strip() for p in line.split(',')]
-                if len(parts) >= 3:
-                    pid = int(parts[0])
-                    name = parts[1]
-                    memory_mb = int(parts[2])
-                    
-                    if pid in exclude_pids:
-                        continue
-                    
-                    try:
-                        if psutil.pid_exists(pid):
-                            process = psutil.Process(pid)
-                            logger.info(f"🔪 Завершение процесса: {name} (PID: {pid}, {memory_mb} MB)")
-                            
-                            process.terminate()
-                            time.sleep(1)
-                            
-                            if process.is_running():
-                                process.kill()
-                                time.sleep(0.5)
-                            
-                            killed_processes.append({
-                                'pid': pid,
-                                'name': name,
-                                'memory_mb': memory_mb
-                            })
-                    except Exception as e:
-                        logger.warning(f"Не удалось завершить процесс {pid}: {e}")
+                
+                try:
+                    if psutil.pid_exists(pid):
+                        process = psutil.Process(pid)
+                        logger.info(f"🔪 Завершение процесса: {name} (PID: {pid}, {memory_mb} MB)")
+                        
+                        process.terminate()
+                        time.sleep(1)
+                        
+                        if process.is_running():
+                            process.kill()
+                            time.sleep(0.5)
+                        
+                        killed_processes.append({
+                            'pid': pid,
+                            'name': name,
+                            'memory_mb': memory_mb
+                        })
+                except Exception as e:
+                    logger.warning(f"Не удалось завершить процесс {pid}: {e}")
         
         except Exception as e:
             logger.warning(f"Ошибка получения GPU процессов: {e}")
@@ -193,7 +167,8 @@ class MemoryController:
     
     def check_memory_availability(self, required_gb: float) -> Tuple[bool, str]:
         """Проверка доступности памяти"""
-        gpu_info = self.get_gpu_memory_info()
+        # Решение о загрузке модели принимается по свежему замеру (NVML, без подпроцесса)
+        gpu_info = self.get_gpu_memory_info(max_age=0)
         
         if gpu_info.free_gb < required_gb:
             return False, f"Недостаточно GPU памяти: требуется {required_gb:.1f}GB, доступно {gpu_info.free_gb:.1f}GB"
@@ -208,21 +183,11 @@ class MemoryController:
         containers = {}
         
         try:
-            result = subprocess.run([
-                "docker", "ps", "--format", "{{.ID}}\t{{.Names}}\t{{.Image}}"
-            ], capture_output=True, text=True, check=True)
-            
-            for line in result.stdout.strip().split('\n'):
-                if not line.strip():
-                    continue
-                
-                parts = line.split('\t')
-                if len(parts) >= 3:
-                    container_id, name, image = parts
-                    
-                    # Определяем vLLM контейнеры по образу или имени
-                    if 'vllm' in image.lower() or 'vllm' in name.lower():
-                        containers[name] = container_id
+            # Таблица состояний из потока событий Docker, без запуска docker ps
+            for name, state in get_container_registry().containers(running_only=True).items():
+                # Определяем vLLM контейнеры по образу или имени
+                if 'vllm' in state.image.lower() or 'vllm' in name.lower():
+                    containers[name] = state.id
         
         except Exception as e:
             logger.warning(f"Ошибка получения Docker контейнеров: {e}")
@@ -0,0 +1,585 @@
+"""Prometheus-style metrics with low-overhead instrumentation.
+
+A small in-process registry rendering the Prometheus text exposition
+format (no client library needed). Instruments are cheap enough to stay
+enabled in production:
+
+- every label combination gets its child once; histogram children hold
+  pre-allocated bucket counters, so ``observe`` is a bisect and two
+  additions under a per-child lock,
+- request-path timing uses ``perf_counter`` timers only,
+- gauges that are expensive or owned elsewhere (GPU memory, cache hit
+  ratios) are callbacks evaluated at scrape time.
+
+Per-request stages (``STAGES``) share one histogram,
+``chatvlm_stage_seconds{stage, model}``:
+
+- upload_read, validation, image_decode: API request handling,
+- queue_wait: waiting for the model (``TimedLock`` or
+  ``utils.scheduler.FairScheduler``),
+- model_load: first use of a model,
+- preprocessing, prefill, decode, postprocessing: one model call
+  (``model_call``). Prefill and decode are split at the first generated
+  token by ``GenerationTimer``, a ``generate()`` streamer that also counts
+  prompt and generated tokens. Preprocessing is the time from the call
+  start to the first ``generate()``; postprocessing from the last
+  ``generate()`` to the call end.
+
+Usage:
+    with STAGE_SECONDS.labels("validation", model).time():
+        header = validate_file(file, content)
+
+    with model_lock(model), model_call(model):
+        text = model_instance.extract_text(image)
+
+    body = registry.render()
+"""
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)
+
+STAGES = (
+    "upload_read", "validation", "image_decode", "queue_wait", "model_load",
+    "preprocessing", "prefill", "decode", "postprocessing",
+)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Metric family: children per label combination."""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[LabelValues, Any] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self) -> Any:
+        raise NotImplementedError
+
+    def labels(self, *values: Any) -> Any:
+        """
+        Child for a label combination (created on first use).
+
+        Args:
+            *values: Label values in ``labelnames`` order
+
+        Returns:
+            Child instrument
+        """
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _samples(self) -> Iterable[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self._samples())
+        return lines
+
+    def _items(self) -> List[Tuple[LabelValues, Any]]:
+        with self._lock:
+            return list(self._children.items())
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """Monotonic counter."""
+
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._children[()].inc(amount)
+
+    def _samples(self):
+        for values, child in self._items():
+            yield self.name, _format_labels(self.labelnames, values), child.value
+
+
+class _GaugeChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down; optionally computed at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Optional[Callable[[], Iterable[Tuple[LabelValues, float]]]] = None
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self._children[()].set(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._children[()].inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._children[()].dec(amount)
+
+    def set_function(self, function: Callable[[], Iterable[Tuple[LabelValues, float]]]) -> None:
+        """
+        Compute the gauge at scrape time.
+
+        Args:
+            function: Returns (label values, value) pairs
+        """
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            try:
+                pairs = list(self._function())
+            except Exception:
+                pairs = []
+            for values, value in pairs:
+                yield self.name, _format_labels(self.labelnames, values), value
+            return
+        for values, child in self._items():
+            yield self.name, _format_labels(self.labelnames, values), child.value
+
+
+class _Timer:
+    """Context manager observing elapsed seconds into a histogram child."""
+
+    __slots__ = ("_child", "_start")
+
+    def __init__(self, child: "_HistogramChild"):
+        self._child = child
+        self._start = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._child.observe(time.perf_counter() - self._start)
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # Last slot is the +Inf bucket
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class Histogram(_Metric):
+    """Histogram with fixed buckets (cumulative counts are built at scrape time)."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(float(bucket) for bucket in buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value: float) -> None:
+        self._children[()].observe(value)
+
+    def time(self) -> _Timer:
+        return self._children[()].time()
+
+    def _samples(self):
+        for values, child in self._items():
+            counts, total, count = child.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(self.bounds + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, values, le), cumulative
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together."""
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> Any:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Metric {metric.name} already registered differently")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "chatvlm_stage_seconds", "Latency of request processing stages", ("stage", "model")
+)
+REQUESTS = registry.counter(
+    "chatvlm_requests_total", "Requests by endpoint, model and status code", ("endpoint", "model", "status")
+)
+REQUEST_SECONDS = registry.histogram(
+    "chatvlm_request_seconds", "End-to-end request latency (until response headers)", ("endpoint",)
+)
+REQUESTS_IN_FLIGHT = registry.gauge("chatvlm_requests_in_flight", "Requests being handled")
+QUEUE_DEPTH = registry.gauge("chatvlm_model_queue_depth", "Calls waiting for a model", ("model",))
+TOKENS = registry.counter("chatvlm_tokens_total", "Prompt and generated tokens", ("model", "direction"))
+MODEL_CACHE = registry.counter("chatvlm_model_cache_total", "Model cache lookups", ("result",))
+
+# Model label of names outside the known models (the name is client input)
+OTHER_MODEL = "other"
+
+
+# Model call of the current thread (GenerationTimer reports into it)
+_local = threading.local()
+
+
+class _ModelCall:
+    """Splits one model call into preprocessing/prefill/decode/postprocessing."""
+
+    __slots__ = ("model", "start", "first_generate", "last_generate_end", "outer")
+
+    def __init__(self, model: str):
+        self.model = model
+        self.start = 0.0
+        self.first_generate: Optional[float] = None
+        self.last_generate_end: Optional[float] = None
+
+    def __enter__(self) -> "_ModelCall":
+        self.start = time.perf_counter()
+        self.outer = getattr(_local, "call", None)
+        _local.call = self
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        _local.call = self.outer
+        if self.first_generate is None:
+            return
+        STAGE_SECONDS.labels("preprocessing", self.model).observe(self.first_generate - self.start)
+        STAGE_SECONDS.labels("postprocessing", self.model).observe(time.perf_counter() - self.last_generate_end)
+
+
+def model_call(model: str) -> _ModelCall:
+    """
+    Context manager around one model call (in the thread that runs it).
+
+    Args:
+        model: Model label
+
+    Returns:
+        Context manager
+    """
+    return _ModelCall(model)
+
+
+class GenerationTimer:
+    """
+    ``generate()`` streamer timing prefill and decode.
+
+    ``generate()`` calls ``put`` with the prompt ids first and then with
+    every new token (batch); ``end`` when generation finishes. Prefill is
+    the time from the prompt to the first new token, decode the rest.
+    """
+
+    def __init__(self, model: str = "unknown"):
+        """
+        Args:
+            model: Model label (the surrounding ``model_call`` takes precedence)
+        """
+        call = getattr(_local, "call", None)
+        self.call = call
+        self.model = call.model if call is not None else model
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget a failed attempt before ``generate()`` is retried."""
+        self.started: Optional[float] = None
+        self.first_token: Optional[float] = None
+        self.prompt_tokens = 0
+        self.generated_tokens = 0
+
+    def put(self, value: Any) -> None:
+        now = time.perf_counter()
+        count = value.numel() if hasattr(value, "numel") else len(value)
+        if self.started is None:
+            self.started = now
+            self.prompt_tokens = count
+            if self.call is not None and self.call.first_generate is None:
+                self.call.first_generate = now
+            return
+        if self.first_token is None:
+            self.first_token = now
+        self.generated_tokens += count
+
+    def end(self) -> None:
+        now = time.perf_counter()
+        if self.started is None:
+            return
+        first_token = self.first_token or now
+        STAGE_SECONDS.labels("prefill", self.model).observe(first_token - self.started)
+        STAGE_SECONDS.labels("decode", self.model).observe(now - first_token)
+        TOKENS.labels(self.model, "in").inc(self.prompt_tokens)
+        TOKENS.labels(self.model, "out").inc(self.generated_tokens)
+        if self.call is not None:
+            self.call.last_generate_end = now
+
+
+class TimedLock:
+    """Lock recording queue wait and queue depth of a model."""
+
+    def __init__(self, model: str):
+        """
+        Args:
+            model: Model label
+        """
+        self.model = model
+        self._lock = threading.Lock()
+        self._wait = STAGE_SECONDS.labels("queue_wait", model)
+        self._depth = QUEUE_DEPTH.labels(model)
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self._lock.acquire(blocking=False):
+            self._wait.observe(0.0)
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        self._depth.inc()
+        try:
+            acquired = self._lock.acquire(timeout=timeout)
+        finally:
+            self._depth.dec()
+        if acquired:
+            self._wait.observe(time.perf_counter() - start)
+        return acquired
+
+    def release(self) -> None:
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self) -> "TimedLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests by endpoint, model and status.
+
+    The endpoint label is the route template (``/models/{model_name}``),
+    so label cardinality stays bounded. The model comes from
+    ``request.state.model`` when a handler sets it (form parameters),
+    otherwise from the ``model`` query parameter, and is passed through
+    ``model_label`` (e.g. mapping unknown names to ``OTHER_MODEL``).
+
+    ``on_request`` is called after every request with (endpoint, model,
+    status, seconds, scope), e.g. to persist latency history; exceptions
+    it raises are logged and ignored.
+    """
+
+    def __init__(self, app: Callable, on_request: Optional[Callable[..., None]] = None,
+                 model_label: Optional[Callable[[str], str]] = None):
+        self.app = app
+        self.on_request = on_request
+        self.model_label = model_label
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_with_metrics(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                REQUEST_SECONDS.labels(self._endpoint(scope)).observe(time.perf_counter() - start)
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            endpoint, model = self._endpoint(scope), self._model(scope)
+            if self.model_label is not None:
+                model = self.model_label(model)
+            REQUESTS.labels(endpoint, model, str(status[0])).inc()
+            if self.on_request is not None:
+                try:
+                    self.on_request(endpoint, model, status[0], time.perf_counter() - start, scope)
+                except Exception as e:
+                    logger.warning(f"Request callback failed: {e}")
+
+    @staticmethod
+    def _endpoint(scope: Dict[str, Any]) -> str:
+        route = scope.get("route")
+        return getattr(route, "path", None) or "unmatched"
+
+    @staticmethod
+    def _model(scope: Dict[str, Any]) -> str:
+        model = (scope.get("state") or {}).get("model")
+        if model:
+            return model
+        query = scope.get("query_string", b"")
+        if b"model=" not in query:
+            return ""
+        return parse_qs(query.decode("latin-1")).get("model", [""])[0]
+
+
+def gpu_memory_samples() -> List[Tuple[LabelValues, float]]:
+    """(device, kind) -> bytes for allocated/reserved/total CUDA memory."""
+    try:
+        import torch
+    except ImportError:
+        return []
+    if not torch.cuda.is_available():
+        return []
+    samples = []
+    for device in range(torch.cuda.device_count()):
+        samples.append(((str(device), "allocated"), float(torch.cuda.memory_allocated(device))))
+        samples.append(((str(device), "reserved"), float(torch.cuda.memory_reserved(device))))
+        samples.append(((str(device), "total"), float(torch.cuda.get_device_properties(device).total_memory)))
+    return samples
+
+
+def gpu_telemetry_samples(field_name: str) -> Callable[[], List[Tuple[LabelValues, float]]]:
+    """Device-wide values of one GpuStats field from the latest telemetry sample."""
+    def samples() -> List[Tuple[LabelValues, float]]:
+        from utils.gpu_telemetry import get_telemetry
+        return [((str(gpu.index),), float(getattr(gpu, field_name)))
+                for gpu in get_telemetry().latest().gpus if getattr(gpu, field_name) is not None]
+    return samples
+
+
+GPU_MEMORY = registry.gauge("chatvlm_gpu_memory_bytes", "CUDA memory per device", ("device", "kind"))
+GPU_MEMORY.set_function(gpu_memory_samples)
+registry.gauge("chatvlm_gpu_device_memory_used_mb", "Device memory used by all processes (MiB)",
+               ("device",)).set_function(gpu_telemetry_samples("memory_used_mb"))
+registry.gauge("chatvlm_gpu_utilization_percent", "GPU utilization", ("device",)).set_function(
+    gpu_telemetry_samples("utilization_percent"))
+registry.gauge("chatvlm_gpu_temperature_celsius", "GPU temperature", ("device",)).set_function(
+    gpu_telemetry_samples("temperature_c"))
@@ -0,0 +1,268 @@
+"""Micro-benchmarks of CPU-side hot paths with regression gates.
+
+Post-processing and ingest run on every request, so a slow regex or an
+accidental quadratic loop costs as much as a slower model. A benchmark is
+a named setup function returning the callable to time; the runner picks
+a loop count so that one sample lasts at least ``min_time``, takes
+``repeat`` samples with the garbage collector disabled (like ``timeit``)
+and reports the median and minimum time per call. The gate compares
+minimums: noise from other processes only ever adds time, so the fastest
+sample is the most stable estimate of the code's own cost.
+
+Baselines are stored as JSON. Timings are compared after dividing by a
+fixed pure-Python reference workload sampled alternately with each
+benchmark, so a baseline recorded on a developer machine remains usable
+on a slower CI runner and drift during a run (frequency scaling, noisy
+neighbours) affects both sides of the ratio; the gate fails when a benchmark is slower than its baseline by
+more than ``tolerance``.
+
+Apparent regressions should be confirmed by rerunning the affected
+benchmarks and keeping the better score (``merge_best``) before failing.
+
+Usage:
+    report = run_benchmarks([Benchmark("clean", lambda: lambda: clean(text))])
+    regressions = [c for c in compare(report, load_report("baseline.json")) if c.regressed]
+"""
+
+import gc
+import json
+import platform
+import statistics
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+# Default regression tolerance: 25% slower than the baseline
+DEFAULT_TOLERANCE = 0.25
+
+
+@dataclass
+class Benchmark:
+    """
+    A named micro-benchmark.
+
+    ``setup`` builds fixtures and returns the callable to time; it may
+    raise ImportError when an optional dependency is missing, which skips
+    the benchmark instead of failing the run.
+    """
+
+    name: str
+    setup: Callable[[], Callable[[], Any]]
+    group: str = "default"
+
+
+@dataclass
+class Comparison:
+    """Benchmark timing against its baseline."""
+
+    name: str
+    baseline: float
+    current: float
+    change: float
+    regressed: bool
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "baseline": self.baseline,
+            "current": self.current,
+            "change": self.change,
+            "regressed": self.regressed,
+        }
+
+
+def measure(fn: Callable[[], Any], repeat: int = 7, min_time: float = 0.02,
+            reference: Optional[Callable[[], Any]] = None) -> Dict[str, Any]:
+    """
+    Time a callable.
+
+    Args:
+        fn: Callable without arguments
+        repeat: Number of samples
+        min_time: Minimum duration of one sample in seconds
+        reference: Optional reference workload sampled alternately with
+            ``fn``, so both see the same machine state
+
+    Returns:
+        Dictionary with loops per sample, per-call median/min/IQR in
+        seconds, the per-call samples and, with a reference, its per-call
+        minimum (``reference_min``)
+    """
+    loops, elapsed = _calibrate(fn, min_time)
+    samples = [elapsed / loops]
+    reference_samples = []
+    if reference is not None:
+        reference_loops, reference_elapsed = _calibrate(reference, min_time)
+        reference_samples.append(reference_elapsed / reference_loops)
+    for _ in range(repeat - 1):
+        samples.append(_time_loops(fn, loops) / loops)
+        if reference is not None:
+            reference_samples.append(_time_loops(reference, reference_loops) / reference_loops)
+
+    quartiles = statistics.quantiles(samples, n=4) if len(samples) > 1 else [samples[0]] * 3
+    result = {
+        "loops": loops,
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "iqr": quartiles[2] - quartiles[0],
+        "samples": samples,
+    }
+    if reference_samples:
+        result["reference_min"] = min(reference_samples)
+    return result
+
+
+def _calibrate(fn: Callable[[], Any], min_time: float) -> tuple:
+    """Loop count for which one sample lasts at least ``min_time`` (and that sample's duration)."""
+    loops = 1
+    while True:
+        elapsed = _time_loops(fn, loops)
+        if elapsed >= min_time:
+            return loops, elapsed
+        # Grow towards min_time without overshooting wildly
+        loops *= min(10, max(2, int(min_time / max(elapsed, 1e-9))))
+
+
+def _time_loops(fn: Callable[[], Any], loops: int) -> float:
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        return time.perf_counter() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def reference_workload() -> int:
+    """Fixed pure-Python work (string, dict and list operations) used to normalize timings."""
+    counts: Dict[str, int] = {}
+    words = []
+    for i in range(2000):
+        word = f"token{i % 97}"
+        counts[word] = counts.get(word, 0) + i
+        words.append(word.upper())
+    return len(" ".join(sorted(words))) + sum(counts.values())
+
+
+def run_benchmarks(benchmarks: List[Benchmark], repeat: int = 7, min_time: float = 0.02,
+                   only: Optional[str] = None, progress: Optional[Callable[[str, Dict[str, Any]], None]] = None
+                   ) -> Dict[str, Any]:
+    """
+    Run benchmarks, each alternating with the reference workload.
+
+    Args:
+        benchmarks: Benchmarks to run
+        repeat: Samples per benchmark
+        min_time: Minimum sample duration in seconds
+        only: Run only benchmarks whose name contains this substring
+        progress: Called with (name, result) after each benchmark
+
+    Returns:
+        Report with metadata, results (each with a ``score``: minimum
+        divided by the reference minimum of the same benchmark) and skipped
+        benchmarks with the reason
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    skipped: Dict[str, str] = {}
+
+    for benchmark in benchmarks:
+        if only and only not in benchmark.name:
+            continue
+        try:
+            fn = benchmark.setup()
+        except ImportError as e:
+            skipped[benchmark.name] = f"missing dependency: {e}"
+            continue
+        result = measure(fn, repeat, min_time, reference=reference_workload)
+        result["group"] = benchmark.group
+        result["score"] = result["min"] / result["reference_min"]
+        results[benchmark.name] = result
+        if progress is not None:
+            progress(benchmark.name, result)
+
+    return {
+        "metadata": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "repeat": repeat,
+            "min_time": min_time,
+        },
+        "results": results,
+        "skipped": skipped,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = DEFAULT_TOLERANCE,
+            normalize: bool = True) -> List[Comparison]:
+    """
+    Compare a report with a baseline.
+
+    Args:
+        report: Current report
+        baseline: Baseline report
+        tolerance: Allowed slowdown (0.25 = 25% slower)
+        normalize: Compare reference-normalized scores instead of raw
+            minimum seconds (use raw seconds only on the baseline machine)
+
+    Returns:
+        Comparison per benchmark present in both reports
+    """
+    key = "score" if normalize else "min"
+    comparisons = []
+    for name, result in report["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if base is None or not base.get(key):
+            continue
+        change = result[key] / base[key] - 1
+        comparisons.append(Comparison(name, base[key], result[key], change, change > tolerance))
+    return comparisons
+
+
+def merge_best(report: Dict[str, Any], rerun: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Combine two runs, keeping the better (lower) score per benchmark.
+
+    Used to confirm apparent regressions: a benchmark slowed down by a
+    burst of background load recovers on the rerun, a real regression
+    does not.
+    """
+    results = dict(report["results"])
+    for name, result in rerun["results"].items():
+        if name not in results or result["score"] < results[name]["score"]:
+            results[name] = result
+    return {**report, "results": results}
+
+
+def strip_samples(report: Dict[str, Any]) -> Dict[str, Any]:
+    """Report without the raw samples (for compact baselines)."""
+    results = {
+        name: {key: value for key, value in result.items() if key != "samples"}
+        for name, result in report["results"].items()
+    }
+    return {**report, "results": results}
+
+
+def load_report(path: str) -> Dict[str, Any]:
+    """Load a report or baseline JSON file."""
+    return json.loads(Path(path).read_text(encoding="utf-8"))
+
+
+def save_report(report: Dict[str, Any], path: str) -> None:
+    """Write a report as JSON, creating parent directories."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(path).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+
+
+def format_duration(seconds: float) -> str:
+    """Human-readable duration (ns, µs, ms or s)."""
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("µs", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
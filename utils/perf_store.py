@@ -0,0 +1,575 @@
+"""Append-only time-series store of benchmark and request metrics.
+
+Benchmark scripts used to leave a timestamped JSON report in the project
+root per run, and the comparison page re-read every one of them on each
+load. This store keeps every sample (one request or one benchmark test)
+in an append-only SQLite table indexed on (model, day, document type),
+plus two rollups updated in the same transaction as the insert:
+
+- ``daily_stats``: count, successes, latency sum and tokens per
+  (model, day, document type);
+- ``latency_buckets``: a log-scaled latency histogram per
+  (model, day, document type) with 5% wide buckets, from which
+  percentiles are read without touching the raw samples.
+
+Summaries, trends and percentiles therefore cost O(models x days) no
+matter how many samples were recorded. Legacy JSON reports are imported
+once: the store remembers each file's size and mtime.
+
+Usage:
+    store = PerformanceStore()
+    store.record("qwen3_vl_2b", latency=1.84, document_type="invoice", source="api")
+    store.percentiles("qwen3_vl_2b", (50, 95, 99), since="2026-01-01")
+    store.trend("qwen3_vl_2b")
+"""
+
+import glob
+import json
+import math
+import os
+import queue
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from utils.logger import logger
+
+DEFAULT_STORE_PATH = "performance_history.sqlite3"
+
+# Relative width of a latency histogram bucket (percentile error is half of it)
+BUCKET_GROWTH = 1.05
+# Bucket of zero (or negative) latencies
+ZERO_BUCKET = -100000
+
+# Legacy report files in the project root
+LEGACY_PATTERNS = (
+    "benchmark_results_*.json",
+    "*_test_results*.json",
+    "final_working_models.json",
+    "working_models_config.json",
+    "dots_ocr_*_results.json",
+    "official_prompts_*_results.json",
+    "vllm_*_test_*.json",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    day TEXT NOT NULL,
+    model TEXT NOT NULL,
+    document_type TEXT NOT NULL,
+    source TEXT NOT NULL,
+    endpoint TEXT,
+    success INTEGER NOT NULL,
+    latency REAL,
+    tokens INTEGER,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS samples_model_day_type ON samples (model, day, document_type);
+
+CREATE TABLE IF NOT EXISTS daily_stats (
+    model TEXT NOT NULL,
+    day TEXT NOT NULL,
+    document_type TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    successes INTEGER NOT NULL,
+    latency_count INTEGER NOT NULL,
+    latency_sum REAL NOT NULL,
+    tokens INTEGER NOT NULL,
+    last_ts REAL NOT NULL,
+    PRIMARY KEY (model, day, document_type)
+);
+
+CREATE TABLE IF NOT EXISTS latency_buckets (
+    model TEXT NOT NULL,
+    day TEXT NOT NULL,
+    document_type TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (model, day, document_type, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS model_status (
+    model TEXT PRIMARY KEY,
+    status TEXT,
+    last_tested TEXT,
+    source TEXT,
+    info TEXT
+);
+
+CREATE TABLE IF NOT EXISTS imported_files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    samples INTEGER NOT NULL
+);
+"""
+
+
+@dataclass
+class Sample:
+    """One measured request or benchmark test."""
+
+    model: str
+    latency: Optional[float]
+    success: bool = True
+    document_type: str = "unknown"
+    source: str = "api"
+    endpoint: Optional[str] = None
+    tokens: Optional[int] = None
+    ts: float = field(default_factory=time.time)
+    extra: Optional[Dict[str, Any]] = None
+
+
+def latency_bucket(latency: float) -> int:
+    """Histogram bucket of a latency in seconds."""
+    if latency <= 0:
+        return ZERO_BUCKET
+    return math.floor(math.log(latency) / math.log(BUCKET_GROWTH))
+
+
+def bucket_value(bucket: int) -> float:
+    """Representative latency (geometric midpoint) of a bucket."""
+    if bucket == ZERO_BUCKET:
+        return 0.0
+    return BUCKET_GROWTH ** (bucket + 0.5)
+
+
+def parse_timestamp(value: Any, default: float) -> float:
+    """Epoch seconds of an ISO or 'YYYY-MM-DD HH:MM:SS' timestamp."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            pass
+    return default
+
+
+def day_of(ts: float) -> str:
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d")
+
+
+class PerformanceStore:
+    """SQLite store of performance samples with incremental rollups."""
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Args:
+            path: Database file (default ``PERF_STORE_PATH`` or
+                ``DEFAULT_STORE_PATH``); ':memory:' for a temporary store
+        """
+        self.path = path or os.getenv("PERF_STORE_PATH", DEFAULT_STORE_PATH)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        if self.path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+
+    def record(self, model: str, latency: Optional[float], success: bool = True, **fields: Any) -> None:
+        """
+        Append one sample.
+
+        Args:
+            model: Model key or id
+            latency: Seconds (None if not measured, e.g. failed launch)
+            success: Whether the request succeeded
+            **fields: Other ``Sample`` fields (document_type, source,
+                endpoint, tokens, ts, extra)
+        """
+        self.record_many([Sample(model, latency, success, **fields)])
+
+    def record_many(self, samples: Iterable[Sample]) -> int:
+        """
+        Append samples in one transaction, updating the rollups.
+
+        Returns:
+            Number of samples written
+        """
+        written = 0
+        with self._lock, self._conn:
+            for sample in samples:
+                self._insert(sample)
+                written += 1
+        return written
+
+    def _insert(self, sample: Sample) -> None:
+        day = day_of(sample.ts)
+        document_type = sample.document_type or "unknown"
+        self._conn.execute(
+            "INSERT INTO samples (ts, day, model, document_type, source, endpoint, success, latency, tokens, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (sample.ts, day, sample.model, document_type, sample.source, sample.endpoint, int(bool(sample.success)),
+             sample.latency, sample.tokens,
+             json.dumps(sample.extra, ensure_ascii=False) if sample.extra else None),
+        )
+        # Latency rollups only count successful requests: failures are often instant
+        timed = sample.latency is not None and sample.success
+        self._conn.execute(
+            "INSERT INTO daily_stats (model, day, document_type, count, successes, latency_count, latency_sum, "
+            "tokens, last_ts) VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (model, day, document_type) DO UPDATE SET "
+            "count = count + 1, successes = successes + excluded.successes, "
+            "latency_count = latency_count + excluded.latency_count, "
+            "latency_sum = latency_sum + excluded.latency_sum, tokens = tokens + excluded.tokens, "
+            "last_ts = MAX(last_ts, excluded.last_ts)",
+            (sample.model, day, document_type, int(bool(sample.success)), int(timed),
+             sample.latency if timed else 0.0, sample.tokens or 0, sample.ts),
+        )
+        if timed:
+            self._conn.execute(
+                "INSERT INTO latency_buckets (model, day, document_type, bucket, count) VALUES (?, ?, ?, ?, 1) "
+                "ON CONFLICT (model, day, document_type, bucket) DO UPDATE SET count = count + 1",
+                (sample.model, day, document_type, latency_bucket(sample.latency)),
+            )
+
+    def set_model_status(self, model: str, status: str, last_tested: str = "", source: str = "",
+                         info: Optional[Dict[str, Any]] = None) -> None:
+        """Store the latest known status of a model (launch/functional tests)."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO model_status (model, status, last_tested, source, info) VALUES (?, ?, ?, ?, ?)",
+                (model, status, last_tested, source, json.dumps(info or {}, ensure_ascii=False)),
+            )
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _filters(model: Optional[str], since: Optional[str], until: Optional[str],
+                 document_type: Optional[str]) -> tuple:
+        clauses, params = [], []
+        for column, operator, value in (("model", "=", model), ("day", ">=", since), ("day", "<=", until),
+                                        ("document_type", "=", document_type)):
+            if value is not None:
+                clauses.append(f"{column} {operator} ?")
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def _query(self, sql: str, params: Sequence[Any] = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def models(self) -> List[str]:
+        """Models with samples."""
+        return [row["model"] for row in self._query("SELECT DISTINCT model FROM daily_stats ORDER BY model")]
+
+    def document_types(self, model: Optional[str] = None) -> List[str]:
+        """Document types with samples (of one model)."""
+        where, params = self._filters(model, None, None, None)
+        return [row["document_type"] for row in
+                self._query(f"SELECT DISTINCT document_type FROM daily_stats{where} ORDER BY document_type", params)]
+
+    def summary(self, model: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                document_type: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Per-model totals from the daily rollup.
+
+        Args:
+            model: Only this model
+            since: First day (YYYY-MM-DD), inclusive
+            until: Last day, inclusive
+            document_type: Only this document type
+
+        Returns:
+            model -> count, successes, success_rate (%), mean_latency,
+            tokens, first_day, last_day, last_ts
+        """
+        where, params = self._filters(model, since, until, document_type)
+        rows = self._query(
+            "SELECT model, SUM(count) AS count, SUM(successes) AS successes, SUM(latency_count) AS latency_count, "
+            "SUM(latency_sum) AS latency_sum, SUM(tokens) AS tokens, MIN(day) AS first_day, MAX(day) AS last_day, "
+            f"MAX(last_ts) AS last_ts FROM daily_stats{where} GROUP BY model",
+            params,
+        )
+        return {
+            row["model"]: {
+                "count": row["count"],
+                "successes": row["successes"],
+                "success_rate": row["successes"] / row["count"] * 100 if row["count"] else 0.0,
+                "mean_latency": row["latency_sum"] / row["latency_count"] if row["latency_count"] else None,
+                "tokens": row["tokens"],
+                "first_day": row["first_day"],
+                "last_day": row["last_day"],
+                "last_ts": row["last_ts"],
+            }
+            for row in rows
+        }
+
+    def percentiles(self, model: Optional[str] = None, quantiles: Sequence[float] = (50, 95, 99),
+                    since: Optional[str] = None, until: Optional[str] = None,
+                    document_type: Optional[str] = None) -> Dict[float, Optional[float]]:
+        """
+        Latency percentiles of successful samples from the histogram rollup.
+
+        Values are bucket midpoints, accurate to about half a bucket (2.5%).
+
+        Returns:
+            quantile -> seconds (None without samples)
+        """
+        where, params = self._filters(model, since, until, document_type)
+        rows = self._query(
+            f"SELECT bucket, SUM(count) AS count FROM latency_buckets{where} GROUP BY bucket ORDER BY bucket", params
+        )
+        return histogram_percentiles([(row["bucket"], row["count"]) for row in rows], quantiles)
+
+    def trend(self, model: str, since: Optional[str] = None, until: Optional[str] = None,
+              document_type: Optional[str] = None, quantiles: Sequence[float] = (50, 95)) -> List[Dict[str, Any]]:
+        """
+        Per-day series of a model.
+
+        Returns:
+            One entry per day: day, count, success_rate (%), mean_latency
+            and the requested latency percentiles (``p50``, ``p95``, ...)
+        """
+        where, params = self._filters(model, since, until, document_type)
+        days = self._query(
+            "SELECT day, SUM(count) AS count, SUM(successes) AS successes, SUM(latency_count) AS latency_count, "
+            f"SUM(latency_sum) AS latency_sum FROM daily_stats{where} GROUP BY day ORDER BY day",
+            params,
+        )
+        buckets: Dict[str, List[tuple]] = {}
+        for row in self._query(
+            f"SELECT day, bucket, SUM(count) AS count FROM latency_buckets{where} GROUP BY day, bucket "
+            "ORDER BY day, bucket", params
+        ):
+            buckets.setdefault(row["day"], []).append((row["bucket"], row["count"]))
+
+        series = []
+        for row in days:
+            entry = {
+                "day": row["day"],
+                "count": row["count"],
+                "success_rate": row["successes"] / row["count"] * 100 if row["count"] else 0.0,
+                "mean_latency": row["latency_sum"] / row["latency_count"] if row["latency_count"] else None,
+            }
+            for quantile, value in histogram_percentiles(buckets.get(row["day"], []), quantiles).items():
+                entry[f"p{quantile:g}"] = value
+            series.append(entry)
+        return series
+
+    def recent_samples(self, model: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """Latest raw samples of a model (index scan from the newest day)."""
+        rows = self._query(
+            "SELECT ts, source, endpoint, document_type, success, latency, tokens FROM samples "
+            "WHERE model = ? ORDER BY day DESC, id DESC LIMIT ?",
+            (model, limit),
+        )
+        return [dict(row) for row in rows]
+
+    def model_status(self) -> Dict[str, Dict[str, Any]]:
+        """Latest stored status per model."""
+        return {
+            row["model"]: {"status": row["status"], "last_tested": row["last_tested"], "source": row["source"],
+                           **json.loads(row["info"] or "{}")}
+            for row in self._query("SELECT * FROM model_status")
+        }
+
+    # ------------------------------------------------------------------
+    # Legacy JSON reports
+    # ------------------------------------------------------------------
+
+    def import_legacy_reports(self, results_dir: str = ".", patterns: Sequence[str] = LEGACY_PATTERNS) -> int:
+        """
+        Import JSON reports not imported yet (or changed since).
+
+        Args:
+            results_dir: Directory with the reports
+            patterns: Glob patterns of report files
+
+        Returns:
+            Number of samples imported
+        """
+        paths = sorted({path for pattern in patterns for path in glob.glob(os.path.join(results_dir, pattern))})
+        known = {row["path"]: (row["size"], row["mtime"]) for row in self._query("SELECT * FROM imported_files")}
+
+        imported = 0
+        for path in paths:
+            stat = os.stat(path)
+            key = os.path.abspath(path)
+            if known.get(key) == (stat.st_size, stat.st_mtime):
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                samples = self._legacy_samples(data, os.path.basename(path), stat.st_mtime)
+            except Exception as e:
+                logger.warning(f"Failed to import report {path}: {e}")
+                samples = []
+            with self._lock, self._conn:
+                # A changed file replaces its previous samples
+                if key in known:
+                    self._delete_source(os.path.basename(path))
+                for sample in samples:
+                    self._insert(sample)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO imported_files (path, size, mtime, samples) VALUES (?, ?, ?, ?)",
+                    (key, stat.st_size, stat.st_mtime, len(samples)),
+                )
+            imported += len(samples)
+        return imported
+
+    def _delete_source(self, source: str) -> None:
+        """Remove the samples of one source and rebuild the affected rollups."""
+        affected = self._conn.execute(
+            "SELECT DISTINCT model, day, document_type FROM samples WHERE source = ?", (source,)
+        ).fetchall()
+        self._conn.execute("DELETE FROM samples WHERE source = ?", (source,))
+        for model, day, document_type in affected:
+            self._conn.execute("DELETE FROM daily_stats WHERE model = ? AND day = ? AND document_type = ?",
+                               (model, day, document_type))
+            self._conn.execute("DELETE FROM latency_buckets WHERE model = ? AND day = ? AND document_type = ?",
+                               (model, day, document_type))
+            rows = self._conn.execute(
+                "SELECT * FROM samples WHERE model = ? AND day = ? AND document_type = ? ORDER BY id",
+                (model, day, document_type),
+            ).fetchall()
+            self._conn.execute("DELETE FROM samples WHERE model = ? AND day = ? AND document_type = ?",
+                               (model, day, document_type))
+            for row in rows:
+                self._insert(Sample(row["model"], row["latency"], bool(row["success"]), row["document_type"],
+                                    row["source"], row["endpoint"], row["tokens"], row["ts"],
+                                    json.loads(row["extra"]) if row["extra"] else None))
+
+    def _legacy_samples(self, data: Any, source: str, mtime: float) -> List[Sample]:
+        """Samples of one legacy report (same file kinds the analyzer used to read)."""
+        samples: List[Sample] = []
+        if not isinstance(data, dict):
+            return samples
+
+        if "benchmark_results" in source:
+            model = data.get("model", "unknown")
+            ts = parse_timestamp(data.get("timestamp"), mtime)
+            for result in data.get("results", []):
+                for test in result.get("tests", []):
+                    samples.append(Sample(model, test.get("processing_time"), bool(test.get("success")),
+                                          source=source, ts=ts, extra={"file": result.get("file")}))
+        elif "working_models" in source:
+            for model, info in data.items():
+                if isinstance(info, dict):
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO model_status (model, status, last_tested, source, info) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (model, info.get("status", "unknown"), info.get("last_tested", ""), source,
+                         json.dumps(info.get("test_results", {}), ensure_ascii=False)),
+                    )
+        elif "test_results" in source and isinstance(data.get("test_results"), list):
+            ts = parse_timestamp(data.get("timestamp"), mtime)
+            for result in data["test_results"]:
+                samples.append(Sample(result.get("model", "unknown"), result.get("processing_time"),
+                                      bool(result.get("success")), source=source,
+                                      tokens=result.get("tokens_used"), ts=ts))
+        return samples
+
+
+def histogram_percentiles(buckets: List[tuple], quantiles: Sequence[float]) -> Dict[float, Optional[float]]:
+    """
+    Percentiles of a bucketed latency histogram.
+
+    Args:
+        buckets: (bucket, count) pairs sorted by bucket
+        quantiles: Percentiles in [0, 100]
+
+    Returns:
+        quantile -> bucket midpoint in seconds (None without samples)
+    """
+    total = sum(count for _, count in buckets)
+    result: Dict[float, Optional[float]] = {}
+    for quantile in quantiles:
+        if not total:
+            result[quantile] = None
+            continue
+        rank = max(1, math.ceil(total * quantile / 100))
+        seen = 0
+        for bucket, count in buckets:
+            seen += count
+            if seen >= rank:
+                result[quantile] = bucket_value(bucket)
+                break
+    return result
+
+
+class PerfRecorder:
+    """
+    Non-blocking writer for request handlers.
+
+    Samples go to a queue; a background thread writes them in batches, so
+    request latency never includes an SQLite commit.
+    """
+
+    def __init__(self, store: PerformanceStore, batch_size: int = 256, flush_interval: float = 1.0):
+        """
+        Args:
+            store: Target store
+            batch_size: Maximum samples per transaction
+            flush_interval: Seconds between writes of a partial batch
+        """
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[Sample]]" = queue.Queue(maxsize=100000)
+        self._thread = threading.Thread(target=self._run, name="perf-recorder", daemon=True)
+        self._thread.start()
+
+    def record(self, model: str, latency: Optional[float], success: bool = True, **fields: Any) -> None:
+        """Queue a sample (dropped, and counted, if the queue is full)."""
+        try:
+            self._queue.put_nowait(Sample(model, latency, success, **fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Wait until queued samples are written."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self) -> None:
+        """Write remaining samples and stop the thread."""
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            batch: List[Sample] = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stop = True
+                else:
+                    batch.append(item)
+                if stop or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            try:
+                if batch:
+                    self.store.record_many(batch)
+            except Exception as e:
+                logger.warning(f"Failed to write performance samples: {e}")
+            finally:
+                for _ in range(len(batch) + int(stop)):
+                    self._queue.task_done()
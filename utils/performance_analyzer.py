@@ -3,201 +3,77 @@
 Анализатор производительности моделей на основе исторических результатов
 """
 
-import json
-import os
-import glob
-from datetime import datetime
-from typing import Dict, List, Optional, Any
-import pandas as pd
+from typing import Dict, List, Optional, Any, Sequence
+
+from utils.perf_store import PerformanceStore
+
+try:
+    import pandas as pd
+    PANDAS_AVAILABLE = True
+except ImportError:
+    PANDAS_AVAILABLE = False
+
 
 class PerformanceAnalyzer:
-    """Класс для анализа производительности моделей на основе исторических данных"""
+    """
+    Класс для анализа производительности моделей на основе исторических данных
+    
+    Данные читаются из PerformanceStore (SQLite): сводки, тренды и
+    перцентили берутся из дневных агрегатов, поэтому страница сравнения
+    загружается за постоянное время при любом объеме истории. Старые
+    JSON-отчеты импортируются в хранилище один раз.
+    """
     
-    def __init__(self, results_dir: str = "."):
+    def __init__(self, results_dir: str = ".", store: Optional[PerformanceStore] = None):
         self.results_dir = results_dir
-        self.historical_data = {}
+        self.store = store or PerformanceStore()
         self.load_historical_results()
     
-    def load_historical_results(self) -> None:
-        """Загрузка всех исторических результатов тестирования"""
-        
-        # Паттерны файлов с результатами
-        result_patterns = [
-            "benchmark_results_*.json",
-            "*_test_results*.json", 
-            "final_working_models.json",
-            "working_models_config.json",
-            "dots_ocr_*_results.json",
-            "official_prompts_*_results.json",
-            "vllm_*_test_*.json"
-        ]
-        
-        for pattern in result_patterns:
-            files = glob.glob(os.path.join(self.results_dir, pattern))
-            for file_path in files:
-                try:
-                    self._load_result_file(file_path)
-                except Exception as e:
-                    print(f"⚠️ Ошибка загрузки {file_path}: {e}")
-    
-    def _load_result_file(self, file_path: str) -> None:
-        """Загрузка отдельного файла с результатами"""
-        
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        file_name = os.path.basename(file_path)
-        
-        # Определение типа результатов по имени файла
-        if "benchmark_results" in file_name:
-            self._process_benchmark_results(data, file_name)
-        elif "working_models" in file_name:
-            self._process_working_models(data, file_name)
-        elif "test_results" in file_name:
-            self._process_test_results(data, file_name)
-        else:
-            # Общая обработка
-            self.historical_data[file_name] = data
-    
-    def _process_benchmark_results(self, data: Dict, source: str) -> None:
-        """Обработка результатов бенчмарков"""
-        
-        model_name = data.get("model", "unknown")
-        timestamp = data.get("timestamp", "")
-        
-        if model_name not in self.historical_data:
-            self.historical_data[model_name] = {
-                "benchmarks": [],
-                "performance_metrics": {},
-                "last_updated": timestamp
-            }
-        
-        # Анализ результатов
-        total_tests = 0
-        successful_tests = 0
-        total_time = 0
-        avg_processing_time = 0
-        
-        for result in data.get("results", []):
-            for test in result.get("tests", []):
-                total_tests += 1
-                if test.get("success", False):
-                    successful_tests += 1
-                    total_time += test.get("processing_time", 0)
-        
-        if successful_tests > 0:
-            avg_processing_time = total_time / successful_tests
-        
-        benchmark_summary = {
-            "timestamp": timestamp,
-            "source": source,
-            "total_tests": total_tests,
-            "successful_tests": successful_tests,
-            "success_rate": (successful_tests / total_tests * 100) if total_tests > 0 else 0,
-            "avg_processing_time": avg_processing_time,
-            "total_documents": data.get("total_documents", 0)
-        }
-        
-        self.historical_data[model_name]["benchmarks"].append(benchmark_summary)
-        
-        # Обновление метрик производительности
-        self.historical_data[model_name]["performance_metrics"].update({
-            "latest_success_rate": benchmark_summary["success_rate"],
-            "latest_avg_time": avg_processing_time,
-            "total_tests_run": total_tests
-        })
-    
-    def _process_working_models(self, data: Dict, source: str) -> None:
-        """Обработка данных о рабочих моделях"""
-        
-        for model_name, model_info in data.items():
-            if isinstance(model_info, dict):
-                if model_name not in self.historical_data:
-                    self.historical_data[model_name] = {
-                        "benchmarks": [],
-                        "performance_metrics": {},
-                        "status_info": {}
-                    }
-                
-                # Извлечение информации о статусе
-                status_info = {
-                    "status": model_info.get("status", "unknown"),
-                    "last_tested": model_info.get("last_tested", ""),
-                    "source": source
-                }
-                
-                # Извлечение результатов тестов
-                test_results = model_info.get("test_results", {})
-                if test_results:
-                    status_info.update({
-                        "text_test_success": test_results.get("text_test_success", False),
-                        "vision_test_success": test_results.get("vision_test_success", False),
-                        "inference_time": test_results.get("inference_time", 0),
-                        "load_time": test_results.get("load_time", 0)
-                    })
-                
-                self.historical_data[model_name]["status_info"] = status_info
-    
-    def _process_test_results(self, data: Dict, source: str) -> None:
-        """Обработка общих результатов тестирования"""
-        
-        timestamp = data.get("timestamp", "")
-        test_results = data.get("test_results", [])
-        
-        if isinstance(test_results, list):
-            for result in test_results:
-                model_name = result.get("model", "unknown")
-                
-                if model_name not in self.historical_data:
-                    self.historical_data[model_name] = {
-                        "benchmarks": [],
-                        "performance_metrics": {},
-                        "test_history": []
-                    }
-                
-                test_summary = {
-                    "timestamp": timestamp,
-                    "source": source,
-                    "success": result.get("success", False),
-                    "processing_time": result.get("processing_time", 0),
-                    "tokens_used": result.get("tokens_used", 0)
-                }
-                
-                self.historical_data[model_name]["test_history"].append(test_summary)
-    
-    def get_model_comparison_data(self) -> pd.DataFrame:
-        """Получение данных для сравнения моделей"""
-        
-        comparison_data = []
-        
-        for model_name, model_data in self.historical_data.items():
-            # Пропускаем файлы, которые не являются моделями
-            if not isinstance(model_data, dict) or "benchmarks" not in model_data:
-                continue
-            
-            # Базовая информация о модели
+    def load_historical_results(self) -> int:
+        """Импорт новых и измененных JSON-отчетов (уже импортированные пропускаются)"""
+        imported = self.store.import_legacy_reports(self.results_dir)
+        if imported:
+            print(f"📥 Импортировано результатов: {imported}")
+        return imported
+    
+    def get_model_comparison_rows(self, since: Optional[str] = None,
+                                  document_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Строки таблицы сравнения моделей
+        
+        Args:
+            since: Первый день периода (YYYY-MM-DD), по умолчанию вся история
+            document_type: Только этот тип документа
+        """
+        summary = self.store.summary(since=since, document_type=document_type)
+        statuses = self.store.model_status()
+        rows = []
+        
+        for model_name in sorted(set(summary) | set(statuses)):
+            stats = summary.get(model_name)
             row = {
                 "Модель": model_name,
                 "Статус": "❓ Неизвестно",
                 "Успешность (%)": 0,
                 "Среднее время (с)": 0,
+                "P95 время (с)": 0,
                 "Всего тестов": 0,
                 "Последнее тестирование": "Нет данных"
             }
             
-            # Информация из бенчмарков
-            benchmarks = model_data.get("benchmarks", [])
-            if benchmarks:
-                latest_benchmark = benchmarks[-1]  # Последний бенчмарк
+            # Агрегаты по хранилищу
+            if stats:
+                p95 = self.store.percentiles(model_name, (95,), since=since, document_type=document_type)[95]
                 row.update({
-                    "Успешность (%)": round(latest_benchmark.get("success_rate", 0), 1),
-                    "Среднее время (с)": round(latest_benchmark.get("avg_processing_time", 0), 3),
-                    "Всего тестов": latest_benchmark.get("total_tests", 0),
-                    "Последнее тестирование": latest_benchmark.get("timestamp", "").split("T")[0]
+                    "Успешность (%)": round(stats["success_rate"], 1),
+                    "Среднее время (с)": round(stats["mean_latency"] or 0, 3),
+                    "P95 время (с)": round(p95 or 0, 3),
+                    "Всего тестов": stats["count"],
+                    "Последнее тестирование": stats["last_day"]
                 })
             
             # Информация о статусе
-            status_info = model_data.get("status_info", {})
+            status_info = statuses.get(model_name)
             if status_info:
                 status = status_info.get("status", "unknown")
                 if status == "tested_working":
@@ -207,7 +83,7 @@ class PerformanceAnalyzer:
                 elif status == "not_working":
                     row["Статус"] = "❌ Не работает"
                 
-                if status_info.get("last_tested"):
+                if status_info.get("last_tested") and not stats:
                     row["Последнее тестирование"] = status_info["last_tested"].split(" ")[0]
             
             # Определение статуса по успешности
@@ -218,95 +94,86 @@ class PerformanceAnalyzer:
             elif row["Успешность (%)"] > 0:
                 row["Статус"] = "⚠️ Частично"
             
-            comparison_data.append(row)
-        
-        # Создание DataFrame
-        df = pd.DataFrame(comparison_data)
+            rows.append(row)
         
         # Сортировка по успешности
-        if not df.empty:
-            df = df.sort_values("Успешность (%)", ascending=False)
-        
-        return df
+        rows.sort(key=lambda row: row["Успешность (%)"], reverse=True)
+        return rows
+    
+    def get_model_comparison_data(self, since: Optional[str] = None,
+                                  document_type: Optional[str] = None) -> "pd.DataFrame":
+        """Получение данных для сравнения моделей (DataFrame)"""
+        if not PANDAS_AVAILABLE:
+            raise ImportError("pandas is required for get_model_comparison_data")
+        return pd.DataFrame(self.get_model_comparison_rows(since, document_type))
     
     def get_model_details(self, model_name: str) -> Dict[str, Any]:
         """Получение детальной информации о модели"""
         
-        if model_name not in self.historical_data:
+        summary = self.store.summary(model_name).get(model_name)
+        status_info = self.store.model_status().get(model_name, {})
+        if summary is None and not status_info:
             return {"error": f"Модель {model_name} не найдена в исторических данных"}
         
-        model_data = self.historical_data[model_name]
+        days = self.store.trend(model_name)
+        performance_metrics = dict(summary or {})
+        if days:
+            # Ключи прежнего формата: последний день вместо последнего бенчмарка
+            performance_metrics.update({
+                "latest_success_rate": days[-1]["success_rate"],
+                "latest_avg_time": days[-1]["mean_latency"] or 0,
+                "total_tests_run": summary["count"]
+            })
         
-        details = {
+        return {
             "model_name": model_name,
-            "benchmarks_count": len(model_data.get("benchmarks", [])),
-            "test_history_count": len(model_data.get("test_history", [])),
-            "performance_metrics": model_data.get("performance_metrics", {}),
-            "status_info": model_data.get("status_info", {}),
-            "recent_benchmarks": model_data.get("benchmarks", [])[-3:],  # Последние 3
-            "recent_tests": model_data.get("test_history", [])[-5:]  # Последние 5
+            "benchmarks_count": len(days),  # Дней с измерениями
+            "test_history_count": summary["count"] if summary else 0,
+            "samples_count": summary["count"] if summary else 0,
+            "document_types": self.store.document_types(model_name),
+            "performance_metrics": performance_metrics,
+            "latency_percentiles": self.get_latency_percentiles(model_name),
+            "status_info": status_info,
+            "recent_days": days[-3:],  # Последние 3 дня
+            "recent_tests": self.store.recent_samples(model_name, 5)  # Последние 5
         }
-        
-        return details
     
-    def get_performance_trends(self, model_name: str) -> Dict[str, List]:
-        """Получение трендов производительности модели"""
+    def get_latency_percentiles(self, model_name: str, quantiles: Sequence[float] = (50, 95, 99),
+                                since: Optional[str] = None, until: Optional[str] = None,
+                                document_type: Optional[str] = None) -> Dict[str, Optional[float]]:
+        """Перцентили времени обработки модели (секунды)"""
+        values = self.store.percentiles(model_name, quantiles, since, until, document_type)
+        return {f"p{quantile:g}": value for quantile, value in values.items()}
+    
+    def get_performance_trends(self, model_name: str, since: Optional[str] = None,
+                               document_type: Optional[str] = None) -> Dict[str, List]:
+        """Получение трендов производительности модели (по дням)"""
         
-        if model_name not in self.historical_data:
+        series = self.store.trend(model_name, since=since, document_type=document_type)
+        if not series:
             return {"error": f"Модель {model_name} не найдена"}
         
-        model_data = self.historical_data[model_name]
-        benchmarks = model_data.get("benchmarks", [])
-        
-        trends = {
-            "timestamps": [],
-            "success_rates": [],
-            "processing_times": [],
-            "test_counts": []
+        return {
+            "timestamps": [day["day"] for day in series],
+            "success_rates": [day["success_rate"] for day in series],
+            "processing_times": [day["mean_latency"] for day in series],
+            "p50_times": [day["p50"] for day in series],
+            "p95_times": [day["p95"] for day in series],
+            "test_counts": [day["count"] for day in series]
         }
-        
-        for benchmark in benchmarks:
-            trends["timestamps"].append(benchmark.get("timestamp", ""))
-            trends["success_rates"].append(benchmark.get("success_rate", 0))
-            trends["processing_times"].append(benchmark.get("avg_processing_time", 0))
-            trends["test_counts"].append(benchmark.get("total_tests", 0))
-        
-        return trends
     
     def get_summary_statistics(self) -> Dict[str, Any]:
         """Получение общей статистики по всем моделям"""
         
-        total_models = len([k for k, v in self.historical_data.items() 
-                           if isinstance(v, dict) and "benchmarks" in v])
-        
-        working_models = 0
-        total_tests = 0
-        avg_success_rate = 0
-        
-        success_rates = []
-        
-        for model_name, model_data in self.historical_data.items():
-            if not isinstance(model_data, dict) or "benchmarks" not in model_data:
-                continue
-            
-            benchmarks = model_data.get("benchmarks", [])
-            if benchmarks:
-                latest = benchmarks[-1]
-                success_rate = latest.get("success_rate", 0)
-                success_rates.append(success_rate)
-                total_tests += latest.get("total_tests", 0)
-                
-                if success_rate > 50:  # Считаем рабочей если успешность > 50%
-                    working_models += 1
-        
-        if success_rates:
-            avg_success_rate = sum(success_rates) / len(success_rates)
+        summary = self.store.summary()
+        success_rates = [stats["success_rate"] for stats in summary.values()]
         
         return {
-            "total_models": total_models,
-            "working_models": working_models,
-            "total_tests_run": total_tests,
-            "average_success_rate": round(avg_success_rate, 1),
+            "total_models": len(summary),
+            # Считаем рабочей если успешность > 50%
+            "working_models": sum(1 for rate in success_rates if rate > 50),
+            "total_tests_run": sum(stats["count"] for stats in summary.values()),
+            "average_success_rate": round(sum(success_rates) / len(success_rates), 1) if success_rates else 0,
             "models_with_data": len(success_rates)
         }
 
@@ -327,20 +194,21 @@ def test_performance_analyzer():
     print(f"   Средняя успешность: {stats['average_success_rate']}%")
     
     # Сравнительная таблица
-    comparison_df = analyzer.get_model_comparison_data()
-    print(f"\n📋 Сравнительная таблица ({len(comparison_df)} моделей):")
-    if not comparison_df.empty:
-        print(comparison_df.to_string(index=False))
+    comparison_rows = analyzer.get_model_comparison_rows()
+    print(f"\n📋 Сравнительная таблица ({len(comparison_rows)} моделей):")
+    if comparison_rows:
+        for row in comparison_rows:
+            print("   " + " | ".join(str(value) for value in row.values()))
     else:
         print("   Нет данных для сравнения")
     
     # Детали по первой модели
-    if not comparison_df.empty:
-        first_model = comparison_df.iloc[0]["Модель"]
+    if comparison_rows:
+        first_model = comparison_rows[0]["Модель"]
         details = analyzer.get_model_details(first_model)
         print(f"\n🔍 Детали модели '{first_model}':")
-        print(f"   Бенчмарков: {details['benchmarks_count']}")
-        print(f"   Тестов в истории: {details['test_history_count']}")
+        print(f"   Результатов в истории: {details['samples_count']}")
+        print(f"   Перцентили времени: {details['latency_percentiles']}")
     
     print("\n✅ Тестирование завершено")
 
@@ -0,0 +1,521 @@
+"""Blank-page and near-duplicate prefilter for batch jobs.
+
+Batch uploads and multi-page documents contain blank separator sheets,
+empty back sides and pages uploaded twice; each would cost a full VLM
+generation. The prefilter runs on a small grayscale proxy of every page
+(well under a millisecond of model-free work per page):
+
+- ink density: share of pixels clearly darker than the paper background
+  (page margins are ignored, so scanner edges do not count as ink);
+  pages under ``blank_ink_density`` are skipped,
+- perceptual hashes: 64-bit pHash (DCT of a 32x32 proxy) and dHash
+  (horizontal gradients of a 9x8 proxy); a page within
+  ``max_phash_distance``/``max_dhash_distance`` bits of an earlier page is
+  a duplicate candidate,
+- content digest: SHA-256 of the page's ink mask at text resolution
+  (``content_size`` pixels on the longest side). Forms filled in from one
+  template are within a few pHash bits of each other, so a candidate is
+  only mapped to the earlier page's result if the digests are equal:
+  re-uploads and re-renders of a page are deduplicated, rescans and pages
+  that differ in any field are processed.
+
+``HashIndex`` finds near-duplicates with multi-index hashing: the pHash
+is split into bands, and only entries sharing a band with the query are
+compared, which is exact whenever the distance threshold is below the
+number of bands.
+
+Each job opens a ``PrefilterSession``; duplicates are looked up among the
+job's own pages and, with ``dedupe='recent'``, among recent results of
+the same model for the same client, so one client never receives text
+of another client's pages. Skipped pages are credited with the average processing
+time of the model, reported as GPU-seconds saved.
+
+config.yaml::
+
+    prefilter:
+      blank_ink_density: 0.002
+      max_phash_distance: 6
+      index_size: 2000
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .preprocessing import ImageSource, decode_image
+
+DEFAULT_PREFILTER_SETTINGS: Dict[str, Any] = {
+    # Pages with less ink than this share of pixels are blank
+    'blank_ink_density': 0.002,
+    # Gray levels below the background that count as ink (bleed-through stays under it)
+    'ink_delta': 48,
+    # Share of each side ignored as margin when measuring ink
+    'margin': 0.04,
+    'max_phash_distance': 6,
+    'max_dhash_distance': 10,
+    # Longest side of the ink mask whose digest confirms a duplicate
+    'content_size': 1024,
+    # Recent results kept per model and client for dedupe='recent'
+    'index_size': 2000,
+}
+
+DEDUPE_MODES = ("off", "batch", "recent")
+
+HASH_BITS = 64
+HASH_BANDS = 8
+
+
+def prefilter_settings(config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Prefilter settings from the application config.
+
+    Args:
+        config: Full config (``prefilter`` section)
+
+    Returns:
+        Settings with defaults applied
+    """
+    return {**DEFAULT_PREFILTER_SETTINGS, **((config or {}).get('prefilter') or {})}
+
+
+def grayscale_proxy(image: ImageSource, width: int, height: int) -> np.ndarray:
+    """
+    Downsampled grayscale proxy of an image.
+
+    Args:
+        image: Encoded bytes, path, PIL Image or RGB array
+        width: Proxy width
+        height: Proxy height
+
+    Returns:
+        uint8 array of shape (height, width)
+    """
+    array = decode_image(image)
+    small = cv2.resize(array, (width, height), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    value = 0
+    for bit in bits.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def phash(image: ImageSource) -> int:
+    """
+    64-bit perceptual hash (low-frequency DCT coefficients vs their median).
+
+    Args:
+        image: Image source
+
+    Returns:
+        Hash as an integer
+    """
+    proxy = grayscale_proxy(image, 32, 32).astype(np.float32)
+    low = cv2.dct(proxy)[:8, :8]
+    # The DC term only carries brightness
+    median = np.median(low.flatten()[1:])
+    return _bits_to_int(low > median)
+
+
+def dhash(image: ImageSource) -> int:
+    """
+    64-bit difference hash (sign of horizontal gradients).
+
+    Args:
+        image: Image source
+
+    Returns:
+        Hash as an integer
+    """
+    proxy = grayscale_proxy(image, 9, 8).astype(np.int16)
+    return _bits_to_int(proxy[:, 1:] > proxy[:, :-1])
+
+
+def hamming(a: int, b: int) -> int:
+    """Number of differing bits."""
+    return bin(a ^ b).count("1")
+
+
+def ink_density(image: ImageSource, ink_delta: int = 48, margin: float = 0.04, size: int = 256) -> float:
+    """
+    Share of page pixels clearly darker than the paper background.
+
+    Args:
+        image: Image source
+        ink_delta: Gray levels below the background median that count as ink
+        margin: Share of each side ignored (scanner edges, punch holes)
+        size: Longest side of the analysis proxy
+
+    Returns:
+        Ink density in [0, 1]
+    """
+    array = decode_image(image)
+    height, width = array.shape[:2]
+    scale = size / max(height, width)
+    proxy = grayscale_proxy(array, max(1, round(width * scale)), max(1, round(height * scale)))
+
+    dy, dx = int(proxy.shape[0] * margin), int(proxy.shape[1] * margin)
+    page = proxy[dy:proxy.shape[0] - dy or None, dx:proxy.shape[1] - dx or None]
+    if page.size == 0:
+        return 0.0
+
+    background = float(np.median(page))
+    return float(np.count_nonzero(page < background - ink_delta)) / page.size
+
+
+def content_digest(image: ImageSource, ink_delta: int = 48, size: int = 1024) -> str:
+    """
+    Digest of a page's ink mask at text resolution.
+
+    Binarizing against the paper background keeps the digest stable under
+    re-encoding, while any changed character changes it.
+
+    Args:
+        image: Image source
+        ink_delta: Gray levels below the background median that count as ink
+        size: Longest side of the mask
+
+    Returns:
+        SHA-256 hex digest
+    """
+    array = decode_image(image)
+    height, width = array.shape[:2]
+    scale = min(1.0, size / max(height, width))
+    proxy = grayscale_proxy(array, max(1, round(width * scale)), max(1, round(height * scale)))
+    mask = proxy < float(np.median(proxy)) - ink_delta
+
+    digest = hashlib.sha256(np.array(mask.shape, dtype=np.int64).tobytes())
+    digest.update(np.packbits(mask).tobytes())
+    return digest.hexdigest()
+
+
+@dataclass
+class PageSignature:
+    """Prefilter measurements of one page."""
+
+    phash: int
+    dhash: int
+    ink_density: float
+    # Ink mask digest; pages with a digest only match pages with the same one
+    digest: Optional[str] = None
+
+
+def page_signature(image: ImageSource, settings: Optional[Dict[str, Any]] = None) -> PageSignature:
+    """
+    Hashes and ink density of a page (decoded once).
+
+    Args:
+        image: Image source
+        settings: Prefilter settings
+
+    Returns:
+        PageSignature
+    """
+    settings = {**DEFAULT_PREFILTER_SETTINGS, **(settings or {})}
+    array = decode_image(image)
+    return PageSignature(
+        phash=phash(array),
+        dhash=dhash(array),
+        ink_density=ink_density(array, settings['ink_delta'], settings['margin']),
+        digest=content_digest(array, settings['ink_delta'], settings['content_size'])
+    )
+
+
+class HashIndex:
+    """
+    Duplicate lookup over recent page hashes (bounded, LRU).
+
+    Perceptual hashes select candidates; signatures with a content digest
+    only match entries with the same digest.
+    """
+
+    def __init__(self, max_phash_distance: int = 6, max_dhash_distance: int = 10, max_entries: int = 2000):
+        """
+        Args:
+            max_phash_distance: pHash Hamming distance for a match
+            max_dhash_distance: dHash Hamming distance for a match (confirmation)
+            max_entries: Entries kept; the oldest are evicted
+        """
+        self.max_phash_distance = max_phash_distance
+        self.max_dhash_distance = max_dhash_distance
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[PageSignature, Any]]" = OrderedDict()
+        self._bands: List[Dict[int, set]] = [{} for _ in range(HASH_BANDS)]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _band_values(value: int) -> List[int]:
+        width = HASH_BITS // HASH_BANDS
+        return [(value >> (band * width)) & ((1 << width) - 1) for band in range(HASH_BANDS)]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, key: Hashable, signature: PageSignature, value: Any = None) -> None:
+        """
+        Add (or replace) an entry.
+
+        Args:
+            key: Entry key
+            signature: Page hashes
+            value: Payload returned by ``find`` (e.g. the OCR result)
+        """
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (signature, value)
+            for band, band_value in enumerate(self._band_values(signature.phash)):
+                self._bands[band].setdefault(band_value, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Hashable) -> None:
+        signature, _ = self._entries.pop(key)
+        for band, band_value in enumerate(self._band_values(signature.phash)):
+            keys = self._bands[band].get(band_value)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._bands[band][band_value]
+
+    def find(self, signature: PageSignature) -> Optional[Tuple[Hashable, int, Any]]:
+        """
+        Closest entry within the distance thresholds.
+
+        Args:
+            signature: Query hashes
+
+        Returns:
+            (key, pHash distance, value) or None
+        """
+        with self._lock:
+            if self.max_phash_distance < HASH_BANDS:
+                # Pigeonhole: a match within d < bands bits shares at least one band
+                candidates = set()
+                for band, band_value in enumerate(self._band_values(signature.phash)):
+                    candidates |= self._bands[band].get(band_value, set())
+            else:
+                candidates = set(self._entries)
+
+            best = None
+            for key in candidates:
+                entry, value = self._entries[key]
+                distance = hamming(entry.phash, signature.phash)
+                if distance > self.max_phash_distance:
+                    continue
+                if hamming(entry.dhash, signature.dhash) > self.max_dhash_distance:
+                    continue
+                if signature.digest is not None and entry.digest != signature.digest:
+                    continue
+                if best is None or distance < best[1]:
+                    best = (key, distance, value)
+
+            if best is not None:
+                self._entries.move_to_end(best[0])
+            return best
+
+
+@dataclass
+class PrefilterDecision:
+    """What to do with one page."""
+
+    action: str  # 'process', 'blank' or 'duplicate'
+    signature: PageSignature
+    duplicate_of: Optional[Hashable] = None
+    distance: Optional[int] = None
+    # Result of a recent (already finished) duplicate
+    result: Any = None
+    recent: bool = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'action': self.action,
+            'ink_density': round(self.signature.ink_density, 5),
+            'distance': self.distance,
+            'recent': self.recent,
+        }
+
+
+class PageFilter:
+    """Shared prefilter state: recent results per model and client, savings totals."""
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            settings: Prefilter settings (see DEFAULT_PREFILTER_SETTINGS)
+        """
+        self.settings = {**DEFAULT_PREFILTER_SETTINGS, **(settings or {})}
+        self._recent: Dict[Tuple[str, Optional[str]], HashIndex] = {}
+        self._seconds: Dict[str, Tuple[float, int]] = {}
+        self._lock = threading.Lock()
+        self.totals = {'pages': 0, 'processed': 0, 'blank_skipped': 0, 'duplicates': 0, 'gpu_seconds_saved': 0.0}
+
+    def new_index(self) -> HashIndex:
+        return HashIndex(
+            self.settings['max_phash_distance'],
+            self.settings['max_dhash_distance'],
+            self.settings['index_size']
+        )
+
+    def recent_index(self, model: str, client: Optional[str] = None) -> HashIndex:
+        """Index of recent results of a model for one client."""
+        with self._lock:
+            key = (model, client)
+            if key not in self._recent:
+                self._recent[key] = self.new_index()
+            return self._recent[key]
+
+    def record_seconds(self, model: str, seconds: float) -> None:
+        """Record the processing time of one page of a model."""
+        with self._lock:
+            total, count = self._seconds.get(model, (0.0, 0))
+            self._seconds[model] = (total + seconds, count + 1)
+
+    def average_seconds(self, model: str) -> Optional[float]:
+        """Average processing time per page of a model."""
+        with self._lock:
+            total, count = self._seconds.get(model, (0.0, 0))
+            return total / count if count else None
+
+    def add_totals(self, report: Dict[str, Any]) -> None:
+        with self._lock:
+            for key in self.totals:
+                self.totals[key] += report[key]
+
+    def session(self, model: str, skip_blank: bool = True, dedupe: str = "off",
+                client: Optional[str] = None) -> "PrefilterSession":
+        """
+        Start a prefilter session for one job.
+
+        Args:
+            model: Model the job runs on (recent results are per model)
+            skip_blank: Skip blank pages
+            dedupe: 'off', 'batch' (within the job) or 'recent' (also recent jobs of the client)
+            client: Client the job belongs to (API key or address); recent
+                results are only shared between jobs of the same client
+
+        Returns:
+            PrefilterSession
+        """
+        if dedupe not in DEDUPE_MODES:
+            raise ValueError(f"dedupe must be one of {DEDUPE_MODES}")
+        return PrefilterSession(self, model, skip_blank, dedupe, client)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Totals over all sessions."""
+        with self._lock:
+            recent: Dict[str, int] = {}
+            for (model, _), index in self._recent.items():
+                recent[model] = recent.get(model, 0) + len(index)
+            return {
+                **{key: round(value, 3) if isinstance(value, float) else value for key, value in self.totals.items()},
+                'recent_entries': recent,
+            }
+
+
+class PrefilterSession:
+    """Prefilter bookkeeping for one batch or document job."""
+
+    def __init__(self, page_filter: PageFilter, model: str, skip_blank: bool, dedupe: str,
+                 client: Optional[str] = None):
+        self.page_filter = page_filter
+        self.model = model
+        self.client = client
+        self.skip_blank = skip_blank
+        self.dedupe = dedupe
+        self.local = page_filter.new_index()
+        self.results: Dict[Hashable, Any] = {}
+        self.pages = 0
+        self.processed = 0
+        self.blank_skipped = 0
+        self.duplicates = 0
+        self.seconds = 0.0
+
+    def check(self, key: Hashable, image: ImageSource) -> PrefilterDecision:
+        """
+        Decide whether a page needs the model.
+
+        Pages to process are registered under ``key``; later near-duplicates
+        of them map to their result.
+
+        Args:
+            key: Page key within the job (e.g. file or page index)
+            image: Page image
+
+        Returns:
+            PrefilterDecision
+        """
+        self.pages += 1
+        signature = page_signature(image, self.page_filter.settings)
+
+        if self.skip_blank and signature.ink_density < self.page_filter.settings['blank_ink_density']:
+            self.blank_skipped += 1
+            return PrefilterDecision('blank', signature)
+
+        if self.dedupe != "off":
+            match = self.local.find(signature)
+            if match is not None:
+                self.duplicates += 1
+                return PrefilterDecision('duplicate', signature, duplicate_of=match[0], distance=match[1])
+
+            if self.dedupe == "recent":
+                match = self.page_filter.recent_index(self.model, self.client).find(signature)
+                if match is not None:
+                    self.duplicates += 1
+                    return PrefilterDecision('duplicate', signature, duplicate_of=match[0],
+                                             distance=match[1], result=match[2], recent=True)
+
+            self.local.add(key, signature)
+
+        self.processed += 1
+        return PrefilterDecision('process', signature)
+
+    def complete(self, key: Hashable, decision: PrefilterDecision, result: Any, seconds: float) -> None:
+        """
+        Record the result of a processed page.
+
+        Args:
+            key: Page key
+            decision: Its 'process' decision
+            result: Model result (shared with its duplicates)
+            seconds: Processing time of the page
+        """
+        self.results[key] = result
+        self.seconds += seconds
+        self.page_filter.record_seconds(self.model, seconds)
+        # Any deduplicating job feeds later dedupe='recent' lookups
+        if self.dedupe != "off":
+            self.page_filter.recent_index(self.model, self.client).add(
+                (self.model, id(self), key), decision.signature, result
+            )
+
+    def resolve(self, decision: PrefilterDecision) -> Any:
+        """Result for a duplicate page (None if its original has no result)."""
+        if decision.recent:
+            return decision.result
+        return self.results.get(decision.duplicate_of)
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Savings of the job; also added to the filter totals.
+
+        Skipped pages are credited with the model's average page time.
+        """
+        average = self.seconds / len(self.results) if self.results else self.page_filter.average_seconds(self.model)
+        skipped = self.blank_skipped + self.duplicates
+        report = {
+            'pages': self.pages,
+            'processed': self.processed,
+            'blank_skipped': self.blank_skipped,
+            'duplicates': self.duplicates,
+            'gpu_seconds_saved': round(skipped * average, 3) if average else 0.0,
+        }
+        self.page_filter.add_totals(report)
+        return report
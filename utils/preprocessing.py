@@ -0,0 +1,355 @@
+"""NumPy-native image preprocessing engine.
+
+The engine decodes an image once into an RGB ``uint8`` array, estimates
+skew, borders and contrast on a small grayscale proxy and then applies
+all geometric transforms (crop, deskew, resize) as a single affine warp
+and all photometric transforms (contrast, sharpness) as a single filter.
+The resulting array can be passed straight to HuggingFace processors.
+"""
+
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+ImageSource = Union[bytes, str, Path, Image.Image, np.ndarray]
+
+# PIL ImageFilter.SMOOTH kernel, used by ImageEnhance.Sharpness
+_SMOOTH_KERNEL = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13.0
+_IDENTITY_KERNEL = np.array([[0, 0, 0], [0, 1, 0], [0, 0, 0]], dtype=np.float32)
+
+
+@dataclass
+class PreprocessResult:
+    """Output of the preprocessing engine."""
+    array: np.ndarray
+    timings: Dict[str, float] = field(default_factory=dict)  # stage -> milliseconds
+    skew_angle: float = 0.0
+    crop_box: Optional[Tuple[int, int, int, int]] = None
+    original_size: Tuple[int, int] = (0, 0)
+
+    def to_pil(self) -> Image.Image:
+        """Convert result to a PIL Image (shares memory where possible)."""
+        return Image.fromarray(self.array)
+
+
+def decode_image(source: ImageSource) -> np.ndarray:
+    """
+    Decode an image source into an RGB uint8 array.
+
+    Args:
+        source: Encoded bytes, file path, PIL Image or array
+
+    Returns:
+        Array of shape (H, W, 3)
+    """
+    if isinstance(source, np.ndarray):
+        array = source
+    else:
+        if isinstance(source, (bytes, bytearray)):
+            source = Image.open(io.BytesIO(source))
+        elif isinstance(source, (str, Path)):
+            source = Image.open(source)
+        if source.mode != 'RGB':
+            source = source.convert('RGB')
+        array = np.asarray(source)
+
+    if array.ndim == 2:
+        array = cv2.cvtColor(array, cv2.COLOR_GRAY2RGB)
+    elif array.shape[2] == 4:
+        array = cv2.cvtColor(array, cv2.COLOR_RGBA2RGB)
+
+    return array
+
+
+class PreprocessingEngine:
+    """Single-pass OCR preprocessing on NumPy arrays."""
+
+    def __init__(
+        self,
+        max_dimension: int = 2048,
+        resize: bool = True,
+        enhance: bool = True,
+        denoise: bool = False,
+        deskew: bool = False,
+        crop_borders: bool = False,
+        proxy_size: int = 512,
+        contrast: float = 1.2,
+        sharpness: float = 1.3,
+        border_threshold: int = 240,
+        min_skew_angle: float = 0.5
+    ):
+        """
+        Initialize preprocessing engine.
+
+        Args:
+            max_dimension: Maximum output dimension
+            resize: Whether to downscale large images
+            enhance: Whether to enhance contrast and sharpness
+            denoise: Whether to apply bilateral denoising
+            deskew: Whether to correct page rotation
+            crop_borders: Whether to crop white borders
+            proxy_size: Longest side of the analysis proxy
+            contrast: Contrast factor (same meaning as ImageEnhance.Contrast)
+            sharpness: Sharpness factor (same meaning as ImageEnhance.Sharpness)
+            border_threshold: Gray level above which pixels count as background
+            min_skew_angle: Smallest rotation (degrees) worth correcting
+        """
+        self.max_dimension = max_dimension
+        self.resize = resize
+        self.enhance = enhance
+        self.denoise = denoise
+        self.deskew = deskew
+        self.crop_borders = crop_borders
+        self.proxy_size = proxy_size
+        self.contrast = contrast
+        self.sharpness = sharpness
+        self.border_threshold = border_threshold
+        self.min_skew_angle = min_skew_angle
+
+    def options(self) -> Dict[str, Any]:
+        """Engine options, used to rebuild the engine in worker processes."""
+        return dict(self.__dict__)
+
+    # ------------------------------------------------------------------
+    # Proxy estimation
+    # ------------------------------------------------------------------
+
+    def make_proxy(self, array: np.ndarray) -> Tuple[np.ndarray, float]:
+        """
+        Build a downsampled grayscale proxy.
+
+        Returns:
+            Tuple of (proxy, scale) where scale maps proxy to full-res pixels
+        """
+        height, width = array.shape[:2]
+        scale = max(height, width) / self.proxy_size
+        gray = cv2.cvtColor(array, cv2.COLOR_RGB2GRAY)
+
+        if scale <= 1:
+            return gray, 1.0
+
+        proxy = cv2.resize(
+            gray,
+            (max(1, int(width / scale)), max(1, int(height / scale))),
+            interpolation=cv2.INTER_AREA
+        )
+        return proxy, scale
+
+    @staticmethod
+    def estimate_skew(proxy: np.ndarray) -> float:
+        """Estimate page rotation in degrees from near-horizontal lines."""
+        edges = cv2.Canny(proxy, 50, 150, apertureSize=3)
+        threshold = max(50, int(min(proxy.shape[:2]) * 0.3))
+        lines = cv2.HoughLines(edges, 1, np.pi / 180, threshold)
+
+        if lines is None:
+            return 0.0
+
+        angles = np.degrees(lines[:, 0, 1]) - 90
+        angles = angles[np.abs(angles) < 45]
+        if len(angles) == 0:
+            return 0.0
+
+        return float(np.median(angles))
+
+    def estimate_borders(
+        self,
+        proxy: np.ndarray,
+        scale: float,
+        full_size: Tuple[int, int],
+        margin: int = 10
+    ) -> Optional[Tuple[int, int, int, int]]:
+        """
+        Estimate content bounding box in full-resolution coordinates.
+
+        Returns:
+            (x0, y0, x1, y1) or None if the page is blank
+        """
+        coords = np.argwhere(proxy < self.border_threshold)
+        if len(coords) == 0:
+            return None
+
+        width, height = full_size
+        y0, x0 = coords.min(axis=0)
+        y1, x1 = coords.max(axis=0) + 1
+
+        return (
+            max(0, int(x0 * scale) - margin),
+            max(0, int(y0 * scale) - margin),
+            min(width, int(np.ceil(x1 * scale)) + margin),
+            min(height, int(np.ceil(y1 * scale)) + margin),
+        )
+
+    # ------------------------------------------------------------------
+    # Single-pass transforms
+    # ------------------------------------------------------------------
+
+    def _geometry_matrix(
+        self,
+        crop_box: Tuple[int, int, int, int],
+        angle: float
+    ) -> Tuple[np.ndarray, Tuple[int, int], bool]:
+        """
+        Compose crop, rotation and resize into one affine matrix.
+
+        Returns:
+            Tuple of (2x3 matrix, output size, is_identity)
+        """
+        x0, y0, x1, y1 = crop_box
+        crop_w, crop_h = x1 - x0, y1 - y0
+
+        scale = 1.0
+        if self.resize and max(crop_w, crop_h) > self.max_dimension:
+            scale = self.max_dimension / max(crop_w, crop_h)
+
+        out_w = max(1, int(crop_w * scale))
+        out_h = max(1, int(crop_h * scale))
+
+        # Rotation around the crop centre, then scale, then shift into output
+        center = (x0 + crop_w / 2.0, y0 + crop_h / 2.0)
+        matrix = cv2.getRotationMatrix2D(center, angle, scale)
+        matrix[0, 2] += out_w / 2.0 - center[0]
+        matrix[1, 2] += out_h / 2.0 - center[1]
+
+        is_identity = angle == 0.0 and scale == 1.0
+        return matrix, (out_w, out_h), is_identity
+
+    def _photometric_kernel(self, mean: float) -> Tuple[np.ndarray, float]:
+        """
+        Fold contrast and sharpness into one 3x3 kernel plus offset.
+
+        Contrast is ``mean + c * (x - mean)`` and sharpness is
+        ``smooth + s * (x - smooth)``; both are linear, so they combine.
+        """
+        sharpen = self.sharpness * _IDENTITY_KERNEL + (1 - self.sharpness) * _SMOOTH_KERNEL
+        kernel = self.contrast * sharpen
+        offset = mean * (1 - self.contrast)
+        return kernel.astype(np.float32), float(offset)
+
+    def process(self, source: ImageSource) -> PreprocessResult:
+        """
+        Preprocess a single image.
+
+        Args:
+            source: Encoded bytes, path, PIL Image or RGB array
+
+        Returns:
+            PreprocessResult with the array and per-stage timings
+        """
+        timings: Dict[str, float] = {}
+        started = time.perf_counter()
+
+        def mark(stage: str, since: float) -> float:
+            now = time.perf_counter()
+            timings[stage] = round((now - since) * 1000, 3)
+            return now
+
+        array = decode_image(source)
+        height, width = array.shape[:2]
+        stage_start = mark("decode", started)
+
+        proxy, scale = self.make_proxy(array)
+        stage_start = mark("proxy", stage_start)
+
+        angle = 0.0
+        if self.deskew:
+            angle = self.estimate_skew(proxy)
+            if abs(angle) <= self.min_skew_angle:
+                angle = 0.0
+
+        crop_box = (0, 0, width, height)
+        if self.crop_borders:
+            crop_box = self.estimate_borders(proxy, scale, (width, height)) or crop_box
+
+        mean = float(proxy.mean()) if self.enhance else 0.0
+        stage_start = mark("estimate", stage_start)
+
+        matrix, out_size, is_identity = self._geometry_matrix(crop_box, angle)
+        if is_identity:
+            x0, y0, x1, y1 = crop_box
+            array = array[y0:y1, x0:x1]
+        elif angle == 0.0:
+            # Pure crop + downscale: INTER_AREA gives the best text quality
+            x0, y0, x1, y1 = crop_box
+            array = cv2.resize(array[y0:y1, x0:x1], out_size, interpolation=cv2.INTER_AREA)
+        else:
+            array = cv2.warpAffine(
+                array, matrix, out_size,
+                flags=cv2.INTER_CUBIC,
+                borderMode=cv2.BORDER_REPLICATE
+            )
+        stage_start = mark("geometry", stage_start)
+
+        if self.enhance:
+            kernel, offset = self._photometric_kernel(mean)
+            array = cv2.filter2D(array, -1, kernel, delta=offset, borderType=cv2.BORDER_REPLICATE)
+        stage_start = mark("photometric", stage_start)
+
+        if self.denoise:
+            array = cv2.bilateralFilter(np.ascontiguousarray(array), 9, 75, 75)
+            stage_start = mark("denoise", stage_start)
+
+        timings["total"] = round((time.perf_counter() - started) * 1000, 3)
+
+        return PreprocessResult(
+            array=np.ascontiguousarray(array),
+            timings=timings,
+            skew_angle=angle,
+            crop_box=crop_box if self.crop_borders else None,
+            original_size=(width, height)
+        )
+
+
+def _process_in_worker(args: Tuple[Dict[str, Any], ImageSource]) -> PreprocessResult:
+    """Process-pool entry point (must be module level to be picklable)."""
+    options, source = args
+    return PreprocessingEngine(**options).process(source)
+
+
+def preprocess_batch(
+    sources: Sequence[ImageSource],
+    engine: Optional[PreprocessingEngine] = None,
+    max_workers: Optional[int] = None
+) -> List[PreprocessResult]:
+    """
+    Preprocess a batch of images across a process pool.
+
+    Encoded bytes or file paths are the cheapest sources to send to
+    workers; arrays and PIL images are pickled.
+
+    Args:
+        sources: Images to preprocess
+        engine: Engine with the desired options (default settings if None)
+        max_workers: Number of worker processes (defaults to CPU count)
+
+    Returns:
+        Results in input order
+    """
+    engine = engine or PreprocessingEngine()
+    max_workers = max_workers or os.cpu_count() or 1
+    max_workers = min(max_workers, len(sources))
+
+    if max_workers <= 1:
+        return [engine.process(source) for source in sources]
+
+    options = engine.options()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_process_in_worker, [(options, s) for s in sources]))
+
+
+def summarize_timings(results: Sequence[PreprocessResult]) -> Dict[str, float]:
+    """Mean per-stage timings (ms) over a batch."""
+    totals: Dict[str, List[float]] = {}
+    for result in results:
+        for stage, value in result.timings.items():
+            totals.setdefault(stage, []).append(value)
+    return {stage: round(float(np.mean(values)), 3) for stage, values in totals.items()}
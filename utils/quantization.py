@@ -0,0 +1,432 @@
+"""Quantized execution profiles and their qualification.
+
+A profile fixes how a model's weights are loaded and run:
+
+    fp32               float32 (CPU reference)
+    fp16 / bf16        half precision on GPU (GPU reference: fp16)
+    int8               bitsandbytes LLM.int8 weight-only quantization
+    int4_nf4           bitsandbytes 4-bit NF4 with double quantization
+    cpu_bf16           bfloat16 on CPUs with native bf16 (AVX512-BF16/AMX)
+    cpu_int8_dynamic   torch dynamic int8 quantization of Linear layers, no GPU
+
+A model selects its profile with ``quantization_profile`` in config.yaml
+(or the legacy ``precision`` key); on CPU-only nodes ``cpu.profile`` picks
+the CPU profile (see utils.cpu_inference). Before a profile is used in
+production it is qualified: the model runs a golden set of documents with
+known text and the run records weight memory, peak memory, tokens/s and character
+error rate (CER). A profile passes if its CER stays under ``max_cer`` and
+within ``max_cer_increase`` of the reference profile on the same device.
+Results are stored per hardware/library environment; the loader refuses
+unqualified profiles when ``require_qualified_quantization`` is set and
+falls back to the reference profile.
+
+Usage:
+    python scripts/qualify_quantization.py qwen3_vl_2b --profiles fp16 int8 int4_nf4
+"""
+
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import torch
+
+from utils.attention_probe import CapabilityStore, environment_fingerprint, environment_key
+from utils.cpu_inference import cpu_settings, preferred_cpu_profile
+from utils.logger import logger
+
+try:
+    from transformers import BitsAndBytesConfig
+    BNB_CONFIG_AVAILABLE = True
+except ImportError:
+    BNB_CONFIG_AVAILABLE = False
+
+try:
+    import bitsandbytes
+    BITSANDBYTES_AVAILABLE = True
+except ImportError:
+    BITSANDBYTES_AVAILABLE = False
+
+
+QUANTIZATION_PROFILES: Dict[str, Dict[str, Any]] = {
+    'fp32': {'device': 'any', 'dtype': torch.float32, 'quantization': None},
+    'fp16': {'device': 'cuda', 'dtype': torch.float16, 'quantization': None},
+    'bf16': {'device': 'cuda', 'dtype': torch.bfloat16, 'quantization': None},
+    'int8': {'device': 'cuda', 'dtype': torch.float16, 'quantization': 'bnb_int8'},
+    'int4_nf4': {'device': 'cuda', 'dtype': torch.float16, 'quantization': 'bnb_nf4'},
+    'cpu_bf16': {'device': 'cpu', 'dtype': torch.bfloat16, 'quantization': None},
+    'cpu_int8_dynamic': {'device': 'cpu', 'dtype': torch.float32, 'quantization': 'dynamic_int8'},
+}
+
+# Profiles the others are compared against
+REFERENCE_PROFILES = {'cuda': 'fp16', 'cpu': 'fp32'}
+
+# Legacy ``precision`` values
+PRECISION_PROFILES = {
+    'fp32': 'fp32',
+    'fp16': 'fp16',
+    'bf16': 'bf16',
+    'int8': 'int8',
+    'int4': 'int4_nf4',
+}
+
+DEFAULT_QUALIFICATION_THRESHOLDS: Dict[str, float] = {
+    'max_cer': 0.05,
+    'max_cer_increase': 0.01,
+}
+
+DEFAULT_QUALIFICATION_FILE = os.environ.get("QUANTIZATION_QUALIFICATION_FILE", "quantization_qualification.json")
+
+
+def _device() -> str:
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def resolve_profile(config: Optional[Dict[str, Any]], device: Optional[str] = None) -> str:
+    """
+    Profile requested by a model config, adjusted to the device.
+
+    GPU-only profiles map to the CPU reference on CPU, and the CPU
+    profiles map to the GPU reference on GPU. On CPU without an explicit
+    ``quantization_profile`` the ``cpu.profile`` setting applies.
+
+    Args:
+        config: Model config (``quantization_profile``, ``cpu`` or ``precision``)
+        device: 'cuda' or 'cpu' (default: cuda if available)
+
+    Returns:
+        Profile name
+    """
+    config = config or {}
+    device = device or _device()
+
+    profile = config.get('quantization_profile')
+    if profile is None and device == 'cpu' and config.get('cpu'):
+        profile = preferred_cpu_profile(cpu_settings(config)['profile'])
+    if profile is None:
+        if config.get('load_in_4bit'):
+            profile = 'int4_nf4'
+        elif config.get('load_in_8bit'):
+            profile = 'int8'
+        else:
+            profile = PRECISION_PROFILES.get(config.get('precision', 'fp16'), REFERENCE_PROFILES[device])
+
+    if profile not in QUANTIZATION_PROFILES:
+        logger.warning(f"Unknown quantization profile '{profile}', using {REFERENCE_PROFILES[device]}")
+        return REFERENCE_PROFILES[device]
+
+    profile_device = QUANTIZATION_PROFILES[profile]['device']
+    if profile_device not in ('any', device):
+        return REFERENCE_PROFILES[device]
+    return profile
+
+
+def profile_load_kwargs(profile: str) -> Dict[str, Any]:
+    """
+    ``from_pretrained`` kwargs for a profile.
+
+    Args:
+        profile: Profile name
+
+    Returns:
+        Dictionary with torch_dtype and, for bitsandbytes profiles, quantization_config
+    """
+    spec = QUANTIZATION_PROFILES[profile]
+    load_kwargs: Dict[str, Any] = {'torch_dtype': spec['dtype']}
+
+    if spec['quantization'] in ('bnb_int8', 'bnb_nf4'):
+        if not BNB_CONFIG_AVAILABLE:
+            raise RuntimeError(f"Profile {profile} needs transformers with BitsAndBytesConfig")
+        if spec['quantization'] == 'bnb_int8':
+            load_kwargs['quantization_config'] = BitsAndBytesConfig(load_in_8bit=True)
+        else:
+            load_kwargs['quantization_config'] = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_compute_dtype=spec['dtype'],
+                bnb_4bit_use_double_quant=True,
+                bnb_4bit_quant_type="nf4"
+            )
+    return load_kwargs
+
+
+def apply_post_load_quantization(model: torch.nn.Module, profile: str) -> torch.nn.Module:
+    """
+    Quantize a loaded model in place for profiles applied after loading.
+
+    The module object is kept, so wrappers installed on it (vision cache,
+    compiled generation) stay valid.
+
+    Args:
+        model: Loaded model
+        profile: Profile name
+
+    Returns:
+        The same model
+    """
+    if QUANTIZATION_PROFILES[profile]['quantization'] == 'dynamic_int8':
+        torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        logger.info("Applied dynamic int8 quantization to Linear layers")
+    return model
+
+
+def weight_memory_gb(model: torch.nn.Module) -> float:
+    """
+    Memory held by a model's weights, including quantized storage.
+
+    Parameters and buffers are counted at their storage size (bitsandbytes
+    keeps packed weights as parameters); dynamically quantized Linear
+    layers keep their int8 weights outside ``parameters()``.
+    """
+    total = 0
+    for module in model.modules():
+        for tensor in list(module.parameters(recurse=False)) + list(module.buffers(recurse=False)):
+            total += tensor.numel() * tensor.element_size()
+        weight = getattr(module, 'weight', None)
+        if callable(weight):
+            packed = weight()
+            total += packed.numel() * packed.element_size()
+    return total / 1024 ** 3
+
+
+def _normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def character_error_rate(reference: str, hypothesis: str) -> float:
+    """
+    Character error rate: edit distance divided by the reference length.
+
+    Whitespace runs are collapsed first, so line wrapping differences
+    are not counted as errors.
+
+    Args:
+        reference: Expected text
+        hypothesis: Recognized text
+
+    Returns:
+        CER (0.0 for a perfect match; can exceed 1.0)
+    """
+    reference = _normalize_text(reference)
+    hypothesis = _normalize_text(hypothesis)
+    if not reference:
+        return 0.0 if not hypothesis else 1.0
+
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_char in enumerate(reference, 1):
+        current = [i] + [0] * len(hypothesis)
+        for j, hyp_char in enumerate(hypothesis, 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_char != hyp_char)
+            )
+        previous = current
+    return previous[-1] / len(reference)
+
+
+def load_golden_set(directory: str) -> List[Dict[str, Any]]:
+    """
+    Read a golden set: every image with a ``.txt`` file of the same name.
+
+    Args:
+        directory: Golden set directory
+
+    Returns:
+        List of {"name", "image" (path), "text"} sorted by name
+    """
+    samples = []
+    for text_path in sorted(Path(directory).glob("*.txt")):
+        image_path = next(
+            (text_path.with_suffix(ext) for ext in ('.png', '.jpg', '.jpeg', '.tiff', '.bmp')
+             if text_path.with_suffix(ext).exists()),
+            None
+        )
+        if image_path is None:
+            continue
+        samples.append({
+            'name': text_path.stem,
+            'image': str(image_path),
+            'text': text_path.read_text(encoding="utf-8"),
+        })
+    return samples
+
+
+def run_golden_set(
+    recognize: Callable[[Any], str],
+    samples: Sequence[Dict[str, Any]],
+    count_tokens: Callable[[str], int]
+) -> Dict[str, Any]:
+    """
+    Run a recognizer over a golden set and measure accuracy and speed.
+
+    Args:
+        recognize: Function from image path to recognized text
+        samples: Golden set samples (see ``load_golden_set``)
+        count_tokens: Tokenizer-based token counter for the outputs
+
+    Returns:
+        {"cer", "tokens_per_second", "seconds", "samples": [...]}
+    """
+    results = []
+    total_tokens = 0
+    total_seconds = 0.0
+
+    for sample in samples:
+        start = time.perf_counter()
+        text = recognize(sample['image'])
+        elapsed = time.perf_counter() - start
+
+        tokens = count_tokens(text)
+        total_tokens += tokens
+        total_seconds += elapsed
+        results.append({
+            'name': sample['name'],
+            'cer': round(character_error_rate(sample['text'], text), 4),
+            'tokens': tokens,
+            'seconds': round(elapsed, 3),
+        })
+
+    cer = sum(result['cer'] for result in results) / len(results) if results else None
+    return {
+        'cer': round(cer, 4) if cer is not None else None,
+        'tokens_per_second': round(total_tokens / total_seconds, 1) if total_seconds else None,
+        'seconds': round(total_seconds, 2),
+        'samples': results,
+    }
+
+
+def qualification_fingerprint(device: str) -> Dict[str, Any]:
+    """Environment fingerprint for qualification results (adds bitsandbytes)."""
+    fingerprint = environment_fingerprint(device)
+    fingerprint['bitsandbytes'] = getattr(bitsandbytes, '__version__', None) if BITSANDBYTES_AVAILABLE else None
+    return fingerprint
+
+
+def passes(result: Dict[str, Any], reference_cer: Optional[float], thresholds: Optional[Dict[str, float]] = None) -> Tuple[bool, str]:
+    """
+    Decide whether a qualification run passes.
+
+    Args:
+        result: Golden set result with ``cer``
+        reference_cer: CER of the reference profile (None when this is the reference)
+        thresholds: ``max_cer`` / ``max_cer_increase`` overrides
+
+    Returns:
+        Tuple of (passed, reason)
+    """
+    thresholds = {**DEFAULT_QUALIFICATION_THRESHOLDS, **(thresholds or {})}
+    cer = result.get('cer')
+
+    if cer is None:
+        return False, "no golden set samples"
+    if cer > thresholds['max_cer']:
+        return False, f"CER {cer:.4f} > {thresholds['max_cer']}"
+    if reference_cer is not None and cer - reference_cer > thresholds['max_cer_increase']:
+        return False, f"CER {cer:.4f} exceeds reference {reference_cer:.4f} by more than {thresholds['max_cer_increase']}"
+    return True, "ok"
+
+
+class QualificationStore:
+    """Qualification results per environment, model and profile."""
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Initialize store.
+
+        Args:
+            path: Results file (default ``DEFAULT_QUALIFICATION_FILE``)
+        """
+        self.store = CapabilityStore(path or DEFAULT_QUALIFICATION_FILE)
+        self.path = self.store.path
+
+    @staticmethod
+    def _key(model_path: str, profile: str) -> str:
+        return f"{model_path}:{profile}"
+
+    def get(self, model_path: str, profile: str, device: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Stored result for a model and profile in the current environment."""
+        env_key = environment_key(qualification_fingerprint(device or _device()))
+        return self.store.get(env_key, self._key(model_path, profile))
+
+    def put(self, model_path: str, profile: str, result: Dict[str, Any], device: Optional[str] = None) -> None:
+        """Store a result for the current environment."""
+        fingerprint = qualification_fingerprint(device or _device())
+        self.store.put(environment_key(fingerprint), fingerprint, self._key(model_path, profile), result)
+
+    def is_allowed(self, model_path: str, profile: str, device: Optional[str] = None) -> Tuple[bool, str]:
+        """
+        Whether a profile may be used in production.
+
+        Reference profiles are always allowed: they define the accuracy the
+        others are measured against.
+
+        Returns:
+            Tuple of (allowed, reason)
+        """
+        device = device or _device()
+        if profile == REFERENCE_PROFILES[device]:
+            return True, "reference profile"
+
+        result = self.get(model_path, profile, device)
+        if result is None:
+            return False, "not qualified in this environment"
+        if not result.get('passed'):
+            return False, f"failed qualification: {result.get('reason')}"
+        return True, "qualified"
+
+
+def qualification_result(
+    profile: str,
+    golden: Dict[str, Any],
+    weights_gb: float,
+    peak_gb: Optional[float],
+    reference_cer: Optional[float],
+    thresholds: Optional[Dict[str, float]] = None
+) -> Dict[str, Any]:
+    """Combine measurements into a stored qualification result."""
+    passed, reason = passes(golden, reference_cer, thresholds)
+    return {
+        'profile': profile,
+        'passed': passed,
+        'reason': reason,
+        'cer': golden['cer'],
+        'reference_cer': reference_cer,
+        'tokens_per_second': golden['tokens_per_second'],
+        'weights_gb': round(weights_gb, 3),
+        'peak_gb': round(peak_gb, 3) if peak_gb is not None else None,
+        'samples': golden['samples'],
+        'qualified_at': datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def validate_production_config(
+    config: Dict[str, Any],
+    store: Optional[QualificationStore] = None,
+    device: Optional[str] = None,
+    model_keys: Optional[Iterable[str]] = None
+) -> List[Dict[str, str]]:
+    """
+    List models in config.yaml whose profile is not allowed in production.
+
+    Args:
+        config: Full config (``models`` section)
+        store: Qualification store
+        device: 'cuda' or 'cpu' (default: cuda if available)
+        model_keys: Models to check (default: all)
+
+    Returns:
+        List of {"model", "profile", "reason"}; empty if the config is valid
+    """
+    store = store or QualificationStore()
+    device = device or _device()
+    models = config.get('models') or {}
+    problems = []
+
+    for model_key in model_keys or models:
+        model_config = models.get(model_key) or {}
+        profile = resolve_profile(model_config, device)
+        allowed, reason = store.is_allowed(model_config.get('model_path', ''), profile, device)
+        if not allowed:
+            problems.append({'model': model_key, 'profile': profile, 'reason': reason})
+    return problems
@@ -0,0 +1,308 @@
+"""GCRA rate limiting with state shared across API worker processes.
+
+The previous limiter kept a list of request timestamps per address,
+rebuilt it on every check and never forgot an address; each
+``uvicorn --workers N`` process also counted separately, multiplying the
+limit by N. Here every (client, dimension) pair is one number: the
+theoretical arrival time (TAT) of the generic cell rate algorithm, the
+timestamp-only form of a token bucket. A call of cost ``c`` is allowed if
+``max(TAT, now) + c * T - burst * T <= now`` (``T = period / rate``) and
+moves TAT forward by ``c * T``; checks are O(1). A key whose TAT lies in
+the past is a full bucket, indistinguishable from a key never seen, so
+such keys are evicted.
+
+Dimensions:
+    requests  every request costs 1
+    pages     images and document pages processed (cost of the request)
+
+Stores:
+    MemoryLimitStore  one process (tests, single worker)
+    SqliteLimitStore  a local SQLite file shared by the worker processes
+                      of one host (``BEGIN IMMEDIATE`` serializes updates)
+
+Quotas are per client: a configured API key gets its own limits, other
+callers are limited by address.
+
+Usage:
+    limiter = RateLimiter(rate_limit_settings(config))
+    client = limiter.identify(api_key=request.headers.get("X-API-Key"), address=ip)
+    decision = limiter.hit(client, "requests")
+    if decision.allowed:
+        decision = limiter.hit(client, "pages", cost=total_pages)
+"""
+
+import hashlib
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Tuple
+
+DIMENSIONS = ("requests", "pages")
+
+DEFAULT_RATE_LIMIT_SETTINGS: Dict[str, Any] = {
+    # Requests per minute of one client (also the burst size)
+    'requests_per_minute': 60,
+    # Images and document pages per minute of one client (None: unlimited)
+    'pages_per_minute': None,
+    # State shared between worker processes: memory (this process only) or sqlite
+    'store': 'memory',
+    # SQLite file of the sqlite store (default: in the system temp directory)
+    'path': None,
+    # Quotas of API keys: key (or "sha256:<hex digest>") -> requests/pages_per_minute
+    'keys': {},
+}
+
+DEFAULT_SQLITE_PATH = os.path.join(tempfile.gettempdir(), "chatvlmllm_rate_limit.sqlite3")
+
+# Seconds between sweeps of expired keys
+SWEEP_INTERVAL = 60.0
+
+
+def rate_limit_settings(config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Rate limit settings from the application config.
+
+    Args:
+        config: Full config (``rate_limit`` section)
+
+    Returns:
+        Settings with defaults applied
+    """
+    return {**DEFAULT_RATE_LIMIT_SETTINGS, **((config or {}).get('rate_limit') or {})}
+
+
+@dataclass(frozen=True)
+class Limit:
+    """``rate`` units per ``period`` seconds with bursts of up to ``burst`` units."""
+
+    rate: float
+    period: float = 60.0
+    burst: Optional[float] = None
+
+    @property
+    def interval(self) -> float:
+        """Seconds one unit takes to refill (GCRA emission interval)."""
+        return self.period / self.rate
+
+    @property
+    def capacity(self) -> float:
+        return self.burst if self.burst is not None else self.rate
+
+
+@dataclass
+class Decision:
+    """Result of one rate limit check."""
+
+    allowed: bool
+    # Units left after this call (None for an unlimited dimension)
+    remaining: Optional[int] = None
+    # Seconds until the call would be allowed (0 when allowed)
+    retry_after: float = 0.0
+    # Seconds until the bucket is full again
+    reset_after: float = 0.0
+
+    def headers(self) -> Dict[str, str]:
+        """X-RateLimit-* and Retry-After response headers."""
+        headers = {}
+        if self.remaining is not None:
+            headers["X-RateLimit-Remaining"] = str(self.remaining)
+            headers["X-RateLimit-Reset"] = str(math.ceil(self.reset_after))
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+
+@dataclass
+class Client:
+    """A rate-limited caller and its limits per dimension (None: unlimited)."""
+
+    id: str
+    limits: Dict[str, Optional[Limit]] = field(default_factory=dict)
+
+
+def gcra(tat: Optional[float], now: float, limit: Limit, cost: float = 1.0) -> Tuple[Decision, float]:
+    """
+    One GCRA step.
+
+    A call costing more than the whole burst is allowed only on a full
+    bucket and leaves the client in debt, so oversized documents are
+    throttled instead of being rejected forever.
+
+    Args:
+        tat: Stored theoretical arrival time (None for a new key)
+        now: Current time
+        limit: Limit of the key
+        cost: Units the call consumes
+
+    Returns:
+        Decision and the TAT to store
+    """
+    interval = limit.interval
+    tolerance = limit.capacity * interval
+    tat = max(tat if tat is not None else now, now)
+    new_tat = tat + cost * interval
+    allow_at = min(new_tat - tolerance, tat)
+
+    if allow_at > now:
+        remaining = int((now + tolerance - tat) / interval + 1e-9)
+        return Decision(False, max(0, remaining), allow_at - now, tat - now), tat
+
+    remaining = int((now + tolerance - new_tat) / interval + 1e-9)
+    return Decision(True, max(0, remaining), 0.0, new_tat - now), new_tat
+
+
+class MemoryLimitStore:
+    """TATs in a dict of this process."""
+
+    def __init__(self, sweep_interval: float = SWEEP_INTERVAL):
+        self._tats: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._sweep_interval = sweep_interval
+        self._next_sweep = time.time() + sweep_interval
+
+    def update(self, key: str, step: Callable[[Optional[float], float], Tuple[Decision, float]]) -> Decision:
+        """Apply ``step(tat, now)`` to a key atomically."""
+        with self._lock:
+            now = time.time()
+            decision, tat = step(self._tats.get(key), now)
+            self._tats[key] = tat
+            if now >= self._next_sweep:
+                self._sweep(now)
+            return decision
+
+    def _sweep(self, now: float) -> None:
+        self._tats = {key: tat for key, tat in self._tats.items() if tat > now}
+        self._next_sweep = now + self._sweep_interval
+
+    def __len__(self) -> int:
+        return len(self._tats)
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteLimitStore:
+    """
+    TATs in a SQLite file shared by the worker processes of a host.
+
+    Each update is one ``BEGIN IMMEDIATE`` transaction, so concurrent
+    workers never lose each other's updates.
+    """
+
+    def __init__(self, path: Optional[str] = None, sweep_interval: float = SWEEP_INTERVAL):
+        """
+        Args:
+            path: Database file (default: ``DEFAULT_SQLITE_PATH``)
+            sweep_interval: Seconds between deletions of expired keys
+        """
+        self.path = path or DEFAULT_SQLITE_PATH
+        self._conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tat REAL NOT NULL)")
+        self._lock = threading.Lock()
+        self._sweep_interval = sweep_interval
+        self._next_sweep = time.time() + sweep_interval
+
+    def update(self, key: str, step: Callable[[Optional[float], float], Tuple[Decision, float]]) -> Decision:
+        """Apply ``step(tat, now)`` to a key atomically across processes."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._conn.execute("SELECT tat FROM buckets WHERE key = ?", (key,)).fetchone()
+                decision, tat = step(row[0] if row else None, now)
+                self._conn.execute(
+                    "INSERT INTO buckets (key, tat) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET tat = excluded.tat",
+                    (key, tat)
+                )
+                if now >= self._next_sweep:
+                    self._conn.execute("DELETE FROM buckets WHERE tat <= ?", (now,))
+                    self._next_sweep = now + self._sweep_interval
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return decision
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_store(settings: Dict[str, Any]) -> Any:
+    """Store selected by the ``store`` setting (memory or sqlite)."""
+    store = (settings.get('store') or 'memory').lower()
+    if store == 'sqlite':
+        return SqliteLimitStore(settings.get('path'))
+    if store != 'memory':
+        raise ValueError(f"Unknown rate limit store: {store} (expected memory or sqlite)")
+    return MemoryLimitStore()
+
+
+def key_digest(api_key: str) -> str:
+    """SHA-256 hex digest of an API key (how keys may be listed in the config)."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+class RateLimiter:
+    """Per-client GCRA limits on requests and pages."""
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None, store: Any = None):
+        """
+        Args:
+            settings: Rate limit settings (see ``DEFAULT_RATE_LIMIT_SETTINGS``)
+            store: TAT store (default: from the ``store`` setting)
+        """
+        self.settings = {**DEFAULT_RATE_LIMIT_SETTINGS, **(settings or {})}
+        self.store = store if store is not None else create_store(self.settings)
+        self._default_limits = self._limits(self.settings)
+        # Key quotas by digest, so raw keys are not kept around after startup
+        self._key_limits = {
+            (key[len("sha256:"):] if key.startswith("sha256:") else key_digest(key)): self._limits(quota or {})
+            for key, quota in (self.settings.get('keys') or {}).items()
+        }
+
+    def _limits(self, quota: Dict[str, Any]) -> Dict[str, Optional[Limit]]:
+        limits = {}
+        for dimension in DIMENSIONS:
+            name = f"{dimension}_per_minute"
+            rate = quota[name] if name in quota else self.settings.get(name)
+            limits[dimension] = Limit(float(rate)) if rate else None
+        return limits
+
+    def identify(self, api_key: Optional[str] = None, address: str = "unknown") -> Client:
+        """
+        Client of a request.
+
+        Configured API keys are limited per key; unknown keys are ignored
+        (otherwise inventing keys would bypass the limit) and the caller
+        is limited by address.
+        """
+        if api_key:
+            digest = key_digest(api_key)
+            if digest in self._key_limits:
+                return Client(f"key:{digest[:16]}", self._key_limits[digest])
+        return Client(f"ip:{address}", self._default_limits)
+
+    def hit(self, client: Client, dimension: str = "requests", cost: float = 1.0) -> Decision:
+        """
+        Consume ``cost`` units of a dimension if the client's limit allows it.
+
+        Denied calls consume nothing.
+        """
+        limit = client.limits.get(dimension)
+        if limit is None:
+            return Decision(True)
+        return self.store.update(f"{dimension}:{client.id}", lambda tat, now: gcra(tat, now, limit, cost))
+
+    def close(self) -> None:
+        self.store.close()
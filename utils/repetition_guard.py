@@ -0,0 +1,491 @@
+"""Early stopping for repetition loops during generation.
+
+OCR models occasionally fall into loops (the same line, cell or digit
+group over and over) and keep generating until ``max_new_tokens``. The
+detector here looks at the tail of the token stream while it is being
+generated:
+
+- periodic loops: the last tokens are an exact repetition of a unit of
+  1..``max_period`` tokens;
+- n-gram loops: one n-gram occurs too often within a sliding window
+  (catches loops with small variations, e.g. incrementing numbers).
+
+``RepetitionStoppingCriteria`` plugs the detector into ``generate()`` of
+Transformers models; ``StreamWatchdog`` applies it to a streamed vLLM
+response so the client can abort the request. Both report how many
+tokens were saved relative to the generation budget.
+
+Tables legitimately repeat: identical rows (``| 0 | 0 |``, ``<tr>...</tr>``)
+and runs of identical cells. A repeated unit that decodes to table markup
+only counts as a loop beyond ``max_markup_repeats`` copies, which no real
+row or table width reaches within the inspected window. Trimmed outputs
+are logged as warnings and flagged in the reports.
+"""
+
+import json
+import re
+from collections import Counter
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Sequence
+
+import torch
+
+from utils.logger import logger
+
+try:
+    from transformers import StoppingCriteria
+    TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    StoppingCriteria = object
+    TRANSFORMERS_AVAILABLE = False
+
+
+DEFAULT_DETECTOR_SETTINGS: Dict[str, int] = {
+    "max_period": 48,        # longest repeated unit, in tokens
+    "min_repeats": 4,        # copies of the unit needed for a periodic loop
+    "min_span": 48,          # shortest repeated region, in tokens
+    "ngram_size": 12,
+    "max_ngram_repeats": 8,  # occurrences of one n-gram within the window
+    "window": 384,
+    "max_markup_repeats": 64,  # copies of a table row/cell unit that still are content
+}
+
+# Pseudo-tokens for text streams: words, numbers and single punctuation marks
+_PSEUDO_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Markdown table pipes and HTML table tags (pseudo-tokens are joined with spaces)
+_TABLE_MARKUP_PATTERN = re.compile(r"\||<\s*/?\s*t[rdh]\b", re.IGNORECASE)
+
+
+@dataclass
+class RepetitionMatch:
+    """Loop found in a token sequence."""
+    kind: str      # 'periodic' or 'ngram'
+    start: int     # index where the repeated region begins
+    period: int    # length of the repeated unit
+    repeats: int
+
+    @property
+    def keep_length(self) -> int:
+        """Tokens to keep: everything before the loop plus one copy of the unit."""
+        return self.start + self.period
+
+
+def _find_periodic(tokens: Sequence[Hashable], max_period: int, min_repeats: int, min_span: int) -> Optional[RepetitionMatch]:
+    length = len(tokens)
+
+    for period in range(1, max_period + 1):
+        needed = max(min_repeats * period, min_span)
+        if needed > length:
+            break
+
+        # Quick reject on the required span before measuring the full run
+        if any(tokens[length - 1 - i] != tokens[length - 1 - i - period] for i in range(needed - period)):
+            continue
+
+        run = needed - period
+        while run + period < length and tokens[length - 1 - run] == tokens[length - 1 - run - period]:
+            run += 1
+
+        span = run + period
+        return RepetitionMatch(kind="periodic", start=length - span, period=period, repeats=span // period)
+
+    return None
+
+
+def _find_ngram(tokens: Sequence[Hashable], ngram_size: int, max_ngram_repeats: int) -> Optional[RepetitionMatch]:
+    if len(tokens) < ngram_size * max_ngram_repeats:
+        return None
+
+    ngrams = [tuple(tokens[i:i + ngram_size]) for i in range(len(tokens) - ngram_size + 1)]
+    ngram, count = Counter(ngrams).most_common(1)[0]
+    if count < max_ngram_repeats:
+        return None
+
+    positions = [i for i, candidate in enumerate(ngrams) if candidate == ngram]
+    period = max(ngram_size, positions[1] - positions[0])
+    return RepetitionMatch(kind="ngram", start=positions[0], period=period, repeats=count)
+
+
+def is_table_markup(text: str) -> bool:
+    """True if a decoded loop unit contains table markup (markdown pipes, HTML row/cell tags)."""
+    return bool(_TABLE_MARKUP_PATTERN.search(text))
+
+
+def _is_table_content(
+    match: RepetitionMatch,
+    tokens: Sequence[Hashable],
+    decode: Optional[Callable[[Sequence[Hashable]], str]],
+    max_markup_repeats: int
+) -> bool:
+    if decode is None or match.repeats > max_markup_repeats:
+        return False
+    return is_table_markup(decode(tokens[match.start:match.start + match.period]))
+
+
+def find_repetition(
+    tokens: Sequence[Hashable],
+    max_period: int = DEFAULT_DETECTOR_SETTINGS["max_period"],
+    min_repeats: int = DEFAULT_DETECTOR_SETTINGS["min_repeats"],
+    min_span: int = DEFAULT_DETECTOR_SETTINGS["min_span"],
+    ngram_size: int = DEFAULT_DETECTOR_SETTINGS["ngram_size"],
+    max_ngram_repeats: int = DEFAULT_DETECTOR_SETTINGS["max_ngram_repeats"],
+    window: int = DEFAULT_DETECTOR_SETTINGS["window"],
+    max_markup_repeats: int = DEFAULT_DETECTOR_SETTINGS["max_markup_repeats"],
+    decode: Optional[Callable[[Sequence[Hashable]], str]] = None
+) -> Optional[RepetitionMatch]:
+    """
+    Detect a repetition loop at the end of a token sequence.
+
+    Args:
+        tokens: Token ids (or any hashable pseudo-tokens)
+        max_period: Longest repeated unit checked for periodic loops
+        min_repeats: Minimum copies of the unit for a periodic loop
+        min_span: Minimum length of the repeated region
+        ngram_size: N-gram length for the frequency check
+        max_ngram_repeats: N-gram occurrences within the window that count as a loop
+        window: Number of trailing tokens inspected
+        max_markup_repeats: Copies of a table markup unit that are still content
+        decode: Turns a unit of tokens into text for the table markup check
+            (None: every repeated unit is a loop candidate)
+
+    Returns:
+        RepetitionMatch with positions relative to ``tokens``, or None
+    """
+    offset = max(0, len(tokens) - window)
+    tail = list(tokens[offset:])
+
+    match = _find_periodic(tail, max_period, min_repeats, min_span)
+    if match is not None and _is_table_content(match, tail, decode, max_markup_repeats):
+        match = None
+    if match is None and ngram_size > 0:
+        match = _find_ngram(tail, ngram_size, max_ngram_repeats)
+        if match is not None and _is_table_content(match, tail, decode, max_markup_repeats):
+            match = None
+
+    if match is not None:
+        match.start += offset
+    return match
+
+
+def detector_settings(config: Optional[Dict[str, Any]] = None) -> Dict[str, int]:
+    """Detector settings from a model config's ``repetition_guard`` section."""
+    settings = dict(DEFAULT_DETECTOR_SETTINGS)
+    section = (config or {}).get("repetition_guard") or {}
+    if isinstance(section, dict):
+        settings.update({k: int(v) for k, v in section.items() if k in settings})
+    return settings
+
+
+def guard_enabled(config: Optional[Dict[str, Any]] = None) -> bool:
+    """Repetition guard is on unless ``repetition_guard: false`` is configured."""
+    return (config or {}).get("repetition_guard", True) is not False
+
+
+@dataclass
+class RepetitionStop:
+    """Early stop of one sequence."""
+    row: int
+    kind: str
+    period: int
+    loop_start: int          # generated-token index where the loop begins
+    generated_tokens: int    # tokens generated when the loop was detected
+    tokens_saved: int
+
+    @property
+    def keep_length(self) -> int:
+        return self.loop_start + self.period
+
+
+class RepetitionStoppingCriteria(StoppingCriteria):
+    """``generate()`` stopping criterion that ends rows caught in a loop."""
+
+    def __init__(
+        self,
+        prompt_length: int,
+        max_new_tokens: int,
+        check_every: int = 4,
+        stop_token_ids: Optional[Sequence[int]] = None,
+        decode: Optional[Callable[[Sequence[int]], str]] = None,
+        **detector_kwargs
+    ):
+        """
+        Initialize stopping criterion.
+
+        Args:
+            prompt_length: Length of the (padded) prompt in input_ids
+            max_new_tokens: Generation budget, used to report tokens saved
+            check_every: Run the detector every N generated tokens
+            stop_token_ids: EOS/pad ids; rows ending in one are already finished
+            decode: Token ids -> text (tokenizer.decode), lets table rows repeat
+            **detector_kwargs: Overrides for ``find_repetition``
+        """
+        self.prompt_length = prompt_length
+        self.max_new_tokens = max_new_tokens
+        self.check_every = max(1, check_every)
+        self.stop_token_ids = {int(t) for t in (stop_token_ids or []) if t is not None}
+        self.settings = {**DEFAULT_DETECTOR_SETTINGS, **detector_kwargs}
+        self.decode = decode
+        self.stops: Dict[int, RepetitionStop] = {}
+        # Length at the previous call; assisted decoding appends several tokens per step
+        self._previous: Optional[int] = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        generated = input_ids.shape[1] - self.prompt_length
+        previous = generated - 1 if self._previous is None else self._previous
+        self._previous = generated
+
+        # Check whenever a multiple of check_every was reached since the previous call
+        if generated < self.settings["min_span"] or generated // self.check_every == previous // self.check_every:
+            for row in self.stops:
+                done[row] = True
+            return done
+
+        # Only the generated tail is copied to the host
+        window = min(generated, self.settings["window"])
+        tails = input_ids[:, -window:].tolist()
+        tail_offset = generated - window
+
+        for row, tail in enumerate(tails):
+            if row in self.stops:
+                done[row] = True
+                continue
+            if tail[-1] in self.stop_token_ids:
+                # Finished rows are padded with EOS/pad, which is not a loop
+                continue
+
+            match = find_repetition(tail, decode=self.decode, **self.settings)
+            if match is None:
+                continue
+
+            self.stops[row] = RepetitionStop(
+                row=row,
+                kind=match.kind,
+                period=match.period,
+                loop_start=tail_offset + match.start,
+                generated_tokens=generated,
+                tokens_saved=max(0, self.max_new_tokens - generated)
+            )
+            done[row] = True
+
+        return done
+
+    def trim(self, row: int, generated_ids: Sequence[int]) -> Sequence[int]:
+        """Cut a row's generated ids after the first copy of its loop unit."""
+        stop = self.stops.get(row)
+        if stop is None:
+            return generated_ids
+        return generated_ids[:stop.keep_length]
+
+    def reset(self) -> None:
+        """Forget recorded stops (before re-running generation)."""
+        self.stops.clear()
+        self._previous = None
+
+    def report(self, rows: int = 1) -> Dict[str, Any]:
+        """Per-request summary of early stops and tokens saved; ``trimmed`` flags cut output."""
+        return {
+            "rows": rows,
+            "trimmed": bool(self.stops),
+            "loops_stopped": len(self.stops),
+            "tokens_saved": sum(stop.tokens_saved for stop in self.stops.values()),
+            "max_new_tokens": self.max_new_tokens,
+            "stops": [asdict(stop) for stop in self.stops.values()]
+        }
+
+
+def build_stopping_criteria(
+    prompt_length: int,
+    max_new_tokens: int,
+    config: Optional[Dict[str, Any]] = None,
+    tokenizer: Any = None
+) -> Optional[RepetitionStoppingCriteria]:
+    """
+    Create the stopping criterion for a model config, or None if disabled.
+
+    Args:
+        prompt_length: Length of the prompt in input_ids
+        max_new_tokens: Generation budget
+        config: Model config (``repetition_guard`` may be false or a settings dict)
+        tokenizer: Tokenizer providing EOS/pad ids
+
+    Returns:
+        RepetitionStoppingCriteria or None
+    """
+    if not TRANSFORMERS_AVAILABLE or not guard_enabled(config):
+        return None
+    stop_token_ids = [
+        getattr(tokenizer, 'eos_token_id', None),
+        getattr(tokenizer, 'pad_token_id', None)
+    ]
+    decode = getattr(tokenizer, 'decode', None)
+    return RepetitionStoppingCriteria(
+        prompt_length,
+        max_new_tokens,
+        stop_token_ids=stop_token_ids,
+        decode=(lambda ids: decode(list(ids))) if decode is not None else None,
+        **detector_settings(config)
+    )
+
+
+def log_repetition_report(model_name: str, report: Optional[Dict[str, Any]]) -> None:
+    """Warn about early stops: the output of those sequences was trimmed."""
+    if report and report["loops_stopped"]:
+        logger.warning(
+            f"{model_name}: stopped {report['loops_stopped']}/{report['rows']} looping sequence(s), "
+            f"output trimmed, saved {report['tokens_saved']} of {report['max_new_tokens'] * report['rows']} tokens"
+        )
+
+
+class StreamWatchdog:
+    """Loop detector for streamed text (vLLM / OpenAI-compatible streams)."""
+
+    def __init__(self, max_tokens: int, check_every: int = 8, **detector_kwargs):
+        """
+        Initialize watchdog.
+
+        Args:
+            max_tokens: Requested ``max_tokens`` of the stream
+            check_every: Run the detector every N received chunks
+            **detector_kwargs: Overrides for ``find_repetition``
+        """
+        self.max_tokens = max_tokens
+        self.check_every = max(1, check_every)
+        self.settings = {**DEFAULT_DETECTOR_SETTINGS, **detector_kwargs}
+        self.chunks = 0
+        self.text = ""
+        self.match: Optional[RepetitionMatch] = None
+        self._tokens: List[str] = []
+        self._token_ends: List[int] = []
+
+    def feed(self, delta: str) -> bool:
+        """
+        Add a streamed chunk.
+
+        Returns:
+            True if the stream is looping and should be aborted
+        """
+        if not delta:
+            return False
+
+        self.chunks += 1
+        start = len(self.text)
+        self.text += delta
+        # Re-tokenize from the last token start so words split across chunks stay whole
+        if self._tokens:
+            start = self._token_ends[-1] - len(self._tokens.pop())
+            self._token_ends.pop()
+        for token in _PSEUDO_TOKEN_PATTERN.finditer(self.text, start):
+            self._tokens.append(token.group())
+            self._token_ends.append(token.end())
+
+        if self.chunks % self.check_every:
+            return False
+
+        self.match = find_repetition(self._tokens, decode=" ".join, **self.settings)
+        return self.match is not None
+
+    def trimmed_text(self) -> str:
+        """Received text cut after the first copy of the loop unit."""
+        if self.match is None:
+            return self.text
+        end = self._token_ends[min(self.match.keep_length, len(self._token_ends)) - 1]
+        return self.text[:end]
+
+    def report(self) -> Dict[str, Any]:
+        """Early-stop summary; a streamed chunk is counted as one token."""
+        received = self.chunks
+        return {
+            "loop_detected": self.match is not None,
+            "trimmed": self.match is not None,
+            "kind": self.match.kind if self.match else None,
+            "tokens_received": received,
+            "tokens_saved": max(0, self.max_tokens - received) if self.match else 0,
+            "max_tokens": self.max_tokens
+        }
+
+
+def iter_sse_chunks(lines: Iterator[Any]) -> Iterator[Dict[str, Any]]:
+    """Parse ``data: {...}`` lines of an OpenAI-compatible completion stream."""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        try:
+            yield json.loads(data)
+        except json.JSONDecodeError:
+            continue
+
+
+def chunk_content(chunk: Dict[str, Any]) -> str:
+    """Text delta of a chat completion chunk."""
+    return "".join(
+        (choice.get("delta") or {}).get("content") or ""
+        for choice in chunk.get("choices", [])
+    )
+
+
+def stream_chat_completion(
+    url: str,
+    payload: Dict[str, Any],
+    timeout: float = 120,
+    check_every: int = 8,
+    headers: Optional[Dict[str, str]] = None,
+    **detector_kwargs
+) -> Dict[str, Any]:
+    """
+    Run a streaming chat completion and abort it if the output loops.
+
+    Closing the connection makes vLLM abort the request on the server,
+    which frees the decode slot immediately.
+
+    Args:
+        url: Full ``/v1/chat/completions`` URL
+        payload: Request payload (``stream`` is forced on)
+        timeout: Request timeout in seconds
+        check_every: Detector interval in streamed chunks
+        headers: Extra HTTP headers (e.g. ``traceparent``)
+        **detector_kwargs: Overrides for ``find_repetition``
+
+    Returns:
+        Dictionary with ``status_code``, ``text``, ``usage``, the watchdog
+        ``repetition`` report and ``error`` (response body on HTTP errors)
+    """
+    import requests
+
+    payload = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+    watchdog = StreamWatchdog(payload.get("max_tokens", 0), check_every, **detector_kwargs)
+    usage: Dict[str, Any] = {}
+
+    with requests.post(url, json=payload, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code != 200:
+            return {
+                "status_code": response.status_code,
+                "text": "",
+                "usage": usage,
+                "repetition": None,
+                "error": response.text
+            }
+
+        for chunk in iter_sse_chunks(response.iter_lines()):
+            usage = chunk.get("usage") or usage
+            if watchdog.feed(chunk_content(chunk)):
+                logger.warning(f"Repetition loop in stream ({watchdog.match.kind}), aborting request")
+                break
+
+    report = watchdog.report()
+    if report["loop_detected"]:
+        logger.info(f"Stream watchdog saved ~{report['tokens_saved']} of {report['max_tokens']} tokens")
+
+    return {
+        "status_code": 200,
+        "text": watchdog.trimmed_text(),
+        "usage": usage,
+        "repetition": report,
+        "error": None
+    }
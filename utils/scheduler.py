@@ -0,0 +1,569 @@
+"""Priority and deadline-aware scheduling of model execution.
+
+Interactive users, API clients and bulk batch jobs share one GPU. With a
+plain FIFO lock per model, a 1000-page batch queued first delays every
+interactive request behind it. ``FairScheduler`` replaces the lock with
+a per-model queue ordered by start-time fair queuing on two levels:
+
+- between priority classes (interactive, api, batch) by class weight, so
+  interactive work gets most of the model time while batches still
+  progress;
+- between clients of one class (API key, client id or address) by client
+  weight, so one client submitting hundreds of pages does not starve
+  another client of the same class.
+
+Every request carries a ``Ticket`` with its class, client and deadline.
+Tickets whose deadline has passed or which were cancelled (the client
+disconnected) are dropped before they are granted the model, raising
+``DeadlineExceeded`` or ``ClientDisconnected`` in the waiting thread.
+
+The ticket of the current request travels in a context variable, so the
+worker threads started with ``asyncio.to_thread`` (which copy the
+context) schedule under the ticket of the request that started them.
+
+One execution serving several coalesced requests (see
+``utils.singleflight``) runs under a ``SharedTicket``: it is scheduled
+with the class and deadline of its most urgent live request and dropped
+only once all of them are gone.
+
+Usage:
+    scheduler = FairScheduler(scheduler_settings(config))
+    ticket = scheduler.ticket("interactive", client="alice")
+    with scheduled(ticket), scheduler.slot("qwen3_vl_2b"):
+        text = model.extract_text(image)
+"""
+
+import contextvars
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+from utils.metrics import QUEUE_DEPTH, STAGE_SECONDS, registry
+
+# Priority classes, most urgent first
+PRIORITY_CLASSES = ("interactive", "api", "batch")
+
+DEFAULT_SCHEDULER_SETTINGS: Dict[str, Any] = {
+    # Share of model time of each class while several classes wait
+    'weights': {'interactive': 8, 'api': 4, 'batch': 1},
+    # Seconds a request may wait for a model before it is dropped (None: no limit)
+    'deadlines': {'interactive': 60, 'api': 300, 'batch': None},
+    # Weights of individual clients within their class (default 1)
+    'client_weights': {},
+    # Longest deadline a client may request, in seconds
+    'max_deadline': 3600,
+}
+
+SCHEDULER_WAIT = registry.histogram(
+    "chatvlm_scheduler_wait_seconds", "Time requests waited for a model by priority class", ("model", "priority")
+)
+SCHEDULER_DEPTH = registry.gauge(
+    "chatvlm_scheduler_queue_depth", "Requests waiting for a model by priority class", ("model", "priority")
+)
+SCHEDULER_DROPPED = registry.counter(
+    "chatvlm_scheduler_dropped_total", "Requests dropped before reaching a model", ("model", "priority", "reason")
+)
+
+
+def scheduler_settings(config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Scheduler settings from the application config.
+
+    Args:
+        config: Full config (``scheduler`` section)
+
+    Returns:
+        Settings with defaults applied (per-class tables are merged key by key)
+    """
+    section = (config or {}).get('scheduler') or {}
+    settings = {**DEFAULT_SCHEDULER_SETTINGS, **section}
+    for key in ('weights', 'deadlines'):
+        settings[key] = {**DEFAULT_SCHEDULER_SETTINGS[key], **(section.get(key) or {})}
+    return settings
+
+
+class RequestDropped(Exception):
+    """A request was removed from the queue before it reached the model."""
+
+    reason = "dropped"
+
+    def __init__(self, message: str, priority: str = "api"):
+        super().__init__(message)
+        self.priority = priority
+
+
+class DeadlineExceeded(RequestDropped):
+    """The request's deadline passed while it was waiting."""
+
+    reason = "deadline"
+
+
+class ClientDisconnected(RequestDropped):
+    """The client went away while the request was waiting."""
+
+    reason = "disconnected"
+
+
+class Ticket:
+    """
+    Scheduling identity of one request.
+
+    A ticket may cover several model calls (pages of a batch, cascade
+    tiers); cancelling it drops all of them that have not started yet.
+    """
+
+    def __init__(self, priority: str = "api", client: str = "local", timeout: Optional[float] = None):
+        """
+        Args:
+            priority: Priority class (one of ``PRIORITY_CLASSES``)
+            client: Client identity for fair queuing within the class
+            timeout: Seconds from now until the deadline (None: no deadline)
+        """
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority class: {priority} (expected one of {', '.join(PRIORITY_CLASSES)})")
+        self.priority = priority
+        self.client = client
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self._cancelled = threading.Event()
+        self._conditions: Set[threading.Condition] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def remaining(self) -> Optional[float]:
+        """Seconds until the deadline (None without a deadline)."""
+        return max(0.0, self.deadline - time.monotonic()) if self.deadline is not None else None
+
+    def drop_reason(self) -> Optional[str]:
+        """Why the ticket may no longer be granted a model (None while it may)."""
+        if self.cancelled:
+            return ClientDisconnected.reason
+        if self.expired():
+            return DeadlineExceeded.reason
+        return None
+
+    def cancel(self) -> None:
+        """Cancel the ticket and wake the queues it is waiting in."""
+        self._cancelled.set()
+        with self._lock:
+            conditions = list(self._conditions)
+        for condition in conditions:
+            with condition:
+                condition.notify_all()
+
+    def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Call ``fn`` with this ticket as the current ticket (for worker threads)."""
+        with scheduled(self):
+            return fn(*args, **kwargs)
+
+    def _watch(self, condition: threading.Condition) -> None:
+        with self._lock:
+            self._conditions.add(condition)
+
+    def _unwatch(self, condition: threading.Condition) -> None:
+        with self._lock:
+            self._conditions.discard(condition)
+
+
+class SharedTicket(Ticket):
+    """
+    Ticket of one execution shared by several requests.
+
+    The execution is scheduled in the most urgent class of the requests
+    still waiting for it, ordered by their earliest deadline, and is
+    dropped only when every request has been cancelled or has expired;
+    a request that joins later may move it to a more urgent class.
+    """
+
+    def __init__(self, tickets: Tuple[Ticket, ...] = ()):
+        """
+        Args:
+            tickets: Tickets of the requests waiting for the execution
+        """
+        self._members: List[Ticket] = []
+        self._cancelled = threading.Event()
+        self._conditions: Set[threading.Condition] = set()
+        self._lock = threading.Lock()
+        for ticket in tickets:
+            self.add(ticket)
+
+    def add(self, ticket: Ticket) -> None:
+        """Attach a request; queues the execution waits in are woken to re-rank it."""
+        with self._lock:
+            self._members.append(ticket)
+            conditions = list(self._conditions)
+        for condition in conditions:
+            ticket._watch(condition)
+            with condition:
+                condition.notify_all()
+
+    def _live(self) -> List[Ticket]:
+        with self._lock:
+            members = list(self._members)
+        return [ticket for ticket in members if ticket.drop_reason() is None] or members
+
+    def _lead(self) -> Ticket:
+        """Most urgent live request: class first, then earliest deadline."""
+        return min(self._live(), key=lambda t: (
+            PRIORITY_CLASSES.index(t.priority), t.deadline if t.deadline is not None else math.inf
+        ))
+
+    @property
+    def priority(self) -> str:
+        return self._lead().priority if self._members else "api"
+
+    @property
+    def client(self) -> str:
+        return self._lead().client if self._members else "local"
+
+    @property
+    def deadline(self) -> Optional[float]:
+        """Earliest deadline of the live requests (orders the execution in its class)."""
+        deadlines = [t.deadline for t in self._live() if t.deadline is not None]
+        return min(deadlines) if deadlines else None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.drop_reason() is not None
+
+    def expired(self) -> bool:
+        return self.drop_reason() == DeadlineExceeded.reason
+
+    def remaining(self) -> Optional[float]:
+        """Seconds until the last request expires (None if one has no deadline)."""
+        with self._lock:
+            members = list(self._members)
+        if not members or any(t.deadline is None for t in members):
+            return None
+        return max(t.remaining() for t in members)
+
+    def drop_reason(self) -> Optional[str]:
+        """None while any request still waits; otherwise ``deadline`` if one expired."""
+        if self._cancelled.is_set():
+            return ClientDisconnected.reason
+        with self._lock:
+            members = list(self._members)
+        reasons = [ticket.drop_reason() for ticket in members]
+        if not members or not all(reasons):
+            return None
+        return DeadlineExceeded.reason if DeadlineExceeded.reason in reasons else ClientDisconnected.reason
+
+    def _watch(self, condition: threading.Condition) -> None:
+        # Cancelling any request wakes the queue, which re-checks the group
+        with self._lock:
+            self._conditions.add(condition)
+            members = list(self._members)
+        for ticket in members:
+            ticket._watch(condition)
+
+    def _unwatch(self, condition: threading.Condition) -> None:
+        with self._lock:
+            self._conditions.discard(condition)
+            members = list(self._members)
+        for ticket in members:
+            ticket._unwatch(condition)
+
+
+_current_ticket: contextvars.ContextVar = contextvars.ContextVar("scheduler_ticket", default=None)
+
+
+def current_ticket() -> Optional[Ticket]:
+    """Ticket of the request being handled in this context (None outside requests)."""
+    return _current_ticket.get()
+
+
+@contextmanager
+def scheduled(ticket: Ticket) -> Iterator[Ticket]:
+    """Make ``ticket`` the current ticket within the block."""
+    token = _current_ticket.set(ticket)
+    try:
+        yield ticket
+    finally:
+        _current_ticket.reset(token)
+
+
+class _Waiter:
+    """One queued model call."""
+
+    __slots__ = ("ticket", "priority", "cost", "seq", "tag", "enqueued", "granted", "dropped")
+
+    def __init__(self, ticket: Ticket, cost: float, seq: int, tag: float):
+        self.ticket = ticket
+        # Class the call is queued in (a shared ticket's class may change)
+        self.priority = ticket.priority
+        self.cost = cost
+        self.seq = seq
+        self.tag = tag
+        self.enqueued = time.perf_counter()
+        self.granted = False
+        self.dropped: Optional[str] = None
+
+    def order(self) -> Tuple[float, float, int]:
+        """Dispatch order within a class: client tag, then earliest deadline, then arrival."""
+        deadline = self.ticket.deadline if self.ticket.deadline is not None else math.inf
+        return self.tag, deadline, self.seq
+
+
+class _ModelQueue:
+    """
+    Queue of one model: two-level start-time fair queuing.
+
+    A call of cost ``c`` arriving in class ``p`` gets the class start tag
+    ``max(V, F_p)`` and advances ``F_p`` by ``c / weight_p``; the class
+    whose oldest start tag is smallest is served next and ``V`` moves to
+    that tag. Within the class the same rule over client tags picks the
+    call. Tags restart from zero whenever the queue drains.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.condition = threading.Condition()
+        self.busy = False
+        self.waiters: List[_Waiter] = []
+        self._seq = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        self.vtime = 0.0
+        self.class_finish: Dict[str, float] = {}
+        # Start tags of the waiting calls of each class, in arrival order
+        self.class_tags: Dict[str, Deque[float]] = {p: deque() for p in PRIORITY_CLASSES}
+        self.client_vtime: Dict[str, float] = {p: 0.0 for p in PRIORITY_CLASSES}
+        self.client_finish: Dict[Tuple[str, str], float] = {}
+
+    def enqueue(self, ticket: Ticket, cost: float, class_weight: float, client_weight: float) -> _Waiter:
+        priority = ticket.priority
+        start = max(self.vtime, self.class_finish.get(priority, 0.0))
+        self.class_finish[priority] = start + cost / class_weight
+        self.class_tags[priority].append(start)
+
+        flow = (priority, ticket.client)
+        client_start = max(self.client_vtime[priority], self.client_finish.get(flow, 0.0))
+        self.client_finish[flow] = client_start + cost / client_weight
+
+        self._seq += 1
+        waiter = _Waiter(ticket, cost, self._seq, client_start)
+        self.waiters.append(waiter)
+        return waiter
+
+    def remove(self, waiter: _Waiter) -> None:
+        """Take a waiter out of the queue (its class gives up one tag)."""
+        self.waiters.remove(waiter)
+        self.class_tags[waiter.priority].pop()
+        if not self.waiters:
+            self._reset()
+
+    def discard(self, waiter: _Waiter, reason: str) -> None:
+        """Remove a waiter that will not be served."""
+        self.remove(waiter)
+        waiter.dropped = reason
+
+    def dispatch(self) -> Optional[_Waiter]:
+        """Grant the model to the next live waiter (dead waiters are dropped first)."""
+        for waiter in list(self.waiters):
+            reason = waiter.ticket.drop_reason()
+            if reason:
+                self.discard(waiter, reason)
+        if not self.waiters:
+            return None
+
+        waiting = {waiter.priority for waiter in self.waiters}
+        priority = min(waiting, key=lambda p: (self.class_tags[p][0], PRIORITY_CLASSES.index(p)))
+        self.vtime = max(self.vtime, self.class_tags[priority].popleft())
+
+        waiter = min((w for w in self.waiters if w.priority == priority), key=_Waiter.order)
+        self.client_vtime[priority] = max(self.client_vtime[priority], waiter.tag)
+        self.waiters.remove(waiter)
+        waiter.granted = True
+        self.busy = True
+        if not self.waiters:
+            self._reset()
+        return waiter
+
+
+class FairScheduler:
+    """
+    Per-model execution slots shared fairly between priority classes and clients.
+
+    Each model runs one call at a time (like the per-model lock it
+    replaces); ``slot`` waits for the model in scheduling order.
+    """
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            settings: Scheduler settings (see ``DEFAULT_SCHEDULER_SETTINGS``)
+        """
+        self.settings = scheduler_settings({'scheduler': settings})
+        self._queues: Dict[str, _ModelQueue] = {}
+        self._guard = threading.Lock()
+        self._stats = {
+            p: {"granted": 0, "wait_seconds": 0.0, "dropped": {DeadlineExceeded.reason: 0,
+                                                               ClientDisconnected.reason: 0}}
+            for p in PRIORITY_CLASSES
+        }
+        self._stats_lock = threading.Lock()
+
+    def ticket(self, priority: str = "api", client: str = "local", timeout: Optional[float] = None) -> Ticket:
+        """
+        Ticket with the class default deadline.
+
+        Args:
+            priority: Priority class
+            client: Client identity
+            timeout: Requested deadline in seconds (capped at ``max_deadline``;
+                default: the deadline of the class)
+        """
+        if timeout is None:
+            timeout = self.settings['deadlines'].get(priority)
+        max_deadline = self.settings.get('max_deadline')
+        if timeout is not None and max_deadline:
+            timeout = min(timeout, max_deadline)
+        return Ticket(priority, client, timeout)
+
+    def _queue(self, model: str) -> _ModelQueue:
+        with self._guard:
+            if model not in self._queues:
+                self._queues[model] = _ModelQueue(model)
+            return self._queues[model]
+
+    def acquire(self, model: str, ticket: Optional[Ticket] = None, cost: float = 1.0) -> float:
+        """
+        Wait until ``model`` is granted to the ticket.
+
+        Args:
+            model: Model name
+            ticket: Request ticket (default: the current ticket, or an
+                ``api`` ticket of a local caller)
+            cost: Relative amount of work (e.g. pages in the call)
+
+        Returns:
+            Seconds spent waiting
+
+        Raises:
+            DeadlineExceeded: The deadline passed before the model was granted
+            ClientDisconnected: The ticket was cancelled before the model was granted
+        """
+        ticket = ticket or current_ticket() or self.ticket()
+        queue = self._queue(model)
+        cost = max(float(cost), 1e-6)
+
+        with queue.condition:
+            reason = ticket.drop_reason()
+            if reason:
+                self._dropped(model, ticket, reason)
+            if not queue.busy and not queue.waiters:
+                queue.busy = True
+                self._granted(model, ticket, 0.0)
+                return 0.0
+
+            waiter = self._enqueue(queue, ticket, cost)
+            enqueued = waiter.enqueued
+            depth = SCHEDULER_DEPTH.labels(model, waiter.priority)
+            model_depth = QUEUE_DEPTH.labels(model)
+            depth.inc()
+            model_depth.inc()
+            ticket._watch(queue.condition)
+            try:
+                while not waiter.granted and waiter.dropped is None:
+                    reason = ticket.drop_reason()
+                    if reason:
+                        queue.discard(waiter, reason)
+                        break
+                    if ticket.priority != waiter.priority:
+                        # A more urgent request joined the shared ticket: queue in its class
+                        queue.remove(waiter)
+                        depth.dec()
+                        waiter = self._enqueue(queue, ticket, cost)
+                        waiter.enqueued = enqueued
+                        depth = SCHEDULER_DEPTH.labels(model, waiter.priority)
+                        depth.inc()
+                    queue.condition.wait(self._wake_after(ticket))
+            finally:
+                ticket._unwatch(queue.condition)
+                depth.dec()
+                model_depth.dec()
+
+            if waiter.dropped is not None:
+                self._dropped(model, ticket, waiter.dropped)
+            waited = time.perf_counter() - waiter.enqueued
+            self._granted(model, ticket, waited)
+            return waited
+
+    def _enqueue(self, queue: _ModelQueue, ticket: Ticket, cost: float) -> _Waiter:
+        return queue.enqueue(
+            ticket, cost,
+            float(self.settings['weights'].get(ticket.priority, 1)),
+            float(self.settings['client_weights'].get(ticket.client, 1))
+        )
+
+    @staticmethod
+    def _wake_after(ticket: Ticket) -> Optional[float]:
+        """Seconds until the ticket must be re-checked (its earliest live deadline)."""
+        deadline = ticket.deadline
+        return max(0.0, deadline - time.monotonic()) if deadline is not None else None
+
+    def release(self, model: str) -> None:
+        """Finish the running call of ``model`` and grant the next waiter."""
+        queue = self._queue(model)
+        with queue.condition:
+            queue.busy = False
+            queue.dispatch()
+            queue.condition.notify_all()
+
+    @contextmanager
+    def slot(self, model: str, ticket: Optional[Ticket] = None, cost: float = 1.0) -> Iterator[None]:
+        """Hold ``model`` for the duration of the block (see ``acquire``)."""
+        self.acquire(model, ticket, cost)
+        try:
+            yield
+        finally:
+            self.release(model)
+
+    def _granted(self, model: str, ticket: Ticket, waited: float) -> None:
+        SCHEDULER_WAIT.labels(model, ticket.priority).observe(waited)
+        STAGE_SECONDS.labels("queue_wait", model).observe(waited)
+        with self._stats_lock:
+            stats = self._stats[ticket.priority]
+            stats["granted"] += 1
+            stats["wait_seconds"] += waited
+
+    def _dropped(self, model: str, ticket: Ticket, reason: str) -> None:
+        SCHEDULER_DROPPED.labels(model, ticket.priority, reason).inc()
+        with self._stats_lock:
+            self._stats[ticket.priority]["dropped"][reason] += 1
+        if reason == DeadlineExceeded.reason:
+            raise DeadlineExceeded(f"Deadline passed while waiting for {model}", ticket.priority)
+        raise ClientDisconnected(f"Client disconnected while waiting for {model}", ticket.priority)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Granted and dropped calls, mean wait per class and current queues per model."""
+        with self._stats_lock:
+            classes = {
+                p: {
+                    "granted": stats["granted"],
+                    "dropped": dict(stats["dropped"]),
+                    "avg_wait_seconds": round(stats["wait_seconds"] / stats["granted"], 4) if stats["granted"] else 0.0,
+                    "weight": self.settings['weights'].get(p, 1),
+                    "deadline": self.settings['deadlines'].get(p),
+                }
+                for p, stats in self._stats.items()
+            }
+        with self._guard:
+            queues = list(self._queues.values())
+        models = {}
+        for queue in queues:
+            with queue.condition:
+                waiting = {p: 0 for p in PRIORITY_CLASSES}
+                for waiter in queue.waiters:
+                    waiting[waiter.priority] += 1
+                models[queue.model] = {"busy": queue.busy, "waiting": waiting}
+        return {"classes": classes, "models": models}
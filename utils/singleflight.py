@@ -0,0 +1,186 @@
+"""In-flight coalescing of identical model requests (single-flight).
+
+A result cache only helps once the first request has finished. When a
+batch contains duplicate pages, or several users upload the same template
+at once, identical requests would each run a full generation. The
+single-flight layer keys every request by (input content, model, prompt,
+parameters); while a request with that key is running, later identical
+requests attach to its future and receive the same result (or exception).
+
+Both thread callers (Streamlit sessions, the vLLM adapter) and asyncio
+callers (the FastAPI endpoints) share one in-flight table, so they
+coalesce with each other.
+
+The execution runs under a ``SharedTicket`` of the scheduler tickets of
+all its callers: it is scheduled for the most urgent of them and dropped
+only when all of them have disconnected or expired, so a leader that goes
+away does not take its followers down with it. Callers without a ticket
+(threads outside requests) keep the execution alive.
+
+Usage:
+    flight = SingleFlight()
+    key = request_key(image_bytes, model="qwen3_vl_2b", prompt=prompt, max_tokens=512)
+    result = flight.do(key, lambda: model.chat(image, prompt))
+    result = await flight.do_async(key, lambda: model.chat(image, prompt))
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+from PIL import Image
+
+from utils.scheduler import RequestDropped, SharedTicket, Ticket, current_ticket
+
+
+def content_digest(data: Any) -> str:
+    """
+    Digest of request input content.
+
+    Args:
+        data: Raw bytes, a PIL image, an array with ``tobytes()`` or a string
+
+    Returns:
+        SHA-256 hex digest
+    """
+    digest = hashlib.sha256()
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        digest.update(bytes(data))
+    elif isinstance(data, Image.Image):
+        digest.update(f"{data.mode}:{data.size}".encode())
+        digest.update(data.tobytes())
+    elif hasattr(data, "tobytes"):
+        digest.update(f"{getattr(data, 'dtype', '')}:{getattr(data, 'shape', '')}".encode())
+        digest.update(data.tobytes())
+    else:
+        digest.update(str(data).encode())
+    return digest.hexdigest()
+
+
+def request_key(content: Any, model: str, prompt: Optional[str] = None, **params: Any) -> str:
+    """
+    Key identifying a request for coalescing.
+
+    Args:
+        content: Input content (see ``content_digest``)
+        model: Model name
+        prompt: Prompt text
+        **params: Generation/processing parameters
+
+    Returns:
+        Key string
+    """
+    spec = json.dumps({'model': model, 'prompt': prompt, 'params': params}, sort_keys=True, default=str)
+    return f"{content_digest(content)}:{hashlib.sha256(spec.encode()).hexdigest()[:16]}"
+
+
+class SingleFlight:
+    """Runs one execution per key at a time and shares its result."""
+
+    def __init__(self):
+        self._in_flight: Dict[str, Future] = {}
+        self._waiters: Dict[str, int] = {}
+        self._tickets: Dict[str, SharedTicket] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.max_waiters = 0
+
+    def _join(self, key: str, ticket: Ticket) -> tuple:
+        """Return (future, is_leader) for a key; the caller's ticket joins the execution's."""
+        with self._lock:
+            self.calls += 1
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                self._waiters[key] += 1
+                self.max_waiters = max(self.max_waiters, self._waiters[key])
+                self._tickets[key].add(ticket)
+                return future, False
+
+            future = Future()
+            self._in_flight[key] = future
+            self._waiters[key] = 0
+            self._tickets[key] = SharedTicket((ticket,))
+            self.executions += 1
+            return future, True
+
+    def _release(self, key: str) -> None:
+        with self._lock:
+            self._in_flight.pop(key, None)
+            self._waiters.pop(key, None)
+            self._tickets.pop(key, None)
+
+    def _finish(self, key: str, future: Future, fn: Callable[[], Any]) -> None:
+        """Run ``fn`` as the leader and publish its outcome."""
+        with self._lock:
+            shared = self._tickets[key]
+        try:
+            result = shared.run(fn)
+        except BaseException as e:
+            self._release(key)
+            future.set_exception(e)
+            return
+        self._release(key)
+        future.set_result(result)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        Run ``fn`` or wait for the identical request already running.
+
+        Args:
+            key: Request key
+            fn: Function executing the request
+
+        Returns:
+            The (shared) result
+        """
+        ticket = current_ticket() or Ticket()
+        while True:
+            future, leader = self._join(key, ticket)
+            if leader:
+                self._finish(key, future, fn)
+            try:
+                return future.result()
+            except RequestDropped:
+                # Dropped just before this caller joined: run again for it
+                if leader or ticket.drop_reason() is not None:
+                    raise
+
+    async def do_async(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        Asyncio variant: the leader runs ``fn`` in a worker thread.
+
+        Args:
+            key: Request key
+            fn: Blocking function executing the request
+
+        Returns:
+            The (shared) result
+        """
+        ticket = current_ticket() or Ticket()
+        while True:
+            future, leader = self._join(key, ticket)
+            if leader:
+                await asyncio.to_thread(self._finish, key, future, fn)
+            try:
+                return await asyncio.wrap_future(future)
+            except RequestDropped:
+                if leader or ticket.drop_reason() is not None:
+                    raise
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Coalescing counters."""
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+                'coalesced_rate': round(self.coalesced / self.calls, 3) if self.calls else 0.0,
+                'in_flight': len(self._in_flight),
+                'max_waiters': self.max_waiters,
+            }
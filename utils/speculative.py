@@ -0,0 +1,313 @@
+"""Speculative (assisted) decoding with a small same-tokenizer draft model.
+
+Large VLMs (``qwen3_vl_8b``, ``qwen_vl_7b``) spend most of a hard document
+in decode, one target forward per token. With a draft model from the same
+family (e.g. ``qwen3_vl_2b``) the draft proposes several tokens and the
+target verifies them in a single forward; greedy outputs are unchanged.
+
+Enable it per model in config.yaml::
+
+    speculative:
+      draft_model: qwen3_vl_2b      # registry key, loaded as a dedicated instance
+      num_assistant_tokens: 5
+      schedule: heuristic           # or 'constant'
+
+The draft is a separate instance owned by the target: the shared
+``qwen3_vl_2b`` instance serves its own requests concurrently, and the
+draft's image features and forward counts must not leak between calls.
+
+Acceptance rate and speedup are tracked per document type. The speedup
+baseline comes from single-sequence calls that run without the draft:
+the first and then every ``baseline_every``-th call of a document type.
+
+vLLM containers get the equivalent ``--speculative-config`` option from
+the container command builders.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+import torch
+
+from utils.logger import logger
+
+
+DEFAULT_SPECULATIVE_SETTINGS: Dict[str, Any] = {
+    # Registry key of the draft model (required to enable speculation)
+    'draft_model': None,
+    # Draft tokens proposed per target forward (starting value for 'heuristic')
+    'num_assistant_tokens': 5,
+    # 'heuristic' grows/shrinks the draft length with acceptance, 'constant' keeps it
+    'schedule': 'heuristic',
+    # Stop drafting early when the draft's confidence drops below this
+    'confidence_threshold': 0.4,
+    # Run every N-th eligible call without the draft to measure the baseline (0 = never)
+    'baseline_every': 20,
+}
+
+# Draft image features of the running generate() call; context-local, so
+# concurrent calls never see each other's features
+_draft_encoder_outputs: ContextVar[Optional[Dict[str, Any]]] = ContextVar("draft_encoder_outputs", default=None)
+
+
+def speculative_settings(config: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Speculative decoding settings from a model config.
+
+    Args:
+        config: Model config (``speculative`` key)
+
+    Returns:
+        Settings with defaults applied, or None if no draft model is configured
+    """
+    overrides = (config or {}).get('speculative') or {}
+    if not overrides.get('draft_model'):
+        return None
+    return {**DEFAULT_SPECULATIVE_SETTINGS, **overrides}
+
+
+class SpeculativeStats:
+    """Per-document-type acceptance and speedup counters."""
+
+    def __init__(self):
+        self._types: Dict[str, Dict[str, float]] = {}
+
+    def _entry(self, document_type: str) -> Dict[str, float]:
+        return self._types.setdefault(document_type, {
+            'calls': 0, 'new_tokens': 0, 'target_forwards': 0, 'draft_forwards': 0, 'seconds': 0.0,
+            'baseline_calls': 0, 'baseline_tokens': 0, 'baseline_seconds': 0.0,
+        })
+
+    def record(
+        self,
+        document_type: str,
+        new_tokens: int,
+        target_forwards: int,
+        draft_forwards: int,
+        seconds: float
+    ) -> None:
+        """Record one assisted generate() call."""
+        entry = self._entry(document_type)
+        entry['calls'] += 1
+        entry['new_tokens'] += new_tokens
+        entry['target_forwards'] += target_forwards
+        entry['draft_forwards'] += draft_forwards
+        entry['seconds'] += seconds
+
+    def record_baseline(self, document_type: str, new_tokens: int, seconds: float) -> None:
+        """Record one generate() call that ran without the draft."""
+        entry = self._entry(document_type)
+        entry['baseline_calls'] += 1
+        entry['baseline_tokens'] += new_tokens
+        entry['baseline_seconds'] += seconds
+
+    @staticmethod
+    def summarize(entry: Dict[str, float]) -> Dict[str, Any]:
+        """
+        Derived metrics for one document type.
+
+        Every target forward yields one token of its own plus the accepted
+        draft tokens, and every draft forward proposes one token, so
+        ``accepted = new_tokens - target_forwards``.
+
+        Args:
+            entry: Raw counters
+
+        Returns:
+            Counters plus acceptance_rate, tokens_per_target_forward,
+            tokens_per_second, baseline_tokens_per_second and speedup
+        """
+        accepted = max(0, entry['new_tokens'] - entry['target_forwards'])
+        proposed = entry['draft_forwards']
+        tokens_per_second = entry['new_tokens'] / entry['seconds'] if entry['seconds'] else None
+        baseline = entry['baseline_tokens'] / entry['baseline_seconds'] if entry['baseline_seconds'] else None
+
+        return {
+            **{key: round(value, 3) if isinstance(value, float) else int(value) for key, value in entry.items()},
+            'accepted_tokens': int(accepted),
+            'acceptance_rate': round(min(1.0, accepted / proposed), 3) if proposed else None,
+            'tokens_per_target_forward': (
+                round(entry['new_tokens'] / entry['target_forwards'], 2) if entry['target_forwards'] else None
+            ),
+            'tokens_per_second': round(tokens_per_second, 1) if tokens_per_second else None,
+            'baseline_tokens_per_second': round(baseline, 1) if baseline else None,
+            'speedup': round(tokens_per_second / baseline, 2) if tokens_per_second and baseline else None,
+        }
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        """Metrics per document type."""
+        return {document_type: self.summarize(entry) for document_type, entry in self._types.items()}
+
+
+@contextmanager
+def count_forwards(*modules: torch.nn.Module) -> Iterator[List[int]]:
+    """
+    Count forward calls of each module made by this thread while the context is active.
+
+    Forwards of other threads using the same modules are not counted.
+
+    Yields:
+        List with one counter per module, updated in place
+    """
+    counts = [0] * len(modules)
+    handles = []
+    thread = threading.get_ident()
+    for index, module in enumerate(modules):
+        def hook(*_args, index=index):
+            if threading.get_ident() == thread:
+                counts[index] += 1
+        handles.append(module.register_forward_hook(hook))
+    try:
+        yield counts
+    finally:
+        for handle in handles:
+            handle.remove()
+
+
+class SpeculativeDecoder:
+    """Runs ``generate()`` of a target model with a draft model as assistant."""
+
+    def __init__(
+        self,
+        target: torch.nn.Module,
+        draft: torch.nn.Module,
+        settings: Optional[Dict[str, Any]] = None,
+        name: str = "model"
+    ):
+        """
+        Initialize speculative decoder.
+
+        Args:
+            target: Loaded target model
+            draft: Loaded draft model sharing the target's tokenizer (an instance
+                dedicated to this decoder, not one that serves requests itself)
+            settings: Speculative settings (see ``DEFAULT_SPECULATIVE_SETTINGS``)
+            name: Model name for logs
+        """
+        self.target = target
+        self.draft = draft
+        self.settings = {**DEFAULT_SPECULATIVE_SETTINGS, **(settings or {})}
+        self.name = name
+        self.stats = SpeculativeStats()
+        self._eligible_calls: Dict[str, int] = {}
+
+        generation_config = draft.generation_config
+        generation_config.num_assistant_tokens = self.settings['num_assistant_tokens']
+        generation_config.num_assistant_tokens_schedule = self.settings['schedule']
+        generation_config.assistant_confidence_threshold = self.settings['confidence_threshold']
+
+        self._original_prepare_inputs = draft.prepare_inputs_for_generation
+        self._instance_override = 'prepare_inputs_for_generation' in vars(draft)
+        draft.prepare_inputs_for_generation = self._prepare_draft_inputs
+
+    def detach(self) -> None:
+        """Restore the draft model's input preparation."""
+        if self._instance_override:
+            self.draft.prepare_inputs_for_generation = self._original_prepare_inputs
+        else:
+            del self.draft.prepare_inputs_for_generation
+
+    def _prepare_draft_inputs(self, input_ids, past_key_values=None, is_first_iteration=False, **kwargs):
+        # Transformers runs the assistant's prefill as a continuation and drops
+        # image features there, and passes the target's own features; the draft
+        # needs its own features in the forward that fills its empty cache
+        if past_key_values is None or past_key_values.get_seq_length() == 0:
+            is_first_iteration = True
+            encoder_outputs = _draft_encoder_outputs.get()
+            if encoder_outputs is not None:
+                kwargs['mm_encoder_outputs'] = encoder_outputs
+        return self._original_prepare_inputs(
+            input_ids,
+            past_key_values=past_key_values,
+            is_first_iteration=is_first_iteration,
+            **kwargs
+        )
+
+    def _encode_draft_images(self, inputs: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Run the draft's own vision encoder on the request's pixels."""
+        prepare = getattr(self.draft, '_prepare_multimodal_encoder_kwargs_for_generation', None)
+        pixel_inputs = {
+            key: value for key, value in inputs.items()
+            if key.startswith('pixel_values') or key.endswith('grid_thw')
+        }
+        if prepare is None or not pixel_inputs:
+            return None
+
+        device = next(self.draft.parameters()).device
+        pixel_inputs = {
+            key: value.to(device) if isinstance(value, torch.Tensor) else value
+            for key, value in pixel_inputs.items()
+        }
+        return prepare(pixel_inputs).get('mm_encoder_outputs')
+
+    def should_speculate(self, inputs: Dict[str, Any], document_type: str) -> bool:
+        """
+        Whether a call runs with the draft.
+
+        Assisted generation handles one sequence at a time. The first
+        single call of each document type, and then every
+        ``baseline_every``-th one, runs without the draft to measure the
+        baseline for the speedup.
+
+        Args:
+            inputs: generate() inputs
+            document_type: Document type of the request
+
+        Returns:
+            True to use the draft
+        """
+        if inputs['input_ids'].shape[0] != 1:
+            return False
+
+        calls = self._eligible_calls.get(document_type, 0)
+        self._eligible_calls[document_type] = calls + 1
+
+        every = self.settings['baseline_every']
+        return not every or calls % every != 0
+
+    def generate(self, inputs: Dict[str, Any], document_type: str = "general", **gen_kwargs) -> torch.Tensor:
+        """
+        ``model.generate(**inputs, assistant_model=draft, **gen_kwargs)`` with metrics.
+
+        Args:
+            inputs: Model inputs (batch size 1)
+            document_type: Key the metrics are recorded under
+            **gen_kwargs: generate() parameters
+
+        Returns:
+            Generated ids, as returned by ``generate()``
+        """
+        token = _draft_encoder_outputs.set(self._encode_draft_images(inputs))
+        prompt_length = inputs['input_ids'].shape[1]
+
+        start = time.perf_counter()
+        try:
+            with count_forwards(self.target, self.draft) as counts:
+                output = self.target.generate(**inputs, assistant_model=self.draft, **gen_kwargs)
+        finally:
+            _draft_encoder_outputs.reset(token)
+        elapsed = time.perf_counter() - start
+
+        new_tokens = output.shape[1] - prompt_length
+        self.stats.record(document_type, new_tokens, counts[0], counts[1], elapsed)
+        logger.debug(
+            f"{self.name}: speculative {new_tokens} tokens in {counts[0]} target forwards "
+            f"({counts[1]} draft forwards, {document_type})"
+        )
+        return output
+
+    def record_baseline(self, document_type: str, new_tokens: int, seconds: float) -> None:
+        """Record a call that ran without the draft."""
+        self.stats.record_baseline(document_type, new_tokens, seconds)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Speculative decoding settings and per-document-type metrics."""
+        return {
+            'draft_model': self.settings['draft_model'],
+            'num_assistant_tokens': self.settings['num_assistant_tokens'],
+            'schedule': self.settings['schedule'],
+            'by_document_type': self.stats.to_dict(),
+        }
@@ -0,0 +1,354 @@
+"""Tiled processing for oversized document images.
+
+Large pages (A3 drawings, long receipts) lose small text when they are
+downscaled to a model's input budget. This module splits such pages into
+overlapping tiles that each fit the model's pixel budget at native
+resolution and merges the per-tile outputs back into one result.
+"""
+
+import difflib
+import json
+import math
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+ImageLike = Union[Image.Image, np.ndarray]
+
+
+# Pixel budget per model family (width * height the processor keeps without
+# downscaling). Qwen-VL families derive theirs from ``max_pixels * 28 * 28``.
+MODEL_PIXEL_BUDGETS: Dict[str, int] = {
+    "qwen3_vl": 1280 * 28 * 28,
+    "qwen_vl": 1280 * 28 * 28,
+    "got_ocr": 1024 * 1024,
+    "deepseek_ocr": 1024 * 1024,
+    "phi3_vision": 1344 * 1344,
+    "dots_ocr": 11289600,
+}
+
+DEFAULT_PIXEL_BUDGET = 2048 * 2048
+
+
+@dataclass
+class TilingPolicy:
+    """Tile geometry chosen for one image/model pair."""
+    tile_width: int
+    tile_height: int
+    overlap: int
+    pixel_budget: int
+
+
+@dataclass
+class Tile:
+    """Single tile cut from a page."""
+    image: ImageLike
+    box: Tuple[int, int, int, int]  # (x0, y0, x1, y1) in page coordinates
+    row: int
+    col: int
+
+
+def get_pixel_budget(model_key: Optional[str], model_config: Optional[Dict[str, Any]] = None) -> int:
+    """
+    Resolve the pixel budget for a model.
+
+    Args:
+        model_key: Model identifier (e.g. 'qwen3_vl_2b', 'got_ocr_hf')
+        model_config: Optional model config; ``max_pixels`` overrides the default
+
+    Returns:
+        Maximum number of pixels the model consumes without downscaling
+    """
+    if model_config and model_config.get("max_pixels"):
+        return int(model_config["max_pixels"]) * 28 * 28
+
+    if not model_key:
+        return DEFAULT_PIXEL_BUDGET
+
+    # Longest prefix wins so that 'qwen3_vl' is not shadowed by 'qwen_vl'
+    for family in sorted(MODEL_PIXEL_BUDGETS, key=len, reverse=True):
+        if model_key.startswith(family):
+            return MODEL_PIXEL_BUDGETS[family]
+
+    return DEFAULT_PIXEL_BUDGET
+
+
+def select_tiling_policy(
+    image_size: Tuple[int, int],
+    model_key: Optional[str] = None,
+    model_config: Optional[Dict[str, Any]] = None,
+    min_scale: float = 0.6,
+    overlap_ratio: float = 0.1,
+    min_overlap: int = 64
+) -> Optional[TilingPolicy]:
+    """
+    Decide whether an image should be tiled for a given model.
+
+    Tiling is used only when fitting the whole page into the model's
+    budget would shrink it by more than ``min_scale``; mild downscaling
+    keeps text legible and is cheaper than several generations.
+
+    Args:
+        image_size: (width, height) of the page
+        model_key: Model identifier used to look up the pixel budget
+        model_config: Optional model config with ``max_pixels``
+        min_scale: Smallest acceptable downscale factor before tiling
+        overlap_ratio: Overlap between neighbouring tiles as a tile fraction
+        min_overlap: Minimum overlap in pixels
+
+    Returns:
+        TilingPolicy, or None if the image should be processed whole
+    """
+    width, height = image_size
+    budget = get_pixel_budget(model_key, model_config)
+
+    if width * height <= budget:
+        return None
+
+    scale = math.sqrt(budget / (width * height))
+    if scale >= min_scale:
+        return None
+
+    # Narrow pages (receipts) keep their full width and are cut into strips
+    side = int(math.sqrt(budget))
+    tile_width = min(width, side)
+    tile_height = min(height, budget // tile_width)
+
+    overlap = max(min_overlap, int(min(tile_width, tile_height) * overlap_ratio))
+    overlap = min(overlap, min(tile_width, tile_height) // 2)
+
+    return TilingPolicy(
+        tile_width=tile_width,
+        tile_height=tile_height,
+        overlap=overlap,
+        pixel_budget=budget
+    )
+
+
+def _tile_starts(length: int, tile: int, overlap: int) -> List[int]:
+    """Evenly spaced tile offsets that cover ``length`` with at least ``overlap``."""
+    if tile >= length:
+        return [0]
+
+    count = math.ceil((length - overlap) / (tile - overlap))
+    step = (length - tile) / (count - 1)
+    return [int(round(i * step)) for i in range(count)]
+
+
+def image_size(image: ImageLike) -> Tuple[int, int]:
+    """(width, height) of a PIL Image or HxWxC array."""
+    if isinstance(image, np.ndarray):
+        return (image.shape[1], image.shape[0])
+    return image.size
+
+
+def split_into_tiles(image: ImageLike, policy: TilingPolicy) -> List[Tile]:
+    """
+    Split an image into overlapping tiles in reading order.
+
+    Arrays are sliced without copying; PIL Images are cropped.
+
+    Args:
+        image: Page image (PIL Image or RGB array)
+        policy: Tile geometry from ``select_tiling_policy``
+
+    Returns:
+        List of tiles, row-major (top-to-bottom, left-to-right)
+    """
+    width, height = image_size(image)
+    tiles = []
+
+    for row, y0 in enumerate(_tile_starts(height, policy.tile_height, policy.overlap)):
+        for col, x0 in enumerate(_tile_starts(width, policy.tile_width, policy.overlap)):
+            box = (x0, y0, min(width, x0 + policy.tile_width), min(height, y0 + policy.tile_height))
+            if isinstance(image, np.ndarray):
+                crop = image[box[1]:box[3], box[0]:box[2]]
+            else:
+                crop = image.crop(box)
+            tiles.append(Tile(image=crop, box=box, row=row, col=col))
+
+    return tiles
+
+
+def _lines_match(a: str, b: str, threshold: float = 0.8) -> bool:
+    """Fuzzy line equality tolerant to OCR noise at tile edges."""
+    a, b = a.strip(), b.strip()
+    if not a or not b:
+        return a == b
+    return difflib.SequenceMatcher(None, a, b).ratio() >= threshold
+
+
+def _overlap_length(previous: List[str], current: List[str], max_lines: int) -> int:
+    """Length of the longest suffix of ``previous`` matching a prefix of ``current``."""
+    limit = min(len(previous), len(current), max_lines)
+
+    for size in range(limit, 0, -1):
+        if all(_lines_match(p, c) for p, c in zip(previous[-size:], current[:size])):
+            return size
+
+    return 0
+
+
+def merge_tile_texts(texts: Sequence[str], max_overlap_lines: int = 20) -> str:
+    """
+    Merge plain-text outputs of vertically stacked tiles (or row bands),
+    dropping lines repeated in overlap bands.
+
+    Args:
+        texts: Per-band outputs, top to bottom
+        max_overlap_lines: Upper bound on lines that can be duplicated
+
+    Returns:
+        Merged text
+    """
+    merged: List[str] = []
+
+    for text in texts:
+        lines = [line for line in (text or "").splitlines() if line.strip()]
+        skip = _overlap_length(merged, lines, max_overlap_lines)
+        merged.extend(lines[skip:])
+
+    return "\n".join(merged)
+
+
+def _box_area(box: Sequence[float]) -> float:
+    return max(0.0, box[2] - box[0]) * max(0.0, box[3] - box[1])
+
+
+def _intersection(a: Sequence[float], b: Sequence[float]) -> float:
+    return _box_area((max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])))
+
+
+def merge_tile_layouts(
+    tile_elements: Sequence[Tuple[Tile, List[Dict[str, Any]]]],
+    containment_threshold: float = 0.7,
+    text_threshold: float = 0.8
+) -> List[Dict[str, Any]]:
+    """
+    Merge layout elements (dots.ocr style ``{bbox, category, text}``) from tiles.
+
+    Boxes are shifted into page coordinates. Two elements are considered the
+    same when the smaller box lies mostly inside the larger one and their
+    texts align; the larger (least truncated) element is kept.
+
+    Args:
+        tile_elements: Pairs of (tile, elements with tile-relative bboxes)
+        containment_threshold: Share of the smaller box covered by the larger one
+        text_threshold: Minimum text similarity for a duplicate
+
+    Returns:
+        De-duplicated elements sorted in reading order
+    """
+    elements: List[Dict[str, Any]] = []
+
+    for tile, items in tile_elements:
+        x_off, y_off = tile.box[0], tile.box[1]
+        for item in items:
+            bbox = item.get("bbox")
+            if not bbox or len(bbox) != 4:
+                continue
+            shifted = dict(item)
+            shifted["bbox"] = [bbox[0] + x_off, bbox[1] + y_off, bbox[2] + x_off, bbox[3] + y_off]
+            elements.append(shifted)
+
+    # Largest first, so truncated copies from tile edges get absorbed
+    elements.sort(key=lambda e: _box_area(e["bbox"]), reverse=True)
+    kept: List[Dict[str, Any]] = []
+
+    for element in elements:
+        duplicate = False
+        area = _box_area(element["bbox"])
+        for existing in kept:
+            if existing.get("category") != element.get("category"):
+                continue
+            if area == 0 or _intersection(existing["bbox"], element["bbox"]) / area < containment_threshold:
+                continue
+            text_a = existing.get("text", "") or ""
+            text_b = element.get("text", "") or ""
+            if text_b.strip() in text_a or _lines_match(text_a, text_b, text_threshold):
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(element)
+
+    kept.sort(key=lambda e: (e["bbox"][1], e["bbox"][0]))
+    return kept
+
+
+def _parse_layout(output: Any) -> Optional[List[Dict[str, Any]]]:
+    """Layout elements of a tile output (a list or its JSON), None for plain text."""
+    if isinstance(output, str):
+        try:
+            output = json.loads(output)
+        except ValueError:
+            return None
+    if isinstance(output, list) and all(isinstance(item, dict) for item in output):
+        return output
+    return None
+
+
+def merge_tile_grid(tiles: Sequence[Tile], outputs: Sequence[str]) -> str:
+    """
+    Merge plain-text outputs of a tile grid, column by column.
+
+    Plain-text outputs carry no line positions, so the parts of one page
+    line seen by horizontally adjacent tiles cannot be paired reliably.
+    Each column of tiles is merged top to bottom instead, and the columns
+    are concatenated left to right; ``merge_tile_texts`` drops the lines
+    repeated in both overlaps.
+
+    Args:
+        tiles: Tiles as returned by ``split_into_tiles``
+        outputs: Output of each tile
+
+    Returns:
+        Merged text
+    """
+    columns: Dict[int, List[Tuple[int, str]]] = {}
+    for tile, output in zip(tiles, outputs):
+        columns.setdefault(tile.box[0], []).append((tile.box[1], output))
+
+    return merge_tile_texts([
+        merge_tile_texts([output for _, output in sorted(columns[x0], key=lambda item: item[0])])
+        for x0 in sorted(columns)
+    ])
+
+
+def process_tiled(
+    image: ImageLike,
+    infer_batch: Callable[[List[ImageLike]], List[str]],
+    policy: TilingPolicy,
+    layout: bool = False
+) -> Dict[str, Any]:
+    """
+    Run a batched inference callable over tiles and merge the outputs.
+
+    Args:
+        image: Page image (PIL Image or RGB array)
+        infer_batch: Callable mapping a list of tile images to a list of outputs
+        policy: Tile geometry
+        layout: Outputs are layout elements (dots.ocr JSON with tile-relative
+            bboxes); they are merged with ``merge_tile_layouts`` and returned
+            as JSON. Falls back to text merging if a tile is not valid JSON.
+
+    Returns:
+        Dictionary with merged ``text``, number of ``tiles`` and tile ``grid``
+    """
+    tiles = split_into_tiles(image, policy)
+    outputs = infer_batch([tile.image for tile in tiles])
+
+    elements = [_parse_layout(output) for output in outputs] if layout else []
+    if layout and all(items is not None for items in elements):
+        text = json.dumps(merge_tile_layouts(list(zip(tiles, elements))), ensure_ascii=False)
+    else:
+        text = merge_tile_grid(tiles, outputs)
+
+    return {
+        "text": text,
+        "tiles": len(tiles),
+        "grid": [max(t.row for t in tiles) + 1, max(t.col for t in tiles) + 1],
+        "tile_size": [policy.tile_width, policy.tile_height],
+        "overlap": policy.overlap
+    }
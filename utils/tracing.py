@@ -0,0 +1,568 @@
+"""Lightweight request tracing.
+
+Spans record where the time of one request went: API handling, the
+vLLM adapter (PNG encoding, health probes, container switches), the vLLM
+server and post-processing. The active span lives in a ``contextvars``
+variable, so it follows asyncio tasks and ``asyncio.to_thread`` workers;
+across HTTP it travels as a W3C ``traceparent`` header (vLLM continues the
+trace when started with ``--otlp-traces-endpoint``).
+
+Spans are exported when they end:
+
+- ``TRACING=jsonl``: one JSON object per line in ``TRACE_FILE``
+  (default ``logs/traces.jsonl``),
+- ``TRACING=otlp``: batched OTLP/HTTP JSON posts to
+  ``OTLP_ENDPOINT/v1/traces`` (an OpenTelemetry collector or any stand-in),
+- unset/``off``: tracing is disabled and spans are no-ops.
+
+Usage:
+    with tracer.span("vllm.request", model=model):
+        headers = tracer.inject({})
+        ...
+
+    @tracer.traced("container.switch")
+    def start_single_container(self, model_key): ...
+
+Analysis: ``scripts/trace_report.py`` prints a flame-style breakdown of
+the slowest traces of a JSONL file.
+"""
+
+import functools
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.logger import logger
+
+TRACEPARENT_HEADER = "traceparent"
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str]]:
+    """
+    Parse a W3C ``traceparent`` header.
+
+    Args:
+        header: Header value (``00-<trace id>-<span id>-<flags>``)
+
+    Returns:
+        (trace id, parent span id) or None if absent or malformed
+    """
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2]
+
+
+class Span:
+    """One timed operation of a trace."""
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, parent_id: Optional[str],
+                 attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+        self._token = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def activate(self) -> "Span":
+        """Make this span the parent of spans started in the current context."""
+        self._token = _current_span.set(self)
+        return self
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        """
+        Finish the span and export it (idempotent).
+
+        Args:
+            error: Exception that ended the operation
+        """
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._start
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                # Ended from another context (e.g. a Streamlit rerun)
+                pass
+            self._token = None
+        self.tracer.export(self)
+
+    def __enter__(self) -> "Span":
+        return self.activate()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.end(exc)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "service": self.tracer.service,
+            "start": round(self.start_time, 6),
+            "duration": round(self.duration or 0.0, 6),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """Span used while tracing is disabled."""
+
+    traceparent = None
+    attributes: Dict[str, Any] = {}
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def activate(self) -> "_NoopSpan":
+        return self
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class JsonlExporter:
+    """Appends finished spans to a JSONL file."""
+
+    def __init__(self, path: str = "logs/traces.jsonl"):
+        """
+        Args:
+            path: Output file (created with its directory)
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_payload(spans: List[Dict[str, Any]], service: str) -> Dict[str, Any]:
+    """
+    OTLP/HTTP JSON body for exported spans.
+
+    Args:
+        spans: Span dictionaries (``Span.to_dict``)
+        service: service.name resource attribute
+
+    Returns:
+        ``ExportTraceServiceRequest`` as a dictionary
+    """
+    otlp_spans = []
+    for span in spans:
+        start_ns = int(span["start"] * 1e9)
+        otlp_span = {
+            "traceId": span["trace_id"],
+            "spanId": span["span_id"],
+            "name": span["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int(span["duration"] * 1e9)),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span["attributes"].items()],
+            "status": {"code": 2, "message": span["error"]} if span["error"] else {"code": 1},
+        }
+        if span["parent_id"]:
+            otlp_span["parentSpanId"] = span["parent_id"]
+        otlp_spans.append(otlp_span)
+
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+            "scopeSpans": [{"scope": {"name": "chatvlmllm"}, "spans": otlp_spans}],
+        }]
+    }
+
+
+class OtlpExporter:
+    """Posts spans to an OTLP/HTTP JSON endpoint from a background thread."""
+
+    def __init__(self, endpoint: str = "http://localhost:4318", batch_size: int = 64,
+                 interval: float = 2.0, timeout: float = 5.0):
+        """
+        Args:
+            endpoint: Collector base URL (``/v1/traces`` is appended)
+            batch_size: Spans per request
+            interval: Maximum seconds a span waits in the queue
+            timeout: HTTP timeout
+        """
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        self.dropped = 0
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=10000)
+        self._service = "chatvlmllm"
+        self._thread = threading.Thread(target=self._run, name="otlp-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span) -> None:
+        self._service = span.tracer.service
+        try:
+            self._queue.put_nowait(span.to_dict())
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        import requests
+
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                requests.post(self.url, json=otlp_payload(batch, self._service), timeout=self.timeout)
+            except Exception as e:
+                self.dropped += len(batch)
+                logger.debug(f"OTLP export to {self.url} failed: {e}")
+
+
+def exporter_from_env() -> Optional[Any]:
+    """
+    Exporter selected by ``TRACING`` (off, jsonl, otlp).
+
+    Returns:
+        Exporter or None when tracing is disabled
+    """
+    mode = os.getenv("TRACING", "off").lower()
+    if mode == "jsonl":
+        return JsonlExporter(os.getenv("TRACE_FILE", "logs/traces.jsonl"))
+    if mode == "otlp":
+        return OtlpExporter(os.getenv("OTLP_ENDPOINT", "http://localhost:4318"))
+    if mode not in ("", "off", "0", "false"):
+        logger.warning(f"Unknown TRACING mode '{mode}', tracing disabled")
+    return None
+
+
+class Tracer:
+    """Creates spans and hands finished ones to an exporter."""
+
+    def __init__(self, exporter: Optional[Any] = None, service: str = "chatvlmllm"):
+        """
+        Args:
+            exporter: Object with ``export(span)``; None disables tracing
+            service: Service name recorded on spans
+        """
+        self.exporter = exporter
+        self.service = service
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def start_span(self, name: str, traceparent: Optional[str] = None, root: bool = False,
+                   **attributes: Any) -> Any:
+        """
+        Start a span (not activated; use ``with`` or ``activate()``).
+
+        The parent is the active span, unless ``traceparent`` (an incoming
+        header) is given or ``root`` starts a new trace.
+
+        Args:
+            name: Span name
+            traceparent: Remote parent
+            root: Start a new trace even inside an active span
+            **attributes: Span attributes
+
+        Returns:
+            Span (a no-op span while tracing is disabled)
+        """
+        if self.exporter is None:
+            return NOOP_SPAN
+
+        remote = parse_traceparent(traceparent)
+        parent = None if root else _current_span.get()
+        if remote is not None:
+            trace_id, parent_id = remote
+        elif parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            trace_id, parent_id = secrets.token_hex(16), None
+        return Span(self, name, trace_id, parent_id, attributes)
+
+    def span(self, name: str, **attributes: Any) -> Any:
+        """Child span of the active span, for ``with`` blocks."""
+        return self.start_span(name, **attributes)
+
+    def traced(self, name: Optional[str] = None) -> Callable:
+        """
+        Decorator running a function inside a span.
+
+        Args:
+            name: Span name (default: the function's qualified name)
+        """
+        def decorator(fn: Callable) -> Callable:
+            span_name = name or fn.__qualname__
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if self.exporter is None:
+                    return fn(*args, **kwargs)
+                with self.start_span(span_name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def current_span(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def inject(self, headers: Dict[str, str]) -> Dict[str, str]:
+        """
+        Add the ``traceparent`` of the active span to outgoing HTTP headers.
+
+        Args:
+            headers: Headers to update
+
+        Returns:
+            The same dictionary
+        """
+        span = _current_span.get()
+        if span is not None:
+            headers[TRACEPARENT_HEADER] = span.traceparent
+        return headers
+
+    def export(self, span: Span) -> None:
+        if self.exporter is None:
+            return
+        try:
+            self.exporter.export(span)
+        except Exception as e:
+            logger.debug(f"Span export failed: {e}")
+
+
+tracer = Tracer(exporter_from_env())
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening a root span per HTTP request.
+
+    An incoming ``traceparent`` header continues the caller's trace. The
+    span is renamed to the route template once routing is done.
+    """
+
+    def __init__(self, app: Callable, tracer: Tracer = tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or not self.tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        traceparent = headers.get(TRACEPARENT_HEADER.encode(), b"").decode("latin-1") or None
+        span = self.tracer.start_span(f"{scope['method']} {scope['path']}", traceparent=traceparent,
+                                      root=True, path=scope["path"])
+
+        async def send_with_status(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                span.set_attribute("status", message["status"])
+            await send(message)
+
+        with span:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route = scope.get("route")
+                if route is not None:
+                    span.name = f"{scope['method']} {route.path}"
+                if span.attributes.get("status", 200) >= 500:
+                    span.error = f"HTTP {span.attributes['status']}"
+
+
+# =============================================================================
+# Analysis of exported spans
+# =============================================================================
+
+def load_spans(path: str) -> List[Dict[str, Any]]:
+    """
+    Read spans from a JSONL file (malformed lines are skipped).
+
+    Args:
+        path: JSONL file written by ``JsonlExporter``
+
+    Returns:
+        Span dictionaries
+    """
+    spans = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except ValueError:
+                continue
+    return spans
+
+
+def group_traces(spans: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Spans grouped by trace id."""
+    traces: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for span in spans:
+        traces[span["trace_id"]].append(span)
+    return dict(traces)
+
+
+def trace_roots(spans: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Spans of a trace whose parent is not in the trace."""
+    ids = {span["span_id"] for span in spans}
+    return [span for span in spans if span.get("parent_id") not in ids]
+
+
+def slowest_traces(spans: List[Dict[str, Any]], limit: int = 5,
+                   name: Optional[str] = None) -> List[List[Dict[str, Any]]]:
+    """
+    Traces ordered by the duration of their longest root span.
+
+    Args:
+        spans: All spans
+        limit: Number of traces
+        name: Only traces with a root span of this name (prefix match)
+
+    Returns:
+        Span lists of the slowest traces
+    """
+    ranked = []
+    for trace in group_traces(spans).values():
+        roots = trace_roots(trace)
+        if name is not None:
+            roots = [root for root in roots if root["name"].startswith(name)]
+        if roots:
+            ranked.append((max(root["duration"] for root in roots), trace))
+    ranked.sort(key=lambda item: item[0], reverse=True)
+    return [trace for _, trace in ranked[:limit]]
+
+
+def format_trace(spans: List[Dict[str, Any]], width: int = 40) -> str:
+    """
+    Flame-style text breakdown of one trace.
+
+    Each span gets a bar positioned on the trace timeline, its total and
+    self time (total minus children).
+
+    Args:
+        spans: Spans of one trace
+        width: Bar width in characters
+
+    Returns:
+        Multi-line string
+    """
+    children: Dict[Optional[str], List[Dict[str, Any]]] = defaultdict(list)
+    for span in spans:
+        children[span.get("parent_id")].append(span)
+    for group in children.values():
+        group.sort(key=lambda span: span["start"])
+
+    start = min(span["start"] for span in spans)
+    end = max(span["start"] + span["duration"] for span in spans)
+    total = max(end - start, 1e-9)
+
+    roots = sorted(trace_roots(spans), key=lambda span: span["start"])
+    lines = [f"trace {spans[0]['trace_id']}  {total * 1000:.1f} ms"]
+
+    def walk(span: Dict[str, Any], depth: int) -> None:
+        offset = int((span["start"] - start) / total * width)
+        length = max(1, int(round(span["duration"] / total * width)))
+        bar = " " * offset + "█" * min(length, width - offset)
+        nested = children.get(span["span_id"], [])
+        self_time = span["duration"] - sum(child["duration"] for child in nested)
+        label = "  " * depth + span["name"]
+        if span.get("error"):
+            label += " [error]"
+        lines.append(
+            f"  {bar:<{width}}  {span['duration'] * 1000:9.1f} ms  self {max(self_time, 0) * 1000:8.1f} ms  {label}"
+        )
+        for child in nested:
+            walk(child, depth + 1)
+
+    for root in roots:
+        walk(root, 0)
+    return "\n".join(lines)
+
+
+def stage_totals(traces: List[List[Dict[str, Any]]]) -> List[Tuple[str, float]]:
+    """
+    Self time per span name summed over traces (where the time went).
+
+    Args:
+        traces: Span lists
+
+    Returns:
+        (span name, seconds) sorted by time
+    """
+    totals: Dict[str, float] = defaultdict(float)
+    for spans in traces:
+        child_time: Dict[str, float] = defaultdict(float)
+        for span in spans:
+            if span.get("parent_id"):
+                child_time[span["parent_id"]] += span["duration"]
+        for span in spans:
+            totals[span["name"]] += max(span["duration"] - child_time[span["span_id"]], 0.0)
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
@@ -1,8 +1,6 @@
 """Input validation utilities."""
 
 from typing import Optional, Tuple
-from PIL import Image
-import io
 
 
 class ValidationError(Exception):
@@ -30,26 +28,23 @@ def validate_image(
     if len(image_bytes) > max_size:
         return False, f"Image size exceeds maximum ({max_size / 1024 / 1024:.1f}MB)"
     
+    from .ingest import sniff_image_header
+    
     try:
-        # Try to open image
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        # Check format
-        if image.format not in allowed_formats:
-            return False, f"Image format '{image.format}' not supported. Allowed: {', '.join(allowed_formats)}"
-        
-        # Check dimensions
-        width, height = image.size
-        if width < 10 or height < 10:
-            return False, "Image dimensions too small (minimum 10x10 pixels)"
-        
-        if width > 10000 or height > 10000:
-            return False, "Image dimensions too large (maximum 10000x10000 pixels)"
-        
-        return True, None
-        
-    except Exception as e:
-        return False, f"Invalid image file: {str(e)}"
+        # Read format and size from the header only, without decoding pixels
+        header = sniff_image_header(image_bytes, allowed_formats=allowed_formats, max_megapixels=100)
+    except ValidationError as e:
+        return False, str(e)
+    
+    # Check dimensions
+    width, height = header.size
+    if width < 10 or height < 10:
+        return False, "Image dimensions too small (minimum 10x10 pixels)"
+    
+    if width > 10000 or height > 10000:
+        return False, "Image dimensions too large (maximum 10000x10000 pixels)"
+    
+    return True, None
 
 
 def validate_model_key(model_key: str, available_models: list) -> Tuple[bool, Optional[str]]:
@@ -0,0 +1,237 @@
+"""Cache for image preprocessing and vision-encoder outputs.
+
+Several prompts are often run against the same image (official prompts,
+benchmark prompt sets, chat turns). Each call normally re-runs the image
+processor and the whole vision tower. This module provides:
+
+- ``image_cache_key``: a stable key from image content and processor config;
+- ``TensorLRUCache``: a bounded two-tier LRU that keeps the most recent
+  entries on the accelerator and spills older ones to CPU memory;
+- ``install_vision_cache``: a wrapper for Qwen-style vision towers
+  (``forward(pixel_values, grid_thw)``) that serves per-image outputs from
+  the cache and only encodes images it has not seen.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Sequence
+
+import numpy as np
+import torch
+from PIL import Image
+
+from utils.logger import logger
+
+
+def image_cache_key(image: Any, processor_config: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Build a cache key from image pixels and processor settings.
+
+    Args:
+        image: PIL Image, RGB array or image URL/path
+        processor_config: Settings that change preprocessing output
+
+    Returns:
+        Hex digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+
+    if isinstance(image, Image.Image):
+        digest.update(f"{image.mode}:{image.size}".encode())
+        digest.update(image.tobytes())
+    elif isinstance(image, np.ndarray):
+        digest.update(f"{image.dtype}:{image.shape}".encode())
+        digest.update(np.ascontiguousarray(image).data)
+    else:
+        digest.update(str(image).encode())
+
+    if processor_config:
+        digest.update(json.dumps(processor_config, sort_keys=True, default=str).encode())
+
+    return digest.hexdigest()
+
+
+def move_to_device(value: Any, device: Any) -> Any:
+    """Recursively move tensors in tuples, lists and dict-like outputs."""
+    if isinstance(value, torch.Tensor):
+        return value.to(device, non_blocking=True)
+    if isinstance(value, dict):
+        moved = type(value)(**{k: move_to_device(v, device) for k, v in value.items()})
+        return moved
+    if isinstance(value, (list, tuple)):
+        return type(value)(move_to_device(v, device) for v in value)
+    return value
+
+
+def concat_outputs(outputs: Sequence[Any]) -> Any:
+    """
+    Concatenate per-image vision outputs along the token dimension.
+
+    Qwen-style towers return tensors (or tuples/lists/ModelOutputs of
+    tensors) whose first dimension is the concatenation of all images'
+    tokens, so per-image results can be joined element-wise. Containers
+    are always rebuilt: callers such as ``get_image_features`` assign to
+    fields of the returned output and must not mutate cached entries.
+    """
+    first = outputs[0]
+    if isinstance(first, torch.Tensor):
+        return first if len(outputs) == 1 else torch.cat(list(outputs), dim=0)
+    if isinstance(first, dict):
+        return type(first)(**{k: concat_outputs([o[k] for o in outputs]) for k in first.keys()})
+    if isinstance(first, (list, tuple)):
+        return type(first)(concat_outputs(items) for items in zip(*outputs))
+    return first
+
+
+class TensorLRUCache:
+    """Bounded LRU for tensors with a device tier and a CPU spill tier."""
+
+    def __init__(self, max_entries: int = 64, max_device_entries: int = 8):
+        """
+        Initialize cache.
+
+        Args:
+            max_entries: Total entries kept (device + CPU)
+            max_device_entries: Most recent entries kept on the accelerator
+        """
+        self.max_entries = max_entries
+        self.max_device_entries = max_device_entries
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._on_device: Dict[Hashable, bool] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, device: Any = None) -> Optional[Any]:
+        """Return cached value (moved to ``device``) or None."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            value = self._entries[key]
+
+        if device is not None and not self._on_device.get(key, False):
+            value = move_to_device(value, device)
+            self.put(key, value, on_device=True)
+        return value
+
+    def put(self, key: Hashable, value: Any, on_device: bool = True) -> None:
+        """Insert value, spilling and evicting the least recently used entries."""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._on_device[key] = on_device
+
+            device_keys = [k for k in self._entries if self._on_device.get(k)]
+            overflow = len(device_keys) - self.max_device_entries
+            for stale in device_keys[:max(0, overflow)]:
+                self._entries[stale] = move_to_device(self._entries[stale], "cpu")
+                self._on_device[stale] = False
+
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._on_device.pop(evicted, None)
+
+    def clear(self) -> None:
+        """Drop all entries."""
+        with self._lock:
+            self._entries.clear()
+            self._on_device.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and occupancy."""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "device_entries": sum(1 for v in self._on_device.values() if v),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0
+        }
+
+
+class VisionCacheContext:
+    """Per-thread list of image keys for the images in the current call."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def keys(self) -> Optional[List[str]]:
+        return getattr(self._local, "keys", None)
+
+    @contextmanager
+    def activate(self, keys: Sequence[str]) -> Iterator[None]:
+        """Make ``keys`` (one per image, in batch order) visible to the tower."""
+        previous = self.keys
+        self._local.keys = list(keys)
+        try:
+            yield
+        finally:
+            self._local.keys = previous
+
+
+def install_vision_cache(
+    tower: torch.nn.Module,
+    cache: TensorLRUCache,
+    context: VisionCacheContext
+) -> Callable:
+    """
+    Wrap a vision tower's forward with a per-image output cache.
+
+    The tower must accept ``(pixel_values, grid_thw)`` where pixel_values
+    holds the flattened patches of all images in order and grid_thw has
+    one (t, h, w) row per image. Calls made outside
+    ``context.activate(...)`` are passed through unchanged.
+
+    Args:
+        tower: Vision tower module (e.g. ``model.visual``)
+        cache: Cache for per-image outputs
+        context: Context that supplies the image keys for the current call
+
+    Returns:
+        The original forward, for uninstalling
+    """
+    original_forward = tower.forward
+
+    def cached_forward(pixel_values, grid_thw=None, *args, **kwargs):
+        keys = context.keys
+        if grid_thw is None:
+            grid_thw = kwargs.pop("image_grid_thw", None)
+        if not keys or grid_thw is None or len(keys) != grid_thw.shape[0]:
+            return original_forward(pixel_values, grid_thw, *args, **kwargs)
+
+        patch_counts = grid_thw.prod(-1).tolist()
+        outputs = []
+        computed: Dict[str, Any] = {}
+        offset = 0
+
+        for index, (key, count) in enumerate(zip(keys, patch_counts)):
+            output = computed.get(key)
+            if output is None:
+                output = cache.get(key, device=pixel_values.device)
+            if output is None:
+                output = original_forward(
+                    pixel_values[offset:offset + count],
+                    grid_thw[index:index + 1],
+                    *args,
+                    **kwargs
+                )
+                cache.put(key, output)
+            computed[key] = output
+            outputs.append(output)
+            offset += count
+
+        return concat_outputs(outputs)
+
+    tower.forward = cached_forward
+    logger.info(f"Vision encoder cache installed on {type(tower).__name__}")
+    return original_forward
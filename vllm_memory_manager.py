@@ -12,9 +12,13 @@ import subprocess
 from typing import Dict, List, Optional, Tuple
 import streamlit as st
 
+from utils.container_registry import get_container_registry
+
 class VLLMMemoryManager:
     def __init__(self):
         self.client = docker.from_env()
+        # Состояние контейнеров из потока событий Docker (без опроса API)
+        self.registry = get_container_registry()
         
         # Конфигурация контейнеров и их потребления памяти
         self.containers_config = {
@@ -49,29 +53,21 @@ class VLLMMemoryManager:
     
     def get_container_status(self, container_name: str) -> Dict:
         """Получение статуса контейнера"""
-        try:
-            container = self.client.containers.get(container_name)
-            return {
-                "exists": True,
-                "running": container.status == "running",
-                "status": container.status,
-                "health": getattr(container.attrs.get("State", {}), "Health", {}).get("Status", "unknown")
-            }
-        except docker.errors.NotFound:
+        state = self.registry.get(container_name)
+        if state is None:
             return {
                 "exists": False,
                 "running": False,
                 "status": "not_found",
                 "health": "unknown"
             }
-        except Exception as e:
-            return {
-                "exists": False,
-                "running": False,
-                "status": "error",
-                "health": "unknown",
-                "error": str(e)
-            }
+        
+        return {
+            "exists": True,
+            "running": state.running,
+            "status": state.status,
+            "health": state.health
+        }
     
     def check_container_health(self, port: int) -> bool:
         """Проверка здоровья контейнера через API"""
@@ -86,7 +82,10 @@ class VLLMMemoryManager:
         running = []
         for name, config in self.containers_config.items():
             status = self.get_container_status(config["container_name"])
-            if status["running"] and self.check_container_health(config["port"]):
+            if not status["running"]:
+                continue
+            # Healthcheck из docker-compose приходит событием; без него - запрос к API
+            if status["health"] == "healthy" or (status["health"] == "none" and self.check_container_health(config["port"])):
                 running.append(name)
         return running
     
@@ -118,16 +117,13 @@ class VLLMMemoryManager:
             ], capture_output=True, text=True, timeout=60)
             
             if result.returncode == 0:
-                # Ждем готовности контейнера
-                max_wait = 120  # 2 минуты
-                start_time = time.time()
-                
-                while time.time() - start_time < max_wait:
-                    if self.check_container_health(config["port"]):
-                        return True
-                    time.sleep(5)
-                
-                return False
+                # Ждем готовности контейнера (события health_status/die вместо опроса)
+                ready, _ = self.registry.wait_until_ready(
+                    config["container_name"],
+                    timeout=120,  # 2 минуты
+                    probe=lambda _: self.check_container_health(config["port"])
+                )
+                return ready
             else:
                 print(f"Ошибка запуска {container_name}: {result.stderr}")
                 return False
@@ -150,7 +146,10 @@ class VLLMMemoryManager:
                 "stop", config["compose_service"]
             ], capture_output=True, text=True, timeout=30)
             
-            return result.returncode == 0
+            if result.returncode != 0:
+                return False
+            # Память освобождается, когда контейнер завершился
+            return self.registry.wait_until_gone(config["container_name"], timeout=30)
             
         except Exception as e:
             print(f"Ошибка остановки {container_name}: {e}")
@@ -210,7 +209,6 @@ class VLLMMemoryManager:
             for container in containers_to_stop:
                 if self.stop_container(container):
                     stopped_containers.append(container)
-                    time.sleep(2)  # Небольшая пауза между остановками
             
             # Запускаем целевой контейнер
             success = self.start_container(target_container)
@@ -274,7 +272,6 @@ class VLLMMemoryManager:
             if self.stop_container(container):
                 stopped_containers.append(container)
                 current_memory -= self.containers_config[container]["estimated_memory_gb"]
-                time.sleep(2)
         
         if stopped_containers:
             stopped_models = [self.containers_config[c]["model"].split("/")[-1] for c in stopped_containers]
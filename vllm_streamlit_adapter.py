@@ -13,6 +13,14 @@ from PIL import Image
 import io
 from typing import Optional, Dict, Any, List
 from single_container_manager import SingleContainerManager
+from utils.repetition_guard import stream_chat_completion
+from utils.layout_decoding import LAYOUT_JSON_SCHEMA, finalize_layout_json, is_layout_prompt
+from utils.singleflight import SingleFlight, request_key
+from utils.tracing import tracer
+
+# Общий для всех сессий Streamlit: одинаковые одновременные запросы к vLLM
+# (изображение, модель, промпт, параметры) выполняются один раз
+vllm_single_flight = SingleFlight()
 
 class VLLMStreamlitAdapter:
     def __init__(self, base_url: str = "http://localhost:8000"):
@@ -42,6 +50,7 @@ class VLLMStreamlitAdapter:
         
         self.check_all_connections()
     
+    @tracer.traced("vllm_adapter.check_all_connections")
     def check_all_connections(self) -> bool:
         """Проверка подключения к активному vLLM серверу"""
         self.available_models = []
@@ -95,6 +104,7 @@ class VLLMStreamlitAdapter:
         """Получение endpoint для конкретной модели"""
         return self.healthy_endpoints.get(model_name, self.base_url)
     
+    @tracer.traced("vllm_adapter.ensure_model_available")
     def ensure_model_available(self, model_name: str) -> bool:
         """Обеспечение доступности модели через менеджер контейнеров"""
         
@@ -169,6 +179,7 @@ class VLLMStreamlitAdapter:
         """Чат с изображением через vLLM API"""
         return self.process_image(image, prompt, model)
     
+    @tracer.traced("vllm_adapter.process_image")
     def process_image(self, image: Image.Image, prompt: str = "Extract all text from this image", 
                      model: str = "rednote-hilab/dots.ocr", max_tokens: int = 4096) -> Optional[Dict[str, Any]]:
         """Обработка изображения через vLLM API с автоматическим управлением контейнерами"""
@@ -201,12 +212,14 @@ class VLLMStreamlitAdapter:
             max_tokens = adjusted_tokens
         
         # Конвертация изображения в base64
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        buffer = io.BytesIO()
-        image.save(buffer, format='PNG')
-        image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+        with tracer.span("vllm_adapter.encode_png", size=f"{image.width}x{image.height}"):
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            
+            buffer = io.BytesIO()
+            image.save(buffer, format='PNG')
+            image_bytes = buffer.getvalue()
+            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
         
         # Подготовка запроса
         payload = {
@@ -222,23 +235,47 @@ class VLLMStreamlitAdapter:
             "temperature": 0.1
         }
         
+        # Layout-промпт: vLLM ограничивает вывод JSON-схемой (guided decoding)
+        layout = is_layout_prompt(prompt)
+        if layout:
+            payload["guided_json"] = LAYOUT_JSON_SCHEMA
+            payload["temperature"] = 0.0
+        
         try:
             # Отправка запроса к правильному endpoint
             start_time = time.time()
             
             model_display_name = model.split('/')[-1]
             with st.spinner(f"🔄 Обработка изображения через {model_display_name} (макс. {max_tokens} токенов)..."):
-                response = requests.post(
-                    f"{endpoint}/v1/chat/completions",
-                    json=payload,
-                    timeout=120
+                # Потоковый ответ: watchdog обрывает запрос при зацикливании.
+                # Если такой же запрос уже выполняется, ждем его результат.
+                # Контекст трассировки передается vLLM заголовком traceparent
+                key = request_key(
+                    image_bytes, model, prompt,
+                    endpoint=endpoint, max_tokens=max_tokens,
+                    temperature=payload["temperature"], layout=layout
                 )
+                with tracer.span("vllm.request", model=model, endpoint=endpoint, max_tokens=max_tokens) as request_span:
+                    result = vllm_single_flight.do(
+                        key,
+                        lambda: stream_chat_completion(
+                            f"{endpoint}/v1/chat/completions",
+                            payload,
+                            timeout=120,
+                            headers=tracer.inject({})
+                        )
+                    )
+                    request_span.set_attribute("status_code", result["status_code"])
+                    request_span.set_attribute("completion_tokens", result["usage"].get("completion_tokens", 0))
             
             processing_time = time.time() - start_time
             
-            if response.status_code == 200:
-                result = response.json()
-                content = result["choices"][0]["message"]["content"]
+            if result["status_code"] == 200:
+                content = result["text"]
+                if layout:
+                    # Ответ, обрезанный по max_tokens, закрываем после последнего элемента
+                    with tracer.span("postprocess.finalize_layout_json"):
+                        content = finalize_layout_json(content)
                 
                 return {
                     "success": True,
@@ -248,13 +285,14 @@ class VLLMStreamlitAdapter:
                     "model_display_name": model_display_name,
                     "endpoint": endpoint,
                     "mode": "vLLM",
-                    "tokens_used": result.get("usage", {}).get("total_tokens", 0),
+                    "tokens_used": result["usage"].get("total_tokens", 0),
                     "max_tokens_limit": model_max_tokens,
-                    "actual_max_tokens": max_tokens
+                    "actual_max_tokens": max_tokens,
+                    "repetition": result["repetition"]
                 }
             else:
-                error_text = response.text
-                st.error(f"❌ API ошибка: {response.status_code}")
+                error_text = result["error"]
+                st.error(f"❌ API ошибка: {result['status_code']}")
                 
                 # Специальная обработка ошибок валидации токенов
                 if "max_tokens" in error_text and "exceeds" in error_text:
@@ -266,7 +304,7 @@ class VLLMStreamlitAdapter:
                 st.error(f"Ответ сервера: {error_text}")
                 return {
                     "success": False,
-                    "error": f"API ошибка: {response.status_code}",
+                    "error": f"API ошибка: {result['status_code']}",
                     "text": "",
                     "processing_time": processing_time
                 }
@@ -291,7 +329,8 @@ class VLLMStreamlitAdapter:
             "total_endpoints": total_count,
             "available_models": self.available_models,
             "model_limits": getattr(self, 'model_limits', {}),
-            "endpoints": self.healthy_endpoints
+            "endpoints": self.healthy_endpoints,
+            "coalescing": vllm_single_flight.get_stats()
         }
 
 def create_vllm_interface():